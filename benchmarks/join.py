@@ -0,0 +1,96 @@
+"""
+Joining orders to customers, by seeking each customer's
+row_id and with a hash join (in memory and spilling), run with:
+
+    pdm run bench_join
+"""
+import sys
+import tempfile
+import time
+
+from toysql.btree import BTree
+from toysql.compiler import Compiler
+from toysql.pager import Pager
+from toysql.record import DataType, Record
+from toysql.vm import VM
+
+# The query and whether to run it again with a
+# join buffer too small for customers.
+QUERIES = [
+    # customers.id is the primary key, a nested loop join.
+    (
+        "SELECT orders.id, name FROM orders JOIN customers ON customer_id = customers.id",
+        False,
+    ),
+    # code isn't, a hash join.
+    (
+        "SELECT orders.id, name FROM orders JOIN customers ON customer_id = customers.code",
+        True,
+    ),
+]
+
+
+def load(pager: Pager, compiler: Compiler, table_name: str, rows):
+    # Inserting row by row would take longer than the joins,
+    # build the table bottom up instead.
+    tree = BTree(pager, compiler.get_catalog().table(table_name).root_page_number)
+    tree.bulk_load(
+        [
+            tree.new_cell(
+                Record(
+                    [
+                        [DataType.text if isinstance(v, str) else DataType.integer, v]
+                        for v in row
+                    ]
+                )
+            )
+            for row in rows
+        ]
+    )
+
+
+def run(customers: int, orders: int):
+    with tempfile.NamedTemporaryFile() as f:
+        pager = Pager(f.name)
+        compiler = Compiler(pager)
+        vm = VM(pager)
+
+        for sql in [
+            "CREATE TABLE customers (id INTEGER PRIMARY KEY, name TEXT, code INTEGER);",
+            "CREATE TABLE orders (id INTEGER PRIMARY KEY, customer_id INTEGER, amount INTEGER);",
+        ]:
+            list(vm.execute(compiler.compile(sql)))
+
+        load(
+            pager,
+            compiler,
+            "customers",
+            ([n, f"customer-{n}", n] for n in range(customers)),
+        )
+        load(
+            pager,
+            compiler,
+            "orders",
+            ([n, n * 7 % customers, n % 100] for n in range(orders)),
+        )
+
+        print(f"{customers} customers {orders} orders")
+        for sql, spill in QUERIES:
+            program = compiler.compile(sql)
+
+            for join_buffer in [customers, customers // 10] if spill else [customers]:
+                vm = VM(pager, join_buffer=join_buffer)
+                start = time.perf_counter()
+                results = list(vm.execute(program))
+                elapsed = time.perf_counter() - start
+
+                print(
+                    f"join_buffer {join_buffer:>8} {len(results):>8} results "
+                    f"{vm.steps:>10,} instructions {elapsed:8.3f}s  {sql}"
+                )
+
+
+if __name__ == "__main__":
+    sizes = [int(arg) for arg in sys.argv[1:]] or [1_000, 10_000]
+    customers, orders = sizes[0], sizes[1]
+    run(customers, orders)
@@ -0,0 +1,35 @@
+"""
+Lexer throughput, run with:
+
+    pdm run bench_lexer
+"""
+import sys
+import time
+
+from toysql.lexer import lex
+
+
+def source(rows: int) -> str:
+    return "\n".join(
+        f"INSERT INTO users VALUES ({i}, 'user-{i}', 'user{i}@example.com', {i * 1.5});"
+        for i in range(rows)
+    )
+
+
+def run(rows: int):
+    text = source(rows)
+    start = time.perf_counter()
+    tokens = lex(text)
+    elapsed = time.perf_counter() - start
+
+    print(
+        f"{rows:>8} rows {len(text):>10} chars {len(tokens):>9} tokens "
+        f"{elapsed:8.3f}s {len(tokens) / elapsed:>12,.0f} tokens/sec"
+    )
+
+
+if __name__ == "__main__":
+    sizes = [int(arg) for arg in sys.argv[1:]] or [1_000, 10_000, 100_000]
+
+    for rows in sizes:
+        run(rows)
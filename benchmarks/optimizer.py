@@ -0,0 +1,66 @@
+"""
+Program length and VM steps with and without the peephole passes, run with:
+
+    pdm run bench_optimizer
+"""
+import contextlib
+import io
+import sys
+import tempfile
+
+from toysql.compiler import Compiler
+from toysql.pager import Pager
+from toysql.vm import VM
+
+QUERIES = [
+    "INSERT INTO {table} VALUES {values};",
+    "SELECT * FROM {table}",
+    "SELECT id, name FROM {table} WHERE name != 'name-3' AND id > 10",
+    "SELECT name FROM {table} WHERE age = 3 OR NOT (id < 40)",
+    "SELECT name, age FROM {table} WHERE age > 6 LIMIT 50",
+]
+
+
+def run(rows: int):
+    # Runs of rows with the same name and age.
+    values = ", ".join(f"({n}, 'name-{n // 100}', {n // 50 % 10})" for n in range(rows))
+
+    with tempfile.NamedTemporaryFile() as f:
+        pager = Pager(f.name)
+        vm = VM(pager)
+
+        def execute(compiler: Compiler, sql: str):
+            program = compiler.compile(sql)
+            # The VM prints each program.
+            with contextlib.redirect_stdout(io.StringIO()):
+                list(vm.execute(program))
+
+            return len(program.instructions), vm.steps
+
+        compilers = {
+            "plain": Compiler(pager, optimize=False),
+            "optimized": Compiler(pager),
+        }
+        for table, compiler in compilers.items():
+            execute(
+                compiler, f"CREATE TABLE {table} (id INTEGER, name TEXT, age INTEGER);"
+            )
+
+        print(f"{rows} rows")
+        for query in QUERIES:
+            (length, steps), (optimized_length, optimized_steps) = [
+                execute(compiler, query.format(table=table, values=values))
+                for table, compiler in compilers.items()
+            ]
+            print(
+                f"{length:>8} -> {optimized_length:>8} instructions "
+                f"{steps:>10,} -> {optimized_steps:>10,} steps "
+                f"{1 - optimized_steps / steps:>5.0%} fewer  {query[:60].format(table='t', values='...')}"
+            )
+
+
+if __name__ == "__main__":
+    sizes = [int(arg) for arg in sys.argv[1:]] or [1_000]
+
+    for rows in sizes:
+        run(rows)
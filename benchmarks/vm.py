@@ -0,0 +1,81 @@
+"""
+VM throughput scanning a table with each engine,
+a row and a page at a time, run with:
+
+    pdm run bench_vm
+"""
+import sys
+import tempfile
+import time
+
+from toysql.btree import BTree
+from toysql.compiler import Compiler
+from toysql.pager import Pager
+from toysql.record import DataType, Record
+from toysql.vm import VM, ENGINES
+
+QUERIES = [
+    "SELECT * FROM people",
+    "SELECT id FROM people WHERE age = 3",
+    "SELECT id, name FROM people WHERE age > 90 OR name = 'name-7'",
+]
+
+
+def run(rows: int):
+    with tempfile.NamedTemporaryFile() as f:
+        pager = Pager(f.name)
+        compiler = Compiler(pager)
+        vm = VM(pager)
+
+        list(
+            vm.execute(
+                compiler.compile(
+                    "CREATE TABLE people (id INTEGER, name TEXT, age INTEGER);"
+                )
+            )
+        )
+
+        # Inserting row by row would take longer than the scans,
+        # build the table bottom up instead.
+        tree = BTree(pager, compiler.get_catalog().table("people").root_page_number)
+        tree.bulk_load(
+            [
+                tree.new_cell(
+                    Record(
+                        [
+                            [DataType.integer, n],
+                            [DataType.text, f"name-{n}"],
+                            [DataType.integer, n % 100],
+                        ]
+                    )
+                )
+                for n in range(rows)
+            ]
+        )
+
+        print(f"{rows} rows")
+        for sql in QUERIES:
+            for mode, program in [
+                ("row", compiler.compile(sql)),
+                ("batch", compiler.compile_batch(sql)),
+            ]:
+                for engine in ENGINES:
+                    vm = VM(pager, engine=engine)
+                    start = time.perf_counter()
+                    results = list(vm.execute(program))
+                    elapsed = time.perf_counter() - start
+
+                    if mode == "batch":
+                        results = [row for batch in results for row in batch]
+
+                    print(
+                        f"{mode:>5} {engine:>12} {len(results):>8} results "
+                        f"{vm.steps:>10,} instructions {elapsed:8.3f}s  {sql}"
+                    )
+
+
+if __name__ == "__main__":
+    sizes = [int(arg) for arg in sys.argv[1:]] or [100_000]
+
+    for rows in sizes:
+        run(rows)
@@ -0,0 +1,49 @@
+from unittest import TestCase
+from toysql.aggregate import Aggregate, HashAggregate
+
+
+class TestHashAggregate(TestCase):
+    def test_aggregate(self):
+        aggregates = [
+            Aggregate("count", star=True),
+            Aggregate("count"),
+            Aggregate("sum"),
+            Aggregate("min"),
+            Aggregate("max"),
+            Aggregate("avg"),
+        ]
+        aggregate = HashAggregate(aggregates, 1)
+
+        for region, amount in [("a", 1), ("b", 5), ("a", None), ("a", 4)]:
+            aggregate.step([region, *[amount] * len(aggregates)])
+
+        assert list(aggregate.rows()) == [
+            ["a", 3, 2, 5, 1, 4, 2.5],
+            ["b", 1, 1, 5, 5, 5, 5.0],
+        ]
+
+        # Without a GROUP BY there's a row even without any input.
+        assert list(HashAggregate(aggregates, 0).rows()) == [
+            [0, 0, None, None, None, None]
+        ]
+        # But not with one.
+        assert list(HashAggregate(aggregates, 1).rows()) == []
+
+    def test_spill(self):
+        rows = [[n % 50, n] for n in range(1000)]
+        expected = {}
+        for key, amount in rows:
+            expected[key] = expected.get(key, 0) + amount
+
+        aggregate = HashAggregate([Aggregate("sum")], 1, max_groups=4)
+        for row in rows:
+            aggregate.step(row)
+
+        assert len(aggregate.groups) == 4
+        assert aggregate.spilled > 0
+
+        result = list(aggregate.rows())
+        assert len(result) == 50
+        assert {key: total for key, total in result} == expected
+        # The first groups seen stay in memory and come out first.
+        assert [key for key, _ in result[:4]] == [0, 1, 2, 3]
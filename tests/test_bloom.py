@@ -0,0 +1,108 @@
+from snapshottest import TestCase
+from toysql.bloom import BloomFilter
+from toysql.btree import BTree
+from toysql.page import PageType
+from toysql.record import Record, DataType
+from tests.fixtures import Fixtures
+from unittest.mock import patch
+
+
+class TestBloomFilter(Fixtures, TestCase):
+    def test_bloom(self):
+        page_number = self.pager.new(PageType.bloom)
+        bloom = BloomFilter.read(self.pager, page_number)
+
+        for key in range(0, 2000, 2):
+            bloom.add(key)
+            bloom.write(self.pager)
+
+        # Read it back from disk.
+        bloom = BloomFilter.read(self.pager, page_number)
+
+        # No false negatives.
+        assert all(key in bloom for key in range(0, 2000, 2))
+
+        false_positives = [key for key in range(1, 2000, 2) if key in bloom]
+        assert len(false_positives) < 20
+
+        # Index keys are tuples.
+        bloom.add(((1, 5), (2, "a")))
+        assert ((1, 5), (2, "a")) in bloom
+        assert ((1, 5), (2, "b")) not in bloom
+
+    def test_bloom_key_encoding(self):
+        bloom = BloomFilter.read(self.pager, self.pager.new(PageType.bloom))
+        bloom.add(1)
+        bloom.add(((1, 7), (0, 0)))
+
+        # Equal values are the same key whatever their type.
+        assert 1.0 in bloom
+        assert ((1, 7.0), (0, 0)) in bloom
+        assert ((1, 7), (0, 0)) in bloom
+        # NULL isn't 0 or "".
+        assert ((1, 7), (1, 0)) not in bloom
+        assert ((1, 7), (2, "")) not in bloom
+
+        assert not bloom.add(1.0)
+        bloom.add(-1)
+        assert -1 in bloom
+
+    def test_bloom_grows(self):
+        page_number = self.pager.new(PageType.bloom)
+        bloom = BloomFilter.read(self.pager, page_number)
+        capacity = bloom.pages[0].capacity()
+
+        for key in range(capacity * 3):
+            bloom.add(key)
+        bloom.write(self.pager)
+
+        bloom = BloomFilter.read(self.pager, page_number)
+        assert len(bloom.pages) == 3
+        assert all(page.count <= capacity for page in bloom.pages)
+        assert all(key in bloom for key in range(capacity * 3))
+
+        # Still around 1% for each page.
+        false_positives = [
+            key for key in range(capacity * 3, capacity * 4) if key in bloom
+        ]
+        assert len(false_positives) < capacity * 0.05
+
+    def test_btree_bloom(self):
+        btree = BTree(
+            self.pager,
+            self.pager.new(),
+            bloom_page_number=self.pager.new(PageType.bloom),
+        )
+
+        for key in range(0, 200, 2):
+            btree.insert(
+                Record([[DataType.integer, key], [DataType.text, f"hello-{key}" * 10]])
+            )
+
+        assert btree.find(10)
+
+        # One write for the filter and one for the leaf per insert.
+        writes = []
+        write_bytes = self.pager.write_bytes
+
+        def counting_write_bytes(page_number, offset, data):
+            writes.append(page_number)
+            return write_bytes(page_number, offset, data)
+
+        with patch.object(self.pager, "write_bytes", counting_write_bytes):
+            btree.insert(Record([[DataType.integer, 1000], [DataType.text, "a"]]))
+
+        assert writes == [btree.bloom_page_number]
+        reads = []
+        read = self.pager.read
+
+        def counting_read(page_number):
+            reads.append(page_number)
+            return read(page_number)
+
+        with patch.object(self.pager, "read", counting_read):
+            misses = [key for key in range(1, 200, 2) if btree.find(key) is None]
+
+        assert len(misses) == 100
+        # Most of them never touch the tree.
+        assert len(reads) < 10
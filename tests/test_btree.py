@@ -1,7 +1,8 @@
 import random
 from snapshottest import TestCase
 
-from toysql.btree import BTree
+from toysql.btree import BTree, SplitPolicy
+from toysql.page import Page, PageType, index_key
 from toysql.exceptions import NotFoundException
 from toysql.record import Record, DataType
 from tests.fixtures import Fixtures
@@ -249,3 +250,213 @@ class TestBTree(Fixtures, TestCase):
         assert record
         # Last row has key 9
         assert record.row_id == total - 1
+
+    def test_cursor_seek_ge(self):
+        cursor = BTree(self.pager, self.pager.new())
+        keys = [n * 2 for n in range(10)]
+
+        random.shuffle(keys)
+        for n in keys:
+            cursor.insert(self.create_record(n, f"hello-{n}"))
+
+        record = cursor.seek_ge(7)
+        assert record and record.row_id == 8
+        # Carries on across leaves.
+        assert [r.row_id for r in cursor] == sorted(keys)
+        record = cursor.seek_ge(8)
+        assert record and record.row_id == 8
+        record = cursor.seek_gt(8)
+        assert record and record.row_id == 10
+        assert cursor.seek_gt(18) is None
+
+    def test_index(self):
+        page_number = self.pager.new(PageType.index_leaf)
+        index = BTree(self.pager, page_number)
+        values = [(n, f"v-{n % 4}") for n in range(20)]
+
+        random.shuffle(values)
+        for row_id, value in values:
+            index.insert(self.create_record(row_id, value))
+
+        entry = index.seek_ge(index_key(["v-2"]))
+        assert entry is not None
+        rows = [entry.row_id]
+        while True:
+            entry = next(index)
+            if entry.values[1][1] != "v-2":
+                break
+            rows.append(entry.row_id)
+
+        assert rows == [n for n in range(20) if n % 4 == 2]
+        assert index.seek_gt(index_key(["v-3"])) is None
+
+    def test_bulk_load(self):
+        for total in [1, 2, 100]:
+            btree = BTree(self.pager, self.pager.new())
+            # Long values so the records span several leaves.
+            btree.bulk_load(
+                [
+                    btree.new_cell(self.create_record(n, f"hello-{n}" * 50))
+                    for n in range(total)
+                ]
+            )
+
+            assert [r.row_id for r in btree] == list(range(total))
+
+            for key in range(total):
+                record = btree.find(key)
+                assert record
+                assert record.row_id == key
+
+            # Still a valid tree to insert into.
+            btree.insert(self.create_record(total, "last"))
+            assert btree.find(total)
+
+    def test_append(self):
+        btree = BTree(self.pager, self.pager.new())
+        for n in range(10, 30):
+            btree.insert(self.create_record(n, f"hello-{n}"), append=True)
+
+        assert btree.appending
+        assert [r.row_id for r in btree] == list(range(10, 30))
+
+        # Out of order, falls back to seeking and stops trying to append.
+        btree.insert(self.create_record(0, "first"), append=True)
+        assert not btree.appending
+        btree.insert(self.create_record(30, "last"), append=True)
+
+        keys = [0, *range(10, 31)]
+        assert [r.row_id for r in btree] == keys
+        for key in keys:
+            assert btree.find(key)
+
+    def test_bulk_load_deep(self):
+        """
+        Enough rows for more than one level of interior pages,
+        which takes more than 256 pages.
+        """
+        btree = BTree(self.pager, self.pager.new())
+        total = 2000
+        btree.bulk_load(
+            [btree.new_cell(self.create_record(n, "x" * 1000)) for n in range(total)]
+        )
+
+        assert len(self.pager) > 256
+        assert [r.row_id for r in btree] == list(range(total))
+        assert btree.find(1234) == self.create_record(1234, "x" * 1000)
+
+    def test_next_leaf(self):
+        btree = BTree(self.pager, self.pager.new())
+        assert btree.next_leaf() is None
+
+        total = 300
+        btree.bulk_load(
+            [btree.new_cell(self.create_record(n, "x" * 100)) for n in range(total)]
+        )
+        btree.reset()
+        leaves = []
+
+        while (page := btree.next_leaf()) is not None:
+            leaves.append([cell.row_id for cell in page.cells])
+
+        assert len(leaves) > 1
+        assert [row_id for leaf in leaves for row_id in leaf] == list(range(total))
+
+    def test_update(self):
+        btree = BTree(self.pager, self.pager.new())
+        for n in range(10):
+            btree.insert(self.create_record(n, f"hello-{n}"))
+
+        btree.seek(4)
+        page_number = btree.stack[-1].page_number
+        before = self.pager.read(page_number).to_bytes()
+        [slot] = [c.slot for c in Page.from_bytes(before).cells if c.row_id == 4]
+        start, end = slot[0], slot[0] + slot[1]
+
+        # Shorter, so it's written over the old cell.
+        assert btree.update(self.create_record(4, "hi"))
+        assert btree.find(4) == self.create_record(4, "hi")
+
+        # The rest of the page is untouched.
+        self.pager.f.seek(page_number * self.pager.page_size)
+        after = self.pager.f.read(self.pager.page_size)
+        assert after[:start] == before[:start]
+        assert after[end:] == before[end:]
+
+        # Longer, falls back to replacing the cell.
+        assert not btree.update(self.create_record(5, "hello" * 10))
+        assert btree.find(5) == self.create_record(5, "hello" * 10)
+        assert [r.row_id for r in btree] == list(range(10))
+
+    def test_delete(self):
+        btree = BTree(self.pager, self.pager.new())
+        for n in range(10):
+            btree.insert(self.create_record(n, f"hello-{n}"))
+
+        for n in [0, 1, 2, 7]:
+            assert btree.delete(n)
+
+        assert not btree.delete(7)
+        assert [r.row_id for r in btree] == [3, 4, 5, 6, 8, 9]
+        assert btree.find(7) is None
+
+
+class TestSplitPolicy(Fixtures, TestCase):
+    def fill(self, policy: SplitPolicy, keys):
+        btree = BTree(self.pager, self.pager.new(), policy)
+
+        for key in keys:
+            btree.insert(
+                Record([[DataType.integer, key], [DataType.text, f"hello-{key}" * 20]])
+            )
+
+        assert [r.row_id for r in btree] == sorted(keys)
+        for key in keys:
+            assert btree.find(key)
+
+        return btree.utilization()
+
+    def test_split_policy(self):
+        keys = list(range(200))
+        even = self.fill(SplitPolicy(), keys)
+        append = self.fill(SplitPolicy("append"), keys)
+        half = self.fill(SplitPolicy("fillfactor", 50), keys)
+
+        # Ascending keys leave every page but the last full.
+        assert append.fill > 0.9
+        assert append.leaf_pages < even.leaf_pages
+        assert 0.45 < even.fill < 0.6
+        assert 0.45 < half.fill < 0.6
+
+        # Random keys still produce a valid tree.
+        random.shuffle(keys)
+        self.fill(SplitPolicy("append"), keys)
+
+    def test_bulk_load_fillfactor(self):
+        btree = BTree(self.pager, self.pager.new(), SplitPolicy("fillfactor", 70))
+        btree.bulk_load(
+            [
+                btree.new_cell(
+                    Record([[DataType.integer, n], [DataType.text, f"hello-{n}" * 20]])
+                )
+                for n in range(200)
+            ]
+        )
+
+        utilization = btree.utilization()
+        assert utilization.interior_pages == 1
+        assert 0.6 < utilization.fill < 0.7
+
+    def test_from_options(self):
+        assert SplitPolicy.from_options({}) == SplitPolicy()
+        assert SplitPolicy.from_options({"fillfactor": 90}) == SplitPolicy(
+            "fillfactor", 90
+        )
+        assert SplitPolicy.from_options({"split": "append"}) == SplitPolicy("append")
+
+        for options in [{"fillfactor": 5}, {"split": "odd"}, {"size": 1}]:
+            with self.assertRaises(ValueError):
+                SplitPolicy.from_options(options)
+
+        with self.assertRaisesRegex(ValueError, "got 5"):
+            SplitPolicy.from_options({"fillfactor": 5})
@@ -0,0 +1,45 @@
+from unittest import TestCase
+from toysql.catalog import Catalog, IndexSchema, SCHEMA_TABLE_NAME
+from toysql.exceptions import TableFoundException, ColumnNotFoundException
+
+
+class TestCatalog(TestCase):
+    def test_catalog(self):
+        rows = [
+            [
+                1,
+                "table",
+                "users",
+                "users",
+                1,
+                "CREATE TABLE users (name TEXT, id INTEGER PRIMARY KEY, age INTEGER) WITH (bloom=1);",
+            ],
+            [2, "bloom", "users", "users", 2, ""],
+            [
+                3,
+                "index",
+                "users_age",
+                "users",
+                3,
+                "CREATE INDEX users_age ON users (age) INCLUDE (name);",
+            ],
+        ]
+        catalog = Catalog(rows, schema_cookie=3)
+
+        users = catalog.table("users")
+        assert len(catalog) == 3
+        assert users.root_page_number == 1
+        assert users.columns == ["name", "id", "age"]
+        assert users.pk_index == 1
+        assert users.column_index("age") == 2
+        assert users.indexes == [
+            IndexSchema("users_age", "users", 3, ["age"], ["name"])
+        ]
+        assert catalog.blooms == {"users": 2}
+        assert catalog.table(SCHEMA_TABLE_NAME).root_page_number == 0
+
+        with self.assertRaises(TableFoundException):
+            catalog.table("orgs")
+
+        with self.assertRaises(ColumnNotFoundException):
+            users.column_index("email")
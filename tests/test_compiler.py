@@ -1,4 +1,11 @@
-from toysql.compiler import Compiler, Instruction, Opcode, SCHEMA_TABLE_NAME
+from toysql.compiler import (
+    Compiler,
+    Instruction,
+    Opcode,
+    SCHEMA_TABLE_NAME,
+    JUMP_IF_NULL,
+    OPFLAG_APPEND,
+)
 from tests.fixtures import Fixtures
 from unittest.mock import Mock, patch
 
@@ -12,7 +19,8 @@ class TestCompiler(Fixtures):
             "CREATE TABLE products(code INTEGER PRIMARY KEY, name TEXT, price INTEGER)"
         )
         self.root_page_number = 2
-        self.compiler = Compiler(self.pager)
+        # The programs as generated, before the peephole passes.
+        self.compiler = Compiler(self.pager, optimize=False)
         self.compiler.get_schema = Mock(
             return_value=[
                 [
@@ -108,6 +116,9 @@ class TestCompiler(Fixtures):
 
         # Close the cursor
         Close        0  _  _  _
+
+        # Bump the schema cookie
+        SetCookie    1  _  _  _
         """
 
         sql_text = self.sql_text
@@ -125,8 +136,9 @@ class TestCompiler(Fixtures):
             Instruction(Opcode.String, p1=len(sql_text), p2=5, p4=sql_text),
             Instruction(Opcode.MakeRecord, p1=1, p2=5, p3=6),
             Instruction(Opcode.Integer, p1=1, p2=7),
-            Instruction(Opcode.Insert, p1=0, p2=6, p3=7),
+            Instruction(Opcode.Insert, p1=0, p2=6, p3=7, p4=SCHEMA_TABLE_NAME),
             Instruction(Opcode.Close, p1=0),
+            Instruction(Opcode.SetCookie, p1=1),
         ]
 
     def test_insert_with_primary_key(self):
@@ -150,8 +162,9 @@ class TestCompiler(Fixtures):
             # Instruction(Opcode.Null, p2=2), TODO: Not sure why Null is necessary here?
             Instruction(Opcode.Integer, p1=240, p2=2),
             Instruction(Opcode.Integer, p1=1, p2=3),
-            Instruction(Opcode.MakeRecord, p1=1, p2=3, p3=4),
-            Instruction(Opcode.Insert, p1=0, p2=4, p3=3),
+            # The primary key is the row_id so it's not part of the record.
+            Instruction(Opcode.MakeRecord, p1=1, p2=2, p3=4),
+            Instruction(Opcode.Insert, p1=0, p2=4, p3=3, p4="products"),
             Instruction(Opcode.Close, p1=0),
         ]
 
@@ -193,7 +206,131 @@ class TestCompiler(Fixtures):
             # Instruction(Opcode.Null, p2=2), TODO: Not sure why Null is necessary here?
             Instruction(Opcode.String, p1=10, p2=2, p4="Hard Drive"),
             Instruction(Opcode.Integer, p1=240, p2=3),
-            Instruction(Opcode.MakeRecord, p1=1, p2=3, p3=4),
-            Instruction(Opcode.Insert, p1=0, p2=4, p3=1),
+            Instruction(Opcode.MakeRecord, p1=2, p2=2, p3=4),
+            Instruction(Opcode.Insert, p1=0, p2=4, p3=1, p4="products"),
+            Instruction(Opcode.Close, p1=0),
+        ]
+
+    def test_parameters(self):
+        program = self.compiler.compile(
+            "UPDATE products SET name = :name, price = ? WHERE code = ? AND name = :name;"
+        )
+        variables = [
+            (i.p1, i.p4) for i in program.instructions if i.opcode == Opcode.Variable
+        ]
+
+        assert program.parameters == [":name", "?", "?"]
+        # The where clause is compiled first but numbered by position.
+        assert sorted(variables) == [(0, ":name"), (0, ":name"), (1, "?"), (2, "?")]
+
+    def test_select_rowid_range(self):
+        """
+        Seeks to the first code > 10 and stops after 20
+        rather than scanning the whole table.
+        """
+        program = self.compiler.compile(
+            "select name from products where code > 10 and price = 5 and code <= 20"
+        )
+
+        assert program.instructions == [
+            Instruction(Opcode.Integer, p1=2, p2=0),
+            Instruction(Opcode.OpenRead, p1=0, p2=0, p3=4),
+            Instruction(Opcode.Integer, p1=10, p2=2),
+            Instruction(Opcode.SeekGt, p1=0, p2=13, p3=2),
+            Instruction(Opcode.Integer, p1=20, p2=3),
+            Instruction(Opcode.Key, p1=0, p2=4),
+            Instruction(Opcode.Gt, p1=4, p2=13, p3=3, p5=0x10),
+            Instruction(Opcode.Column, p1=0, p2=2, p3=5),
+            Instruction(Opcode.Integer, p1=5, p2=6),
+            Instruction(Opcode.Ne, p1=5, p2=12, p3=6, p5=0x10),
+            Instruction(Opcode.Column, p1=0, p2=1, p3=1),
+            Instruction(Opcode.ResultRow, p1=1, p2=1),
+            Instruction(Opcode.Next, p1=0, p2=5),
+            Instruction(Opcode.Close, p1=0),
+            Instruction(Opcode.Halt, p1=0, p2=0),
+        ]
+
+    def test_select_with_index(self):
+        """
+        Walks the index from the first entry >= 10 and
+        looks up each row in the table.
+        """
+        index_sql_text = "CREATE INDEX products_price ON products (price)"
+        schema = [
+            [1, "table", "products", "products", self.root_page_number, self.sql_text],
+            [2, "index", "products_price", "products", 3, index_sql_text],
+        ]
+
+        with patch.object(self.compiler, "get_schema", return_value=schema):
+            program = self.compiler.compile(
+                "select name from products where price >= 10"
+            )
+
+        assert program.instructions == [
+            Instruction(Opcode.Integer, p1=2, p2=0),
+            Instruction(Opcode.OpenRead, p1=0, p2=0, p3=4),
+            Instruction(Opcode.Integer, p1=3, p2=2),
+            Instruction(Opcode.OpenRead, p1=1, p2=2, p3=2),
+            Instruction(Opcode.Integer, p1=10, p2=3),
+            Instruction(Opcode.SeekGe, p1=1, p2=11, p3=3, p4=1),
+            Instruction(Opcode.IdxPKey, p1=1, p2=4),
+            Instruction(Opcode.Seek, p1=0, p2=10, p3=4),
+            Instruction(Opcode.Column, p1=0, p2=1, p3=1),
+            Instruction(Opcode.ResultRow, p1=1, p2=1),
+            Instruction(Opcode.Next, p1=1, p2=6),
+            Instruction(Opcode.Close, p1=1),
+            Instruction(Opcode.Close, p1=0),
+            Instruction(Opcode.Halt, p1=0, p2=0),
+        ]
+
+    def test_optimize(self):
+        self.compiler.optimize = True
+        program = self.compiler.compile(
+            "SELECT name, price FROM products WHERE price > 10 AND name != 'x' OR code = 3"
+        )
+
+        assert program.instructions == [
+            # The literals are loaded once, before the loop.
+            Instruction(Opcode.Integer, p1=10, p2=4),
+            Instruction(Opcode.String, p1=1, p2=6, p4="x"),
+            Instruction(Opcode.Integer, p1=3, p2=8),
+            Instruction(Opcode.Integer, p1=2, p2=0),
+            Instruction(Opcode.OpenRead, p1=0, p2=0, p3=4),
+            Instruction(Opcode.Rewind, p1=0, p2=15),
+            Instruction(Opcode.Column, p1=0, p2=2, p3=3),
+            # Jumped to the Noop after the AND, now the instruction after it.
+            Instruction(Opcode.Le, p1=3, p2=10, p3=4, p5=JUMP_IF_NULL),
+            Instruction(Opcode.Column, p1=0, p2=1, p3=5),
+            Instruction(Opcode.Ne, p1=5, p2=12, p3=6),
+            Instruction(Opcode.Key, p1=0, p2=7),
+            Instruction(Opcode.Ne, p1=7, p2=14, p3=8, p5=JUMP_IF_NULL),
+            # name and price in one read.
+            Instruction(Opcode.Column, p1=0, p2=1, p3=1, p4=2),
+            Instruction(Opcode.ResultRow, p1=1, p2=2),
+            Instruction(Opcode.Next, p1=0, p2=6),
+            Instruction(Opcode.Close, p1=0),
+            Instruction(Opcode.Halt, p1=0, p2=0),
+        ]
+
+        program = self.compiler.compile(
+            "INSERT INTO products VALUES (1, 'a', 5), (2, 'a', 5)"
+        )
+
+        assert program.instructions == [
+            Instruction(Opcode.Integer, p1=2, p2=0),
+            Instruction(Opcode.OpenWrite, p1=0, p2=0, p3=3),
+            Instruction(Opcode.Integer, p1=1, p2=1),
+            Instruction(Opcode.String, p1=1, p2=2, p4="a"),
+            Instruction(Opcode.Integer, p1=5, p2=3),
+            Instruction(Opcode.MakeRecord, p1=2, p2=2, p3=4),
+            Instruction(
+                Opcode.Insert, p1=0, p2=4, p3=1, p4="products", p5=OPFLAG_APPEND
+            ),
+            # 'a' and 5 are still in their registers.
+            Instruction(Opcode.Integer, p1=2, p2=1),
+            Instruction(Opcode.MakeRecord, p1=2, p2=2, p3=4),
+            Instruction(
+                Opcode.Insert, p1=0, p2=4, p3=1, p4="products", p5=OPFLAG_APPEND
+            ),
             Instruction(Opcode.Close, p1=0),
         ]
@@ -0,0 +1,162 @@
+from unittest import TestCase
+import tempfile
+
+from toysql import dbapi
+from toysql.exceptions import BindingException, ClosedException
+
+
+class TestDBAPI(TestCase):
+    engine = "interpreter"
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.connection = dbapi.connect(
+            self.temp_dir.name + "/__testdb__.db", engine=self.engine
+        )
+        self.connection.execute(
+            "CREATE TABLE users (id INTEGER PRIMARY KEY, name TEXT);"
+        )
+
+    def tearDown(self) -> None:
+        self.connection.close()
+        self.temp_dir.cleanup()
+
+    def insert_users(self, n: int):
+        self.connection.executemany(
+            "INSERT INTO users VALUES (?, ?);",
+            ([i, f"user-{i}"] for i in range(1, n + 1)),
+        )
+
+    def description(self, cursor: dbapi.Cursor) -> list:
+        # Once a test asserts description is None the type checker keeps
+        # it narrowed to None across execute, so read it through here.
+        assert cursor.description is not None
+        return cursor.description
+
+    def test_execute(self):
+        cursor = self.connection.cursor()
+        # Statements without rows run in execute.
+        cursor.execute("INSERT INTO users VALUES (?, ?);", [1, "Phil"])
+        cursor.execute(
+            "INSERT INTO users VALUES (:id, :name);", {"id": 2, "name": "Bob"}
+        )
+        assert cursor.fetchone() is None
+
+        cursor.execute("SELECT name FROM users WHERE id > ?", [0])
+        assert cursor.fetchone() == ["Phil"]
+        assert cursor.fetchone() == ["Bob"]
+        assert cursor.fetchone() is None
+
+        with self.assertRaises(BindingException):
+            cursor.execute("SELECT name FROM users WHERE id = ?", [])
+
+    def test_description(self):
+        cursor = self.connection.cursor()
+        assert cursor.description is None
+
+        cursor.execute("INSERT INTO users VALUES (?, ?);", [1, "Phil"])
+        assert cursor.description is None
+
+        cursor.execute("SELECT name, id FROM users")
+        assert [column[0] for column in self.description(cursor)] == ["name", "id"]
+        assert all(len(column) == 7 for column in self.description(cursor))
+
+        cursor.execute("SELECT * FROM users WHERE id = 2")
+        assert [column[0] for column in self.description(cursor)] == ["id", "name"]
+
+        cursor.execute("SELECT count(*) FROM users")
+        assert len(self.description(cursor)) == 1
+
+        cursor.execute("EXPLAIN QUERY PLAN SELECT * FROM users")
+        assert [column[0] for column in self.description(cursor)] == ["id", "detail"]
+
+        cursor.execute("CREATE TABLE orders (id INTEGER PRIMARY KEY, user_id INTEGER);")
+        assert cursor.description is None
+
+        cursor.execute("SELECT * FROM users JOIN orders ON users.id = orders.user_id")
+        assert [column[0] for column in self.description(cursor)] == [
+            "id",
+            "name",
+            "id",
+            "user_id",
+        ]
+
+    def test_executemany(self):
+        stats = self.connection.compiler.cache_stats
+        misses = stats.misses
+        self.insert_users(50)
+
+        # One compile for every row.
+        assert stats.misses == misses + 1
+        assert self.connection.execute("SELECT count(*) FROM users").fetchall() == [
+            [50]
+        ]
+
+    def test_fetchmany(self):
+        self.insert_users(10)
+        cursor = self.connection.execute("SELECT id FROM users")
+
+        assert cursor.fetchmany() == [[1]]
+        assert cursor.fetchmany(3) == [[2], [3], [4]]
+        cursor.arraysize = 4
+        assert cursor.fetchmany() == [[5], [6], [7], [8]]
+        assert list(cursor) == [[9], [10]]
+        assert cursor.fetchmany(5) == []
+        assert cursor.fetchall() == []
+
+    def test_streaming(self):
+        self.insert_users(100)
+        vm = self.connection.vm
+        vm.count_steps = True
+        cursor = self.connection.execute("SELECT name FROM users")
+        assert cursor.fetchmany(2) == [["user-1"], ["user-2"]]
+        streamed = vm.steps
+
+        # Only enough of the program ran for the rows fetched so far.
+        assert list(self.connection.execute("SELECT name FROM users"))[-1] == [
+            "user-100"
+        ]
+        assert streamed * 10 < vm.steps
+
+        # Cursors are independent and a new statement drops the old rows.
+        assert cursor.fetchone() == ["user-3"]
+        cursor.execute("SELECT id FROM users WHERE id = 50")
+        assert cursor.fetchall() == [[50]]
+
+    def test_two_connections(self):
+        other = dbapi.connect(self.temp_dir.name + "/__testdb__.db", self.engine)
+        insert = "INSERT INTO users VALUES (?, ?);"
+        other.execute(insert, [1, "Phil"])
+
+        # The index is made by this connection, the other one's
+        # cached INSERT has to be recompiled to maintain it.
+        self.connection.execute("CREATE INDEX users_name ON users (name);")
+        assert other.pager.schema_cookie() == self.connection.pager.schema_cookie()
+        other.execute(insert, [2, "Bob"])
+
+        for connection in [self.connection, other]:
+            rows = connection.execute("SELECT id FROM users WHERE name = 'Bob'")
+            assert rows.fetchall() == [[2]]
+
+        other.close()
+
+    def test_close(self):
+        cursor = self.connection.cursor()
+        cursor.close()
+
+        with self.assertRaises(ClosedException):
+            cursor.execute("SELECT * FROM users")
+
+        cursor = self.connection.execute("SELECT * FROM users")
+        self.connection.close()
+
+        with self.assertRaises(ClosedException):
+            cursor.fetchone()
+
+        with self.assertRaises(ClosedException):
+            self.connection.cursor()
+
+
+class TestCodegenDBAPI(TestDBAPI):
+    engine = "codegen"
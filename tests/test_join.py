@@ -0,0 +1,66 @@
+from unittest import TestCase
+from toysql.join import HashJoin
+import random
+
+
+class TestHashJoin(TestCase):
+    def setUp(self) -> None:
+        # customer_id, order_id
+        self.build_rows = [[n % 40, n] for n in range(200)]
+        random.shuffle(self.build_rows)
+        self.probe_rows = [[n, f"customer-{n}"] for n in range(50)]
+        self.expected = sorted(
+            (probe[1], build[1])
+            for probe in self.probe_rows
+            for build in self.build_rows
+            if probe[0] == build[0]
+        )
+
+    def join(self, join: HashJoin):
+        for key, order_id in self.build_rows:
+            join.build(key, [order_id])
+
+        pairs = []
+        for key, name in self.probe_rows:
+            if join.probe(key, [name]):
+                pairs.extend((name, row[0]) for row in join.matches)
+
+        while (entry := join.next_deferred()) is not None:
+            _, [name] = entry
+            pairs.extend((name, row[0]) for row in join.matches)
+
+        return sorted(pairs)
+
+    def test_join(self):
+        join = HashJoin()
+        assert self.join(join) == self.expected
+        assert join.spilled == 0
+
+    def test_spill(self):
+        join = HashJoin(buffer_size=16)
+        assert self.join(join) == self.expected
+        assert join.spilled > 0
+        assert join.rows <= 16
+
+    def test_nulls(self):
+        join = HashJoin()
+        join.build(None, ["a"])
+        join.build(1, ["b"])
+
+        assert join.probe(None, [])
+        assert list(join.matches) == []
+        assert join.probe(1, [])
+        assert list(join.matches) == [["b"]]
+        assert join.next_deferred() is None
+
+    def test_same_key(self):
+        # Every row has the same key so splitting doesn't help,
+        # eventually it's kept in memory.
+        join = HashJoin(buffer_size=4)
+        for n in range(20):
+            join.build(1, [n])
+
+        assert not join.probe(1, ["x"])
+        assert join.next_deferred() == (1, ["x"])
+        assert [row[0] for row in join.matches] == list(range(20))
+        assert join.next_deferred() is None
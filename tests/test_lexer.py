@@ -5,6 +5,7 @@ from toysql.lexer import (
     Identifier,
     DataType,
     Symbol,
+    Parameter,
     Token,
     Cursor,
     Location,
@@ -14,14 +15,26 @@ from toysql.lexer import (
     keyword_lexer,
     identifier_lexer,
     lex,
+    lex_stream,
+    tokenize,
+    to_sql,
 )
+from io import StringIO
 from unittest import TestCase
 from toysql.exceptions import LexingException
 
 
 class TestSymbolLexer(TestCase):
     def test_lex(self):
-        cases = [(",b", ",", 1), ("*", "*", 1), (" *", None, 0), ("select", None, 0)]
+        cases = [
+            (",b", ",", 1),
+            ("*", "*", 1),
+            (" *", None, 0),
+            ("select", None, 0),
+            (">=1", ">=", 2),
+            ("<= 1", "<=", 2),
+            ("<1", "<", 1),
+        ]
 
         for source, value, pointer in cases:
             cursor = Cursor(source)
@@ -94,6 +107,7 @@ class TestIdentifierLexer(TestCase):
         cases = [
             ("my_table", "my_table"),
             ('"hello"', "hello"),
+            ("Orders.ID", "orders.id"),
             ("12345", None),
         ]
 
@@ -234,3 +248,72 @@ class TestStatementLexer(TestCase):
         tokens = lex(query)
 
         assert Token(Keyword._as, loc=Location(line=0, col=58)) not in tokens
+
+        tokens = lex("SELECT null_values, order2 FROM stats;")
+        assert tokens[1] == Token(
+            Identifier.long, value="null_values", loc=Location(0, 7)
+        )
+        assert tokens[3] == Token(Identifier.long, value="order2", loc=Location(0, 20))
+
+    def test_parameters(self):
+        tokens = lex("SELECT * FROM users WHERE id = ? AND name = :user_name;")
+
+        assert tokens[-6] == Token(Parameter.positional, loc=Location(0, 31))
+        assert tokens[-2] == Token(
+            Parameter.named, value=":user_name", loc=Location(0, 44)
+        )
+        assert tokens[-2].kind == Kind.datatype
+
+    def test_multiline_location(self):
+        query = "SELECT id,\n  name\r\nFROM users\n\nWHERE id = 'a\nb';"
+        tokens = lex(query)
+
+        assert tokens[3] == Token(Identifier.long, value="name", loc=Location(1, 2))
+        assert tokens[4] == Token(Keyword._from, loc=Location(2, 0))
+        assert tokens[6] == Token(Keyword.where, loc=Location(4, 0))
+        assert tokens[9] == Token(DataType.text, value="a\nb", loc=Location(4, 11))
+        assert tokens[10] == Token(Symbol.semicolon, loc=Location(5, 2))
+
+    def test_large_input(self):
+        query = "\n".join(
+            f"INSERT INTO users VALUES ({i}, 'user-{i}');" for i in range(20_000)
+        )
+        tokens = lex(query)
+
+        assert len(tokens) == 20_000 * 10
+        assert tokens[-1] == Token(Symbol.semicolon, loc=Location(19_999, 46))
+
+
+class TestStreamLexer(TestCase):
+    def test_chunk_boundaries(self):
+        query = "CREATE TABLE users (id INTEGER, name TEXT);\nINSERT INTO users VALUES (1, 'Phil\nip'), (22, \"Bob\");\n\nSELECT * FROM users WHERE id >= 1;"
+
+        for chunk_size in [1, 2, 3, 7, 64]:
+            tokens = list(lex_stream(StringIO(query), chunk_size))
+            assert tokens == lex(query)
+
+    def test_qualified_identifier_chunks(self):
+        query = "SELECT o.id FROM o;"
+        expected = lex(query)
+
+        # Every split, including "SELECT o." then "id FROM o;".
+        for i in range(1, len(query)):
+            assert list(tokenize([query[:i], query[i:]])) == expected
+
+        for chunk_size in [1, 2, 9]:
+            assert list(lex_stream(StringIO(query), chunk_size)) == expected
+
+    def test_invalid_sql_symbol(self):
+        with self.assertRaises(LexingException) as exec_info:
+            list(lex_stream(StringIO("SELECT *\nFROM $$"), 2))
+
+        assert str(exec_info.exception) == "Lexing error at location 1:5"
+
+    def test_to_sql(self):
+        query = """create table users (id integer primary key, "Name" text) with (fillfactor = 90);"""
+        assert to_sql(lex(query)) == query
+        query = "select orders.id from orders join customers on orders.customer_id = customers.id;"
+        assert to_sql(lex(query)) == query
+        assert lex(to_sql(lex("INSERT INTO \"select\" VALUES (1,'a b');"))) == lex(
+            "insert into \"select\" values (1, 'a b');"
+        )
@@ -1,5 +1,12 @@
 from toysql.record import Record, DataType
-from toysql.page import LeafPageCell, InteriorPageCell, Page, PageType
+from toysql.page import (
+    LeafPageCell,
+    InteriorPageCell,
+    IndexLeafPageCell,
+    IndexInteriorPageCell,
+    Page,
+    PageType,
+)
 from unittest import TestCase
 
 
@@ -91,3 +98,37 @@ class TestPage(TestCase):
             cells.append(leaf_page.add(payload))
 
         assert sorted(cells) == leaf_page.cells
+
+    def test_index_leaf_page(self):
+        page = Page(PageType.index_leaf, 1)
+
+        for row_id, value in [(3, "b"), (1, "b"), (2, "a")]:
+            record = Record([[DataType.integer, row_id], [DataType.text, value]])
+            page.add_cell(IndexLeafPageCell(record))
+
+        new_page = Page.from_bytes(page.to_bytes())
+        # Ordered by (value, row_id)
+        assert [cell.row_id for cell in new_page.cells] == [2, 1, 3]
+
+
+class TestIndexCell(TestCase):
+    def test_index_cells(self):
+        record = Record([[DataType.integer, 7], [DataType.text, "Craig"]])
+        cell = IndexLeafPageCell.from_bytes(IndexLeafPageCell(record).to_bytes())
+        assert cell.record.values == record.values
+        assert cell.key == ((2, "Craig"), (1, 7))
+
+        interior = IndexInteriorPageCell.from_bytes(cell.divider(12).to_bytes())
+        assert interior.key == cell.key
+        assert interior.left_child_page_number == 12
+
+    def test_index_cell_included_values(self):
+        record = Record(
+            [[DataType.integer, 7], [DataType.integer, 1], [DataType.text, "Craig"]]
+        )
+        cell = IndexLeafPageCell.from_bytes(IndexLeafPageCell(record, 1).to_bytes())
+        assert cell.key_size == 1
+        # Included values aren't part of the key
+        assert cell.key == ((1, 1), (1, 7))
+        # or the interior cells.
+        assert cell.divider(12).record.values == record.values[:2]
@@ -1,7 +1,17 @@
+from pathlib import Path
 from snapshottest import TestCase
-from toysql.pager import Pager
+import shutil
+
+from toysql import dbapi
+from toysql.pager import Pager, LEGACY_PAGE_NUMBER_SIZE
+from toysql.page import PAGE_NUMBER_SIZE
+from toysql.lexer import DataType
 from tests.fixtures import Fixtures
 
+# Written by toysql before the page number in the page header was
+# widened to 4 bytes: a users table of 200 rows with an index on age.
+LEGACY_DB = Path(__file__).parent / "data" / "legacy.db"
+
 
 class TestPager(Fixtures, TestCase):
     def test_is_corrupt(self):
@@ -15,3 +25,48 @@ class TestPager(Fixtures, TestCase):
 
         with self.assertRaises(Exception):
             Pager(self.db_file_path)
+
+    def test_schema_cookie(self):
+        assert self.pager.schema_cookie() == 0
+        self.pager.new()
+        self.pager.set_schema_cookie(7)
+
+        page = self.pager.read(0)
+        page.add([[DataType.integer, 1], [DataType.text, "hello"]])
+        self.pager.write(page)
+
+        assert self.pager.schema_cookie() == 7
+        assert self.pager.read(0).cells[0].record.values[1][1] == "hello"
+
+    def test_page_number_size(self):
+        self.pager.new()
+        assert self.pager.header_page_number_size() == PAGE_NUMBER_SIZE
+        assert not self.pager.is_legacy()
+
+    def test_legacy_page_number(self):
+        shutil.copy(LEGACY_DB, self.db_file_path)
+        connection = dbapi.connect(self.db_file_path)
+        assert connection.pager.page_number_size == LEGACY_PAGE_NUMBER_SIZE
+
+        def count(sql):
+            return len(connection.execute(sql).fetchall())
+
+        assert count("SELECT * FROM users") == 200
+        assert count("SELECT id FROM users WHERE age = 3") == 20
+        assert connection.execute("SELECT age FROM users WHERE id = 57").fetchall() == [
+            [7]
+        ]
+
+        # Writes keep the file's layout.
+        connection.executemany(
+            "INSERT INTO users VALUES (?, ?, ?);",
+            ([i, f"user-{i}" * 10, i % 10] for i in range(201, 301)),
+        )
+        connection.close()
+
+        connection = dbapi.connect(self.db_file_path)
+        assert connection.pager.is_legacy()
+        assert count("SELECT * FROM users") == 300
+        assert count("SELECT id FROM users WHERE age = 3") == 30
+        assert count("SELECT id FROM users WHERE id > 290") == 10
+        connection.close()
@@ -1,4 +1,4 @@
-from toysql.lexer import Token, Keyword, Symbol, Identifier, DataType
+from toysql.lexer import Token, Keyword, Symbol, Identifier, DataType, lex
 from toysql.parser import (
     parse,
     SelectStatement,
@@ -6,8 +6,19 @@ from toysql.parser import (
     CreateStatement,
     TokenCursor,
     ColumnDefinition,
+    CreateIndexStatement,
+    BinaryExpression,
+    UnaryExpression,
+    FunctionExpression,
+    UpdateStatement,
+    Assignment,
+    Join,
+    AnalyzeStatement,
+    ExplainStatement,
+    parse_stream,
 )
 from unittest import TestCase
+from toysql.exceptions import ParsingException
 
 
 class TestParser(TestCase):
@@ -64,8 +75,27 @@ class TestParser(TestCase):
         [stmt] = parse(tokens)
         assert isinstance(stmt, SelectStatement)
         assert stmt._from.value == "my_table"
+        assert isinstance(stmt.items[0], Token)
         assert stmt.items[0].value == "*"
 
+    def test_parse_stream(self):
+        select = [
+            Token(Keyword.select),
+            Token(Symbol.asterisk),
+            Token(Keyword._from),
+            Token(Identifier.long, value="my_table"),
+            Token(Symbol.semicolon),
+        ]
+
+        def tokens():
+            yield from select
+            raise Exception("Read past the first statement")
+
+        stmts = parse_stream(tokens())
+        stmt = next(stmts)
+        assert isinstance(stmt, SelectStatement)
+        assert stmt._from.value == "my_table"
+
 
 class TestCreateParser(TestCase):
     def test_create(self):
@@ -102,6 +132,32 @@ class TestCreateParser(TestCase):
         ]
         assert stmt.table == tokens[2]
 
+    def test_create_with_options(self):
+        tokens = [
+            Token(Keyword.create),
+            Token(Keyword.table),
+            Token(Identifier.long, value="users"),
+            Token(Symbol.left_paren),
+            Token(Identifier.long, value="id"),
+            Token(Keyword.integer),
+            Token(Symbol.right_paren),
+            Token(Keyword._with),
+            Token(Symbol.left_paren),
+            Token(Identifier.long, value="fillfactor"),
+            Token(Symbol.equal),
+            Token(DataType.integer, value="90"),
+            Token(Symbol.comma),
+            Token(Identifier.long, value="split"),
+            Token(Symbol.equal),
+            Token(Identifier.long, value="append"),
+            Token(Symbol.right_paren),
+            Token(Symbol.semicolon),
+        ]
+
+        [stmt] = parse(tokens)
+        assert isinstance(stmt, CreateStatement)
+        assert stmt.options == {"fillfactor": tokens[11], "split": tokens[15]}
+
 
 class TestInsertParser(TestCase):
     def test_insert(self):
@@ -121,9 +177,31 @@ class TestInsertParser(TestCase):
         stmt = InsertStatement.parse(cursor)
         assert isinstance(stmt, InsertStatement)
         assert stmt.columns == []
-        assert stmt.values == [tokens[5], tokens[7]]
+        assert stmt.values == [[tokens[5], tokens[7]]]
         assert stmt.into == tokens[2]
 
+    def test_insert_many(self):
+        [stmt] = parse(lex("INSERT INTO users VALUES (1, 'Phil'), (2, 'Sam');"))
+        assert isinstance(stmt, InsertStatement)
+        assert [[t.value for t in row] for row in stmt.values] == [
+            ["1", "Phil"],
+            ["2", "Sam"],
+        ]
+        assert stmt.select is None
+
+    def test_insert_select(self):
+        [stmt, select] = parse(
+            lex(
+                "INSERT INTO users SELECT * FROM people WHERE id > 2; SELECT * FROM users;"
+            )
+        )
+        assert isinstance(stmt, InsertStatement)
+        assert stmt.values == []
+        assert isinstance(stmt.select, SelectStatement)
+        assert stmt.select._from.value == "people"
+        assert stmt.select.where is not None
+        assert isinstance(select, SelectStatement)
+
 
 class TestSelectParser(TestCase):
     def test_select_astrix(self):
@@ -146,6 +224,7 @@ class TestSelectParser(TestCase):
         stmt = SelectStatement.parse(cursor)
         assert isinstance(stmt, SelectStatement)
         assert stmt._from.value == "my_table"
+        assert isinstance(stmt.items[0], Token)
         assert stmt.items[0].value == "*"
 
     def test_select_multi_columns(self):
@@ -170,6 +249,8 @@ class TestSelectParser(TestCase):
         stmt = SelectStatement.parse(cursor)
         assert isinstance(stmt, SelectStatement)
         assert stmt._from.value == "my_table"
+        assert isinstance(stmt.items[0], Token)
+        assert isinstance(stmt.items[1], Token)
         assert stmt.items[0].value == "a"
         assert stmt.items[1].value == "b"
 
@@ -192,3 +273,268 @@ class TestSelectParser(TestCase):
             SelectStatement.parse(cursor)
 
         assert cursor.pointer == 0
+
+    def test_select_where(self):
+        tokens = [
+            Token(Keyword.select),
+            Token(Symbol.asterisk),
+            Token(Keyword._from),
+            Token(Identifier.long, value="my_table"),
+            Token(Keyword.where),
+            Token(Identifier.long, value="x"),
+            Token(Symbol.gteq),
+            Token(DataType.integer, value="1"),
+            Token(Keyword._and),
+            Token(DataType.text, value="hi"),
+            Token(Symbol.equal),
+            Token(Identifier.long, value="y"),
+        ]
+        cursor = TokenCursor(tokens)
+        stmt = SelectStatement.parse(cursor)
+        assert stmt.where == BinaryExpression(
+            tokens[8],
+            BinaryExpression(tokens[6], tokens[5], tokens[7]),
+            BinaryExpression(tokens[10], tokens[9], tokens[11]),
+        )
+
+    def test_select_limit(self):
+        tokens = [
+            Token(Keyword.select),
+            Token(Symbol.asterisk),
+            Token(Keyword._from),
+            Token(Identifier.long, value="my_table"),
+            Token(Keyword.limit),
+            Token(DataType.integer, value="10"),
+            Token(Keyword.offset),
+            Token(DataType.integer, value="20"),
+            Token(Symbol.semicolon),
+        ]
+
+        [stmt] = parse(tokens)
+        assert stmt.limit == tokens[5]
+        assert stmt.offset == tokens[7]
+
+        with self.assertRaises(ParsingException):
+            parse(tokens[:5] + [Token(DataType.text, value="10")])
+
+    def test_select_group_by(self):
+        [stmt] = parse(
+            lex(
+                "SELECT region, SUM(amount), COUNT(*) FROM orders "
+                "WHERE amount > 1 GROUP BY region, year LIMIT 2;"
+            )
+        )
+        assert isinstance(stmt, SelectStatement)
+        region, total, count = stmt.items
+        assert isinstance(region, Token)
+        assert region.value == "region"
+        assert isinstance(total, FunctionExpression)
+        assert (total.name.value, total.argument.value) == ("sum", "amount")
+        assert str(count) == "count(*)"
+        assert stmt.aggregates == [total, count]
+        assert [c.value for c in stmt.group_by] == ["region", "year"]
+        assert stmt.where is not None
+        assert stmt.limit is not None
+
+        for sql in [
+            "SELECT SUM(*) FROM orders",
+            "SELECT MEDIAN(amount) FROM orders",
+            "SELECT SUM(amount FROM orders",
+            "SELECT region FROM orders GROUP region",
+            "SELECT region FROM orders GROUP BY 1",
+        ]:
+            with self.assertRaises(ParsingException):
+                parse(lex(sql))
+
+    def test_select_order_by(self):
+        [stmt] = parse(
+            lex(
+                "SELECT region, SUM(amount) FROM orders GROUP BY region "
+                "ORDER BY SUM(amount) DESC, region ASC, year LIMIT 2;"
+            )
+        )
+        assert isinstance(stmt, SelectStatement)
+        assert [(str(t), t.descending) for t in stmt.order_by] == [
+            ("sum(amount)", True),
+            ("region", False),
+            ("year", False),
+        ]
+        assert stmt.limit is not None
+
+        for sql in [
+            "SELECT * FROM orders ORDER region",
+            "SELECT * FROM orders ORDER BY",
+            "SELECT * FROM orders ORDER BY 1",
+        ]:
+            with self.assertRaises(ParsingException):
+                parse(lex(sql))
+
+    def test_select_join(self):
+        [stmt] = parse(
+            lex(
+                "SELECT orders.id, name FROM orders "
+                "LEFT OUTER JOIN customers ON orders.customer_id = customers.id "
+                "WHERE amount > 10;"
+            )
+        )
+        assert isinstance(stmt, SelectStatement)
+        assert stmt._from.value == "orders"
+        id_column, name_column = stmt.items
+        assert isinstance(id_column, Token) and isinstance(name_column, Token)
+        assert (id_column.value, name_column.value) == ("orders.id", "name")
+        [join] = stmt.joins
+        assert isinstance(join, Join)
+        assert join.table.value == "customers"
+        assert join.left
+        assert isinstance(join.on, BinaryExpression)
+        assert isinstance(join.on.left, Token)
+        assert join.on.left.value == "orders.customer_id"
+        assert stmt.where is not None
+
+        for sql in [
+            "SELECT * FROM a JOIN b ON a.id = b.id",
+            "SELECT * FROM a INNER JOIN b ON a.id = b.id",
+        ]:
+            [stmt] = parse(lex(sql))
+            assert [j.left for j in stmt.joins] == [False]
+
+        for sql in [
+            "SELECT * FROM a JOIN b",
+            "SELECT * FROM a JOIN ON a.id = b.id",
+            "SELECT * FROM a LEFT b ON a.id = b.id",
+            "SELECT * FROM a INNER JOIN b ON",
+        ]:
+            with self.assertRaises(ParsingException):
+                parse(lex(sql))
+
+    def test_analyze(self):
+        assert parse(lex("ANALYZE;")) == [AnalyzeStatement()]
+        [stmt] = parse(lex("analyze orders"))
+        assert isinstance(stmt, AnalyzeStatement)
+        assert stmt.table is not None and stmt.table.value == "orders"
+
+    def test_explain(self):
+        [stmt] = parse(lex("EXPLAIN SELECT * FROM orders;"))
+        assert isinstance(stmt, ExplainStatement) and not stmt.query_plan
+        assert isinstance(stmt.statement, SelectStatement)
+
+        [stmt] = parse(lex("explain query plan analyze"))
+        assert isinstance(stmt, ExplainStatement) and stmt.query_plan
+        assert stmt.statement == AnalyzeStatement()
+
+        [stmt] = parse(lex("EXPLAIN ANALYZE SELECT * FROM orders;"))
+        assert isinstance(stmt, ExplainStatement) and stmt.analyze
+        assert isinstance(stmt.statement, SelectStatement)
+
+        # Without a statement after it ANALYZE is the statement.
+        [stmt] = parse(lex("EXPLAIN ANALYZE orders;"))
+        assert isinstance(stmt, ExplainStatement) and not stmt.analyze
+        assert isinstance(stmt.statement, AnalyzeStatement)
+
+        for sql in ["EXPLAIN;", "EXPLAIN QUERY SELECT 1;", "EXPLAIN EXPLAIN ANALYZE;"]:
+            with self.assertRaises(ParsingException):
+                parse(lex(sql))
+
+    def test_select_where_precedence(self):
+        """
+        NOT a = 1 OR b = 2 AND (c = 3 OR d = 4)
+        """
+        comparisons = [
+            [
+                Token(Identifier.long, value=name),
+                Token(Symbol.equal),
+                Token(DataType.integer, value=str(i)),
+            ]
+            for i, name in enumerate(["a", "b", "c", "d"])
+        ]
+        _not, _or, _and = Token(Keyword._not), Token(Keyword._or), Token(Keyword._and)
+        tokens = (
+            [Token(Keyword.select), Token(Symbol.asterisk), Token(Keyword._from)]
+            + [Token(Identifier.long, value="my_table"), Token(Keyword.where)]
+            + [_not, *comparisons[0], _or, *comparisons[1], _and]
+            + [Token(Symbol.left_paren), *comparisons[2], _or, *comparisons[3]]
+            + [Token(Symbol.right_paren), Token(Symbol.semicolon)]
+        )
+        [a, b, c, d] = [BinaryExpression(op, l, r) for l, op, r in comparisons]
+
+        [stmt] = parse(tokens)
+        assert stmt.where == BinaryExpression(
+            _or,
+            UnaryExpression(_not, a),
+            BinaryExpression(_and, b, BinaryExpression(_or, c, d)),
+        )
+
+
+class TestCreateIndexParser(TestCase):
+    def test_create_index(self):
+        tokens = [
+            Token(Keyword.create),
+            Token(Keyword.index),
+            Token(Identifier.long, value="users_name"),
+            Token(Keyword.on),
+            Token(Identifier.long, value="users"),
+            Token(Symbol.left_paren),
+            Token(Identifier.long, value="name"),
+            Token(Symbol.comma),
+            Token(Identifier.long, value="email"),
+            Token(Symbol.right_paren),
+            Token(Symbol.semicolon),
+        ]
+
+        [stmt] = parse(tokens)
+        assert isinstance(stmt, CreateIndexStatement)
+        assert stmt.name == tokens[2]
+        assert stmt.table == tokens[4]
+        assert stmt.columns == [tokens[6], tokens[8]]
+        assert stmt.include == []
+
+    def test_create_index_include(self):
+        tokens = [
+            Token(Keyword.create),
+            Token(Keyword.index),
+            Token(Identifier.long, value="users_name"),
+            Token(Keyword.on),
+            Token(Identifier.long, value="users"),
+            Token(Symbol.left_paren),
+            Token(Identifier.long, value="name"),
+            Token(Symbol.right_paren),
+            Token(Keyword.include),
+            Token(Symbol.left_paren),
+            Token(Identifier.long, value="email"),
+            Token(Symbol.right_paren),
+        ]
+
+        [stmt] = parse(tokens)
+        assert isinstance(stmt, CreateIndexStatement)
+        assert stmt.columns == [tokens[6]]
+        assert stmt.include == [tokens[10]]
+
+
+class TestUpdateParser(TestCase):
+    def test_update(self):
+        tokens = [
+            Token(Keyword.update),
+            Token(Identifier.long, value="users"),
+            Token(Keyword.set),
+            Token(Identifier.long, value="name"),
+            Token(Symbol.equal),
+            Token(DataType.text, value="fred"),
+            Token(Symbol.comma),
+            Token(Identifier.long, value="age"),
+            Token(Symbol.equal),
+            Token(Keyword.null),
+            Token(Keyword.where),
+            Token(Identifier.long, value="id"),
+            Token(Symbol.equal),
+            Token(DataType.integer, value="1"),
+            Token(Symbol.semicolon),
+        ]
+
+        [stmt] = parse(tokens)
+        assert isinstance(stmt, UpdateStatement)
+        assert stmt.table == tokens[1]
+        assert stmt.assignments == [
+            Assignment(tokens[3], tokens[5]),
+            Assignment(tokens[7], tokens[9]),
+        ]
+        assert stmt.where == BinaryExpression(tokens[12], tokens[11], tokens[13])
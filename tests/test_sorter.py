@@ -0,0 +1,61 @@
+from unittest import TestCase
+from toysql.sorter import Sorter
+import random
+
+
+class TestSorter(TestCase):
+    def setUp(self) -> None:
+        self.rows = [[n % 7, f"name-{n}", n] for n in range(200)]
+        random.shuffle(self.rows)
+        # age ASC, name DESC
+        self.expected = [
+            row[2:]
+            for row in sorted(
+                sorted(self.rows, key=lambda r: r[1], reverse=True),
+                key=lambda r: r[0],
+            )
+        ]
+
+    def sort(self, sorter: Sorter):
+        for row in self.rows:
+            sorter.insert(row)
+
+        return list(sorter.sorted())
+
+    def test_sort(self):
+        sorter = Sorter([False, True])
+        assert self.sort(sorter) == self.expected
+        assert sorter.runs == []
+
+    def test_spill(self):
+        sorter = Sorter([False, True], buffer_size=16)
+        for row in self.rows:
+            sorter.insert(row)
+
+        assert len(sorter.runs) == len(self.rows) // 16
+        assert list(sorter.sorted()) == self.expected
+
+    def test_top_n(self):
+        sorter = Sorter([False, True], limit=5, buffer_size=16)
+        for row in self.rows:
+            sorter.insert(row)
+            # Only the best rows so far are kept.
+            assert len(sorter.rows) <= 5
+
+        assert sorter.runs == []
+        assert list(sorter.sorted()) == self.expected[:5]
+
+        # More than fits in memory, falls back to sorting everything.
+        assert (
+            self.sort(Sorter([False, True], limit=50, buffer_size=16))[:50]
+            == self.expected[:50]
+        )
+
+    def test_nulls_and_ties(self):
+        sorter = Sorter([True])
+        for row in [[None, "a"], [2, "b"], ["x", "c"], [2, "d"], [None, "e"]]:
+            sorter.insert(row)
+
+        # Text sorts after integers and NULL first, reversed for DESC.
+        # Equal keys keep the order they came in.
+        assert list(sorter.sorted()) == [["c"], ["b"], ["d"], ["a"], ["e"]]
@@ -0,0 +1,85 @@
+from tests.fixtures import Fixtures
+from toysql.btree import BTree
+from toysql.page import LeafPageCell
+from toysql.lexer import Symbol
+from toysql.record import Record, DataType
+from toysql.stats import (
+    ColumnStats,
+    Stats,
+    analyze,
+    estimate_distinct,
+    histogram,
+    BUCKETS,
+)
+
+
+class TestStats(Fixtures):
+    def setUp(self) -> None:
+        super().setUp()
+        self.root_page_number = self.pager.new()
+        cells = []
+
+        for key in range(1, 1001):
+            name = None if key % 10 == 0 else f"name-{key % 50:02}"
+            record = Record(
+                [
+                    [DataType.integer, key],
+                    [DataType.null if name is None else DataType.text, name],
+                    [DataType.integer, key % 4],
+                ]
+            )
+            cells.append(LeafPageCell(record))
+
+        BTree(self.pager, self.root_page_number).bulk_load(cells)
+
+    def test_analyze(self):
+        row_count, page_count, distinct, nulls, histograms = analyze(
+            self.pager, self.root_page_number, [0, 1, 2]
+        )
+
+        assert row_count == 1000
+        assert page_count > 2
+        stats = Stats.from_row(
+            [1, "t", "t", row_count, page_count, distinct, nulls, histograms]
+        )
+        [key, name, mod] = stats.columns
+
+        assert (key.distinct, key.nulls) == (1000, 0)
+        assert (name.distinct, name.nulls) == (45, 100)
+        assert (mod.distinct, mod.nulls) == (4, 0)
+        assert key.histogram[0] == 1 and key.histogram[-1] == 1000
+        assert len(key.histogram) == BUCKETS + 1
+
+    def test_sample(self):
+        # Only a couple of leaves are read but every row is counted.
+        row_count, page_count, distinct, nulls, _ = analyze(
+            self.pager, self.root_page_number, [0, 2], sample_pages=2
+        )
+        stats = Stats.from_row(
+            [1, "t", "t", row_count, page_count, distinct, nulls, "[[], []]"]
+        )
+
+        assert row_count == 1000
+        [key, mod] = stats.columns
+        # Every sampled key is unique so they're taken to all be.
+        assert key.distinct == 1000
+        assert mod.distinct == 4
+
+    def test_estimate_distinct(self):
+        assert estimate_distinct([], 10) == 0
+        assert estimate_distinct([1, 2, 2, 3], 4) == 3
+        assert estimate_distinct(list(range(100)), 10_000) == 10_000
+        assert estimate_distinct([n % 5 for n in range(100)], 10_000) == 5
+
+    def test_selectivity(self):
+        column = ColumnStats(10, 20, histogram(list(range(80))))
+
+        assert column.selectivity(Symbol.equal, 5, 100) == 0.08
+        assert column.selectivity(Symbol.equal, 500, 100) == 0
+        assert column.selectivity(Symbol.not_equal, 5, 100) == 0.8 - 0.08
+        assert column.selectivity(Symbol.equal, None, 100) == 0
+        assert column.selectivity(Symbol.lt, 0, 100) == 0
+        assert column.selectivity(Symbol.gt, 79, 100) == 0
+        assert 0.3 < column.selectivity(Symbol.lt, 40, 100) < 0.5
+        assert 0.3 < column.selectivity(Symbol.gteq, 40, 100) < 0.5
+        assert column.selectivity(Symbol.gteq, 0, 100) == 0.8
@@ -1,11 +1,35 @@
 import unittest
-from toysql.vm import VM
+from toysql.vm import VM, Codegen, Profile
 from tests.fixtures import Fixtures
-from toysql.compiler import Compiler, SCHEMA_TABLE_NAME
+from toysql.compiler import (
+    Compiler,
+    Opcode,
+    IndexScan,
+    JoinPlan,
+    SCHEMA_TABLE_NAME,
+    PROFILE_COLUMNS,
+    conjuncts,
+)
 import random
+from typing import cast
+from io import StringIO
+from contextlib import redirect_stdout
+import logging
+from toysql.btree import BTree
+from toysql.exceptions import (
+    DuplicateKeyException,
+    ParsingException,
+    BindingException,
+    SchemaChangedException,
+    ColumnNotFoundException,
+    TableFoundException,
+)
+from unittest.mock import patch
 
 
 class TestVM(Fixtures):
+    engine = "interpreter"
+
     def setUp(self) -> None:
         super().setUp()
         self.table_name = "users"
@@ -13,7 +37,7 @@ class TestVM(Fixtures):
             f"CREATE TABLE {self.table_name} (id INTEGER, name TEXT, email TEXT);"
         )
 
-        self.vm = VM(self.pager)
+        self.vm = VM(self.pager, engine=self.engine)
         self.compiler = Compiler(self.pager)
 
         def execute(sql: str):
@@ -40,6 +64,167 @@ class TestVM(Fixtures):
         # TODO: Listing key here twice.
         assert new_row == [2, "table", table_name, table_name, 2, create_stmt]
 
+    def test_create_with_fillfactor(self):
+        create_stmt = "CREATE TABLE logs (id INTEGER, body TEXT) WITH (split=append);"
+        self.execute(create_stmt)
+        records = self.execute(f"SELECT * FROM {SCHEMA_TABLE_NAME}")
+        assert records[-1][-1] == create_stmt
+
+        self.execute("CREATE TABLE even_logs (id INTEGER, body TEXT);")
+
+        for n in range(100):
+            self.execute(f"INSERT INTO logs VALUES ({n}, '{'x' * 200}');")
+            self.execute(f"INSERT INTO even_logs VALUES ({n}, '{'x' * 200}');")
+
+        assert [r[0] for r in self.execute("SELECT id FROM logs")] == list(range(100))
+        append = self.compiler.get_table_utilization("logs")
+        even = self.compiler.get_table_utilization("even_logs")
+        assert append.leaf_pages < even.leaf_pages
+        assert append.fill > even.fill
+
+        with self.assertRaises(ParsingException):
+            self.execute("CREATE TABLE bad (id INTEGER) WITH (fillfactor=1);")
+
+    def test_compile_stream(self):
+        script = StringIO(
+            """
+            CREATE TABLE "Logs" (id INTEGER PRIMARY KEY, body TEXT);
+            INSERT INTO "Logs" VALUES (1, 'one; two');
+            INSERT INTO "Logs" VALUES (2, 'three');
+            SELECT body FROM "Logs";
+            """
+        )
+        # Each statement runs before the next is compiled.
+        results = [
+            list(self.vm.execute(p)) for p in self.compiler.compile_stream(script)
+        ]
+
+        assert results[-1] == [["one; two"], ["three"]]
+        assert self.compiler.get_table_column_names("Logs") == ["id", "body"]
+        assert (
+            self.compiler.get_table_create_stmt("Logs")
+            == 'create table "Logs" (id integer primary key, body text);'
+        )
+
+    def test_compile_stream_invalid_statement(self):
+        script = StringIO(
+            """
+            CREATE TABLE logs (id INTEGER PRIMARY KEY, body TEXT);
+            INSERT INTO logs VALUES (1, 'one');
+            INSERTT INTO logs VALUES (2, 'two');
+            INSERT INTO logs VALUES (3, 'three');
+            """
+        )
+        programs = self.compiler.compile_stream(script)
+        list(self.vm.execute(next(programs)))
+        list(self.vm.execute(next(programs)))
+
+        with self.assertRaises(ParsingException) as exec_info:
+            next(programs)
+
+        assert str(exec_info.exception) == (
+            "Invalid statement at location 3:12: insertt into logs values (2, 'two');"
+        )
+        assert self.execute("SELECT id FROM logs") == [[1]]
+
+    def test_prepared_statement(self):
+        insert = self.compiler.prepare_statement(
+            f"INSERT INTO {self.table_name} VALUES (?, ?, ?);"
+        )
+        select = self.compiler.prepare_statement(
+            f"SELECT name FROM {self.table_name} WHERE id = :id;"
+        )
+
+        with patch("toysql.compiler.lex") as lex:
+            for n in range(20):
+                list(self.vm.execute(insert.program, insert.bind([n, f"u{n}", None])))
+
+            rows = self.vm.execute(select.program, select.bind({"id": 7}))
+            assert list(rows) == [["u7"]]
+            rows = self.vm.execute(select.program, select.bind({"id": "7"}))
+            assert list(rows) == []
+            lex.assert_not_called()
+
+        assert len(self.execute(f"SELECT * FROM {self.table_name}")) == 20
+
+        with self.assertRaises(BindingException):
+            insert.bind([1, "a"])
+
+        with self.assertRaises(BindingException):
+            select.bind({"name": "u7"})
+
+    def test_prepared_statement_indexed(self):
+        self.execute("CREATE TABLE t (id INTEGER PRIMARY KEY, name TEXT, age INTEGER);")
+        self.execute("INSERT INTO t VALUES (1, 'a', 1), (2, 'b', 2), (3, 'c', 1);")
+        self.execute("CREATE INDEX t_age ON t (age);")
+        self.execute("CREATE INDEX t_name_age ON t (name, age);")
+
+        def run(sql: str, parameters: list):
+            statement = self.compiler.prepare_statement(sql)
+            # A ? used by both the index seek and the filter is one parameter.
+            assert len(statement.program.parameters) == len(parameters)
+            return list(self.vm.execute(statement.program, statement.bind(parameters)))
+
+        assert run("SELECT * FROM t WHERE age = ?", [1]) == [[1, "a", 1], [3, "c", 1]]
+        assert run("SELECT id FROM t WHERE name = ? AND age = ?", ["c", 1]) == [[3]]
+        assert run("SELECT id FROM t WHERE age = ? LIMIT ?", [1, 1]) == [[1]]
+        run("UPDATE t SET age = ? WHERE age = ?", [5, 1])
+        assert run("SELECT id FROM t WHERE age = ?", [5]) == [[1], [3]]
+        assert run("SELECT id FROM t WHERE age = ?", [1]) == []
+
+    def test_program_cache(self):
+        select = f"SELECT name FROM {self.table_name} WHERE id = 1;"
+        program = self.compiler.compile(select)
+
+        assert self.compiler.compile(f"  {select.lower()}  ") is not program
+        assert (
+            self.compiler.compile(f"SELECT  name\nFROM {self.table_name} WHERE id = 1")
+            is program
+        )
+        assert self.compiler.compile(f"{select[:-7]} name = 'a  b'") is not (
+            self.compiler.compile(f"{select[:-7]} name = 'a b'")
+        )
+        stats = self.compiler.cache_stats
+        # The CREATE TABLE in setUp was a miss too.
+        assert (stats.hits, stats.misses) == (1, 5)
+        assert stats.hit_rate == 1 / 6
+
+        # A schema change drops everything compiled before it.
+        self.execute(f"CREATE INDEX idx_name ON {self.table_name} (name);")
+        assert self.compiler.compile(select) is not program
+        assert stats.invalidations == 1
+
+        with self.assertRaises(SchemaChangedException):
+            list(self.vm.execute(program))
+
+    def test_catalog(self):
+        compiler = Compiler(self.pager, cache_size=0)
+
+        with patch.object(compiler, "get_schema", wraps=compiler.get_schema) as scan:
+            for n in range(5):
+                compiler.compile(
+                    f"INSERT INTO {self.table_name} VALUES ({n}, 'a', 'b');"
+                )
+                compiler.compile(f"SELECT name FROM {self.table_name} WHERE id = {n};")
+
+            assert scan.call_count == 1
+
+            self.execute("CREATE TABLE orgs (id INTEGER, name TEXT);")
+            assert compiler.get_table_column_names("orgs") == ["id", "name"]
+            assert scan.call_count == 2
+
+    def test_program_cache_eviction(self):
+        compiler = Compiler(self.pager, cache_size=2)
+
+        for n in range(3):
+            compiler.compile(f"SELECT * FROM {self.table_name} WHERE id = {n};")
+
+        compiler.compile(f"SELECT * FROM {self.table_name} WHERE id = 2;")
+        compiler.compile(f"SELECT * FROM {self.table_name} WHERE id = 0;")
+        assert len(compiler.cache) == 2
+        assert compiler.cache_stats.evictions == 2
+        assert compiler.cache_stats.hits == 1
+
     def test_insert_and_select_x(self):
         rows = [
             [1, "fred", "fred@flintstone.com"],
@@ -78,7 +263,6 @@ class TestVM(Fixtures):
         for i, record in enumerate(records):
             assert record[0] == keys[i]
 
-    @unittest.skip("TODO: No duplicate checking.")
     def test_vm_duplicate_key(self):
         row = (1, "fred", "fred@flintstone.com")
         row_2 = (1, "pebbles", "pebbles@flintstone.com")
@@ -92,6 +276,995 @@ class TestVM(Fixtures):
                 f"INSERT INTO {self.table_name} VALUES ({row_2[0]}, '{row_2[1]}', '{row_2[2]}');"
             )
 
+    def test_duplicate_key_indexed(self):
+        self.execute("CREATE TABLE t (id INTEGER PRIMARY KEY, name TEXT, age INTEGER);")
+        self.execute("CREATE INDEX t_age ON t (age);")
+        self.execute("INSERT INTO t VALUES (1, 'a', 1);")
+
+        # Rejected before the table or its index is touched.
+        with self.assertRaisesRegex(DuplicateKeyException, "t.row_id"):
+            self.execute("INSERT INTO t VALUES (1, 'b', 2);")
+
+        with self.assertRaisesRegex(DuplicateKeyException, "t.row_id"):
+            self.execute("INSERT INTO t VALUES (2, 'c', 3), (1, 'b', 2);")
+
+        assert self.execute("SELECT * FROM t WHERE age = 1") == [[1, "a", 1]]
+        assert self.execute("SELECT * FROM t WHERE age = 2") == []
+        assert self.execute("SELECT count(*) FROM t WHERE age >= 1") == [[2]]
+        assert self.execute("SELECT * FROM t") == [[1, "a", 1], [2, "c", 3]]
+
     @unittest.skip("TODO: table doesnt exist")
     def test_vm_table_not_exists(self):
         pass
+
+    def insert_people(self, n=100):
+        self.execute("CREATE TABLE people (id INTEGER, name TEXT, age INTEGER);")
+        keys = [k for k in range(n)]
+        random.shuffle(keys)
+        rows = {}
+
+        for key in keys:
+            rows[key] = [key, f"name-{key}", key % 10]
+            self.execute(
+                f"INSERT INTO people VALUES ({key}, 'name-{key}', {key % 10});"
+            )
+
+        return rows
+
+    def test_select_where(self):
+        rows = self.insert_people()
+
+        records = self.execute("SELECT id, name FROM people WHERE age = 3 AND id > 50")
+        expected = [[r[0], r[1]] for r in rows.values() if r[2] == 3 and r[0] > 50]
+
+        assert records == sorted(expected)
+
+    def test_select_where_or_not(self):
+        rows = self.insert_people(40)
+        self.execute("UPDATE people SET age = NULL WHERE id < 5")
+        for key in range(5):
+            rows[key][2] = None
+
+        def compare(a, b, op):
+            # Comparisons with NULL are NULL
+            return None if a is None else op(a, b)
+
+        def _not(a):
+            return None if a is None else not a
+
+        def _or(a, b):
+            return True if a or b else (None if None in (a, b) else False)
+
+        def _and(a, b):
+            return (
+                False
+                if a is False or b is False
+                else (None if None in (a, b) else True)
+            )
+
+        cases = {
+            "age = 3 OR id > 35": lambda r: _or(
+                compare(r[2], 3, int.__eq__), r[0] > 35
+            ),
+            "NOT age < 5": lambda r: _not(compare(r[2], 5, int.__lt__)),
+            "NOT (age != 2 AND id >= 10)": lambda r: _not(
+                _and(compare(r[2], 2, int.__ne__), r[0] >= 10)
+            ),
+            "id < 3 OR age <> 1 AND NOT (id > 20 OR name = 'name-7')": lambda r: _or(
+                r[0] < 3,
+                _and(
+                    compare(r[2], 1, int.__ne__),
+                    _not(_or(r[0] > 20, r[1] == "name-7")),
+                ),
+            ),
+        }
+
+        for where, predicate in cases.items():
+            records = self.execute(f"SELECT id FROM people WHERE {where}")
+            expected = [[r[0]] for r in rows.values() if predicate(r) is True]
+            assert records == sorted(expected), where
+
+    def test_select_rowid_range(self):
+        rows = self.insert_people(60)
+        cases = {
+            "id > 50": lambda r: r[0] > 50,
+            "id >= 50 AND id < 55": lambda r: 50 <= r[0] < 55,
+            "id <= 3": lambda r: r[0] <= 3,
+            "5 < id AND id <= 9 AND age = 7": lambda r: 5 < r[0] <= 9 and r[2] == 7,
+            "id > 100": lambda r: False,
+            "id > 10 AND id < 5": lambda r: False,
+        }
+
+        for where, predicate in cases.items():
+            records = self.execute(f"SELECT id FROM people WHERE {where}")
+            assert records == sorted([[r[0]] for r in rows.values() if predicate(r)])
+
+        program = self.compiler.compile("SELECT id FROM people WHERE id > 50")
+        assert Opcode.Rewind not in [i.opcode for i in program.instructions]
+
+        select = self.compiler.prepare_statement(
+            "SELECT id FROM people WHERE id >= ? AND id < ?"
+        )
+        records = self.vm.execute(select.program, select.bind([57, 100]))
+        assert list(records) == [[57], [58], [59]]
+        records = self.vm.execute(select.program, select.bind([None, 100]))
+        assert list(records) == []
+
+    def test_select_rowid_range_reads(self):
+        self.execute("CREATE TABLE logs (id INTEGER, body TEXT);")
+        for n in range(300):
+            self.execute(f"INSERT INTO logs VALUES ({n}, '{'x' * 100}');")
+
+        reads = []
+        read = self.pager.read
+
+        def counting_read(page_number):
+            reads.append(page_number)
+            return read(page_number)
+
+        with patch.object(self.pager, "read", counting_read):
+            records = self.execute("SELECT id FROM logs WHERE id >= 290")
+            range_reads = len(reads)
+            reads.clear()
+            self.execute("SELECT id FROM logs WHERE body = 'y'")
+            scan_reads = len(reads)
+
+        assert records == [[n] for n in range(290, 300)]
+        assert range_reads * 3 < scan_reads
+
+    def test_select_limit(self):
+        rows = self.insert_people(30)
+        ids = sorted(rows)
+
+        assert self.execute("SELECT id FROM people LIMIT 5") == [[i] for i in ids[:5]]
+        assert self.execute("SELECT id FROM people LIMIT 0") == []
+        assert self.execute("SELECT id FROM people LIMIT 100") == [[i] for i in ids]
+        assert self.execute("SELECT id FROM people LIMIT 3 OFFSET 4") == [
+            [i] for i in ids[4:7]
+        ]
+        assert self.execute("SELECT id FROM people LIMIT 3 OFFSET 40") == []
+        assert (
+            self.execute("SELECT id FROM people WHERE age = 2 LIMIT 2 OFFSET 1")
+            == [[i] for i in ids if rows[i][2] == 2][1:3]
+        )
+        assert self.execute("SELECT id FROM people WHERE id = 7 LIMIT 1") == [[7]]
+
+        select = self.compiler.prepare_statement(
+            "SELECT id FROM people LIMIT ? OFFSET ?"
+        )
+        records = self.vm.execute(select.program, select.bind([2, 10]))
+        assert list(records) == [[i] for i in ids[10:12]]
+
+    def test_select_limit_reads(self):
+        self.execute("CREATE TABLE logs (id INTEGER, body TEXT);")
+        for n in range(300):
+            self.execute(f"INSERT INTO logs VALUES ({n}, '{'x' * 100}');")
+
+        reads = []
+        read = self.pager.read
+
+        def counting_read(page_number):
+            reads.append(page_number)
+            return read(page_number)
+
+        with patch.object(self.pager, "read", counting_read):
+            records = self.execute("SELECT id FROM logs LIMIT 10")
+
+        assert records == [[n] for n in range(10)]
+        # The root and the first leaf, maybe the leaf after.
+        assert len(set(reads)) <= 3
+
+    def test_insert_many(self):
+        self.execute("CREATE TABLE people (id INTEGER, name TEXT, age INTEGER);")
+        self.execute("CREATE INDEX people_age ON people (age);")
+        values = ", ".join(f"({n}, 'name-{n}', {n % 10})" for n in range(200))
+
+        program = self.compiler.compile(f"INSERT INTO people VALUES {values};")
+        # One cursor for the table and one for the index.
+        assert [i.p1 for i in program.instructions if i.opcode == Opcode.OpenWrite] == [
+            0,
+            1,
+        ]
+        list(self.vm.execute(program))
+
+        assert self.execute("SELECT * FROM people") == [
+            [n, f"name-{n}", n % 10] for n in range(200)
+        ]
+        assert self.execute("SELECT id FROM people WHERE age = 3") == [
+            [n] for n in range(3, 200, 10)
+        ]
+
+        with self.assertRaises(ParsingException):
+            self.execute("INSERT INTO people VALUES (300, 'a', 1), (301, 'b');")
+
+    def test_insert_select(self):
+        rows = self.insert_people(50)
+        self.execute("CREATE TABLE adults (id INTEGER, name TEXT, age INTEGER);")
+        self.execute("CREATE INDEX adults_name ON adults (name);")
+
+        self.execute("INSERT INTO adults SELECT * FROM people WHERE age > 6;")
+        expected = sorted(r for r in rows.values() if r[2] > 6)
+        assert self.execute("SELECT * FROM adults") == expected
+        assert self.execute("SELECT id FROM adults WHERE name = 'name-17'") == [[17]]
+
+        self.execute("CREATE TABLE names (name TEXT, id INTEGER PRIMARY KEY);")
+        self.execute(
+            "INSERT INTO names SELECT name, id FROM people WHERE age = 1 LIMIT 2 OFFSET 1;"
+        )
+        assert self.execute("SELECT id FROM names") == [[11], [21]]
+
+        with self.assertRaises(ParsingException):
+            self.execute("INSERT INTO adults SELECT * FROM adults;")
+
+        with self.assertRaises(ParsingException):
+            self.execute("INSERT INTO adults SELECT id FROM people;")
+
+    def test_optimizer(self):
+        """
+        The optimized programs return the same rows in fewer steps.
+        """
+        self.insert_people(50)
+        self.execute("CREATE INDEX people_age ON people (age);")
+        plain = Compiler(self.pager, optimize=False)
+        self.vm.count_steps = True
+        queries = [
+            "SELECT * FROM people",
+            "SELECT id, name FROM people WHERE name != 'name-3' AND id > 10",
+            "SELECT name FROM people WHERE age = 3 OR NOT (id < 40)",
+            "SELECT * FROM people WHERE age > 6 LIMIT 5 OFFSET 2",
+        ]
+
+        for sql in queries:
+            before = plain.compile(sql)
+            expected = list(self.vm.execute(before))
+            before_steps = self.vm.steps
+
+            after = self.compiler.compile(sql)
+            assert list(self.vm.execute(after)) == expected, sql
+            assert len(after.instructions) <= len(before.instructions), sql
+            assert self.vm.steps < before_steps, sql
+
+    def test_trace(self):
+        self.execute("INSERT INTO users VALUES (1, 'Phil', 'phil@example.com');")
+
+        stdout = StringIO()
+        with redirect_stdout(stdout):
+            assert self.execute("SELECT name FROM users") == [["Phil"]]
+
+        # Nothing is printed unless tracing is turned on.
+        assert stdout.getvalue() == ""
+
+        self.vm.trace = True
+        with self.assertLogs("toysql.vm", level=logging.DEBUG) as logs:
+            assert self.execute("SELECT name FROM users") == [["Phil"]]
+
+        assert any("OpenRead" in line for line in logs.output)
+        assert any("'Phil'" in line for line in logs.output)
+
+    def test_select_batch(self):
+        self.execute("CREATE TABLE events (id INTEGER, name TEXT, score INTEGER);")
+        values = ", ".join(f"({n}, 'event-{n}', {n % 10})" for n in range(300))
+        self.execute(f"INSERT INTO events VALUES {values};")
+        self.execute("UPDATE events SET score = NULL WHERE score = 0")
+        assert self.execute("SELECT score FROM events WHERE id = 10") == [[None]]
+        queries = [
+            "SELECT * FROM events",
+            "SELECT name, id FROM events WHERE score > 4",
+            "SELECT id FROM events WHERE score = 3 OR name = 'event-10'",
+            "SELECT id, score FROM events WHERE NOT (score < 8 AND id > 20)",
+            "SELECT id FROM events WHERE 5 >= score AND id != 6",
+            "SELECT id FROM events WHERE score = 99",
+        ]
+
+        for sql in queries:
+            batches = list(self.vm.execute(self.compiler.compile_batch(sql)))
+            rows = [row for rows in batches for row in rows]
+            assert rows == self.execute(sql), sql
+            assert all(batches), sql
+
+        batches = list(
+            self.vm.execute(self.compiler.compile_batch("SELECT * FROM events"))
+        )
+        assert len(batches) > 1
+
+        with self.assertRaises(ParsingException):
+            self.compiler.compile_batch("SELECT * FROM events LIMIT 1")
+
+        with self.assertRaises(ParsingException):
+            self.compiler.compile_batch("INSERT INTO events VALUES (1000, 'x', 1);")
+
+    def test_aggregate(self):
+        self.execute("CREATE TABLE orders (id INTEGER, region TEXT, amount INTEGER);")
+        assert self.execute("SELECT COUNT(*), SUM(amount) FROM orders") == [[0, None]]
+
+        regions = ["north", "south", "east"]
+        values = ", ".join(f"({n}, '{regions[n % 3]}', {n % 11})" for n in range(1, 61))
+        self.execute(f"INSERT INTO orders VALUES {values};")
+        self.execute("UPDATE orders SET amount = NULL WHERE id = 3")
+        orders = self.execute("SELECT * FROM orders")
+
+        def expected(rows):
+            groups = {}
+            for _, region, amount in rows:
+                groups.setdefault(region, []).append(amount)
+
+            return {
+                region: [
+                    len(amounts),
+                    sum(a for a in amounts if a is not None),
+                    min(a for a in amounts if a is not None),
+                    max(a for a in amounts if a is not None),
+                ]
+                for region, amounts in groups.items()
+            }
+
+        sql = (
+            "SELECT COUNT(*), SUM(amount), MIN(amount), MAX(amount), region "
+            "FROM orders GROUP BY region"
+        )
+        result = self.execute(sql)
+        assert {row[-1]: row[:-1] for row in result} == expected(orders)
+
+        result = self.execute(
+            "SELECT region, COUNT(amount), AVG(amount) FROM orders "
+            "WHERE id > 30 GROUP BY region"
+        )
+        rows = [row for row in orders if row[0] > 30]
+        assert {row[0]: row[1] for row in result} == {
+            r: len([a for i, g, a in rows if g == r and a is not None]) for r in regions
+        }
+        for region, count, average in result:
+            amounts = [a for _, g, a in rows if g == region and a is not None]
+            assert average == sum(amounts) / count
+
+        assert self.execute("SELECT COUNT(amount) FROM orders") == [[59]]
+        assert self.execute("SELECT MAX(region) FROM orders") == [["south"]]
+        assert len(self.execute("SELECT region FROM orders GROUP BY region")) == 3
+        assert self.execute(
+            "SELECT SUM(id) FROM orders GROUP BY region LIMIT 1 OFFSET 1"
+        ) == [[sum(range(2, 61, 3))]]
+
+        # Spilling groups to disk doesn't change the answer.
+        spilling = VM(self.pager, engine=self.engine, max_groups=2)
+        program = self.compiler.compile(sql)
+        assert sorted(spilling.execute(program)) == sorted(self.execute(sql))
+
+        for sql in [
+            "SELECT id, SUM(amount) FROM orders GROUP BY region",
+            "SELECT * FROM orders GROUP BY region",
+        ]:
+            with self.assertRaises(ParsingException):
+                self.execute(sql)
+
+        with self.assertRaises(ColumnNotFoundException):
+            self.execute("SELECT SUM(missing) FROM orders")
+
+    def test_order_by(self):
+        people = self.insert_people(60)
+        self.execute("UPDATE people SET age = NULL WHERE id = 7")
+        people[7][2] = None
+        rows = list(people.values())
+        by_age = sorted(rows, key=lambda r: (r[2] is not None, r[2] or 0, -r[0]))
+
+        assert self.execute("SELECT * FROM people ORDER BY age, id DESC") == by_age
+        assert self.execute(
+            "SELECT name FROM people WHERE id > 20 ORDER BY name DESC"
+        ) == [
+            [r[1]] for r in sorted(rows, key=lambda r: r[1], reverse=True) if r[0] > 20
+        ]
+        assert self.execute(
+            "SELECT id FROM people ORDER BY age, id DESC LIMIT 4 OFFSET 2"
+        ) == [[r[0]] for r in by_age[2:6]]
+        assert self.execute("SELECT id FROM people ORDER BY id LIMIT 0") == []
+
+        # A small sort buffer spills runs to disk, same rows come back.
+        spilling = VM(self.pager, engine=self.engine, sort_buffer=8)
+        program = self.compiler.compile("SELECT * FROM people ORDER BY age, id DESC")
+        assert list(spilling.execute(program)) == by_age
+
+        program = self.compiler.compile("SELECT id FROM people ORDER BY name LIMIT 3")
+        assert [i.opcode for i in program.instructions].count(Opcode.SorterOpen) == 1
+        assert list(spilling.execute(program)) == [
+            [r[0]] for r in sorted(rows, key=lambda r: r[1])[:3]
+        ]
+
+        # Groups can be ordered by their key or an aggregate.
+        assert self.execute(
+            "SELECT age, COUNT(*) FROM people WHERE age > 5 "
+            "GROUP BY age ORDER BY age DESC"
+        ) == [[9, 6], [8, 6], [7, 5], [6, 6]]
+        result = self.execute(
+            "SELECT age, SUM(id) FROM people GROUP BY age ORDER BY SUM(id) DESC LIMIT 2"
+        )
+        totals = {}
+        for id, _, age in rows:
+            totals[age] = totals.get(age, 0) + id
+
+        assert (
+            result
+            == sorted(
+                [[age, total] for age, total in totals.items()], key=lambda r: -r[1]
+            )[:2]
+        )
+
+        for sql in [
+            "SELECT id FROM people ORDER BY SUM(id)",
+            "SELECT age, COUNT(*) FROM people GROUP BY age ORDER BY name",
+        ]:
+            with self.assertRaises(ParsingException):
+                self.execute(sql)
+
+        with self.assertRaises(ColumnNotFoundException):
+            self.execute("SELECT id FROM people ORDER BY missing")
+
+    def test_join(self):
+        self.execute(
+            "CREATE TABLE customers (id INTEGER PRIMARY KEY, name TEXT, region TEXT);"
+        )
+        self.execute(
+            "CREATE TABLE orders (id INTEGER PRIMARY KEY, customer_id INTEGER, amount INTEGER);"
+        )
+        regions = ["north", "south", "east"]
+        customers = {n: [n, f"customer-{n}", regions[n % 3]] for n in range(1, 31)}
+        values = ", ".join(
+            f"({n}, '{name}', '{region}')" for n, name, region in customers.values()
+        )
+        self.execute(f"INSERT INTO customers VALUES {values};")
+        # Customer 31 doesn't exist and customers 26 to 30 have no orders.
+        orders = {n: [n, n % 25 + 1 if n % 17 else 31, n % 13] for n in range(100, 200)}
+        values = ", ".join(
+            f"({n}, {customer_id}, {amount})"
+            for n, customer_id, amount in orders.values()
+        )
+        self.execute(f"INSERT INTO orders VALUES {values};")
+
+        expected = [
+            [o[0], customers[o[1]][1]] for o in orders.values() if o[1] in customers
+        ]
+        sql = "SELECT orders.id, name FROM orders JOIN customers ON orders.customer_id = customers.id"
+        assert self.execute(sql) == expected
+        # The join is on customers' primary key so each order seeks its customer.
+        opcodes = [i.opcode for i in self.compiler.compile(sql).instructions]
+        assert Opcode.Seek in opcodes and Opcode.HashBuild not in opcodes
+
+        # Either way round, unqualified columns are found in whichever table has them.
+        assert sorted(
+            self.execute(
+                "SELECT orders.id, name FROM customers INNER JOIN orders "
+                "ON customer_id = customers.id WHERE region = 'north' AND amount > 5"
+            )
+        ) == sorted(
+            [o[0], customers[o[1]][1]]
+            for o in orders.values()
+            if o[1] in customers and customers[o[1]][2] == "north" and o[2] > 5
+        )
+
+        # Every customer's orders, matched with a hash join.
+        by_customer = [
+            [c[0], o[0]]
+            for c in customers.values()
+            for o in orders.values()
+            if o[1] == c[0]
+        ]
+        sql = "SELECT customers.id, orders.id FROM customers LEFT JOIN orders ON orders.customer_id = customers.id"
+        opcodes = [i.opcode for i in self.compiler.compile(sql).instructions]
+        assert Opcode.HashBuild in opcodes
+        left = by_customer + [[n, None] for n in range(26, 31)]
+        assert sorted(self.execute(sql), key=str) == sorted(left, key=str)
+
+        # A small join buffer spills partitions, same rows come back.
+        spilling = VM(self.pager, engine=self.engine, join_buffer=8)
+        assert sorted(
+            list(spilling.execute(self.compiler.compile(sql))), key=str
+        ) == sorted(left, key=str)
+
+        # ON narrows the matches, WHERE the joined rows.
+        expected = []
+        for c in range(1, 4):
+            matches = [o[0] for o in orders.values() if o[1] == c and o[2] > 11]
+            expected.extend([c, o] for o in matches or [None])
+
+        assert sorted(
+            self.execute(
+                "SELECT customers.id, orders.id FROM customers LEFT JOIN orders "
+                "ON orders.customer_id = customers.id AND amount > 11 WHERE customers.id < 4"
+            ),
+            key=str,
+        ) == sorted(expected, key=str)
+        assert [None] in [row[1:] for row in expected]
+        assert self.execute(
+            "SELECT customers.id FROM customers LEFT JOIN orders "
+            "ON orders.customer_id = customers.id WHERE orders.id = 150"
+        ) == [[orders[150][1]]]
+
+        assert (
+            len(
+                self.execute(
+                    "SELECT * FROM orders JOIN customers ON customer_id = customers.id LIMIT 5 OFFSET 2"
+                )
+            )
+            == 5
+        )
+        assert self.execute(
+            "SELECT * FROM orders JOIN customers ON customer_id = customers.id LIMIT 1"
+        ) == [orders[100] + customers[orders[100][1]]]
+
+        for sql in [
+            "SELECT id FROM orders JOIN customers ON customer_id = customers.id",
+            "SELECT * FROM orders JOIN customers ON amount > 3",
+            "SELECT COUNT(*) FROM orders JOIN customers ON customer_id = customers.id",
+            "SELECT * FROM orders JOIN orders ON orders.id = orders.id",
+        ]:
+            with self.assertRaises(ParsingException):
+                self.execute(sql)
+
+        with self.assertRaises(ColumnNotFoundException):
+            self.execute(
+                "SELECT missing FROM orders JOIN customers ON customer_id = customers.id"
+            )
+
+    def test_analyze(self):
+        self.execute(
+            "CREATE TABLE events (id INTEGER PRIMARY KEY, kind INTEGER, name TEXT);"
+        )
+        names = {n: f"name-{n:03}-{'x' * 40}" for n in range(1, 202)}
+        values = ", ".join(f"({n}, {n % 2}, '{names[n]}')" for n in range(1, 201))
+        self.execute(f"INSERT INTO events VALUES {values};")
+        self.execute("CREATE INDEX events_kind ON events (kind);")
+        self.execute("CREATE INDEX events_name ON events (name);")
+
+        def path(sql: str):
+            [statement] = self.compiler.prepare(sql)
+            needed = [str(item.value) for item in statement.items]
+            return self.compiler.choose_access_path(
+                "events", conjuncts(statement.where), needed
+            )
+
+        kind = "SELECT id, name FROM events WHERE kind = 1"
+        name = f"SELECT id FROM events WHERE name = '{names[5]}'"
+        expected = self.execute(kind)
+        assert len(expected) == 100
+        # Without stats any index beats reading every row.
+        assert path(kind).index_scan is not None
+        assert path(kind).cost is None
+
+        self.execute("ANALYZE;")
+        assert self.execute("SELECT name, t_name, row_count FROM stats") == [
+            [self.table_name, self.table_name, 0],
+            ["events", "events", 200],
+            ["events_kind", "events", 200],
+            ["events_name", "events", 200],
+        ]
+
+        # Half the rows have kind = 1, seeking each of them
+        # through the index costs more than reading them all.
+        assert path(kind).index_scan is None
+        assert path(kind).rows == 100
+        assert self.execute(kind) == expected
+        # Unless the index has every column, then it's read instead of the table.
+        assert path("SELECT id FROM events WHERE kind = 1").index_scan is not None
+        assert cast(IndexScan, path(name).index_scan).index.name == "events_name"
+        assert self.execute(name) == [[5]]
+
+        # Analyzing again replaces the rows.
+        self.execute(f"INSERT INTO events VALUES (201, 1, '{names[201]}');")
+        self.execute("ANALYZE events;")
+        assert self.execute("SELECT row_count FROM stats") == [[0], [201], [201], [201]]
+
+        with self.assertRaises(TableFoundException):
+            self.execute("ANALYZE missing;")
+
+        with self.assertRaises(ParsingException):
+            self.execute(f"ANALYZE {SCHEMA_TABLE_NAME};")
+
+    def test_analyze_join(self):
+        self.execute("CREATE TABLE customers (id INTEGER PRIMARY KEY, name TEXT);")
+        self.execute(
+            "CREATE TABLE orders (id INTEGER PRIMARY KEY, customer_id INTEGER);"
+        )
+        values = ", ".join(f"({n}, 'customer-{n}')" for n in range(1, 21))
+        self.execute(f"INSERT INTO customers VALUES {values};")
+        values = ", ".join(f"({n}, {n % 20 + 1})" for n in range(1, 301))
+        self.execute(f"INSERT INTO orders VALUES {values};")
+        self.execute("ANALYZE;")
+
+        def plan(sql: str) -> JoinPlan:
+            [statement] = self.compiler.prepare(sql)
+            return self.compiler.plan_join(statement)
+
+        # Seeking a customer for every order reads more pages than
+        # scanning both, the smaller customers table is built.
+        sql = "SELECT orders.id, name FROM orders JOIN customers ON customer_id = customers.id"
+        join = plan(sql)
+        assert not join.nested_loop and join.cost is not None
+        assert join.table_names[join.inner] == "customers"
+        assert sorted(self.execute(sql)) == [
+            [n, f"customer-{n % 20 + 1}"] for n in range(1, 301)
+        ]
+
+        # One order is a single seek into customers.
+        sql += " WHERE orders.id = 7"
+        assert plan(sql).nested_loop
+        assert self.execute(sql) == [[7, "customer-8"]]
+
+    def test_explain(self):
+        sql = "SELECT id, name FROM users WHERE id = 1"
+        rows = self.execute(f"EXPLAIN {sql}")
+        instructions = self.compiler.compile(sql).instructions
+
+        assert len(rows) == len(instructions)
+        assert [row[:5] for row in rows] == [
+            [addr, i.opcode.name, i.p1, i.p2, i.p3]
+            for addr, i in enumerate(instructions)
+        ]
+
+        # Explaining a statement doesn't run it.
+        rows = self.execute("EXPLAIN CREATE TABLE org (id INTEGER, name TEXT);")
+        assert Opcode.CreateTable.name in [row[1] for row in rows]
+        assert self.execute(f"SELECT name FROM {SCHEMA_TABLE_NAME}") == [["users"]]
+
+    def test_explain_query_plan(self):
+        self.execute(
+            "CREATE TABLE customers (id INTEGER PRIMARY KEY, name TEXT, city TEXT);"
+        )
+        self.execute(
+            "CREATE TABLE orders (id INTEGER PRIMARY KEY, customer_id INTEGER);"
+        )
+        self.execute("CREATE INDEX customers_city ON customers (city);")
+
+        def plan(sql: str):
+            return [detail for _, detail in self.execute(f"EXPLAIN QUERY PLAN {sql}")]
+
+        assert plan("SELECT * FROM customers") == ["SCAN customers"]
+        assert plan("SELECT * FROM customers WHERE id = 3") == [
+            "SEARCH customers USING INTEGER PRIMARY KEY (rowid=?)"
+        ]
+        assert plan("SELECT city FROM customers WHERE city = 'Paris'") == [
+            "SEARCH customers USING COVERING INDEX customers_city (city=?)"
+        ]
+        assert plan("SELECT city, count(*) FROM customers GROUP BY city") == [
+            "SCAN customers",
+            "USE HASH AGGREGATE FOR GROUP BY",
+        ]
+        assert plan("SELECT name FROM customers ORDER BY name LIMIT 3") == [
+            "USE TOP-N SORTER FOR ORDER BY",
+            "SCAN customers",
+        ]
+        assert plan(
+            "SELECT orders.id, name FROM orders JOIN customers ON customer_id = customers.id"
+        ) == [
+            "NESTED LOOP JOIN",
+            "SCAN orders",
+            "SEARCH customers USING INTEGER PRIMARY KEY (rowid=?)",
+        ]
+        assert plan("INSERT INTO orders VALUES (1, 1)") == []
+
+        # With stats the estimates are shown too.
+        values = ", ".join(f"({n}, 'c-{n}', 'city-{n % 5}')" for n in range(1, 51))
+        self.execute(f"INSERT INTO customers VALUES {values};")
+        self.execute("ANALYZE;")
+        # It all fits on one page so scanning beats seeking.
+        assert plan("SELECT * FROM customers WHERE id > 10") == [
+            "SCAN customers (cost=1.0 rows=41)"
+        ]
+        [detail] = plan("SELECT * FROM customers WHERE id = 10")
+        assert detail.startswith(
+            "SEARCH customers USING INTEGER PRIMARY KEY (rowid=?) (cost="
+        )
+        assert detail.endswith(" rows=1)")
+
+    def test_profile(self):
+        self.execute("CREATE TABLE people (id INTEGER PRIMARY KEY, name TEXT);")
+        values = ", ".join(f"({n}, 'name-{n:04}')" for n in range(1, 301))
+        self.execute(f"INSERT INTO people VALUES {values};")
+
+        program = self.compiler.compile("SELECT name FROM people WHERE id > 100")
+        profile = Profile(program)
+        rows = list(self.vm.execute(program, profile=profile))
+        assert len(rows) == 200
+
+        listing = profile.listing()
+        assert len(listing) == len(program.instructions)
+        counts = {row[1]: row[PROFILE_COLUMNS.index("count")] for row in listing}
+        assert counts["ResultRow"] == counts["Column"] == 200
+        assert counts["OpenRead"] == counts["Halt"] == 1
+        assert sum(profile.times) > 0
+
+        # Each leaf is decoded once, the rest of
+        # the time the cursor has the page already.
+        root_page_number = self.compiler.get_table_root_page_number("people")
+        leaves = BTree(self.pager, root_page_number).utilization().leaf_pages
+        assert leaves > 1
+        assert profile.cursors[0].reads == sum(profile.reads) >= leaves
+        assert profile.cursors[0].hits == sum(profile.hits) >= 400
+        assert profile.cursors[0].decoded > 200 * len("name-0000")
+        assert "cursor 0:" in profile.show()
+
+    def test_explain_analyze(self):
+        self.execute("CREATE TABLE people (id INTEGER PRIMARY KEY, name TEXT);")
+        rows = self.execute("EXPLAIN ANALYZE INSERT INTO people VALUES (1, 'Phil');")
+        program = self.compiler.compile("INSERT INTO people VALUES (1, 'Phil');")
+
+        assert [row[:7] for row in rows] == self.execute(
+            "EXPLAIN INSERT INTO people VALUES (1, 'Phil');"
+        )
+        assert all(len(row) == len(PROFILE_COLUMNS) for row in rows)
+        insert = [row for row in rows if row[1] == Opcode.Insert.name]
+        assert insert[0][PROFILE_COLUMNS.index("count")] == 1
+        assert len(rows) == len(program.instructions)
+
+        # Unlike EXPLAIN the statement is run.
+        assert self.execute("SELECT * FROM people") == [[1, "Phil"]]
+
+        # With the explained statement's parameters.
+        statement = self.compiler.prepare_statement(
+            "EXPLAIN ANALYZE SELECT name FROM people WHERE id = ?"
+        )
+        assert statement.program.parameters == ["?"]
+        rows = list(self.vm.execute(statement.program, statement.bind([1])))
+        result = [row for row in rows if row[1] == Opcode.ResultRow.name]
+        assert result[0][PROFILE_COLUMNS.index("count")] == 1
+
+        # The sql text kept for a table comes from the tokens after EXPLAIN.
+        self.execute("EXPLAIN ANALYZE\n   CREATE  TABLE org (id INTEGER, name TEXT);")
+        assert self.compiler.get_table_create_stmt("org") == (
+            "create table org (id integer, name text)"
+        )
+
+    def test_select_all_columns(self):
+        rows = self.insert_people(3)
+
+        records = self.execute("SELECT * FROM people")
+        assert records == [rows[0], rows[1], rows[2]]
+
+    def test_create_index(self):
+        rows = self.insert_people()
+        self.execute("CREATE INDEX people_age ON people (age);")
+
+        cases = [
+            ("age = 3", lambda r: r[2] == 3),
+            ("age > 7", lambda r: r[2] > 7),
+            ("age >= 7", lambda r: r[2] >= 7),
+            ("2 > age", lambda r: r[2] < 2),
+            ("age <= 1", lambda r: r[2] <= 1),
+            ("age > 2 AND age < 5", lambda r: 2 < r[2] < 5),
+            ("age = 4 AND name = 'name-14'", lambda r: r[0] == 14),
+            ("age = 11", lambda r: False),
+        ]
+
+        for where, predicate in cases:
+            records = self.execute(f"SELECT * FROM people WHERE {where}")
+            expected = [r for r in rows.values() if predicate(r)]
+            # Index order is (age, row_id)
+            expected.sort(key=lambda r: (r[2], r[0]))
+
+            assert records == expected, where
+
+    def test_index_nulls(self):
+        self.execute("CREATE TABLE t (id INTEGER, a INTEGER);")
+        insert = self.compiler.prepare_statement("INSERT INTO t VALUES (?, ?);")
+        rows = {key: None if key % 3 == 0 else key % 7 for key in range(20)}
+        for key, a in rows.items():
+            list(self.vm.execute(insert.program, [key, a]))
+
+        self.execute("CREATE INDEX t_a ON t (a);")
+
+        cases = [
+            ("a < 4", lambda a: a < 4),
+            ("a <= 4", lambda a: a <= 4),
+            ("a = 4", lambda a: a == 4),
+            ("a > 4", lambda a: a > 4),
+            # Text sorts after every integer.
+            ("a <= 'z'", lambda a: True),
+        ]
+
+        # The same rows whether or not the stats pick the index.
+        for analyze in [False, True]:
+            if analyze:
+                self.execute("ANALYZE t;")
+
+            for where, predicate in cases:
+                records = self.execute(f"SELECT id FROM t WHERE {where}")
+                expected = [
+                    k for k, a in rows.items() if a is not None and predicate(a)
+                ]
+                assert sorted(r[0] for r in records) == expected, where
+
+        # Nothing matches a NULL bound.
+        for op in ["<", "<=", "=", ">", ">="]:
+            statement = self.compiler.prepare_statement(
+                f"SELECT id FROM t WHERE a {op} ?"
+            )
+            assert list(self.vm.execute(statement.program, [None])) == [], op
+
+    def test_composite_index_nulls(self):
+        self.execute("CREATE TABLE t (id INTEGER, b TEXT, c INTEGER);")
+        insert = self.compiler.prepare_statement("INSERT INTO t VALUES (?, ?, ?);")
+        rows = {}
+        for key in range(30):
+            rows[key] = ["x" if key % 4 else "y", None if key % 2 == 0 else key % 9]
+            list(self.vm.execute(insert.program, [key, *rows[key]]))
+
+        self.execute("CREATE INDEX t_b_c ON t (b, c);")
+
+        cases = [
+            ("b = 'x' AND c < 5", lambda c: c is not None and c < 5),
+            ("b = 'x' AND c <= 5", lambda c: c is not None and c <= 5),
+            ("b = 'x' AND c > 5", lambda c: c is not None and c > 5),
+            ("b = 'x'", lambda c: True),
+        ]
+
+        for where, predicate in cases:
+            records = self.execute(f"SELECT id FROM t WHERE {where}")
+            expected = [k for k, (b, c) in rows.items() if b == "x" and predicate(c)]
+            assert sorted(r[0] for r in records) == expected, where
+
+        # Nothing matches a NULL bound on either column.
+        for where in ["b = 'x' AND c < ?", "b = ? AND c < 5", "b = ?"]:
+            statement = self.compiler.prepare_statement(
+                f"SELECT id FROM t WHERE {where}"
+            )
+            assert list(self.vm.execute(statement.program, [None])) == [], where
+
+    def test_insert_maintains_index(self):
+        self.execute("CREATE TABLE people (id INTEGER, name TEXT, age INTEGER);")
+        self.execute("CREATE INDEX people_name ON people (name);")
+
+        for key in range(30):
+            self.execute(f"INSERT INTO people VALUES ({key}, 'name-{key}', {key});")
+
+        records = self.execute("SELECT id FROM people WHERE name = 'name-17'")
+        assert records == [[17]]
+
+        records = self.execute("SELECT id FROM people WHERE name < 'name-11'")
+        assert records == [[0], [1], [10]]
+
+    def test_covering_index(self):
+        self.execute(
+            "CREATE TABLE events (id INTEGER, tenant_id INTEGER, created_at INTEGER, body TEXT);"
+        )
+        rows = []
+        for key in range(60):
+            row = [key, key % 3, key // 2, f"event-{key}"]
+            rows.append(row)
+            self.execute(
+                f"INSERT INTO events VALUES ({row[0]}, {row[1]}, {row[2]}, '{row[3]}');"
+            )
+
+        self.execute(
+            "CREATE INDEX events_tenant ON events (tenant_id, created_at) INCLUDE (body);"
+        )
+        self.execute(f"INSERT INTO events VALUES (60, 2, 15, 'late');")
+        rows.append([60, 2, 15, "late"])
+
+        sql = "SELECT id, created_at, body FROM events WHERE tenant_id = 2 AND created_at >= 10 AND created_at < 20"
+        program = self.compiler.compile(sql)
+        # Never opens the table.
+        assert [i.p1 for i in program.instructions if i.opcode == Opcode.OpenRead] == [
+            1
+        ]
+
+        records = self.execute(sql)
+        expected = [[r[0], r[2], r[3]] for r in rows if r[1] == 2 and 10 <= r[2] < 20]
+        expected.sort(key=lambda r: (r[1], r[0]))
+        assert records == expected
+
+        # tenant_id only, uses a prefix of the key.
+        records = self.execute("SELECT id FROM events WHERE tenant_id = 1")
+        assert records == [[r[0]] for r in rows if r[1] == 1]
+
+        # name isn't in the index so look up the table.
+        records = self.execute(
+            "SELECT * FROM events WHERE tenant_id = 0 AND created_at > 25"
+        )
+        assert records == [r for r in rows if r[1] == 0 and r[2] > 25]
+
+    def test_update(self):
+        rows = self.insert_people(30)
+        self.execute("CREATE INDEX people_age ON people (age) INCLUDE (name);")
+
+        self.execute("UPDATE people SET age = 42, name = 'old' WHERE age = 3")
+        for row in rows.values():
+            if row[2] == 3:
+                row[1], row[2] = "old", 42
+
+        # Grows the rows so they no longer fit in place.
+        self.execute(f"UPDATE people SET name = '{'x' * 100}' WHERE id >= 25")
+        for row in rows.values():
+            if row[0] >= 25:
+                row[1] = "x" * 100
+
+        expected = sorted(rows.values())
+        assert self.execute("SELECT * FROM people") == expected
+
+        # The index was kept up to date.
+        assert self.execute("SELECT id, name FROM people WHERE age = 42") == [
+            [r[0], r[1]] for r in expected if r[2] == 42
+        ]
+        assert self.execute("SELECT id FROM people WHERE age = 3") == []
+
+        self.execute("UPDATE people SET age = NULL")
+        assert self.execute("SELECT age FROM people WHERE id = 1") == [[None]]
+
+        with self.assertRaises(ParsingException):
+            self.execute("UPDATE people SET id = 1")
+
+    def test_bloom_filter(self):
+        self.execute(
+            "CREATE TABLE events (id INTEGER, name TEXT, age INTEGER) WITH (bloom=1);"
+        )
+        for n in range(0, 40, 2):
+            self.execute(f"INSERT INTO events VALUES ({n}, 'name-{n}', {n % 7});")
+
+        self.execute("CREATE INDEX events_age ON events (age, name);")
+        self.execute("INSERT INTO events VALUES (41, 'late', 9);")
+
+        schema = self.execute(f"SELECT * FROM {SCHEMA_TABLE_NAME}")
+        assert [r[2] for r in schema if r[1] == "bloom"] == ["events", "events_age"]
+
+        assert self.execute("SELECT name FROM events WHERE id = 10") == [["name-10"]]
+        assert self.execute("SELECT name FROM events WHERE id = 11") == []
+        assert self.execute("SELECT name FROM events WHERE id = 41") == [["late"]]
+
+        assert self.execute("SELECT id FROM events WHERE age = 9") == [[41]]
+        assert self.execute("SELECT id FROM events WHERE age = 8") == []
+        assert self.execute(
+            "SELECT id FROM events WHERE age = 3 AND name = 'name-10'"
+        ) == [[10]]
+
+        program = self.compiler.compile("SELECT name FROM events WHERE id = 11")
+        opcodes = [i.opcode for i in program.instructions]
+        assert Opcode.OpenFilter in opcodes
+        assert Opcode.Rewind not in opcodes
+
+
+class TestCodegenVM(TestVM):
+    """
+    Every VM test again with programs run as generated python.
+    """
+
+    engine = "codegen"
+
+    def test_same_as_interpreter(self):
+        self.insert_people(40)
+        self.execute("CREATE INDEX people_age ON people (age);")
+        interpreter = VM(self.pager)
+        self.vm.count_steps = True
+        queries = [
+            "SELECT * FROM people",
+            "SELECT id, name FROM people WHERE name != 'name-3' AND id > 10",
+            "SELECT name FROM people WHERE age = 3 OR NOT (id < 30)",
+            "SELECT id FROM people WHERE age >= 5 AND age < 9",
+            "SELECT * FROM people WHERE id >= 4 LIMIT 5 OFFSET 2",
+        ]
+
+        for sql in queries:
+            program = self.compiler.compile(sql)
+            expected = list(interpreter.execute(program))
+            assert list(self.vm.execute(program)) == expected, sql
+            assert self.vm.steps == interpreter.steps, sql
+            assert program.counting_function is not None
+
+        with self.assertRaises(ValueError):
+            VM(self.pager, engine="jit")
+
+    def test_codegen_source(self):
+        self.insert_people(5)
+        program = self.compiler.compile("SELECT name FROM people WHERE id > 2")
+        source = Codegen(program).source()
+
+        # Steps are only counted when asked for.
+        assert "steps" not in source
+        assert "steps +=" in Codegen(program, count_steps=True).source()
+        # Every exit leaves the loop for the one after it.
+        assert "return" not in source
+        assert source.count("break") == 1
+
+        assert list(self.vm.execute(program)) == [["name-3"], ["name-4"]]
+        assert program.function is not None
+        assert program.counting_function is None
+
+        empty = self.compiler.compile(
+            "EXPLAIN QUERY PLAN INSERT INTO people VALUES (9, 'a', 1)"
+        )
+        assert "while" not in Codegen(empty).source()
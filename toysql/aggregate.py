@@ -0,0 +1,164 @@
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from dataclasses import dataclass
+import pickle
+import tempfile
+
+from toysql.page import sort_key
+
+# Groups a HashAggregate keeps in memory before it spills rows to disk.
+MAX_GROUPS = 10_000
+# Spill files per aggregate, a partition which is still too big
+# when it's read back is split again.
+PARTITIONS = 8
+
+
+@dataclass
+class Aggregate:
+    """
+    An aggregate function eg: SUM(amount)
+
+    Each group keeps a state per aggregate, step folds a value into it
+    and final turns it into the result. NULLs are skipped
+    except by COUNT(*) which counts rows rather than values.
+    """
+
+    name: str
+    # COUNT(*)
+    star: bool = False
+
+    def initial(self) -> Any:
+        if self.name == "count":
+            return 0
+
+        if self.name == "avg":
+            # total, count
+            return (0, 0)
+
+        return None
+
+    def step(self, state: Any, value: Any) -> Any:
+        if self.star:
+            return state + 1
+
+        if value is None:
+            return state
+
+        if self.name == "count":
+            return state + 1
+
+        if self.name == "avg":
+            total, count = state
+            return (total + value, count + 1)
+
+        if state is None:
+            return value
+
+        if self.name == "sum":
+            return state + value
+
+        if self.name == "min":
+            return value if sort_key(value) < sort_key(state) else state
+
+        # max
+        return value if sort_key(value) > sort_key(state) else state
+
+    def final(self, state: Any) -> Any:
+        if self.name == "avg":
+            total, count = state
+            return total / count if count else None
+
+        return state
+
+
+AGGREGATES = ["count", "sum", "min", "max", "avg"]
+
+
+class HashAggregate:
+    """
+    Groups rows by their first key_count values with a dict and folds the
+    rest into one state per aggregate.
+
+    Once max_groups groups are in memory rows for any other group are
+    written to one of the partition files, picked by hashing the key,
+    instead. Every row of a group which isn't in memory lands in the same
+    partition so each partition is aggregated on its own afterwards
+    (and spills again if it's still too big).
+
+    Groups come out in the order they were first seen, spilled ones last.
+    """
+
+    def __init__(
+        self,
+        aggregates: List[Aggregate],
+        key_count: int,
+        max_groups: int = MAX_GROUPS,
+        depth: int = 0,
+    ):
+        self.aggregates = aggregates
+        self.key_count = key_count
+        self.max_groups = max(1, max_groups)
+        # Salts the partition hash so a partition splits
+        # differently when it spills again.
+        self.depth = depth
+        self.groups: Dict[Tuple[Any, ...], List[Any]] = {}
+        self.partitions: Optional[List[Any]] = None
+        # Rows written to partition files.
+        self.spilled = 0
+
+    def step(self, values: List[Any]):
+        key = tuple(values[: self.key_count])
+        states = self.groups.get(key)
+
+        if states is None:
+            if len(self.groups) >= self.max_groups:
+                self.spill(key, values)
+                return
+
+            states = [aggregate.initial() for aggregate in self.aggregates]
+            self.groups[key] = states
+
+        for i, aggregate in enumerate(self.aggregates):
+            states[i] = aggregate.step(states[i], values[self.key_count + i])
+
+    def spill(self, key: Tuple[Any, ...], values: List[Any]):
+        if self.partitions is None:
+            self.partitions = [tempfile.TemporaryFile() for _ in range(PARTITIONS)]
+
+        partition = self.partitions[hash((self.depth, key)) % PARTITIONS]
+        pickle.dump(values, partition)
+        self.spilled += 1
+
+    def rows(self) -> Iterator[List[Any]]:
+        """
+        The finished groups, the key values followed by each aggregate's result.
+        """
+        if self.key_count == 0 and self.depth == 0 and not self.groups:
+            # No rows, without a GROUP BY there's still one group.
+            yield [
+                aggregate.final(aggregate.initial()) for aggregate in self.aggregates
+            ]
+            return
+
+        for key, states in self.groups.items():
+            yield [
+                *key,
+                *(a.final(state) for a, state in zip(self.aggregates, states)),
+            ]
+
+        self.groups = {}
+
+        for partition in self.partitions or []:
+            partition.seek(0)
+            aggregate = HashAggregate(
+                self.aggregates, self.key_count, self.max_groups, self.depth + 1
+            )
+
+            while True:
+                try:
+                    aggregate.step(pickle.load(partition))
+                except EOFError:
+                    break
+
+            partition.close()
+            yield from aggregate.rows()
+            self.spilled += aggregate.spilled
@@ -0,0 +1,195 @@
+from dataclasses import dataclass
+from typing import Any, List, Iterator, Optional
+import hashlib
+import struct
+
+from toysql.page import FixedInteger, Page, PageType, PAGE_NUMBER_SIZE
+from toysql.record import Integer, Null, Text
+
+# With 4 hashes and 10 bits per key a page holds ~3,200 keys
+# with a 1% false positive rate. Once a page has that many
+# the filter carries on in a new page chained to it.
+BLOOM_HASHES = 4
+BLOOM_BITS_PER_KEY = 10
+# Bytes for the count of keys in the page, after the next page number.
+BLOOM_COUNT_SIZE = 4
+# The float serial type, records don't store floats yet.
+FLOAT_SERIAL_TYPE = 7
+
+
+def encode_key(key: Any) -> bytes:
+    """
+    The key in the record format, hashing repr(key) would put
+    equal values like 1 and 1.0 under different bits.
+
+    Index keys are tuples of sort_key values, they're unwrapped
+    back to the values they were made from.
+    """
+    values = key if isinstance(key, tuple) else (key,)
+    header = b""
+    body = b""
+
+    for value in values:
+        if isinstance(value, tuple):
+            rank, value = value
+            value = None if rank == 0 else value
+
+        if isinstance(value, float) and value.is_integer():
+            value = int(value)
+
+        if value is None:
+            serial_type, data = Null().serial_type(), Null().to_bytes()
+        elif isinstance(value, int):
+            # Fixed size, Integer's varint doesn't take negative numbers.
+            serial_type, data = 6, value.to_bytes(8, "big", signed=True)
+        elif isinstance(value, float):
+            serial_type, data = FLOAT_SERIAL_TYPE, struct.pack(">d", value)
+        else:
+            text = Text(value)
+            serial_type, data = text.serial_type(), text.to_bytes()
+
+        header += Integer(serial_type).to_bytes()
+        body += data
+
+    return Integer(len(header)).to_bytes() + header + body
+
+
+@dataclass
+class BloomPage:
+    """
+    One page of a BloomFilter, after the page header:
+
+        next_page_number: PAGE_NUMBER_SIZE bytes, 0 for the last page
+        count: BLOOM_COUNT_SIZE bytes, keys added to this page
+        bits: the rest of the page
+    """
+
+    page_number: Optional[int]
+    bits: bytearray
+    count: int = 0
+    next_page_number: int = 0
+    # Changed since it was last written.
+    dirty: bool = False
+
+    def capacity(self) -> int:
+        return len(self.bits) * 8 // BLOOM_BITS_PER_KEY
+
+    def to_bytes(self) -> bytes:
+        return (
+            FixedInteger.to_bytes(PAGE_NUMBER_SIZE, self.next_page_number)
+            + FixedInteger.to_bytes(BLOOM_COUNT_SIZE, self.count)
+            + bytes(self.bits)
+        )
+
+    @staticmethod
+    def from_bytes(page_number: int, data: bytes) -> "BloomPage":
+        start = BloomFilter.header_size()
+        count_start = start + PAGE_NUMBER_SIZE
+        bits_start = count_start + BLOOM_COUNT_SIZE
+
+        return BloomPage(
+            page_number,
+            bytearray(data[bits_start:]),
+            FixedInteger.from_bytes(data[count_start:bits_start]),
+            FixedInteger.from_bytes(data[start:count_start]),
+        )
+
+
+class BloomFilter:
+    """
+    https://en.wikipedia.org/wiki/Bloom_filter
+
+    A set which can answer "definitely not present" without looking
+    at the b-tree. Keys are never removed so a lookup can have false
+    positives but never false negatives.
+
+    The bits are stored in pages of their own (PageType.bloom) right
+    after the page header. Keys are added to the last page, when it's
+    full a new one is chained on so the false positive rate stays
+    around 1% per page as the tree grows. A lookup checks every page.
+    """
+
+    def __init__(self, page_number: int, pages: List[BloomPage], hashes=BLOOM_HASHES):
+        self.page_number = page_number
+        self.pages = pages
+        self.hashes = hashes
+
+    def positions(self, key: Any, size: int) -> Iterator[int]:
+        """
+        The bits for key, using double hashing: h1 + i * h2
+        It has to be stable between processes so we can't use hash()
+        """
+        digest = hashlib.blake2b(encode_key(key), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "big")
+        h2 = int.from_bytes(digest[8:], "big")
+
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % size
+
+    def add(self, key: Any) -> bool:
+        """
+        Returns True if the filter changed, it's written by write.
+        """
+        if key in self:
+            return False
+
+        page = self.pages[-1]
+        if page.count >= page.capacity():
+            # Allocated by write.
+            page = BloomPage(None, bytearray(len(page.bits)))
+            self.pages.append(page)
+
+        for position in self.positions(key, len(page.bits) * 8):
+            byte, bit = divmod(position, 8)
+            page.bits[byte] |= 1 << bit
+
+        page.count += 1
+        page.dirty = True
+
+        return True
+
+    def __contains__(self, key: Any) -> bool:
+        return any(self.page_contains(page, key) for page in self.pages)
+
+    def page_contains(self, page: BloomPage, key: Any) -> bool:
+        for position in self.positions(key, len(page.bits) * 8):
+            byte, bit = divmod(position, 8)
+            if not page.bits[byte] & (1 << bit):
+                return False
+
+        return True
+
+    @staticmethod
+    def header_size() -> int:
+        return Page(PageType.bloom, None).header_size()
+
+    @staticmethod
+    def read(pager, page_number: int) -> "BloomFilter":
+        pages = [BloomPage.from_bytes(page_number, pager.read_bytes(page_number))]
+
+        # Page 0 is the schema so it's never the next page.
+        while pages[-1].next_page_number:
+            next_page_number = pages[-1].next_page_number
+            pages.append(
+                BloomPage.from_bytes(
+                    next_page_number, pager.read_bytes(next_page_number)
+                )
+            )
+
+        return BloomFilter(page_number, pages)
+
+    def write(self, pager):
+        """
+        Writes the pages which changed, each with a single write.
+        """
+        # The first page is read, only the chained ones are new.
+        for previous, page in zip(self.pages, self.pages[1:]):
+            if page.page_number is None:
+                previous.next_page_number = pager.new(PageType.bloom)
+                page.page_number = previous.next_page_number
+                previous.dirty = True
+
+        for page in self.pages:
+            if page.dirty:
+                pager.write_bytes(page.page_number, self.header_size(), page.to_bytes())
+                page.dirty = False
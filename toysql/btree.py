@@ -1,8 +1,17 @@
-from toysql.page import PageType, LeafPageCell, Page, InteriorPageCell
+from toysql.page import (
+    PageType,
+    LeafPageCell,
+    Page,
+    IndexLeafPageCell,
+    Cell,
+    MAX_SORT_KEY,
+)
 from toysql.record import Record
-from toysql.exceptions import NotFoundException
-from typing import Optional
+from toysql.exceptions import NotFoundException, DuplicateKeyException
+from toysql.bloom import BloomFilter
+from typing import Optional, List, Any, Dict, Union, Tuple
 from dataclasses import dataclass
+import bisect
 import sys
 
 
@@ -12,6 +21,120 @@ class Frame:
     child_index: int
 
 
+SPLIT_POLICIES = ["even", "fillfactor", "append"]
+
+
+@dataclass
+class SplitPolicy:
+    """
+    Decides where a full page is split.
+
+    even: Split the cells in half.
+    fillfactor: Fill the left page up to fillfactor percent of the page,
+        bulk loads pack pages to the same fill.
+    append: If the new cell went to the end of the page keep the left
+        page full and start a new page with just the new cell,
+        this suits keys which are always increasing. Otherwise split evenly.
+    """
+
+    kind: str = "even"
+    fillfactor: int = 100
+
+    @staticmethod
+    def from_options(options: Dict[str, Union[str, int]]) -> "SplitPolicy":
+        """
+        Builds a policy from CREATE TABLE ... WITH (fillfactor=90, split=append)
+        """
+        unknown = set(options) - {"fillfactor", "split"}
+        if unknown:
+            raise ValueError(f"Unknown table options: {', '.join(sorted(unknown))}")
+
+        fillfactor = options.get("fillfactor", 100)
+        if not isinstance(fillfactor, int) or not 10 <= fillfactor <= 100:
+            raise ValueError(
+                f"fillfactor must be between 10 and 100, got {fillfactor!r}"
+            )
+
+        # Setting a fillfactor on its own implies the fillfactor policy.
+        kind = options.get("split", "fillfactor" if "fillfactor" in options else "even")
+        if kind not in SPLIT_POLICIES:
+            raise ValueError(f"Unknown split policy: {kind}")
+
+        return SplitPolicy(str(kind), fillfactor)
+
+    @property
+    def fill(self) -> float:
+        """
+        Fraction of a page to fill when packing pages.
+        """
+        if self.kind == "fillfactor":
+            return self.fillfactor / 100
+        return 1
+
+    def split_index(self, page: Page, appended: bool) -> int:
+        """
+        Returns the index of the first cell to move to the right page.
+        appended is true when the cell causing the split is the last on the page.
+        """
+        count = len(page.cells)
+        # Interior splits pop the first right cell up to the parent
+        # so they need to leave one more cell on the right.
+        highest = count - 1 if page.is_leaf() else count - 2
+
+        if self.kind == "append" and appended:
+            index = highest
+        elif self.kind == "fillfactor":
+            limit = page.page_size * self.fill
+            size = page.header_size()
+            index = 0
+            for cell in page.cells:
+                # Each cell also needs a 2 byte offset.
+                size += len(cell) + 2
+                if size >= limit:
+                    break
+                index += 1
+        else:
+            index = count // 2
+
+        return max(1, min(index, highest))
+
+
+@dataclass
+class CursorIO:
+    """
+    Pages a cursor has asked for, see BTree.read_page.
+    """
+
+    # Pages read from the pager and decoded.
+    reads: int = 0
+    # Pages the cursor already had decoded.
+    hits: int = 0
+    # Bytes of headers, cell pointers and cells decoded.
+    decoded: int = 0
+
+
+@dataclass
+class Utilization:
+    """
+    How full the pages of a b-tree are.
+    """
+
+    leaf_pages: int
+    interior_pages: int
+    # Bytes used across the leaf pages.
+    used: int
+    # Bytes available across the leaf pages.
+    capacity: int
+
+    @property
+    def pages(self) -> int:
+        return self.leaf_pages + self.interior_pages
+
+    @property
+    def fill(self) -> float:
+        return self.used / self.capacity if self.capacity else 0
+
+
 class BTree:
     """
         https://www.sqlite.org/fileformat.html#b_pages
@@ -36,14 +159,78 @@ class BTree:
         child_index: int
     """
 
-    def __init__(self, pager, root_page_number) -> None:
+    def __init__(
+        self,
+        pager,
+        root_page_number,
+        split_policy: Optional[SplitPolicy] = None,
+        bloom_page_number: Optional[int] = None,
+    ) -> None:
         self.pager = pager
         self.root_page_number = root_page_number
+        self.split_policy = split_policy or SplitPolicy()
+        self.bloom_page_number = bloom_page_number
+        self._bloom: Optional[BloomFilter] = None
+        # Cleared the first time an append hint turns out to be wrong.
+        self.appending = True
+        # The last page read_page read, with the pager's change count at the time.
+        self._page: Tuple[Optional[Page], int] = (None, 0)
+        self.io = CursorIO()
         self.reset()
+        # Index b-trees are keyed by (*values, row_id) rather than row_id.
+        self.is_index = self.root.is_index()
+
+    @property
+    def bloom(self) -> Optional[BloomFilter]:
+        """
+        The trees bloom filter if it has one, read on first use.
+        """
+        if self._bloom is None and self.bloom_page_number is not None:
+            self._bloom = BloomFilter.read(self.pager, self.bloom_page_number)
+
+        return self._bloom
+
+    @staticmethod
+    def bloom_keys(cell: Cell) -> List[Any]:
+        """
+        Table cells are looked up by row_id. Index entries are added
+        under every prefix of their key so equality lookups on
+        the leading columns can be checked too.
+        """
+        if isinstance(cell.key, tuple):
+            return [cell.key[:i] for i in range(1, len(cell.key) + 1)]
+
+        return [cell.key]
+
+    def might_contain(self, key: Any) -> bool:
+        """
+        False if the key is definitely not in the tree.
+        Always True for trees without a bloom filter.
+        """
+        bloom = self.bloom
+        return bloom is None or key in bloom
+
+    @property
+    def leaf_type(self) -> PageType:
+        return PageType.index_leaf if self.is_index else PageType.leaf
+
+    @property
+    def interior_type(self) -> PageType:
+        return PageType.index_interior if self.is_index else PageType.interior
+
+    def new_cell(self, record: Record, key_size: Optional[int] = None) -> Cell:
+        """
+        key_size is the number of values in an index record which are
+        part of the key, the rest are included values.
+        """
+        if self.is_index:
+            return IndexLeafPageCell(record, key_size)
+
+        return LeafPageCell(record)
 
     @property
     def root(self) -> Page:
-        return self.pager.read(self.root_page_number)
+        return self.read(self.root_page_number)
 
     def new_page(self, page_type) -> Page:
         page_number = self.pager.new()
@@ -52,8 +239,28 @@ class BTree:
     def show(self):
         return self.root.show(0, self.pager.read)
 
+    def utilization(self) -> Utilization:
+        """
+        Walks every page of the tree and reports how full the leaves are.
+        """
+        utilization = Utilization(0, 0, 0, 0)
+        page_numbers = [self.root_page_number]
+
+        while page_numbers:
+            page = self.pager.read(page_numbers.pop())
+
+            if page.is_leaf():
+                utilization.leaf_pages += 1
+                utilization.used += len(page)
+                utilization.capacity += page.page_size
+            else:
+                utilization.interior_pages += 1
+                page_numbers.extend(self.child_page_numbers(page))
+
+        return utilization
+
     def reset(self):
-        self.stack = [Frame(self.root.page_number, 0)]
+        self.stack = [Frame(self.root_page_number, 0)]
         # rewind = True tells us that the cursor
         # has not moved yet
         # TODO: Better way to do this?
@@ -62,7 +269,13 @@ class BTree:
     def seek_start(self):
         self.reset()
 
-    def insert(self, record: Record):
+    def insert(
+        self,
+        record: Record,
+        key_size: Optional[int] = None,
+        append: bool = False,
+        replace: bool = True,
+    ):
         """
         1. Perform a search to determine which leaf node the new key should go into.
         2. If the node is not full, insert the new key, done!
@@ -71,22 +284,42 @@ class BTree:
             b. Insert the new leaf's smallest key into the parent node.
             c. If the parent is full, split it too, repeat the split process above until a parent is found that need not split.
             d. If the root splits, create a new root which has one key and two children.
+
+        append hints that the key is larger than any in the tree, see seek_append.
+        An existing record with the same key is replaced, unless replace
+        is False then DuplicateKeyException is raised and nothing is written.
         """
-        cell = LeafPageCell(record)
+        cell = self.new_cell(record, key_size)
+        page = self.seek_append(cell.key) if append and self.appending else None
 
-        try:
-            self.seek(record.row_id)
-        except NotFoundException:
-            pass
+        if page is not None:
+            page.cells.append(cell)
+        else:
+            try:
+                # Skip the bloom filter, we need the insert position.
+                self.reset()
+                self._seek(cell.key)
+            except NotFoundException:
+                pass
 
-        # Get current position
-        frame = self.stack[-1]
+            # Get current position
+            frame = self.stack[-1]
+
+            page = self.read(frame.page_number)
+
+            if not replace and page.find_cell(cell.key) is not None:
+                raise DuplicateKeyException(f"Duplicate key: {cell.key}")
 
-        page = self.pager.read(frame.page_number)
-        page.add_cell(cell)
+            page.add_cell(cell)
+
+        bloom = self.bloom
+        if bloom is not None:
+            for key in self.bloom_keys(cell):
+                bloom.add(key)
+            bloom.write(self.pager)
 
         if page.is_full():
-            self._split_leaf(page)
+            self._split_leaf(page, page.cells[-1] is cell)
         else:
             self.pager.write(page)
 
@@ -94,26 +327,112 @@ class BTree:
         # To see how the changes on insert
         # print(self.show())
 
-    def _split_leaf(self, page):
+    def seek_append(self, key: Any) -> Optional[Page]:
+        """
+        Follows the right most branch down to the last leaf without
+        comparing keys. If key is larger than the leaf's last key it's
+        larger than every key in the tree so the leaf is returned
+        for the cell to go on the end.
+
+        Otherwise None, and hints are ignored from then on as
+        the keys aren't arriving in order.
+        """
+        self.reset()
+        self.rewind = False
+        page = self.root
+
+        while not page.is_leaf():
+            assert page.right_child_page_number is not None
+            self.stack[-1].child_index = len(page.cells) + 1
+            self.stack.append(Frame(page.right_child_page_number, 0))
+            page = self.read(page.right_child_page_number)
+
+        if len(page.cells) == 0:
+            # Empty leaves aren't merged away so unless it's the
+            # root an empty last leaf says nothing about the rest of the tree.
+            return page if page.page_number == self.root_page_number else None
+
+        if not page.cells[-1].key < key:
+            self.appending = False
+            return None
+
+        self.stack[-1].child_index = len(page.cells) + 1
+        return page
+
+    def update(self, record: Record) -> bool:
+        """
+        Replaces the record with the same row_id.
+
+        When the new cell is no longer than the old one it's written over
+        the old cell's slot in the page image, padded with zeros, so the
+        rest of the page isn't re-encoded and the page can't split.
+        Otherwise we fall back to insert, which removes the old cell
+        and adds the new one, splitting if needed.
+
+        Returns True if the record was rewritten in place.
+        """
+        cell = self.new_cell(record)
+
+        try:
+            self.seek(cell.key)
+        except NotFoundException:
+            self.insert(record)
+            return False
+
+        frame = self.stack[-1]
+        page = self.read(frame.page_number)
+        slot = page.cells[frame.child_index - 1].slot
+        data = cell.to_bytes()
+
+        if slot is not None and len(data) <= slot[1]:
+            position, length = slot
+            self.pager.write_bytes(
+                page.page_number, position, data.ljust(length, b"\0")
+            )
+            return True
+
+        self.insert(record)
+        return False
+
+    def delete(self, key: Any) -> bool:
+        """
+        Removes the entry with key from its leaf.
+        Pages aren't merged so a leaf can be left empty.
+        Returns False if the key wasn't found.
+        """
+        try:
+            self.seek(key)
+        except NotFoundException:
+            return False
+
+        frame = self.stack[-1]
+        page = self.read(frame.page_number)
+        page.remove_cell(page.cells[frame.child_index - 1])
+        self.pager.write(page)
+        self.reset()
+
+        return True
+
+    def _split_leaf(self, page, appended: bool):
         """
         Given a full leaf page.
-        1. Splits it into two leaf pages.
+        1. Splits it into two leaf pages, where is up to the split policy.
         2. If there is no parent it creates a new InteriorPage.
         3. It then takes the left most key of the right split page.
         4. Inserts that key into the parent.
         5. If the parent is full it splits that.
         """
-        index = len(page.cells) // 2
-        left = self.new_page(PageType.leaf)
+        index = self.split_policy.split_index(page, appended)
+        left = self.new_page(page.page_type)
 
         left.cells = page.cells[:index]
         page.cells = page.cells[index:]
-        key = page.cells[0].row_id
+        divider = page.cells[0].divider(left.page_number)
 
         # Pop of self.
         self.stack.pop()
         if len(self.stack) == 0:
-            parent = self.new_page(PageType.interior)
+            parent = self.new_page(self.interior_type)
 
             # Swap page numbers to keep the root_page_number static.
             parent.page_number, page.page_number = page.page_number, parent.page_number
@@ -121,28 +440,28 @@ class BTree:
             self.stack.append(Frame(parent.page_number, 0))
         else:
             frame = self.stack[-1]
-            parent = self.pager.read(frame.page_number)
+            parent = self.read(frame.page_number)
 
-        parent.add_cell(InteriorPageCell(key, left.page_number))
+        parent.add_cell(divider)
 
         for p in [left, page, parent]:
             self.pager.write(p)
 
         if parent.is_full():
-            self._split_internal(parent)
+            self._split_internal(parent, parent.cells[-1] is divider)
 
-    def _split_internal(self, page: Page):
+    def _split_internal(self, page: Page, appended: bool):
         """
         Given a full InteriorPage
 
-        1. Splits the page in half
+        1. Splits the page, where is up to the split policy
         2. Takes the left most cell of the right page (middle cell)
         3. It makes the left_page.right_child = middle_cell.left_child
         4. It adds the middle_cell.row_id to the parent which points the the left child.
         """
-        index = len(page.cells) // 2
+        index = self.split_policy.split_index(page, appended)
 
-        left = self.new_page(PageType.interior)
+        left = self.new_page(page.page_type)
         left.cells = page.cells[:index]
         page.cells = page.cells[index:]
 
@@ -153,7 +472,7 @@ class BTree:
 
         self.stack.pop()
         if len(self.stack) == 0:
-            parent = self.new_page(PageType.interior)
+            parent = self.new_page(self.interior_type)
 
             # Keep the root_page_number static.
             parent.page_number, page.page_number = page.page_number, parent.page_number
@@ -161,21 +480,23 @@ class BTree:
             self.stack.append(Frame(parent.page_number, 0))
         else:
             frame = self.stack[-1]
-            parent = self.pager.read(frame.page_number)
+            parent = self.read(frame.page_number)
 
-        parent.add_cell(InteriorPageCell(middle.row_id, left.page_number))
+        divider = middle.divider(left.page_number)
+        parent.add_cell(divider)
 
         for p in [left, page, parent]:
             self.pager.write(p)
 
         if parent.is_full():
-            self._split_internal(parent)
+            self._split_internal(parent, parent.cells[-1] is divider)
 
     def seek_end(self):
         try:
             # Seek to the last value
             # using maxsize
-            self.seek(sys.maxsize)
+            self.reset()
+            self._seek(sys.maxsize)
         except NotFoundException:
             # It's always going to raise.
             pass
@@ -188,28 +509,32 @@ class BTree:
         """
         Returns true if the root page is empty.
         """
-        root_page = self.pager.read(self.root_page_number)
+        root_page = self.read(self.root_page_number)
         return len(root_page.cells) == 0
 
-    def find(self, row_id: int) -> Optional[Record]:
+    def find(self, key: Any) -> Optional[Record]:
         """
         Convenience wrapper around seek & current.
         """
         try:
-            self.seek(row_id)
+            self.seek(key)
             return self.current()
         except NotFoundException:
             return None
 
-    def seek(self, row_id: int) -> None:
+    def seek(self, key: Any) -> None:
         self.reset()
-        self._seek(row_id)
 
-    def _seek(self, row_id: int) -> None:
+        if not self.might_contain(key):
+            raise NotFoundException(f"Couldn't seek to key {key}")
+
+        self._seek(key)
+
+    def _seek(self, key: Any) -> None:
         """
-        Cursor seek to a specified row_id in the Btree
+        Cursor seek to a specified key in the Btree
 
-        If the row_id doesn't exist in the b
+        If the key doesn't exist in the b
 
         it'll set the cursor to point at the insert location.
         """
@@ -219,37 +544,209 @@ class BTree:
             raise StopIteration()
 
         frame = self.stack[-1]
-        current_page = self.pager.read(frame.page_number)
+        current_page = self.read(frame.page_number)
 
         if current_page.is_leaf():
             for cell in current_page.cells:
                 frame.child_index += 1
 
-                if row_id == cell.row_id:
+                if key == cell.key:
                     return
 
-                if frame.child_index == len(current_page.cells):
-                    raise NotFoundException(f"Couldn't seek to row {row_id}")
+            raise NotFoundException(f"Couldn't seek to key {key}")
         else:
             # InteriorPage
-            # Here we keep track of each branch we have been down
-            # in the stack. If we have already been down a child branch
-            # we skip it.
-            # If we have been down all child paths we pop off the stack
-            # and traverse the parent.
+            # child_index counts the branches we have been down
+            # so that __next__ carries on from the next branch
+            # once the one we are following is exhausted.
             for cell in current_page.cells:
-                if row_id < cell.row_id:
+                frame.child_index += 1
+
+                if key < cell.key:
                     # found branch to follow
                     self.stack.append(Frame(cell.left_child_page_number, 0))
-                    return self._seek(row_id)
-                else:
-                    frame.child_index += 1
+                    return self._seek(key)
 
             # Didn't find branch take right most child
             # Follow the right most branch
-            assert current_page.right_child_page_number
+            assert current_page.right_child_page_number is not None
+            frame.child_index += 1
             self.stack.append(Frame(current_page.right_child_page_number, 0))
-            return self._seek(row_id)
+            return self._seek(key)
+
+    def seek_ge(self, key: Any) -> Optional[Record]:
+        """
+        Moves the cursor to the first entry with a key >= key
+        and returns it, or None if there isn't one.
+
+        For index b-trees key can be a prefix of the entry keys.
+        """
+        return self._seek_position(key, bisect.bisect_left)
+
+    def seek_gt(self, key: Any) -> Optional[Record]:
+        """
+        Moves the cursor to the first entry with a key > key
+        and returns it, or None if there isn't one.
+        """
+        if self.is_index:
+            # Skip every entry which shares the prefix.
+            key = key + (MAX_SORT_KEY,)
+
+        return self._seek_position(key, bisect.bisect_right)
+
+    def _seek_position(self, key: Any, bisect_fn) -> Optional[Record]:
+        self.reset()
+        self.rewind = False
+
+        while True:
+            frame = self.stack[-1]
+            current_page = self.read(frame.page_number)
+
+            if current_page.is_leaf():
+                break
+
+            for i, page_number in enumerate(self.child_page_numbers(current_page)):
+                if i == len(current_page.cells) or key < current_page.cells[i].key:
+                    frame.child_index = i + 1
+                    self.stack.append(Frame(page_number, 0))
+                    break
+
+        keys = [cell.key for cell in current_page.cells]
+        frame.child_index = bisect_fn(keys, key)
+
+        try:
+            # If we are at the end of the leaf this
+            # carries on into the next one.
+            return self.__next__()
+        except StopIteration:
+            return None
+
+    def bulk_load(self, cells: List[Cell]):
+        """
+        Builds the tree bottom up from cells which are already
+        sorted by key. The tree is expected to be empty.
+
+        Rather than inserting one record at a time, which reads and splits
+        pages as it goes, leaves are packed left to right and each level of
+        interior pages is built from the one below it.
+        """
+        bloom = self.bloom
+        if bloom is not None:
+            for cell in cells:
+                for key in self.bloom_keys(cell):
+                    bloom.add(key)
+            bloom.write(self.pager)
+
+        level = self._pack(cells)
+
+        while len(level) > 1:
+            level = self._pack_interior(level)
+
+        [(_, root)] = level
+        root.page_number = self.root_page_number
+        self.pager.write(root)
+        self.reset()
+
+    def _pack(self, cells: List[Cell]):
+        """
+        Packs cells into as few leaf pages as possible.
+        Returns [(first_cell, page)]
+        """
+        level = []
+        page = Page(self.leaf_type, None)
+        size = page.header_size()
+        limit = page.page_size * self.split_policy.fill
+
+        for cell in cells:
+            # Each cell also needs a 2 byte offset.
+            cell_size = len(cell) + 2
+            if len(page.cells) and size + cell_size >= limit:
+                level.append((page.cells[0], page))
+                page = Page(self.leaf_type, None)
+                size = page.header_size()
+
+            page.cells.append(cell)
+            size += cell_size
+
+        level.append((page.cells[0] if page.cells else None, page))
+        return self._number(level)
+
+    def _pack_interior(self, children):
+        """
+        Given [(first_cell, page)] for a level, builds the interior pages
+        above it. The first child of each page is reached through the
+        divider of the next one, the last becomes the right_child_page_number.
+        Returns [(first_cell, page)] for the new level.
+        """
+        level = []
+        page = None
+        size = 0
+
+        for first, child in children:
+            if page is not None:
+                divider = first.divider(page.right_child_page_number)
+                cell_size = len(divider) + 2
+
+                if size + cell_size < page.page_size:
+                    page.cells.append(divider)
+                    page.right_child_page_number = child.page_number
+                    size += cell_size
+                    continue
+
+            page = Page(self.interior_type, None)
+            page.right_child_page_number = child.page_number
+            size = page.header_size()
+            level.append((first, page))
+
+        return self._number(level)
+
+    def _number(self, level):
+        """
+        Allocates page numbers for a level. A single page is
+        the root so it's left for bulk_load to place.
+        """
+        if len(level) == 1:
+            return level
+
+        for _, page in level:
+            # Allocated as an empty leaf, an interior page
+            # can't be written until it has its right child.
+            page.page_number = self.pager.new()
+            self.pager.write(page)
+
+        return level
+
+    def read(self, page_number: int) -> Page:
+        """
+        Reads and decodes a page, counted in io.
+        """
+        page = self.pager.read(page_number)
+        self.io.reads += 1
+        # Each cell has a 2 byte pointer in the header.
+        self.io.decoded += page.header_size() + sum(
+            2 + length for _, length in (cell.slot for cell in page.cells)
+        )
+
+        return page
+
+    def read_page(self, page_number: int) -> Page:
+        """
+        Reads pages for the cursor, the last one is kept so stepping
+        through a leaf doesn't decode it again for every record.
+        It's only reused if nothing has been written since.
+        """
+        page, changes = self._page
+        if (
+            page is None
+            or page.page_number != page_number
+            or changes != self.pager.changes
+        ):
+            page = self.read(page_number)
+            self._page = (page, self.pager.changes)
+        else:
+            self.io.hits += 1
+
+        return page
 
     def current(self) -> Record:
         """
@@ -263,7 +760,7 @@ class BTree:
             return self.__next__()
 
         frame = self.stack[-1]
-        current_page = self.pager.read(frame.page_number)
+        current_page = self.read_page(frame.page_number)
 
         if current_page.is_leaf():
             if len(current_page.cells) == 0:
@@ -285,7 +782,7 @@ class BTree:
             raise StopIteration()
 
         frame = self.stack[-1]
-        current_page = self.pager.read(frame.page_number)
+        current_page = self.read_page(frame.page_number)
 
         if current_page.is_leaf():
             try:
@@ -322,6 +819,35 @@ class BTree:
             self.stack.pop()
             return self.__next__()
 
+    def next_leaf(self) -> Optional[Page]:
+        """
+        Moves the cursor past every record of the next leaf page
+        and returns it, so a batch scan gets a page of records at a time.
+        None once there are no more leaves.
+        """
+        self.rewind = False
+
+        while self.stack:
+            frame = self.stack[-1]
+            page = self.read_page(frame.page_number)
+
+            if page.is_leaf():
+                if frame.child_index == 0 and page.cells:
+                    frame.child_index = len(page.cells)
+                    return page
+
+                self.stack.pop()
+                continue
+
+            children = list(self.child_page_numbers(page))
+            if frame.child_index < len(children):
+                self.stack.append(Frame(children[frame.child_index], 0))
+                frame.child_index += 1
+            else:
+                self.stack.pop()
+
+        return None
+
     @staticmethod
     def child_page_numbers(page):
         for cell in page.cells:
@@ -0,0 +1,129 @@
+from typing import List, Any, Optional, Dict
+from dataclasses import dataclass, field
+from toysql.lexer import lex
+from toysql.parser import parse, CreateStatement, CreateIndexStatement
+from toysql.exceptions import TableFoundException, ColumnNotFoundException
+from toysql.stats import Stats
+
+SCHEMA_TABLE_NAME = "schema"
+SCHEMA_TABLE_SQL_TEXT = f"CREATE TABLE {SCHEMA_TABLE_NAME} (id INTEGER, schema_type TEXT, name TEXT, t_name TEXT, sql_text TEXT, root_page_number INTEGER);"
+# Filled by ANALYZE, a row for each table and index keyed by its root page number.
+STATS_TABLE_NAME = "stats"
+STATS_TABLE_SQL_TEXT = f"CREATE TABLE {STATS_TABLE_NAME} (id INTEGER PRIMARY KEY, name TEXT, t_name TEXT, row_count INTEGER, page_count INTEGER, distinct_values TEXT, null_values TEXT, histograms TEXT);"
+
+
+@dataclass
+class IndexSchema:
+    name: str
+    table_name: str
+    root_page_number: int
+    columns: List[str]
+    include: List[str]
+
+    def position(self, column_name: str) -> Optional[int]:
+        """
+        Where the column is in the index records [row_id, *columns, *include]
+        """
+        stored = self.columns + self.include
+        if column_name not in stored:
+            return None
+
+        return stored.index(column_name) + 1
+
+
+@dataclass
+class TableSchema:
+    name: str
+    root_page_number: int
+    sql_text: str
+    statement: CreateStatement
+    columns: List[str]
+    pk_index: int
+    indexes: List[IndexSchema] = field(default_factory=list)
+    positions: Dict[str, int] = field(default_factory=dict)
+
+    def __post_init__(self):
+        self.positions = {name: i for i, name in enumerate(self.columns)}
+
+    @staticmethod
+    def from_sql_text(name: str, root_page_number: int, sql_text: str):
+        [statement] = parse(lex(sql_text))
+        columns = [str(column.name.value) for column in statement.columns]
+        # Default to 0 if no primary key is set.
+        pk_index = next(
+            (i for i, c in enumerate(statement.columns) if c.is_primary_key), 0
+        )
+
+        return TableSchema(
+            name, root_page_number, sql_text, statement, columns, pk_index
+        )
+
+    def column_index(self, column_name: str) -> int:
+        """
+        The column's position, it can be qualified with the table name eg: orders.id
+        """
+        table_name, _, name = column_name.rpartition(".")
+        if column_name not in self.positions and table_name == self.name:
+            column_name = name
+
+        try:
+            return self.positions[column_name]
+        except KeyError:
+            raise ColumnNotFoundException(
+                f"Column: {column_name} not found in {self.name}"
+            )
+
+
+class Catalog:
+    """
+    The schema table parsed into tables, columns and indexes.
+
+    Reading it means scanning the schema b-tree and parsing every
+    CREATE statement so it's loaded once and kept until the
+    schema cookie changes, see Compiler.get_catalog.
+    """
+
+    def __init__(self, rows: List[List[Any]], schema_cookie: Optional[int] = None):
+        self.rows = rows
+        self.schema_cookie = schema_cookie
+        self.tables: Dict[str, TableSchema] = {
+            SCHEMA_TABLE_NAME: TableSchema.from_sql_text(
+                SCHEMA_TABLE_NAME, 0, SCHEMA_TABLE_SQL_TEXT
+            )
+        }
+        # Bloom filter page numbers by table or index name.
+        self.blooms: Dict[str, int] = {}
+        # ANALYZE results by table or index name, see Compiler.get_catalog.
+        self.stats: Dict[str, Stats] = {}
+
+        for _, schema_type, name, _, root_page_number, sql_text in rows:
+            if schema_type == "table":
+                self.tables[name] = TableSchema.from_sql_text(
+                    name, root_page_number, sql_text
+                )
+
+            if schema_type == "bloom":
+                self.blooms[name] = root_page_number
+
+        # Indexes after tables so the table is there to attach to.
+        for _, schema_type, name, table_name, root_page_number, sql_text in rows:
+            if schema_type == "index":
+                [statement] = parse(lex(sql_text))
+                assert isinstance(statement, CreateIndexStatement)
+                columns = [str(column.value) for column in statement.columns]
+                include = [str(column.value) for column in statement.include]
+                self.table(table_name).indexes.append(
+                    IndexSchema(name, table_name, root_page_number, columns, include)
+                )
+
+    def table(self, table_name: str) -> TableSchema:
+        try:
+            return self.tables[table_name]
+        except KeyError:
+            raise TableFoundException(f"Table: {table_name} not found")
+
+    def __len__(self) -> int:
+        """
+        Number of rows in the schema table.
+        """
+        return len(self.rows)
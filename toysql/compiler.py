@@ -1,16 +1,66 @@
-from typing import List, Any, Optional, Union
+from typing import (
+    List,
+    Any,
+    Optional,
+    Union,
+    Tuple,
+    Callable,
+    Dict,
+    Iterator,
+    Sequence,
+    Set,
+    TextIO,
+    cast,
+)
 from toysql.pager import Pager
+from toysql.aggregate import Aggregate
 from toysql.parser import (
     SelectStatement,
     InsertStatement,
+    UpdateStatement,
     CreateStatement,
+    CreateIndexStatement,
+    AnalyzeStatement,
+    ExplainStatement,
+    BinaryExpression,
+    UnaryExpression,
+    FunctionExpression,
+    Expression,
     parse,
+    parse_statements,
+    split_statements,
+)
+from toysql.lexer import (
+    lex,
+    lex_stream,
+    to_sql,
+    DataType,
+    Token,
+    Kind,
+    Keyword,
+    Symbol,
+    Parameter,
 )
-from toysql.lexer import lex, DataType
 from enum import Enum, auto
-from dataclasses import dataclass
-from toysql.exceptions import TableFoundException
-from toysql.btree import BTree
+from dataclasses import dataclass, field
+from collections import OrderedDict, Counter
+import re
+from toysql.exceptions import (
+    ParsingException,
+    BindingException,
+    ColumnNotFoundException,
+)
+from toysql.btree import BTree, SplitPolicy, Utilization
+from toysql.catalog import (
+    Catalog,
+    IndexSchema,
+    SCHEMA_TABLE_NAME,
+    SCHEMA_TABLE_SQL_TEXT,
+    STATS_TABLE_NAME,
+    STATS_TABLE_SQL_TEXT,
+)
+from toysql.stats import Stats, seek_cost, EQUAL_SELECTIVITY, RANGE_SELECTIVITY
+from toysql.join import JOIN_BUFFER
 
 
 """
@@ -26,6 +76,7 @@ class Opcode(Enum):
     String = auto()
     Null = auto()
     SCopy = auto()
+    Variable = auto()
 
     # Control Flow Instructions
     Eq = auto()
@@ -36,10 +87,15 @@ class Opcode(Enum):
     Ge = auto()
     Halt = auto()
     Noop = auto()
+    Goto = auto()
+    IfNot = auto()
+    IfPos = auto()
+    DecrJumpZero = auto()
 
     # Database Opening and Closing Instructions
     OpenRead = auto()
     OpenWrite = auto()
+    OpenFilter = auto()
     Close = auto()
 
     # Cursor Manipulation Instructions
@@ -51,6 +107,7 @@ class Opcode(Enum):
     SeekGe = auto()
     SeekLt = auto()
     IdxGt = auto()
+    IdxGe = auto()
     IdxLt = auto()
     IdxLe = auto()
 
@@ -66,10 +123,118 @@ class Opcode(Enum):
     # Insert instructions
     Insert = auto()
     IdxInsert = auto()
+    IdxDelete = auto()
+
+    # RowSet Instructions
+    RowSetAdd = auto()
+    RowSetRead = auto()
 
     # B-Tree Creation Instructions
     CreateTable = auto()
     CreateIndex = auto()
+    CreateFilter = auto()
+
+    # Schema Instructions
+    SetCookie = auto()
+    Analyze = auto()
+    Profile = auto()
+
+    # Batch Instructions, they work on a leaf page of rows at a time.
+    RewindPage = auto()
+    NextPage = auto()
+    ColumnVector = auto()
+    KeyVector = auto()
+    SelectAll = auto()
+    Filter = auto()
+    SelectionUnion = auto()
+    ResultBatch = auto()
+
+    # Aggregate Instructions
+    AggStep = auto()
+    AggFinal = auto()
+    AggNext = auto()
+
+    # Sorter Instructions
+    SorterOpen = auto()
+    SorterInsert = auto()
+    SorterSort = auto()
+    SorterNext = auto()
+
+    # Hash Join Instructions
+    HashOpen = auto()
+    HashBuild = auto()
+    HashProbe = auto()
+    HashNext = auto()
+    HashDeferred = auto()
+
+    # Arithmetic Instructions
+    Add = auto()
+
+
+# P5 flags
+# Comparison opcodes jump if either operand is NULL.
+JUMP_IF_NULL = 0x10
+# IdxInsert buffers the entry, the index is built from the
+# sorted entries when the cursor is closed.
+OPFLAG_BULK_BUILD = 0x01
+# SeekGe is only looking for entries equal to the key.
+OPFLAG_SEEKEQ = 0x02
+# Insert replaces an existing row, in place if the new record fits.
+OPFLAG_ISUPDATE = 0x04
+# Insert's row_id is probably larger than any in the table, see BTree.seek_append.
+OPFLAG_APPEND = 0x08
+# SeekGt's last key value is a NULL to skip the entries where that column
+# is NULL, it isn't a bound. NULL sorts before every other value.
+OPFLAG_SKIP_NULLS = 0x20
+
+# Registers Analyze writes, the stats table's columns after name & t_name.
+ANALYZE_COLUMNS = 5
+
+# Columns of each EXPLAIN row, one for every instruction.
+EXPLAIN_COLUMNS = ["addr", "opcode", "p1", "p2", "p3", "p4", "p5"]
+# Columns of each EXPLAIN QUERY PLAN row.
+QUERY_PLAN_COLUMNS = ["id", "detail"]
+
+# Columns of each EXPLAIN ANALYZE row, see vm.Profile.listing.
+PROFILE_COLUMNS = EXPLAIN_COLUMNS + [
+    "count",
+    "time_ns",
+    "reads",
+    "hits",
+    "decoded",
+]
+
+# Jump used to skip a row when a comparison is false.
+COMPARISON = {
+    Symbol.equal: Opcode.Eq,
+    Symbol.not_equal: Opcode.Ne,
+    Symbol.lt_gt: Opcode.Ne,
+    Symbol.gt: Opcode.Gt,
+    Symbol.gteq: Opcode.Ge,
+    Symbol.lt: Opcode.Lt,
+    Symbol.lteq: Opcode.Le,
+}
+
+INVERSE_COMPARISON = {
+    Symbol.equal: Opcode.Ne,
+    Symbol.not_equal: Opcode.Eq,
+    Symbol.lt_gt: Opcode.Eq,
+    Symbol.gt: Opcode.Le,
+    Symbol.gteq: Opcode.Lt,
+    Symbol.lt: Opcode.Ge,
+    Symbol.lteq: Opcode.Gt,
+}
+
+# The same comparison with its operands swapped. eg 1 < x => x > 1
+FLIPPED_COMPARISON = {
+    Symbol.equal: Symbol.equal,
+    Symbol.not_equal: Symbol.not_equal,
+    Symbol.lt_gt: Symbol.lt_gt,
+    Symbol.gt: Symbol.lt,
+    Symbol.gteq: Symbol.lteq,
+    Symbol.lt: Symbol.gt,
+    Symbol.lteq: Symbol.gteq,
+}
 
 
 @dataclass
@@ -78,7 +243,20 @@ class InstructionIR:
     p1: Union[int, "InstructionIR"] = 0
     p2: Union[int, "InstructionIR"] = 0
     p3: Union[int, "InstructionIR"] = 0
-    p4: Optional[Union[str, int, "InstructionIR"]] = None  # TODO narrow type
+    p4: Optional[
+        Union[
+            str,
+            int,
+            SplitPolicy,
+            Opcode,
+            List[Aggregate],
+            List[bool],
+            List[int],
+            Token,
+            "Program",
+            "InstructionIR",
+        ]
+    ] = None  # TODO narrow type
     p5: int = 0
 
 
@@ -121,7 +299,19 @@ class Instruction:
     p1: int = 0
     p2: int = 0
     p3: int = 0
-    p4: Optional[Union[str, int]] = None  # TODO narrow type
+    p4: Optional[
+        Union[
+            str,
+            int,
+            SplitPolicy,
+            Opcode,
+            List[Aggregate],
+            List[bool],
+            List[int],
+            Token,
+            "Program",
+        ]
+    ] = None  # TODO narrow type
     p5: int = 0
 
 
@@ -146,12 +336,58 @@ class Program:
 
     irs: List[InstructionIR]
     instructions: List[Instruction]
+    # Names of the parameters in the order they're bound, ? for positional ones.
+    parameters: List[str] = field(default_factory=list)
+    # The schema the program was compiled against, see Pager.schema_cookie
+    schema_cookie: Optional[int] = None
+    # Registers used, the VM allocates them all up front.
+    register_count: int = 0
+    # How the statement reads its tables, see EXPLAIN QUERY PLAN.
+    plan: List[str] = field(default_factory=list)
+    # Names of the columns of each row, empty when there are no rows.
+    columns: List[str] = field(default_factory=list)
+    # The program as a python function, made the first time
+    # the codegen engine runs it, see vm.Codegen.
+    function: Optional[Callable] = field(default=None, repr=False, compare=False)
+    # The same for a VM which counts steps.
+    counting_function: Optional[Callable] = field(
+        default=None, repr=False, compare=False
+    )
+
+    def number_parameters(self):
+        """
+        Numbers the placeholders in the order they appear in the sql text.
+        Each ? gets the next number, a :name gets one the first time it's seen.
+        A placeholder can be loaded by more than one instruction (eg an
+        index seek and the filter after it) so a ? is keyed by where it is.
+        """
+        variables = [ir for ir in self.irs if ir.opcode == Opcode.Variable]
+        variables.sort(key=lambda ir: location_key(cast(Token, ir.p4)))
+        numbers: Dict[Any, int] = {}
+
+        for ir in variables:
+            token = cast(Token, ir.p4)
+            name = str(token.value)
+            key: Any = name
+
+            if token.type == Parameter.positional:
+                key = location_key(token) if token.loc is not None else id(token)
+
+            if key not in numbers:
+                numbers[key] = len(self.parameters)
+                self.parameters.append(name)
+
+            ir.p1 = numbers[key]
+            ir.p4 = name
 
     def compile(self):
         """
         This converts it's intermediate representation (ir) into an instruction set.
         resolving pointers to addresses etc.
         """
+        self.number_parameters()
+        addresses = {id(ir): address for address, ir in enumerate(self.irs)}
+
         for ir in self.irs:
             attrs = ["p1", "p2", "p3", "p4", "p5"]
             instruction = Instruction(ir.opcode)
@@ -159,34 +395,697 @@ class Program:
             for a in attrs:
                 value = getattr(ir, a)
                 if isinstance(value, InstructionIR):
-                    setattr(instruction, a, self.irs.index(value))
+                    # Keyed by identity, equal instructions can be in
+                    # more than one place eg Close p1=0
+                    setattr(instruction, a, addresses[id(value)])
                 else:
                     setattr(instruction, a, value)
 
             self.instructions.append(instruction)
 
 
-SCHEMA_TABLE_NAME = "schema"
-SCHEMA_TABLE_SQL_TEXT = f"CREATE TABLE {SCHEMA_TABLE_NAME} (id INTEGER, schema_type TEXT, name TEXT, t_name TEXT, sql_text TEXT, root_page_number INTEGER);"
+@dataclass
+class PreparedStatement:
+    """
+    A program compiled once and executed many times, the values
+    for its placeholders are bound each time it's run. eg:
+
+        statement = compiler.prepare_statement("INSERT INTO users VALUES (?, ?);")
+        vm.execute(statement.program, statement.bind([1, "Phil"]))
+    """
+
+    sql_text: str
+    program: Program
+
+    def bind(self, parameters: Union[Sequence[Any], Dict[str, Any]] = ()) -> List[Any]:
+        """
+        Orders the values by parameter number for the Variable opcode.
+        A dict binds :name placeholders, a sequence binds by position.
+        """
+        names = self.program.parameters
+
+        if isinstance(parameters, dict):
+            values = []
+            for name in names:
+                if name[1:] not in parameters:
+                    raise BindingException(f"No value for parameter {name}")
+
+                values.append(parameters[name[1:]])
+
+            return values
+
+        if len(parameters) != len(names):
+            raise BindingException(
+                f"Expected {len(names)} parameters, got {len(parameters)}"
+            )
+
+        return list(parameters)
+
+
+PROGRAM_CACHE_SIZE = 128
+WHITESPACE_OUTSIDE_QUOTES = re.compile(r"('[^']*'|\"[^\"]*\")|\s+")
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    # Times the cache was emptied because the schema changed.
+    invalidations: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        if lookups == 0:
+            return 0.0
+
+        return self.hits / lookups
+
+
+class ProgramCache:
+    """
+    LRU cache of compiled programs keyed by normalized sql text.
+
+    Programs have root page numbers, column positions etc. baked in
+    so every program is dropped when the schema cookie changes.
+    """
+
+    def __init__(self, size=PROGRAM_CACHE_SIZE):
+        self.size = size
+        self.programs: Dict[str, Program] = OrderedDict()
+        self.schema_cookie: Optional[int] = None
+        self.stats = CacheStats()
+
+    def validate(self, schema_cookie: int):
+        if schema_cookie == self.schema_cookie:
+            return
+
+        if self.programs:
+            self.stats.invalidations += 1
+            self.programs.clear()
+
+        self.schema_cookie = schema_cookie
+
+    def get(self, key: str) -> Optional[Program]:
+        program = self.programs.get(key)
+
+        if program is None:
+            self.stats.misses += 1
+            return None
+
+        self.stats.hits += 1
+        cast(OrderedDict, self.programs).move_to_end(key)
+        return program
+
+    def put(self, key: str, program: Program):
+        if self.size == 0:
+            return
+
+        self.programs[key] = program
+
+        if len(self.programs) > self.size:
+            cast(OrderedDict, self.programs).popitem(last=False)
+            self.stats.evictions += 1
+
+    def __len__(self) -> int:
+        return len(self.programs)
+
+
+def normalize_sql(sql_text: str) -> str:
+    """
+    Collapses whitespace outside of quotes so the same
+    statement laid out differently shares a cache entry.
+    """
+    sql_text = WHITESPACE_OUTSIDE_QUOTES.sub(
+        lambda match: match.group(1) or " ", sql_text
+    )
+    return sql_text.strip().rstrip(";").rstrip()
+
+
+def location_key(token: Token) -> Tuple[int, int]:
+    if token.loc is None:
+        return (0, 0)
+
+    return (token.loc.line, token.loc.col)
+
+
+# Options for CREATE TABLE ... WITH (...)
+TABLE_OPTIONS = ["fillfactor", "split", "bloom"]
+
+
+@dataclass
+class Predicate:
+    """
+    A comparison between a column and a literal. eg: price > 10
+    """
+
+    column_index: int
+    op: Symbol
+    value: Token
+    expression: BinaryExpression
+
+
+Load = Callable[[int, int], InstructionIR]
+# emit(load, skip, done) the instructions for each row of a scan, see compile_scan
+Emit = Callable[[Load, InstructionIR, InstructionIR], List[InstructionIR]]
+
+
+@dataclass
+class RowidRange:
+    """
+    Walks the table between two row_ids, the table b-tree is
+    keyed by row_id so there's no need for an index.
+    """
+
+    lower: Optional[Predicate]
+    upper: Optional[Predicate]
+
+    @property
+    def expressions(self) -> List[Expression]:
+        return [p.expression for p in (self.lower, self.upper) if p is not None]
+
+
+@dataclass
+class IndexScan:
+    """
+    Walks an index between two keys.
+
+    equal are the predicates on the leading key columns,
+    lower & upper bound the key column after them.
+
+    When the index is covering every column the query reads is
+    stored in the index so the table is never read.
+    """
+
+    index: IndexSchema
+    equal: List[Predicate]
+    lower: Optional[Predicate]
+    upper: Optional[Predicate]
+    covering: bool
+
+    @property
+    def expressions(self) -> List[Expression]:
+        """
+        The expressions which are enforced by the scan itself.
+        """
+        predicates = self.equal + [self.lower, self.upper]
+        return [p.expression for p in predicates if p is not None]
+
+
+@dataclass
+class AccessPath:
+    """
+    How compile_scan reads a table: seeking one row_id (lookup),
+    walking a range of row_ids, walking an index or, when they're
+    all None, every row.
+
+    Once the table has been analyzed cost is the estimated pages
+    read and rows the estimated rows matching every predicate.
+    """
+
+    lookup: Optional[Predicate] = None
+    rowid_range: Optional[RowidRange] = None
+    index_scan: Optional[IndexScan] = None
+    cost: Optional[float] = None
+    rows: Optional[float] = None
+
+    def describe(self, table_name: str) -> str:
+        """
+        The path as EXPLAIN QUERY PLAN shows it. eg:
+        SEARCH users USING INDEX users_age (age>?)
+        """
+        if self.lookup is not None:
+            detail = f"SEARCH {table_name} USING INTEGER PRIMARY KEY (rowid=?)"
+        elif self.rowid_range is not None:
+            bounds = [self.rowid_range.lower, self.rowid_range.upper]
+            terms = [f"rowid{p.op.value}?" for p in bounds if p is not None]
+            detail = (
+                f"SEARCH {table_name} USING INTEGER PRIMARY KEY ({' AND '.join(terms)})"
+            )
+        elif self.index_scan is not None:
+            scan = self.index_scan
+            columns = scan.index.columns
+            terms = [f"{column}=?" for column in columns[: len(scan.equal)]]
+            terms += [
+                f"{columns[len(scan.equal)]}{p.op.value}?"
+                for p in (scan.lower, scan.upper)
+                if p is not None
+            ]
+            index = f"COVERING INDEX" if scan.covering else "INDEX"
+            detail = f"SEARCH {table_name} USING {index} {scan.index.name} ({' AND '.join(terms)})"
+        else:
+            detail = f"SCAN {table_name}"
+
+        if self.cost is not None and self.rows is not None:
+            detail += f" (cost={self.cost:.1f} rows={self.rows:.0f})"
+
+        return detail
+
 
+@dataclass
+class JoinPlan:
+    """
+    How a join runs, the tables are numbered by where they are in the
+    statement. Each row of the outer table is matched with the inner
+    table's rows, by seeking its row_id when the join key is the inner
+    table's primary key (a nested loop join) or through a HashJoin.
+    """
 
-# Fancy counter
+    table_names: List[str]
+    outer: int
+    inner: int
+    # The join key's column in the outer and inner tables.
+    outer_key: int
+    inner_key: int
+    nested_loop: bool
+    left: bool
+    # Conditions on only the outer table, checked by its scan.
+    outer_where: List[Expression]
+    # Conditions on only the inner table, checked before rows are matched.
+    inner_where: List[Expression]
+    # Conditions a pair of rows has to meet to match.
+    match: List[Expression]
+    # Conditions checked after the join, including LEFT JOIN rows without a match.
+    post: List[Expression]
+    # Estimated pages read, once both tables have been analyzed.
+    cost: Optional[float] = None
+
+
+# Fancy counter, it also collects the query plan as the program is compiled.
 @dataclass
 class Memory:
     address = 0
+    plan: List[str] = field(default_factory=list)
 
     def next_addr(self):
         self.address += 1
         return self.address - 1
 
 
+OPERANDS = ["p1", "p2", "p3", "p4"]
+# Instructions which set a register to a value known at compile time.
+CONSTANT_LOADS = [Opcode.Integer, Opcode.String, Opcode.Null, Opcode.Variable]
+
+
+def register_effects(ir: InstructionIR) -> Tuple[List[int], List[int]]:
+    """
+    The registers an instruction reads and the registers it writes.
+    """
+    opcode = ir.opcode
+
+    def span(first, count) -> List[int]:
+        return list(range(cast(int, first), cast(int, first) + cast(int, count)))
+
+    if opcode in CONSTANT_LOADS or opcode in (Opcode.Key, Opcode.IdxPKey):
+        return [], [cast(int, ir.p2)]
+
+    if opcode == Opcode.SCopy:
+        return [cast(int, ir.p1)], [cast(int, ir.p2)]
+
+    if opcode in (Opcode.Eq, Opcode.Ne, Opcode.Lt, Opcode.Le, Opcode.Gt, Opcode.Ge):
+        return [cast(int, ir.p1), cast(int, ir.p3)], []
+
+    if opcode == Opcode.IfNot:
+        return [cast(int, ir.p1)], []
+
+    if opcode in (Opcode.IfPos, Opcode.DecrJumpZero):
+        return [cast(int, ir.p1)], [cast(int, ir.p1)]
+
+    if opcode in (Opcode.OpenRead, Opcode.OpenWrite, Opcode.OpenFilter):
+        return [cast(int, ir.p2)], []
+
+    if opcode == Opcode.Seek:
+        return [cast(int, ir.p3)], []
+
+    if opcode in (
+        Opcode.SeekGe,
+        Opcode.SeekGt,
+        Opcode.SeekLt,
+        Opcode.IdxGt,
+        Opcode.IdxGe,
+        Opcode.IdxLt,
+        Opcode.IdxLe,
+    ):
+        return span(ir.p3, ir.p4 or 1), []
+
+    if opcode == Opcode.Column:
+        return [], span(ir.p3, ir.p4 or 1)
+
+    if opcode == Opcode.MakeRecord:
+        return span(ir.p1, ir.p2), [cast(int, ir.p3)]
+
+    if opcode == Opcode.ResultRow:
+        return span(ir.p1, cast(int, ir.p2) - cast(int, ir.p1) + 1), []
+
+    if opcode == Opcode.Insert:
+        return [cast(int, ir.p2), cast(int, ir.p3)], [cast(int, ir.p2)]
+
+    if opcode in (Opcode.IdxInsert, Opcode.IdxDelete):
+        return [cast(int, ir.p2), cast(int, ir.p3)], []
+
+    if opcode == Opcode.RowSetAdd:
+        return [cast(int, ir.p1), cast(int, ir.p2)], [cast(int, ir.p1)]
+
+    if opcode == Opcode.RowSetRead:
+        return [cast(int, ir.p1)], [cast(int, ir.p1), cast(int, ir.p3)]
+
+    if opcode in (Opcode.CreateTable, Opcode.CreateIndex, Opcode.CreateFilter):
+        return [], [cast(int, ir.p1)]
+
+    if opcode == Opcode.ColumnVector:
+        return [], [cast(int, ir.p3)]
+
+    if opcode in (Opcode.KeyVector, Opcode.SelectAll):
+        return [], [cast(int, ir.p2)]
+
+    if opcode == Opcode.Filter:
+        return [cast(int, ir.p1), cast(int, ir.p2), cast(int, ir.p3)], [
+            cast(int, ir.p3)
+        ]
+
+    if opcode == Opcode.SelectionUnion:
+        return [cast(int, ir.p1), cast(int, ir.p2)], [cast(int, ir.p3)]
+
+    if opcode == Opcode.AggStep:
+        width = cast(int, ir.p3) + len(cast(list, ir.p4))
+        return [cast(int, ir.p1)] + span(ir.p2, width), [cast(int, ir.p1)]
+
+    if opcode == Opcode.AggFinal:
+        return [cast(int, ir.p1)], [cast(int, ir.p1)]
+
+    if opcode == Opcode.AggNext:
+        return [cast(int, ir.p1)], span(ir.p3, ir.p4)
+
+    if opcode == Opcode.SorterOpen:
+        return [cast(int, ir.p3)], [cast(int, ir.p1)]
+
+    if opcode == Opcode.SorterInsert:
+        return [cast(int, ir.p1)] + span(ir.p2, ir.p3), [cast(int, ir.p1)]
+
+    if opcode == Opcode.SorterSort:
+        return [cast(int, ir.p1)], [cast(int, ir.p1)]
+
+    if opcode == Opcode.SorterNext:
+        return [cast(int, ir.p1)], span(ir.p3, ir.p4)
+
+    if opcode == Opcode.HashOpen:
+        return [], [cast(int, ir.p1)]
+
+    if opcode == Opcode.HashBuild:
+        return [cast(int, ir.p1)] + span(ir.p2, cast(int, ir.p3) + 1), [
+            cast(int, ir.p1)
+        ]
+
+    if opcode == Opcode.HashProbe:
+        return [cast(int, ir.p1)] + span(ir.p3, cast(int, ir.p4) + 1), [
+            cast(int, ir.p1)
+        ]
+
+    if opcode == Opcode.HashNext:
+        return [cast(int, ir.p1)], [cast(int, ir.p1)] + span(ir.p3, ir.p4)
+
+    if opcode == Opcode.HashDeferred:
+        return [cast(int, ir.p1)], [cast(int, ir.p1)] + span(
+            ir.p3, cast(int, ir.p4) + 1
+        )
+
+    if opcode == Opcode.Add:
+        return [cast(int, ir.p1), cast(int, ir.p2)], [cast(int, ir.p3)]
+
+    if opcode == Opcode.Analyze:
+        return [], span(ir.p2, ANALYZE_COLUMNS)
+
+    if opcode == Opcode.Profile:
+        return [], [cast(int, ir.p1)]
+
+    if opcode == Opcode.ResultBatch:
+        return (
+            span(ir.p1, cast(int, ir.p2) - cast(int, ir.p1) + 1) + [cast(int, ir.p3)],
+            [],
+        )
+
+    return [], []
+
+
+def references(ir: InstructionIR) -> List[InstructionIR]:
+    """
+    The instructions ir jumps to.
+    """
+    return [
+        value
+        for value in (getattr(ir, a) for a in OPERANDS)
+        if isinstance(value, InstructionIR)
+    ]
+
+
+def labels(irs: List[InstructionIR]) -> Set[int]:
+    """
+    ids of the instructions something jumps to.
+    """
+    return {id(target) for ir in irs for target in references(ir)}
+
+
+def remove(irs: List[InstructionIR], removed: Set[int]) -> List[InstructionIR]:
+    """
+    Drops the instructions with ids in removed, anything jumping to one
+    jumps to the next instruction kept instead. Removed instructions
+    at the very end are kept as there's nothing after them to jump to.
+    """
+    kept = []
+    pending = []
+    targets = {}
+
+    for ir in irs:
+        if id(ir) in removed:
+            pending.append(ir)
+            continue
+
+        for dropped in pending:
+            targets[id(dropped)] = ir
+
+        pending = []
+        kept.append(ir)
+
+    kept.extend(pending)
+
+    for ir in kept:
+        for a in OPERANDS:
+            value = getattr(ir, a)
+            if isinstance(value, InstructionIR) and id(value) in targets:
+                setattr(ir, a, targets[id(value)])
+
+    return kept
+
+
+def remove_redundant(irs: List[InstructionIR]) -> List[InstructionIR]:
+    """
+    Noops are only there to be jumped to. An SCopy is redundant
+    if it copies a register onto itself or nothing reads the copy.
+    """
+    read = {r for ir in irs for r in register_effects(ir)[0]}
+
+    return remove(
+        irs,
+        {
+            id(ir)
+            for ir in irs
+            if ir.opcode == Opcode.Noop
+            or (ir.opcode == Opcode.SCopy and (ir.p1 == ir.p2 or ir.p2 not in read))
+        },
+    )
+
+
+def hoist_constants(irs: List[InstructionIR]) -> List[InstructionIR]:
+    """
+    Moves constant loads out of loops to the start of the program,
+    so eg the literals of a WHERE clause are loaded once rather than per row.
+
+    Only loads into registers nothing else writes are moved,
+    then it doesn't matter when they run as long as it's first.
+    """
+    positions = {id(ir): i for i, ir in enumerate(irs)}
+    # A jump backwards closes a loop.
+    loops = [
+        (positions[id(target)], i)
+        for i, ir in enumerate(irs)
+        for target in references(ir)
+        if positions[id(target)] <= i
+    ]
+    writers = Counter(r for ir in irs for r in register_effects(ir)[1])
+    targets = labels(irs)
+
+    hoisted = [
+        ir
+        for i, ir in enumerate(irs)
+        if ir.opcode in CONSTANT_LOADS
+        and writers[cast(int, ir.p2)] == 1
+        and id(ir) not in targets
+        and any(start <= i <= end for start, end in loops)
+    ]
+    moved = {id(ir) for ir in hoisted}
+
+    return hoisted + [ir for ir in irs if id(ir) not in moved]
+
+
+def fold_constants(irs: List[InstructionIR]) -> List[InstructionIR]:
+    """
+    Drops loads of a constant into a register which already holds it,
+    eg a value repeated down a column of a multi-row insert.
+    Registers are only tracked between jump targets.
+    """
+    targets = labels(irs)
+    known: Dict[int, Tuple[Opcode, Any, Any]] = {}
+    removed = set()
+
+    for ir in irs:
+        if id(ir) in targets:
+            # Could have come from anywhere.
+            known = {}
+
+        constant = None
+        if ir.opcode in (Opcode.Integer, Opcode.String, Opcode.Null):
+            constant = (ir.opcode, ir.p1, ir.p4)
+
+            if known.get(cast(int, ir.p2)) == constant:
+                removed.add(id(ir))
+                continue
+
+        for r in register_effects(ir)[1]:
+            known.pop(r, None)
+
+        if constant is not None:
+            known[cast(int, ir.p2)] = constant
+
+    return remove(irs, removed)
+
+
+def merge_columns(irs: List[InstructionIR]) -> List[InstructionIR]:
+    """
+    Reads of neighbouring columns into neighbouring registers become
+    one Column with a count in p4 so the row is only fetched once.
+    """
+    targets = labels(irs)
+    merged: List[InstructionIR] = []
+
+    for ir in irs:
+        previous = merged[-1] if merged else None
+
+        if (
+            previous is not None
+            and ir.opcode == previous.opcode == Opcode.Column
+            and id(ir) not in targets
+            and not ir.p4
+            and ir.p1 == previous.p1
+        ):
+            count = cast(int, previous.p4 or 1)
+
+            if (
+                ir.p2 == cast(int, previous.p2) + count
+                and ir.p3 == cast(int, previous.p3) + count
+            ):
+                previous.p4 = count + 1
+                continue
+
+        merged.append(ir)
+
+    return merged
+
+
+def optimize(irs: List[InstructionIR]) -> List[InstructionIR]:
+    """
+    Peephole passes over a program before its jumps are resolved.
+    """
+    irs = remove_redundant(irs)
+    irs = hoist_constants(irs)
+    irs = fold_constants(irs)
+    return merge_columns(irs)
+
+
+def conjuncts(expression: Optional[Expression]) -> List[Expression]:
+    """
+    Flattens a chain of ANDs into a list of the expressions being and'd
+    """
+    if expression is None:
+        return []
+
+    if isinstance(expression, BinaryExpression) and expression.op.type == Keyword._and:
+        return conjuncts(expression.left) + conjuncts(expression.right)
+
+    return [expression]
+
+
+def referenced_columns(expression: Optional[Expression]) -> List[str]:
+    """
+    The names of every column used in an expression.
+    """
+    if expression is None:
+        return []
+
+    if isinstance(expression, BinaryExpression):
+        return referenced_columns(expression.left) + referenced_columns(
+            expression.right
+        )
+
+    if isinstance(expression, UnaryExpression):
+        return referenced_columns(expression.operand)
+
+    if expression.kind == Kind.identifier:
+        return [str(expression.value)]
+
+    return []
+
+
+def conjunction(expressions: List[Expression]) -> Optional[Expression]:
+    """
+    The opposite of conjuncts, ANDs the expressions back together.
+    """
+    if not expressions:
+        return None
+
+    expression = expressions[0]
+    for right in expressions[1:]:
+        expression = BinaryExpression(Token(type=Keyword._and), expression, right)
+
+    return expression
+
+
+def describe_operand(value: Any) -> Any:
+    """
+    An operand as EXPLAIN shows it, anything but a number or text is shown as text.
+    """
+    if value is None or isinstance(value, (int, str)):
+        return value
+
+    if isinstance(value, Token):
+        # A parameter, eg: :name or ?
+        return "?" if value.value is None else str(value.value)
+
+    return str(value)
+
+
+def record_index(column_index: int, pk_index: int) -> int:
+    """
+    The primary key is an alias for the row_id so it isn't stored
+    in the record a second time. Records are [row_id, *other_columns]
+    """
+    if column_index < pk_index:
+        return column_index + 1
+
+    return column_index
+
+
 class Compiler:
     """
     Given a Statement the compiler will produce a Program for the VM to execute.
     """
 
-    def __init__(self, pager: Pager):
+    def __init__(self, pager: Pager, cache_size=PROGRAM_CACHE_SIZE, optimize=True):
         self.pager = pager
+        # Run the peephole passes over each program, see optimize.
+        self.optimize = optimize
+        self.cache = ProgramCache(cache_size)
+        self.catalog: Optional[Catalog] = None
         # These are needed to parse schema_table.sql_text
         # values to interpret column names and types
         self.init_schema_table()
@@ -197,7 +1096,10 @@ class Compiler:
 
     def get_schema(self) -> List[List[Any]]:
         # Gets the current schema table values
-        cursor = BTree(self.pager, 0)
+        return self.get_rows(0)
+
+    def get_rows(self, root_page_number: int) -> List[List[Any]]:
+        cursor = BTree(self.pager, root_page_number)
         rows = [[r[1] for r in record.values] for record in cursor]
 
         return rows
@@ -214,7 +1116,9 @@ class Compiler:
         names = []
         if isinstance(statement, SelectStatement):
             for col in statement.items:
-                if col.value != "*":
+                if isinstance(col, FunctionExpression):
+                    names.append(str(col))
+                elif col.value != "*":
                     names.append(col.value)
 
         if isinstance(statement, CreateStatement):
@@ -229,279 +1133,2827 @@ class Compiler:
 
         return names
 
-    def get_table_create_stmt(self, table_name):
-        if table_name == SCHEMA_TABLE_NAME:
-            return SCHEMA_TABLE_SQL_TEXT
+    def get_result_columns(self, statement) -> List[str]:
+        """
+        Names of the columns of the rows the statement returns,
+        * is expanded to every column of the tables read.
+        """
+        if isinstance(statement, ExplainStatement):
+            if statement.analyze:
+                return list(PROFILE_COLUMNS)
+            if statement.query_plan:
+                return list(QUERY_PLAN_COLUMNS)
+            return list(EXPLAIN_COLUMNS)
+
+        if not isinstance(statement, SelectStatement):
+            return []
+
+        table_names = [str(statement._from.value)]
+        table_names += [str(join.table.value) for join in statement.joins]
+        names = []
+
+        for item in statement.items:
+            if isinstance(item, FunctionExpression):
+                names.append(str(item))
+            elif item.value == "*":
+                for table_name in table_names:
+                    names.extend(self.get_table_column_names(table_name))
+            else:
+                names.append(str(item.value))
+
+        return names
 
-        for values in self.get_schema():
-            if values[2] == table_name:
-                sql_text = values[5]
-                return sql_text
+    def get_catalog(self) -> Catalog:
+        """
+        The parsed schema, reloaded only when the schema cookie changes.
+        """
+        schema_cookie = self.pager.schema_cookie()
+
+        if self.catalog is None or self.catalog.schema_cookie != schema_cookie:
+            self.catalog = Catalog(self.get_schema(), schema_cookie)
+
+            # ANALYZE bumps the cookie so its stats are picked up here.
+            if STATS_TABLE_NAME in self.catalog.tables:
+                stats_table = self.catalog.table(STATS_TABLE_NAME)
+                for row in self.get_rows(stats_table.root_page_number):
+                    stats = Stats.from_row(row)
+                    self.catalog.stats[stats.name] = stats
 
-        raise TableFoundException(f"Table: {table_name} not found")
+        return self.catalog
+
+    def get_table_create_stmt(self, table_name):
+        return self.get_catalog().table(table_name).sql_text
 
     def get_table_column_names(self, table_name):
-        sql_text = self.get_table_create_stmt(table_name)
-        return self.get_column_names_from_sql_text(sql_text)
+        return self.get_catalog().table(table_name).columns
 
     def get_primary_key_index(self, table_name):
-        sql_text = self.get_table_create_stmt(table_name)
-        [statement] = self.prepare(sql_text)
-        for i, column in enumerate(statement.columns):
-            if column.is_primary_key:
-                return i
+        return self.get_catalog().table(table_name).pk_index
 
-        # Default to 0 if no primary key is set.
-        return 0
+    def get_column_index(self, table_name: str, column_name: str) -> int:
+        return self.get_catalog().table(table_name).column_index(column_name)
 
     def get_column_indexes(self, statement: SelectStatement):
         column_index = []
-        column_names = self.get_table_column_names(statement._from.value)
+        table = self.get_catalog().table(str(statement._from.value))
 
         for column_name in statement.items:
+            if isinstance(column_name, FunctionExpression):
+                raise ParsingException(f"{column_name} can't be used here")
+
             if column_name.value == "*":
                 # TODO need to handle this better.
-                column_index = list(range(0, len(column_names)))
+                column_index = list(range(0, len(table.columns)))
                 break
 
-            column_index.append(column_names.index(column_name.value))
+            column_index.append(table.column_index(str(column_name.value)))
 
         return column_index
 
     def get_table_root_page_number(self, table_name: str) -> int:
-        # We don't need the schema here.
-        if table_name == SCHEMA_TABLE_NAME:
-            return 0
+        return self.get_catalog().table(table_name).root_page_number
 
-        for record in self.get_schema():
-            if record[2] == table_name:
-                root_page_number = record[4]
-                return root_page_number
+    @staticmethod
+    def table_options(statement: CreateStatement) -> Dict[str, Union[str, int]]:
+        options = {}
+        for name, token in statement.options.items():
+            if name not in TABLE_OPTIONS:
+                raise ParsingException(f"Unknown table option: {name}")
 
-        raise TableFoundException(f"Table: {table_name} not found")
+            if token.type == DataType.integer:
+                options[name] = int(token.value)
+            else:
+                options[name] = str(token.value)
 
-    def compile(self, sql_text) -> Program:
-        # Initally we assume only one statement.
-        [statement] = self.prepare(sql_text)
-        program = Program([], [])
-        memory = Memory()
+        if options.get("bloom", 0) not in (0, 1):
+            raise ParsingException("bloom must be 0 or 1")
 
-        if isinstance(statement, SelectStatement):
-            table_page_number = self.get_table_root_page_number(
-                str(statement._from.value)
-            )
-
-            column_count = 4
-            table_cursor = 0
-            instructions = []
+        return options
 
-            instructions.append(
-                InstructionIR(
-                    Opcode.Integer, p1=table_page_number, p2=memory.next_addr()
-                )
-            )
-            instructions.append(
-                InstructionIR(Opcode.OpenRead, p1=table_cursor, p2=0, p3=column_count)
-            )
+    def split_policy(self, statement: CreateStatement) -> SplitPolicy:
+        options = self.table_options(statement)
+        options.pop("bloom", None)
 
-            close = InstructionIR(Opcode.Close, p1=0)
-            instructions.append(InstructionIR(Opcode.Rewind, p1=0, p2=close))
+        try:
+            return SplitPolicy.from_options(options)
+        except ValueError as e:
+            raise ParsingException(str(e))
 
-            key_addr = memory.next_addr()
-            instructions.append(InstructionIR(Opcode.Key, p1=0, p2=key_addr))
+    def get_bloom_page_number(self, name: str) -> Optional[int]:
+        """
+        The page holding the bloom filter for the table or index called name.
+        """
+        return self.get_catalog().blooms.get(name)
 
-            columns = []
-            column_indexes = self.get_column_indexes(statement)
-            for i in column_indexes:
-                if i > 0:
-                    columns.append(
-                        InstructionIR(Opcode.Column, p1=0, p2=i, p3=memory.next_addr())
-                    )
+    def open_filter(
+        self, name: str, cursor: int, memory: Memory
+    ) -> List[InstructionIR]:
+        """
+        Attaches the bloom filter of table or index name to cursor, if it has one.
+        """
+        bloom_page_number = self.get_bloom_page_number(name)
+        if bloom_page_number is None:
+            return []
+
+        addr = memory.next_addr()
+        return [
+            InstructionIR(Opcode.Integer, p1=bloom_page_number, p2=addr),
+            InstructionIR(Opcode.OpenFilter, p1=cursor, p2=addr),
+        ]
+
+    def get_rowid_lookup(
+        self, table_name: str, predicates: List[Expression]
+    ) -> Optional[Predicate]:
+        """
+        Returns a predicate comparing the primary key for equality.
+        There can only be one row so it's looked up rather than scanned for.
+        """
+        pk_index = self.get_primary_key_index(table_name)
+
+        for expression in predicates:
+            predicate = self.get_predicate(table_name, expression)
+            if (
+                predicate is not None
+                and predicate.column_index == pk_index
+                and predicate.op == Symbol.equal
+                and (
+                    predicate.value.type == DataType.integer
+                    or isinstance(predicate.value.type, Parameter)
+                )
+            ):
+                return predicate
 
-            first_column_addr = key_addr if 0 in column_indexes else columns[0].p3
-            instructions.extend(columns)
-            instructions.append(
-                InstructionIR(
-                    Opcode.ResultRow, p1=first_column_addr, p2=len(columns) + 1
+        return None
+
+    def get_rowid_range(
+        self, table_name: str, predicates: List[Expression]
+    ) -> Optional[RowidRange]:
+        """
+        Returns the bounds on the primary key, the scan can
+        start at the lower one and stop once it's past the upper.
+        """
+        pk_index = self.get_primary_key_index(table_name)
+        lower = None
+        upper = None
+
+        for expression in predicates:
+            predicate = self.get_predicate(table_name, expression)
+            if predicate is None or predicate.column_index != pk_index:
+                continue
+
+            if predicate.value.type != DataType.integer and not isinstance(
+                predicate.value.type, Parameter
+            ):
+                continue
+
+            if predicate.op in (Symbol.gt, Symbol.gteq) and lower is None:
+                lower = predicate
+
+            if predicate.op in (Symbol.lt, Symbol.lteq) and upper is None:
+                upper = predicate
+
+        if lower is None and upper is None:
+            return None
+
+        return RowidRange(lower, upper)
+
+    def get_table_split_policy(self, table_name: str) -> Optional[SplitPolicy]:
+        """
+        Returns the split policy set with CREATE TABLE ... WITH (...)
+        or None if the table uses the default.
+        """
+        statement = self.get_catalog().table(table_name).statement
+
+        if not statement.options:
+            return None
+
+        return self.split_policy(statement)
+
+    def get_table_utilization(self, table_name: str) -> Utilization:
+        """
+        Reports how full the pages of a table are.
+        """
+        root_page_number = self.get_table_root_page_number(table_name)
+        return BTree(self.pager, root_page_number).utilization()
+
+    def get_table_indexes(self, table_name: str) -> List[IndexSchema]:
+        return self.get_catalog().table(table_name).indexes
+
+    def compile(self, sql_text) -> Program:
+        self.cache.validate(self.pager.schema_cookie())
+        key = normalize_sql(sql_text)
+        program = self.cache.get(key)
+
+        if program is not None:
+            return program
+
+        # Initally we assume only one statement.
+        [statement] = self.prepare(sql_text)
+        program = self.compile_statement(statement, sql_text)
+
+        # Schema changes are cheap to compile and change
+        # the cookie anyway so there's no point keeping them.
+        if isinstance(statement, ExplainStatement):
+            statement = statement.statement
+
+        if not isinstance(
+            statement, (CreateStatement, CreateIndexStatement, AnalyzeStatement)
+        ):
+            self.cache.put(key, program)
+
+        return program
+
+    def compile_batch(self, sql_text: str) -> Program:
+        """
+        Compiles a SELECT to run a leaf page at a time,
+        executing it yields lists of rows rather than rows.
+        """
+        self.cache.validate(self.pager.schema_cookie())
+        key = "batch:" + normalize_sql(sql_text)
+        program = self.cache.get(key)
+
+        if program is not None:
+            return program
+
+        [statement] = self.prepare(sql_text)
+        if not isinstance(statement, SelectStatement):
+            raise ParsingException("Only SELECT statements can run in batches")
+
+        program = self.compile_statement(statement, sql_text, batch=True)
+        self.cache.put(key, program)
+        return program
+
+    @property
+    def cache_stats(self) -> CacheStats:
+        return self.cache.stats
+
+    def prepare_statement(self, sql_text: str) -> PreparedStatement:
+        return PreparedStatement(sql_text, self.compile(sql_text))
+
+    def compile_stream(self, stream: TextIO) -> Iterator[Program]:
+        """
+        Compiles a script one statement at a time as it's read.
+        Each program should be executed before asking for the next
+        as it's compiled against the schema at that point.
+        """
+        for tokens in split_statements(lex_stream(stream)):
+            for statement in parse_statements(tokens):
+                yield self.compile_statement(statement, to_sql(tokens))
+
+    def compile_statement(self, statement, sql_text: str, batch=False) -> Program:
+        program = Program([], [], schema_cookie=self.pager.schema_cookie())
+        memory = Memory()
+
+        if isinstance(statement, SelectStatement):
+            if batch:
+                program.irs = self.compile_select_batch(statement, memory)
+            else:
+                program.irs = self.compile_select(statement, memory)
+
+        if isinstance(statement, InsertStatement):
+            program.irs = self.compile_insert(statement, memory)
+
+        if isinstance(statement, UpdateStatement):
+            program.irs = self.compile_update(statement, memory)
+
+        if isinstance(statement, CreateStatement):
+            program.irs = self.compile_create(statement, sql_text, memory)
+
+        if isinstance(statement, CreateIndexStatement):
+            program.irs = self.compile_create_index(statement, sql_text, memory)
+
+        if isinstance(statement, AnalyzeStatement):
+            program.irs = self.compile_analyze(statement, memory)
+
+        explained = None
+        if isinstance(statement, ExplainStatement):
+            explained = self.compile_statement(
+                statement.statement, to_sql(statement.tokens)
+            )
+            program.irs = self.compile_explain(statement, explained, memory)
+
+        if self.optimize:
+            program.irs = optimize(program.irs)
+
+        program.register_count = memory.address
+        program.plan = memory.plan
+        program.columns = self.get_result_columns(statement)
+
+        program.compile()
+
+        if isinstance(statement, ExplainStatement) and statement.analyze:
+            # The explained program is run with the parameters.
+            program.parameters = cast(Program, explained).parameters
+
+        return program
+
+    @staticmethod
+    def load_literal(token: Token, addr: int) -> InstructionIR:
+        if isinstance(token.type, Parameter):
+            # Numbered once the program is complete, see Program.number_parameters
+            return InstructionIR(Opcode.Variable, p2=addr, p4=token)
+
+        if token.type == DataType.integer:
+            return InstructionIR(Opcode.Integer, p1=int(token.value), p2=addr)
+
+        if token.type == DataType.text:
+            return InstructionIR(
+                Opcode.String, p1=len(str(token.value)), p2=addr, p4=token.value
+            )
+
+        return InstructionIR(Opcode.Null, p2=addr)
+
+    @staticmethod
+    def load_column(
+        cursor: int, column_index: int, pk_index: int, addr: int
+    ) -> InstructionIR:
+        if column_index == pk_index:
+            return InstructionIR(Opcode.Key, p1=cursor, p2=addr)
+
+        return InstructionIR(
+            Opcode.Column,
+            p1=cursor,
+            p2=record_index(column_index, pk_index),
+            p3=addr,
+        )
+
+    def get_predicate(self, table_name: str, expression) -> Optional[Predicate]:
+        """
+        Returns a Predicate if the expression compares a column with a literal.
+        """
+        if not isinstance(expression, BinaryExpression):
+            return None
+
+        if expression.op.type not in INVERSE_COMPARISON:
+            return None
+
+        left, right, op = expression.left, expression.right, expression.op.type
+        op = cast(Symbol, op)
+
+        if isinstance(left, Token) and left.kind == Kind.datatype:
+            left, right, op = right, left, FLIPPED_COMPARISON[op]
+
+        if not isinstance(left, Token) or left.kind != Kind.identifier:
+            return None
+
+        if not isinstance(right, Token) or right.kind != Kind.datatype:
+            return None
+
+        column_index = self.get_column_index(table_name, left.value)
+        return Predicate(column_index, op, right, expression)
+
+    def index_scans(
+        self, table_name: str, predicates: List[Expression], needed: List[str]
+    ) -> List[IndexScan]:
+        """
+        How each index could narrow the scan, by the leading key columns
+        compared by equality followed by a range on the next key column.
+        """
+        pk_index = self.get_primary_key_index(table_name)
+        column_names = self.get_table_column_names(table_name)
+        parsed = [self.get_predicate(table_name, p) for p in predicates]
+        candidates = [p for p in parsed if p is not None]
+        scans = []
+
+        for index in self.get_table_indexes(table_name):
+            equal = []
+            lower = None
+            upper = None
+
+            for column_name in index.columns:
+                column_index = self.get_column_index(table_name, column_name)
+                on_column = [p for p in candidates if p.column_index == column_index]
+                equals = [p for p in on_column if p.op == Symbol.equal]
+
+                if equals:
+                    equal.append(equals[0])
+                    continue
+
+                for predicate in on_column:
+                    if predicate.op in (Symbol.gt, Symbol.gteq) and lower is None:
+                        lower = predicate
+
+                    if predicate.op in (Symbol.lt, Symbol.lteq) and upper is None:
+                        upper = predicate
+
+                break
+
+            if not equal and lower is None and upper is None:
+                continue
+
+            stored = index.columns + index.include + [column_names[pk_index]]
+            covering = all(column_name in stored for column_name in needed)
+            scans.append(IndexScan(index, equal, lower, upper, covering))
+
+        return scans
+
+    def choose_index(
+        self, table_name: str, predicates: List[Expression], needed: List[str]
+    ) -> Optional[IndexScan]:
+        """
+        Looks for the index which can narrow the scan the most.
+        That's the index with the most leading key columns compared by equality,
+        followed by a range on the next key column.
+        Ties go to indexes which store every column in needed.
+        """
+        best = None
+        best_score = None
+
+        for scan in self.index_scans(table_name, predicates, needed):
+            ranged = scan.lower is not None or scan.upper is not None
+            score = (len(scan.equal), ranged, scan.covering)
+
+            if best_score is None or score > best_score:
+                best = scan
+                best_score = score
+
+        return best
+
+    def get_stats(self, name: str) -> Optional[Stats]:
+        """
+        The stats ANALYZE stored for a table or index, if it's been run.
+        """
+        return self.get_catalog().stats.get(name)
+
+    @staticmethod
+    def literal_value(token: Token) -> Any:
+        if token.type == DataType.integer:
+            try:
+                return int(str(token.value))
+            except ValueError:
+                return float(str(token.value))
+
+        return token.value
+
+    def selectivity(self, table_name: str, expressions: List[Expression]) -> float:
+        """
+        The estimated fraction of the table's rows matching every expression,
+        they're taken to be independent of each other.
+        """
+        stats = self.get_stats(table_name)
+        fraction = 1.0
+
+        for expression in expressions:
+            predicate = self.get_predicate(table_name, expression)
+
+            if predicate is None:
+                fraction *= RANGE_SELECTIVITY
+            elif stats is None or isinstance(predicate.value.type, Parameter):
+                if predicate.op == Symbol.equal:
+                    fraction *= EQUAL_SELECTIVITY
+                else:
+                    fraction *= RANGE_SELECTIVITY
+            else:
+                column = stats.columns[predicate.column_index]
+                fraction *= column.selectivity(
+                    predicate.op, self.literal_value(predicate.value), stats.row_count
+                )
+
+        return fraction
+
+    def choose_access_path(
+        self, table_name: str, predicates: List[Expression], needed: List[str]
+    ) -> AccessPath:
+        """
+        Picks how compile_scan reads the table.
+
+        Without stats a row_id lookup comes first, then an index with
+        equality on its key, a row_id range and then any other index.
+        Once the table has been analyzed each is costed in pages read
+        and the cheapest wins, which can mean reading every row.
+        """
+        stats = self.get_stats(table_name)
+        lookup = self.get_rowid_lookup(table_name, predicates)
+
+        if lookup is not None:
+            # There's one row at most, nothing beats going straight to it.
+            path = AccessPath(lookup=lookup)
+
+            if stats is not None:
+                path.cost = seek_cost(stats.page_count)
+                path.rows = min(
+                    1.0, stats.row_count * self.selectivity(table_name, predicates)
                 )
+
+            return path
+
+        rowid_range = self.get_rowid_range(table_name, predicates)
+
+        if stats is None:
+            scan = self.choose_index(table_name, predicates, needed)
+
+            if rowid_range is not None and scan is not None and scan.equal:
+                # Equality on an index narrows it more than the range.
+                rowid_range = None
+
+            if rowid_range is not None:
+                scan = None
+
+            return AccessPath(rowid_range=rowid_range, index_scan=scan)
+
+        candidates = [AccessPath(cost=stats.page_count)]
+
+        if rowid_range is not None:
+            fraction = self.selectivity(table_name, rowid_range.expressions)
+            cost = seek_cost(stats.page_count) + stats.page_count * fraction
+            candidates.append(AccessPath(rowid_range=rowid_range, cost=cost))
+
+        for scan in self.index_scans(table_name, predicates, needed):
+            index_stats = self.get_stats(scan.index.name)
+            index_pages = stats.page_count
+            if index_stats is not None:
+                index_pages = index_stats.page_count
+
+            fraction = self.selectivity(table_name, scan.expressions)
+            cost = seek_cost(index_pages) + index_pages * fraction
+
+            if not scan.covering:
+                # Each entry seeks its row in the table.
+                cost += stats.row_count * fraction * seek_cost(stats.page_count)
+
+            candidates.append(AccessPath(index_scan=scan, cost=cost))
+
+        # Ties go to the earlier candidate, a plain scan first.
+        path = min(candidates, key=lambda candidate: cast(float, candidate.cost))
+        path.rows = stats.row_count * self.selectivity(table_name, predicates)
+
+        return path
+
+    def compile_condition(
+        self,
+        expression: Expression,
+        table_name: str,
+        load: Optional[Load],
+        jump: InstructionIR,
+        memory: Memory,
+        when: bool = False,
+        jump_if_null: bool = True,
+        registers: Optional[Callable[[str], int]] = None,
+    ) -> List[InstructionIR]:
+        """
+        Compiles an expression to instructions which jump to `jump`
+        when it's `when` and fall through otherwise. A NULL comparison is
+        neither true nor false, it jumps only if jump_if_null is set.
+        load(column_index, addr) reads a column into a register,
+        unless registers(column_name) gives the register it's already in.
+
+        By default it jumps when the expression is false or NULL,
+        which is what a WHERE clause needs to skip a row.
+        """
+
+        def compile(expression, when, jump, jump_if_null):
+            return self.compile_condition(
+                expression,
+                table_name,
+                load,
+                jump,
+                memory,
+                when,
+                jump_if_null,
+                registers,
             )
-            instructions.append(InstructionIR(Opcode.Next, p1=0, p2=3))
-            instructions.extend([close, InstructionIR(Opcode.Halt, p1=0, p2=0)])
 
-            program.irs = instructions
+        if isinstance(expression, UnaryExpression):
+            # NOT, jump on the opposite.
+            return compile(expression.operand, not when, jump, jump_if_null)
 
-        if isinstance(statement, InsertStatement):
-            table_cursor = 0
-            table_page_number = self.get_table_root_page_number(
-                str(statement.into.value)
+        if not isinstance(expression, BinaryExpression):
+            raise Exception(f"Unsupported expression {expression}")
+
+        op = expression.op.type
+
+        if op in (Keyword._and, Keyword._or):
+            if (op == Keyword._and) != when:
+                # False AND or a true OR, either side decides it.
+                return compile(expression.left, when, jump, jump_if_null) + compile(
+                    expression.right, when, jump, jump_if_null
+                )
+
+            # Both sides are needed so when the left side decides
+            # the other way skip past the right.
+            decided = InstructionIR(Opcode.Noop)
+            return (
+                compile(expression.left, not when, decided, not jump_if_null)
+                + compile(expression.right, when, jump, jump_if_null)
+                + [decided]
             )
-            table_page_number_addr = memory.next_addr()
-            instructions = []
 
+        instructions = []
+        addrs = []
+
+        for operand in (expression.left, expression.right):
+            if not isinstance(operand, Token):
+                raise Exception(f"Unsupported expression {operand}")
+
+            if operand.kind == Kind.identifier and registers is not None:
+                addrs.append(registers(str(operand.value)))
+                continue
+
+            addr = memory.next_addr()
+            addrs.append(addr)
+
+            if operand.kind == Kind.identifier:
+                column_index = self.get_column_index(table_name, operand.value)
+                instructions.append(cast(Load, load)(column_index, addr))
+            else:
+                instructions.append(self.load_literal(operand, addr))
+
+        comparisons = COMPARISON if when else INVERSE_COMPARISON
+        instructions.append(
+            InstructionIR(
+                comparisons[cast(Symbol, op)],
+                p1=addrs[0],
+                p2=jump,
+                p3=addrs[1],
+                p5=JUMP_IF_NULL if jump_if_null else 0,
+            )
+        )
+
+        return instructions
+
+    def load_key(
+        self, predicates: List[Predicate], memory: Memory
+    ) -> Tuple[List[InstructionIR], int]:
+        """
+        Loads the values of the predicates into contiguous registers
+        returns the instructions and the first register, or -1 if
+        there aren't any predicates.
+        """
+        addrs = [memory.next_addr() for _ in predicates]
+        instructions = [
+            self.load_literal(predicate.value, addr)
+            for predicate, addr in zip(predicates, addrs)
+        ]
+
+        return instructions, addrs[0] if addrs else -1
+
+    def compile_select(
+        self, statement: SelectStatement, memory: Memory
+    ) -> List[InstructionIR]:
+        if statement.joins:
+            return self.compile_join(statement, memory)
+
+        if statement.aggregates or statement.group_by:
+            return self.compile_aggregate(statement, memory)
+
+        if statement.order_by:
+            return self.compile_select_sorted(statement, memory)
+
+        table_name = str(statement._from.value)
+        column_names = self.get_table_column_names(table_name)
+
+        table_page_number_addr = memory.next_addr()
+        column_indexes = self.get_column_indexes(statement)
+        result_addrs = [memory.next_addr() for _ in column_indexes]
+
+        halt = InstructionIR(Opcode.Halt, p1=0, p2=0)
+        instructions, limit_addr, offset_addr = self.compile_limit(
+            statement, halt, memory
+        )
+
+        def emit(
+            load: Load, skip: InstructionIR, done: InstructionIR
+        ) -> List[InstructionIR]:
+            body = []
+
+            if offset_addr is not None:
+                # Count down the rows to skip before loading anything.
+                body.append(InstructionIR(Opcode.IfPos, p1=offset_addr, p2=skip, p3=1))
+
+            body.extend(load(i, addr) for i, addr in zip(column_indexes, result_addrs))
+            body.append(
+                InstructionIR(Opcode.ResultRow, p1=result_addrs[0], p2=result_addrs[-1])
+            )
+
+            if limit_addr is not None:
+                # Stop the scan as soon as there are enough rows.
+                body.append(InstructionIR(Opcode.DecrJumpZero, p1=limit_addr, p2=done))
+
+            return body
+
+        instructions.extend(
+            self.compile_scan(
+                table_name,
+                statement.where,
+                [column_names[i] for i in column_indexes],
+                table_page_number_addr,
+                emit,
+                memory,
+            )
+        )
+        instructions.append(halt)
+
+        return instructions
+
+    def resolve_column(
+        self, table_names: List[str], column_name: str
+    ) -> Tuple[int, int]:
+        """
+        Which of the tables a column is in and its index there,
+        it can be qualified with the table name eg: orders.id
+        """
+        qualifier, _, name = column_name.rpartition(".")
+        found = []
+
+        for position, table_name in enumerate(table_names):
+            if qualifier and qualifier != table_name:
+                continue
+
+            table = self.get_catalog().table(table_name)
+            if name in table.positions:
+                found.append((position, table.positions[name]))
+
+        if not found:
+            raise ColumnNotFoundException(
+                f"Column: {column_name} not found in {', '.join(table_names)}"
+            )
+
+        if len(found) > 1:
+            raise ParsingException(f"Column: {column_name} is ambiguous")
+
+        return found[0]
+
+    def get_join_keys(
+        self, table_names: List[str], expressions: List[Expression]
+    ) -> List[Tuple[Expression, List[int]]]:
+        """
+        The expressions which compare a column of each table with =,
+        and the two columns' indexes in table order.
+        """
+        keys = []
+
+        for expression in expressions:
+            if not isinstance(expression, BinaryExpression):
+                continue
+
+            operands = [expression.left, expression.right]
+            if expression.op.type != Symbol.equal or not all(
+                isinstance(o, Token) and o.kind == Kind.identifier for o in operands
+            ):
+                continue
+
+            columns = sorted(
+                self.resolve_column(table_names, str(cast(Token, o).value))
+                for o in operands
+            )
+            if [table for table, _ in columns] == [0, 1]:
+                keys.append((expression, [column for _, column in columns]))
+
+        return keys
+
+    def plan_join(self, statement: SelectStatement) -> JoinPlan:
+        if len(statement.joins) > 1:
+            raise ParsingException("Only one JOIN is supported")
+
+        if statement.aggregates or statement.group_by or statement.order_by:
+            raise ParsingException(
+                "GROUP BY, ORDER BY and aggregates aren't supported with JOIN"
+            )
+
+        [join] = statement.joins
+        table_names = [str(statement._from.value), str(join.table.value)]
+        if table_names[0] == table_names[1]:
+            raise ParsingException(f"Can't join {table_names[0]} to itself")
+
+        def tables(expression: Expression) -> Set[int]:
+            return {
+                self.resolve_column(table_names, column_name)[0]
+                for column_name in referenced_columns(expression)
+            }
+
+        on = conjuncts(join.on)
+        where = conjuncts(statement.where)
+        # An inner join's key can be in either clause.
+        keys = self.get_join_keys(table_names, on if join.left else on + where)
+        if not keys:
+            raise ParsingException("JOIN needs a column of each table compared with =")
+
+        cost = None
+
+        if all(self.get_stats(name) is not None for name in table_names):
+            if join.left:
+                filters = [
+                    [e for e in where if tables(e) == {0}],
+                    [e for e in on if tables(e) == {1}],
+                ]
+            else:
+                filters = [[e for e in on + where if tables(e) == {t}] for t in (0, 1)]
+
+            cost, outer, inner, (expression, columns), nested_loop = self.choose_join(
+                table_names, keys, filters, join.left
+            )
+        else:
+            pk_indexes = [self.get_primary_key_index(name) for name in table_names]
+            outer, inner = 0, 1
+            key = next((k for k in keys if k[1][1] == pk_indexes[1]), None)
+
+            if key is None and not join.left:
+                # Seek the FROM table's rows instead, the order
+                # doesn't matter to an inner join.
+                key = next((k for k in keys if k[1][0] == pk_indexes[0]), None)
+                if key is not None:
+                    outer, inner = 1, 0
+
+            nested_loop = key is not None
+            expression, columns = key or keys[0]
+
+        on = [e for e in on if e is not expression]
+        where = [e for e in where if e is not expression]
+
+        if join.left:
+            # WHERE still applies to rows without a match
+            # so only ON can narrow the inner table.
+            outer_where = [e for e in where if tables(e) <= {outer}]
+            inner_where = [e for e in on if tables(e) == {inner}]
+            match = [e for e in on if tables(e) != {inner}]
+            post = [e for e in where if not tables(e) <= {outer}]
+        else:
+            outer_where = [e for e in on + where if tables(e) <= {outer}]
+            inner_where = [e for e in on + where if tables(e) == {inner}]
+            match = [e for e in on + where if len(tables(e)) == 2]
+            post = []
+
+        return JoinPlan(
+            table_names,
+            outer,
+            inner,
+            columns[outer],
+            columns[inner],
+            nested_loop,
+            join.left,
+            outer_where,
+            inner_where,
+            match,
+            post,
+            cost,
+        )
+
+    def choose_join(
+        self,
+        table_names: List[str],
+        keys: List[Tuple[Expression, List[int]]],
+        filters: List[List[Expression]],
+        left: bool,
+    ) -> Tuple[float, int, int, Tuple[Expression, List[int]], bool]:
+        """
+        Costs the ways the join can run from the ANALYZE stats, filters are
+        the conditions on only one of the tables.
+
+        A nested loop reads the outer table then seeks the inner one for
+        each of its rows. A hash join reads both once and builds the inner
+        side, the smaller one is built when the costs are the same.
+        LEFT JOIN keeps the FROM table outer.
+        Returns (cost, outer, inner, key, nested_loop) of the cheapest.
+        """
+        paths = [
+            self.choose_access_path(name, filters[t], self.get_table_column_names(name))
+            for t, name in enumerate(table_names)
+        ]
+        pages = [cast(Stats, self.get_stats(name)).page_count for name in table_names]
+        costs = [cast(float, path.cost) for path in paths]
+        rows = [cast(float, path.rows) for path in paths]
+        orders = [(0, 1)] if left else [(0, 1), (1, 0)]
+        candidates = []
+
+        for outer, inner in orders:
+            pk_index = self.get_primary_key_index(table_names[inner])
+
+            for key in keys:
+                if key[1][inner] == pk_index:
+                    cost = costs[outer] + rows[outer] * seek_cost(pages[inner])
+                    candidates.append((cost, 0.0, outer, inner, key, True))
+
+            cost = costs[outer] + costs[inner]
+            if rows[inner] > JOIN_BUFFER:
+                # Partitions are written out and read back.
+                cost += 2 * (pages[outer] + pages[inner])
+
+            candidates.append((cost, rows[inner], outer, inner, keys[0], False))
+
+        cost, _, outer, inner, key, nested_loop = min(
+            candidates, key=lambda candidate: candidate[:2]
+        )
+
+        return cost, outer, inner, key, nested_loop
+
+    def compile_join(
+        self, statement: SelectStatement, memory: Memory
+    ) -> List[InstructionIR]:
+        """
+        Scans the outer table (cursors 0 and 1) and for each row finds the
+        inner table's rows with the same key, see JoinPlan.
+
+        A nested loop join seeks the key in the inner table through cursor 2
+        so joining n rows to m costs n log m. Otherwise the inner table is
+        scanned once (cursors 2 and 3) into a HashJoin, each outer row probes
+        it and HashDeferred runs the rows it held back after the scan.
+        LEFT JOIN rows without a match get NULLs for the inner table.
+        """
+        plan = self.plan_join(statement)
+        table_names = plan.table_names
+        outer_name = table_names[plan.outer]
+        inner_name = table_names[plan.inner]
+
+        detail = "NESTED LOOP" if plan.nested_loop else "HASH"
+        detail += " LEFT JOIN" if plan.left else " JOIN"
+        if plan.cost is not None:
+            detail += f" (cost={plan.cost:.1f})"
+        memory.plan.append(detail)
+
+        items: List[Tuple[int, int]] = []
+        for item in statement.items:
+            if isinstance(item, FunctionExpression):
+                raise ParsingException(f"{item} can't be used here")
+
+            if item.value == "*":
+                items.extend(
+                    (table, column_index)
+                    for table, table_name in enumerate(table_names)
+                    for column_index in range(
+                        len(self.get_table_column_names(table_name))
+                    )
+                )
+                continue
+
+            items.append(self.resolve_column(table_names, str(item.value)))
+
+        # Columns which are read once the rows are matched,
+        # a nested loop join checks inner_where then too.
+        used = list(items)
+        checked = plan.match + plan.post
+        if plan.nested_loop:
+            checked = plan.inner_where + checked
+
+        for expression in checked:
+            used.extend(
+                self.resolve_column(table_names, column_name)
+                for column_name in referenced_columns(expression)
+            )
+
+        outer_columns = sorted({c for table, c in used if table == plan.outer})
+        inner_columns = sorted({c for table, c in used if table == plan.inner})
+
+        # The key then the outer columns, HashProbe and HashDeferred
+        # need them next to each other.
+        key_addr = memory.next_addr()
+        outer_addrs = [memory.next_addr() for _ in outer_columns]
+        inner_addrs = [memory.next_addr() for _ in inner_columns]
+        result_addrs = [memory.next_addr() for _ in items]
+        addrs = {
+            **{(plan.outer, c): a for c, a in zip(outer_columns, outer_addrs)},
+            **{(plan.inner, c): a for c, a in zip(inner_columns, inner_addrs)},
+        }
+
+        halt = InstructionIR(Opcode.Halt, p1=0, p2=0)
+        instructions, limit_addr, offset_addr = self.compile_limit(
+            statement, halt, memory
+        )
+
+        def registers(column_name: str) -> int:
+            return addrs[self.resolve_column(table_names, column_name)]
+
+        def check(
+            expressions: List[Expression], jump: InstructionIR
+        ) -> List[InstructionIR]:
+            body = []
+            for expression in expressions:
+                body.extend(
+                    self.compile_condition(
+                        expression,
+                        outer_name,
+                        None,
+                        jump,
+                        memory,
+                        registers=registers,
+                    )
+                )
+
+            return body
+
+        def result(skip: InstructionIR, done: InstructionIR) -> List[InstructionIR]:
+            body = []
+
+            if offset_addr is not None:
+                body.append(InstructionIR(Opcode.IfPos, p1=offset_addr, p2=skip, p3=1))
+
+            body.extend(
+                InstructionIR(Opcode.SCopy, p1=addrs[item], p2=addr)
+                for item, addr in zip(items, result_addrs)
+            )
+            body.append(
+                InstructionIR(Opcode.ResultRow, p1=result_addrs[0], p2=result_addrs[-1])
+            )
+
+            if limit_addr is not None:
+                body.append(InstructionIR(Opcode.DecrJumpZero, p1=limit_addr, p2=done))
+
+            return body
+
+        def unmatched(skip: InstructionIR, done: InstructionIR) -> List[InstructionIR]:
+            # The LEFT JOIN row for an outer row without a match.
+            body = [InstructionIR(Opcode.Null, p2=addr) for addr in inner_addrs]
+            body.extend(check(plan.post, skip))
+            body.extend(result(skip, done))
+            return body
+
+        def load_outer(load: Load) -> List[InstructionIR]:
+            body = [load(plan.outer_key, key_addr)]
+            body.extend(load(c, addr) for c, addr in zip(outer_columns, outer_addrs))
+            return body
+
+        outer_column_names = self.get_table_column_names(outer_name)
+        outer_needed = [outer_column_names[c] for c in outer_columns + [plan.outer_key]]
+        inner_page_number_addr = memory.next_addr()
+        inner_pk_index = self.get_primary_key_index(inner_name)
+        inner_cursor = 2
+
+        if plan.nested_loop:
             instructions.append(
                 InstructionIR(
                     Opcode.Integer,
-                    p1=table_page_number,
-                    p2=table_page_number_addr,
-                    p3=0,
+                    p1=self.get_table_root_page_number(inner_name),
+                    p2=inner_page_number_addr,
                 )
             )
-            # TODO: get number of columns from schema stmt - replace 3.
             instructions.append(
                 InstructionIR(
-                    Opcode.OpenWrite, p1=table_cursor, p2=table_page_number_addr, p3=3
+                    Opcode.OpenRead, p1=inner_cursor, p2=inner_page_number_addr, p3=4
                 )
             )
 
-            pk_addr = None
-            first_column_addr = None
-            pk_index = self.get_primary_key_index(statement.into.value)
+            def seek(
+                load: Load, skip: InstructionIR, done: InstructionIR
+            ) -> List[InstructionIR]:
+                body = load_outer(load)
+                miss = InstructionIR(Opcode.Noop) if plan.left else skip
+                body.append(
+                    InstructionIR(Opcode.Seek, p1=inner_cursor, p2=miss, p3=key_addr)
+                )
+                body.extend(
+                    self.load_column(inner_cursor, c, inner_pk_index, addr)
+                    for c, addr in zip(inner_columns, inner_addrs)
+                )
+                body.extend(check(plan.inner_where + plan.match, miss))
+                body.extend(check(plan.post, skip))
+                body.extend(result(skip, done))
+
+                if plan.left:
+                    body.append(InstructionIR(Opcode.Goto, p2=skip))
+                    body.append(miss)
+                    body.extend(unmatched(skip, done))
+
+                return body
+
+            instructions.extend(
+                self.compile_scan(
+                    outer_name,
+                    conjunction(plan.outer_where),
+                    outer_needed,
+                    memory.next_addr(),
+                    seek,
+                    memory,
+                )
+            )
+            memory.plan.append(
+                f"SEARCH {inner_name} USING INTEGER PRIMARY KEY (rowid=?)"
+            )
+            instructions.append(InstructionIR(Opcode.Close, p1=inner_cursor))
+            instructions.append(halt)
+            return instructions
+
+        join_addr = memory.next_addr()
+        matched_addr = memory.next_addr()
+        build_key_addr = memory.next_addr()
+        build_addrs = [memory.next_addr() for _ in inner_columns]
+        inner_column_names = self.get_table_column_names(inner_name)
+        instructions.append(InstructionIR(Opcode.HashOpen, p1=join_addr))
+
+        def build(
+            load: Load, skip: InstructionIR, done: InstructionIR
+        ) -> List[InstructionIR]:
+            body = [load(plan.inner_key, build_key_addr)]
+            body.extend(load(c, addr) for c, addr in zip(inner_columns, build_addrs))
+            body.append(
+                InstructionIR(
+                    Opcode.HashBuild,
+                    p1=join_addr,
+                    p2=build_key_addr,
+                    p3=len(build_addrs),
+                )
+            )
+            return body
+
+        instructions.extend(
+            self.compile_scan(
+                inner_name,
+                conjunction(plan.inner_where),
+                [inner_column_names[c] for c in inner_columns + [plan.inner_key]],
+                inner_page_number_addr,
+                build,
+                memory,
+                cursors=(inner_cursor, inner_cursor + 1),
+            )
+        )
+        inner_key = inner_column_names[plan.inner_key]
+        memory.plan.append(f"BUILD HASH TABLE ON {inner_name}.{inner_key}")
+
+        def matches(
+            next_row: InstructionIR, done: InstructionIR
+        ) -> List[InstructionIR]:
+            # Each of the outer row's matches then, for a LEFT
+            # JOIN, the row with NULLs if none of them were.
+            after = InstructionIR(Opcode.Noop)
+            hash_next = InstructionIR(
+                Opcode.HashNext,
+                p1=join_addr,
+                p2=after,
+                p3=inner_addrs[0] if inner_addrs else 0,
+                p4=len(inner_addrs),
+            )
+            body = []
 
-            for i, token in enumerate(statement.values):
-                addr = memory.next_addr()
-                if i == 0:
-                    first_column_addr = addr
+            if plan.left:
+                body.append(InstructionIR(Opcode.Integer, p1=0, p2=matched_addr))
 
-                if i == pk_index:
-                    pk_addr = addr
+            body.append(hash_next)
+            body.extend(check(plan.match, hash_next))
 
-                if token.type == DataType.integer:
-                    instructions.append(
-                        InstructionIR(Opcode.Integer, p1=int(token.value), p2=addr)
-                    )
+            if plan.left:
+                body.append(InstructionIR(Opcode.Integer, p1=1, p2=matched_addr))
 
-                if token.type == DataType.text:
-                    instructions.append(
-                        InstructionIR(
-                            Opcode.String,
-                            p1=len(str(token.value)),
-                            p2=addr,
-                            p4=token.value,
-                        )
-                    )
+            body.extend(check(plan.post, hash_next))
+            body.extend(result(hash_next, done))
+            body.append(InstructionIR(Opcode.Goto, p2=hash_next))
+            body.append(after)
 
-                # TODO: handle NULL.
-            record_addr = memory.next_addr()
-            assert first_column_addr
-            instructions.append(
+            if plan.left:
+                body.append(
+                    InstructionIR(Opcode.IfPos, p1=matched_addr, p2=next_row, p3=0)
+                )
+                body.extend(unmatched(next_row, done))
+
+            return body
+
+        def probe(
+            load: Load, skip: InstructionIR, done: InstructionIR
+        ) -> List[InstructionIR]:
+            body = load_outer(load)
+            body.append(
                 InstructionIR(
-                    Opcode.MakeRecord,
-                    p1=first_column_addr,
-                    p2=len(statement.values),
-                    p3=record_addr,
+                    Opcode.HashProbe,
+                    p1=join_addr,
+                    p2=skip,
+                    p3=key_addr,
+                    p4=len(outer_addrs),
                 )
             )
+            # Once there are enough rows there's no need to
+            # run the deferred ones either.
+            body.extend(matches(skip, halt))
+            return body
+
+        instructions.extend(
+            self.compile_scan(
+                outer_name,
+                conjunction(plan.outer_where),
+                outer_needed,
+                memory.next_addr(),
+                probe,
+                memory,
+            )
+        )
+        outer_key = self.get_table_column_names(outer_name)[plan.outer_key]
+        memory.plan.append(f"PROBE HASH TABLE WITH {outer_name}.{outer_key}")
+
+        deferred = InstructionIR(
+            Opcode.HashDeferred,
+            p1=join_addr,
+            p2=halt,
+            p3=key_addr,
+            p4=len(outer_addrs),
+        )
+        instructions.append(deferred)
+        instructions.extend(matches(deferred, halt))
+        instructions.append(InstructionIR(Opcode.Goto, p2=deferred))
+        instructions.append(halt)
+
+        return instructions
+
+    def compile_aggregate(
+        self, statement: SelectStatement, memory: Memory
+    ) -> List[InstructionIR]:
+        """
+        Scans the table stepping a HashAggregate with the GROUP BY columns
+        and the aggregates' arguments of each row, then loops over the
+        finished groups to return them. LIMIT and OFFSET count groups.
+        """
+        table_name = str(statement._from.value)
+        group_names = [str(column.value) for column in statement.group_by]
+        group_indexes = [self.get_column_index(table_name, n) for n in group_names]
+        aggregates = [
+            Aggregate(str(f.name.value), star=f.argument.type == Symbol.asterisk)
+            for f in statement.aggregates
+        ]
+        # Where each item is in the finished rows [*group by, *aggregates]
+        positions = []
+
+        for item in statement.items:
+            if isinstance(item, FunctionExpression):
+                positions.append(len(group_names) + statement.aggregates.index(item))
+            elif item.value in group_names:
+                positions.append(group_names.index(item.value))
+            else:
+                raise ParsingException(
+                    f"{item.value} must be in the GROUP BY clause or an aggregate"
+                )
 
-            # TODO: How is this figured? This means we need to load the btree cursor?
-            assert pk_addr
-            instructions.append(
+        table_page_number_addr = memory.next_addr()
+        aggregate_addr = memory.next_addr()
+        step_addrs = [memory.next_addr() for _ in group_indexes + aggregates]
+        row_addrs = [memory.next_addr() for _ in step_addrs]
+        result_addrs = [memory.next_addr() for _ in positions]
+
+        halt = InstructionIR(Opcode.Halt, p1=0, p2=0)
+        instructions, limit_addr, offset_addr = self.compile_limit(
+            statement, halt, memory
+        )
+
+        def emit(
+            load: Load, skip: InstructionIR, done: InstructionIR
+        ) -> List[InstructionIR]:
+            body = [load(i, addr) for i, addr in zip(group_indexes, step_addrs)]
+
+            for function, addr in zip(
+                statement.aggregates, step_addrs[len(group_indexes) :]
+            ):
+                if function.argument.type != Symbol.asterisk:
+                    column_index = self.get_column_index(
+                        table_name, str(function.argument.value)
+                    )
+                    body.append(load(column_index, addr))
+
+            body.append(
                 InstructionIR(
-                    Opcode.Insert, p1=table_cursor, p2=record_addr, p3=pk_addr
+                    Opcode.AggStep,
+                    p1=aggregate_addr,
+                    p2=step_addrs[0],
+                    p3=len(group_indexes),
+                    p4=aggregates,
+                )
+            )
+            return body
+
+        needed = group_names + [
+            str(f.argument.value)
+            for f in statement.aggregates
+            if f.argument.type != Symbol.asterisk
+        ]
+        instructions.extend(
+            self.compile_scan(
+                table_name,
+                statement.where,
+                needed,
+                table_page_number_addr,
+                emit,
+                memory,
+            )
+        )
+        if statement.group_by:
+            memory.plan.append("USE HASH AGGREGATE FOR GROUP BY")
+
+        instructions.append(
+            InstructionIR(
+                Opcode.AggFinal,
+                p1=aggregate_addr,
+                p3=len(group_indexes),
+                p4=aggregates,
+            )
+        )
+        copies = [
+            InstructionIR(Opcode.SCopy, p1=row_addrs[position], p2=addr)
+            for position, addr in zip(positions, result_addrs)
+        ]
+
+        if not statement.order_by:
+            next_group = InstructionIR(
+                Opcode.AggNext,
+                p1=aggregate_addr,
+                p2=halt,
+                p3=row_addrs[0],
+                p4=len(row_addrs),
+            )
+            instructions.extend(
+                self.compile_results(
+                    next_group, result_addrs, limit_addr, offset_addr, halt, copies
                 )
             )
+            instructions.append(halt)
+            return instructions
+
+        # Where each ORDER BY term is in the finished rows.
+        key_positions = []
+        aggregate_names = [str(f) for f in statement.aggregates]
+        for term in statement.order_by:
+            if str(term) in aggregate_names:
+                key_positions.append(
+                    len(group_names) + aggregate_names.index(str(term))
+                )
+            elif str(term) in group_names:
+                key_positions.append(group_names.index(str(term)))
+            else:
+                raise ParsingException(
+                    f"Can't order by {term}, it isn't grouped or selected"
+                )
+
+        # Feed the finished groups through a sorter.
+        sorter_addr = memory.next_addr()
+        key_addrs = [memory.next_addr() for _ in key_positions]
+        sorted_addrs = [memory.next_addr() for _ in result_addrs]
+        instructions.extend(
+            self.compile_sorter_open(
+                statement, sorter_addr, limit_addr, offset_addr, memory
+            )
+        )
+
+        sort = InstructionIR(Opcode.SorterSort, p1=sorter_addr)
+        next_group = InstructionIR(
+            Opcode.AggNext,
+            p1=aggregate_addr,
+            p2=sort,
+            p3=row_addrs[0],
+            p4=len(row_addrs),
+        )
+        instructions.append(next_group)
+        instructions.extend(
+            InstructionIR(Opcode.SCopy, p1=row_addrs[position], p2=addr)
+            for position, addr in zip(
+                key_positions + positions, key_addrs + sorted_addrs
+            )
+        )
+        instructions.append(
+            InstructionIR(
+                Opcode.SorterInsert,
+                p1=sorter_addr,
+                p2=key_addrs[0],
+                p3=len(key_addrs + sorted_addrs),
+            )
+        )
+        instructions.append(InstructionIR(Opcode.Goto, p2=next_group))
+        instructions.append(sort)
+        instructions.extend(
+            self.compile_sorted_results(
+                sorter_addr, sorted_addrs, limit_addr, offset_addr, halt
+            )
+        )
+        instructions.append(halt)
+
+        return instructions
+
+    def compile_select_sorted(
+        self, statement: SelectStatement, memory: Memory
+    ) -> List[InstructionIR]:
+        """
+        Scans the table into a Sorter keyed by the ORDER BY columns
+        then returns the rows it sorted.
+        """
+        table_name = str(statement._from.value)
+        column_names = self.get_table_column_names(table_name)
+        column_indexes = self.get_column_indexes(statement)
+        key_indexes = []
+
+        for term in statement.order_by:
+            if not isinstance(term.expression, Token):
+                raise ParsingException(f"Can't order by {term} without aggregating")
+
+            key_indexes.append(
+                self.get_column_index(table_name, str(term.expression.value))
+            )
 
+        table_page_number_addr = memory.next_addr()
+        sorter_addr = memory.next_addr()
+        # The sorter's rows are [*keys, *result columns]
+        key_addrs = [memory.next_addr() for _ in key_indexes]
+        result_addrs = [memory.next_addr() for _ in column_indexes]
+
+        halt = InstructionIR(Opcode.Halt, p1=0, p2=0)
+        instructions, limit_addr, offset_addr = self.compile_limit(
+            statement, halt, memory
+        )
+        instructions.extend(
+            self.compile_sorter_open(
+                statement, sorter_addr, limit_addr, offset_addr, memory
+            )
+        )
+
+        def emit(
+            load: Load, skip: InstructionIR, done: InstructionIR
+        ) -> List[InstructionIR]:
+            return [
+                *(load(i, addr) for i, addr in zip(key_indexes, key_addrs)),
+                *(load(i, addr) for i, addr in zip(column_indexes, result_addrs)),
+                InstructionIR(
+                    Opcode.SorterInsert,
+                    p1=sorter_addr,
+                    p2=key_addrs[0],
+                    p3=len(key_addrs + result_addrs),
+                ),
+            ]
+
+        instructions.extend(
+            self.compile_scan(
+                table_name,
+                statement.where,
+                [column_names[i] for i in key_indexes + column_indexes],
+                table_page_number_addr,
+                emit,
+                memory,
+            )
+        )
+        instructions.append(InstructionIR(Opcode.SorterSort, p1=sorter_addr))
+        instructions.extend(
+            self.compile_sorted_results(
+                sorter_addr, result_addrs, limit_addr, offset_addr, halt
+            )
+        )
+        instructions.append(halt)
+
+        return instructions
+
+    def compile_sorter_open(
+        self,
+        statement: SelectStatement,
+        sorter_addr: int,
+        limit_addr: Optional[int],
+        offset_addr: Optional[int],
+        memory: Memory,
+    ) -> List[InstructionIR]:
+        """
+        Opens a Sorter for the ORDER BY terms in sorter_addr. With a LIMIT
+        it's told how many rows are wanted (including the OFFSET ones)
+        so it can keep just those rather than sorting everything.
+        """
+        wanted_addr = memory.next_addr()
+        sorter = "SORTER" if limit_addr is None else "TOP-N SORTER"
+        memory.plan.append(f"USE {sorter} FOR ORDER BY")
+
+        if limit_addr is None:
+            instructions = [InstructionIR(Opcode.Null, p2=wanted_addr)]
+        elif offset_addr is None:
+            instructions = [InstructionIR(Opcode.SCopy, p1=limit_addr, p2=wanted_addr)]
+        else:
+            instructions = [
+                InstructionIR(Opcode.Add, p1=limit_addr, p2=offset_addr, p3=wanted_addr)
+            ]
+
+        instructions.append(
+            InstructionIR(
+                Opcode.SorterOpen,
+                p1=sorter_addr,
+                p3=wanted_addr,
+                p4=[term.descending for term in statement.order_by],
+            )
+        )
+        return instructions
+
+    def compile_sorted_results(
+        self,
+        sorter_addr: int,
+        result_addrs: List[int],
+        limit_addr: Optional[int],
+        offset_addr: Optional[int],
+        halt: InstructionIR,
+    ) -> List[InstructionIR]:
+        next_row = InstructionIR(
+            Opcode.SorterNext,
+            p1=sorter_addr,
+            p2=halt,
+            p3=result_addrs[0],
+            p4=len(result_addrs),
+        )
+        return self.compile_results(
+            next_row, result_addrs, limit_addr, offset_addr, halt
+        )
+
+    @staticmethod
+    def compile_results(
+        next_row: InstructionIR,
+        result_addrs: List[int],
+        limit_addr: Optional[int],
+        offset_addr: Optional[int],
+        halt: InstructionIR,
+        copies: Optional[List[InstructionIR]] = None,
+    ) -> List[InstructionIR]:
+        """
+        A loop returning rows, next_row loads the next one (or jumps to halt)
+        then copies move its values into result_addrs.
+        """
+        instructions = [next_row]
+
+        if offset_addr is not None:
             instructions.append(
-                InstructionIR(Opcode.Close, p1=table_cursor),
+                InstructionIR(Opcode.IfPos, p1=offset_addr, p2=next_row, p3=1)
             )
-            program.irs = instructions
 
-        if isinstance(statement, CreateStatement):
+        instructions.extend(copies or [])
+        instructions.append(
+            InstructionIR(Opcode.ResultRow, p1=result_addrs[0], p2=result_addrs[-1])
+        )
+
+        if limit_addr is not None:
+            instructions.append(
+                InstructionIR(Opcode.DecrJumpZero, p1=limit_addr, p2=halt)
+            )
+
+        instructions.append(InstructionIR(Opcode.Goto, p2=next_row))
+        return instructions
+
+    def compile_select_batch(
+        self, statement: SelectStatement, memory: Memory
+    ) -> List[InstructionIR]:
+        """
+        A full scan which reads each leaf page into column vectors,
+        the WHERE clause narrows a selection vector of row positions
+        and ResultBatch yields the selected rows of the page together.
+        """
+        if statement.limit is not None or statement.order_by or statement.joins:
+            raise ParsingException(
+                "LIMIT, ORDER BY and JOIN aren't supported in batch mode"
+            )
+
+        table_name = str(statement._from.value)
+        table_page_number = self.get_table_root_page_number(table_name)
+        pk_index = self.get_primary_key_index(table_name)
+        column_indexes = self.get_column_indexes(statement)
+
+        table_cursor = 0
+        table_page_number_addr = memory.next_addr()
+        selection_addr = memory.next_addr()
+        result_addrs = [memory.next_addr() for _ in column_indexes]
+        loads = list(zip(column_indexes, result_addrs))
+        # The register with each column's vector, for the WHERE clause.
+        vectors = dict(loads)
+
+        for column_name in referenced_columns(statement.where):
+            column_index = self.get_column_index(table_name, column_name)
+            if column_index not in vectors:
+                vectors[column_index] = memory.next_addr()
+                loads.append((column_index, vectors[column_index]))
+
+        close = InstructionIR(Opcode.Close, p1=table_cursor)
+        loop = InstructionIR(Opcode.SelectAll, p1=table_cursor, p2=selection_addr)
+        instructions = [
+            InstructionIR(
+                Opcode.Integer, p1=table_page_number, p2=table_page_number_addr
+            ),
+            InstructionIR(Opcode.OpenRead, p1=table_cursor, p2=table_page_number_addr),
+            InstructionIR(Opcode.RewindPage, p1=table_cursor, p2=close),
+            loop,
+        ]
+
+        for column_index, addr in loads:
+            if column_index == pk_index:
+                instructions.append(
+                    InstructionIR(Opcode.KeyVector, p1=table_cursor, p2=addr)
+                )
+            else:
+                instructions.append(
+                    InstructionIR(
+                        Opcode.ColumnVector,
+                        p1=table_cursor,
+                        p2=record_index(column_index, pk_index),
+                        p3=addr,
+                    )
+                )
+
+        if statement.where is not None:
+            instructions.extend(
+                self.compile_filter(
+                    statement.where, table_name, vectors, selection_addr, memory
+                )
+            )
+
+        instructions.append(
+            InstructionIR(
+                Opcode.ResultBatch,
+                p1=result_addrs[0],
+                p2=result_addrs[-1],
+                p3=selection_addr,
+            )
+        )
+        instructions.append(InstructionIR(Opcode.NextPage, p1=table_cursor, p2=loop))
+        instructions.append(close)
+        instructions.append(InstructionIR(Opcode.Halt, p1=0, p2=0))
+
+        return instructions
+
+    def compile_filter(
+        self,
+        expression: Expression,
+        table_name: str,
+        vectors: Dict[int, int],
+        selection_addr: int,
+        memory: Memory,
+        when: bool = True,
+    ) -> List[InstructionIR]:
+        """
+        The batch version of compile_condition, narrows the selection
+        in selection_addr to the rows where the expression is `when`.
+        vectors are the registers holding each column's vector.
+        A NULL comparison is neither true nor false so it's never selected.
+        """
+
+        def compile(expression, selection_addr, when):
+            return self.compile_filter(
+                expression, table_name, vectors, selection_addr, memory, when
+            )
+
+        if isinstance(expression, UnaryExpression):
+            return compile(expression.operand, selection_addr, not when)
+
+        if not isinstance(expression, BinaryExpression):
+            raise Exception(f"Unsupported expression {expression}")
+
+        op = expression.op.type
+
+        if op in (Keyword._and, Keyword._or):
+            if (op == Keyword._and) == when:
+                # Both sides have to hold, narrow by one then the other.
+                return compile(expression.left, selection_addr, when) + compile(
+                    expression.right, selection_addr, when
+                )
+
+            # Either side will do, narrow copies and merge them.
             instructions = []
-            schema_root_page_num = 0
-            schema_root_page_num_addr = memory.next_addr()
-            # Layout the registers
-            schema_type_addr = memory.next_addr()
-            schema_type = "table"
-            item_name_addr = memory.next_addr()
-            item_name = str(statement.table.value)
-            associated_table_name_addr = memory.next_addr()
-            associated_table_name = str(statement.table.value)
-            root_page_num_addr = memory.next_addr()
-            text = sql_text
-            text_addr = memory.next_addr()
-
-            column_count = 5
-
-            schema_cursor = 0
+            sides = []
+
+            for side in (expression.left, expression.right):
+                side_addr = memory.next_addr()
+                sides.append(side_addr)
+                instructions.append(
+                    InstructionIR(Opcode.SCopy, p1=selection_addr, p2=side_addr)
+                )
+                instructions.extend(compile(side, side_addr, when))
 
             instructions.append(
                 InstructionIR(
-                    Opcode.Integer,
-                    p1=schema_root_page_num,
-                    p2=schema_root_page_num_addr,
+                    Opcode.SelectionUnion, p1=sides[0], p2=sides[1], p3=selection_addr
                 )
             )
+            return instructions
+
+        instructions = []
+        addrs = []
+
+        for operand in (expression.left, expression.right):
+            if not isinstance(operand, Token):
+                raise Exception(f"Unsupported expression {operand}")
+
+            if operand.kind == Kind.identifier:
+                column_index = self.get_column_index(table_name, operand.value)
+                addrs.append(vectors[column_index])
+            else:
+                addr = memory.next_addr()
+                addrs.append(addr)
+                instructions.append(self.load_literal(operand, addr))
+
+        comparisons = COMPARISON if when else INVERSE_COMPARISON
+        instructions.append(
+            InstructionIR(
+                Opcode.Filter,
+                p1=addrs[0],
+                p2=addrs[1],
+                p3=selection_addr,
+                p4=comparisons[cast(Symbol, op)],
+            )
+        )
+
+        return instructions
+
+    def compile_limit(
+        self, statement: SelectStatement, halt: InstructionIR, memory: Memory
+    ) -> Tuple[List[InstructionIR], Optional[int], Optional[int]]:
+        """
+        Loads the LIMIT and OFFSET counters, returns the instructions
+        and their registers. The scan counts them down with IfPos and DecrJumpZero.
+        """
+        instructions = []
+        limit_addr = None
+        offset_addr = None
+
+        if statement.limit is not None:
+            limit_addr = memory.next_addr()
+            instructions.append(self.load_literal(statement.limit, limit_addr))
+            # LIMIT 0, don't open anything.
+            instructions.append(InstructionIR(Opcode.IfNot, p1=limit_addr, p2=halt))
+
+            if statement.offset is not None:
+                offset_addr = memory.next_addr()
+                instructions.append(self.load_literal(statement.offset, offset_addr))
+
+        return instructions, limit_addr, offset_addr
+
+    def compile_scan(
+        self,
+        table_name: str,
+        where: Optional[Expression],
+        needed: List[str],
+        table_page_number_addr: int,
+        emit: Emit,
+        memory: Memory,
+        cursors: Tuple[int, int] = (0, 1),
+    ) -> List[InstructionIR]:
+        """
+        Compiles a loop over the rows of the table which match where,
+        through an index if there is a useful one. The cursors, one for
+        the table and one for the index, are closed after.
+
+        emit(load, skip, done) returns the instructions to run for each row,
+        load(column_index, addr) reads a column of the row into a register,
+        jumping to skip moves on to the next row and to done ends the scan.
+        needed are the columns emit reads, if an index stores them
+        all the table isn't read at all.
+        """
+        table_page_number = self.get_table_root_page_number(table_name)
+        pk_index = self.get_primary_key_index(table_name)
+        column_names = self.get_table_column_names(table_name)
+
+        column_count = 4
+        table_cursor, index_cursor = cursors
+        instructions = []
+
+        predicates = conjuncts(where)
+        needed = needed + [
+            column_names[self.get_column_index(table_name, column_name)]
+            for column_name in referenced_columns(where)
+        ]
+        path = self.choose_access_path(table_name, predicates, needed)
+        lookup, rowid_range, scan = path.lookup, path.rowid_range, path.index_scan
+        memory.plan.append(path.describe(table_name))
+
+        def load(column_index: int, addr: int) -> InstructionIR:
+            if scan is None or not scan.covering:
+                return self.load_column(table_cursor, column_index, pk_index, addr)
+
+            # Index only, read everything from the index entry.
+            if column_index == pk_index:
+                return InstructionIR(Opcode.IdxPKey, p1=index_cursor, p2=addr)
+
+            # A covering index stores every column the query reads.
+            position = scan.index.position(column_names[column_index])
+            assert position is not None
+            return InstructionIR(Opcode.Column, p1=index_cursor, p2=position, p3=addr)
+
+        if scan is None or not scan.covering:
             instructions.append(
                 InstructionIR(
-                    Opcode.OpenWrite,
-                    p1=schema_cursor,
-                    p2=schema_root_page_num_addr,
+                    Opcode.Integer, p1=table_page_number, p2=table_page_number_addr
+                )
+            )
+            instructions.append(
+                InstructionIR(
+                    Opcode.OpenRead,
+                    p1=table_cursor,
+                    p2=table_page_number_addr,
                     p3=column_count,
                 )
             )
+            instructions.extend(self.open_filter(table_name, table_cursor, memory))
+
+        body = []
+        close = InstructionIR(Opcode.Close, p1=table_cursor)
+        loop_cursor = table_cursor
+
+        if lookup is not None:
+            # Go straight to the row, there's no loop.
+            load_row_id, row_id_addr = self.load_key([lookup], memory)
+            instructions.extend(load_row_id)
             instructions.append(
-                InstructionIR(Opcode.CreateTable, p1=root_page_num_addr)
+                InstructionIR(Opcode.Seek, p1=table_cursor, p2=close, p3=row_id_addr)
             )
+            predicates = [p for p in predicates if p is not lookup.expression]
+        elif rowid_range is not None:
+            # Seek to the first row_id in range and stop once past the last.
+            if rowid_range.lower is None:
+                instructions.append(
+                    InstructionIR(Opcode.Rewind, p1=table_cursor, p2=close)
+                )
+            else:
+                load_lower, lower_addr = self.load_key([rowid_range.lower], memory)
+                instructions.extend(load_lower)
+                seek = Opcode.SeekGe
+                if rowid_range.lower.op == Symbol.gt:
+                    seek = Opcode.SeekGt
+
+                instructions.append(
+                    InstructionIR(seek, p1=table_cursor, p2=close, p3=lower_addr)
+                )
+
+            if rowid_range.upper is not None:
+                load_upper, upper_addr = self.load_key([rowid_range.upper], memory)
+                instructions.extend(load_upper)
+                row_id_addr = memory.next_addr()
+                stop = Opcode.Gt
+                if rowid_range.upper.op == Symbol.lt:
+                    stop = Opcode.Ge
+
+                body.append(InstructionIR(Opcode.Key, p1=table_cursor, p2=row_id_addr))
+                body.append(
+                    InstructionIR(
+                        stop,
+                        p1=row_id_addr,
+                        p2=close,
+                        p3=upper_addr,
+                        p5=JUMP_IF_NULL,
+                    )
+                )
+
+            predicates = [p for p in predicates if p not in rowid_range.expressions]
+        elif scan is None:
+            instructions.append(InstructionIR(Opcode.Rewind, p1=table_cursor, p2=close))
+        else:
+            # Walk the index between the bounds and look up
+            # each row it points to in the table.
+            index = scan.index
+            loop_cursor = index_cursor
+            index_page_number_addr = memory.next_addr()
             instructions.append(
                 InstructionIR(
-                    Opcode.String,
-                    p1=len(schema_type),
-                    p2=schema_type_addr,
-                    p4=schema_type,
+                    Opcode.Integer,
+                    p1=index.root_page_number,
+                    p2=index_page_number_addr,
                 )
             )
             instructions.append(
                 InstructionIR(
-                    Opcode.String, p1=len(item_name), p2=item_name_addr, p4=item_name
+                    Opcode.OpenRead,
+                    p1=index_cursor,
+                    p2=index_page_number_addr,
+                    p3=len(index.columns) + len(index.include) + 1,
                 )
             )
-            instructions.append(
-                InstructionIR(
-                    Opcode.String,
-                    p1=len(associated_table_name),
-                    p2=associated_table_name_addr,
-                    p4=associated_table_name,
+            instructions.extend(self.open_filter(index.name, index_cursor, memory))
+
+            close = InstructionIR(Opcode.Close, p1=index_cursor)
+            lower = scan.equal + ([scan.lower] if scan.lower else [])
+            upper = scan.equal + ([scan.upper] if scan.upper else [])
+
+            if scan.lower is None and scan.upper is not None:
+                # The range column has no lower bound but NULL doesn't
+                # match the upper one, start after the NULL entries.
+                load_lower, lower_addr = self.load_key(scan.equal, memory)
+                null_addr = memory.next_addr()
+                lower_addr = lower_addr if scan.equal else null_addr
+                instructions.extend(load_lower)
+                instructions.append(InstructionIR(Opcode.Null, p2=null_addr))
+                instructions.append(
+                    InstructionIR(
+                        Opcode.SeekGt,
+                        p1=index_cursor,
+                        p2=close,
+                        p3=lower_addr,
+                        p4=len(scan.equal) + 1,
+                        p5=OPFLAG_SKIP_NULLS,
+                    )
                 )
+            elif len(lower) == 0:
+                instructions.append(
+                    InstructionIR(Opcode.Rewind, p1=index_cursor, p2=close)
+                )
+            else:
+                load_lower, lower_addr = self.load_key(lower, memory)
+                instructions.extend(load_lower)
+                seek = Opcode.SeekGe
+                if scan.lower and scan.lower.op == Symbol.gt:
+                    seek = Opcode.SeekGt
+
+                flags = 0
+                if scan.lower is None and scan.upper is None:
+                    # Only equal entries are wanted, lets the bloom filter be used.
+                    flags = OPFLAG_SEEKEQ
+
+                instructions.append(
+                    InstructionIR(
+                        seek,
+                        p1=index_cursor,
+                        p2=close,
+                        p3=lower_addr,
+                        p4=len(lower),
+                        p5=flags,
+                    )
+                )
+
+            if len(upper) > 0:
+                load_upper, upper_addr = self.load_key(upper, memory)
+                instructions.extend(load_upper)
+                stop = Opcode.IdxGt
+                if scan.upper and scan.upper.op == Symbol.lt:
+                    stop = Opcode.IdxGe
+
+                body.append(
+                    InstructionIR(
+                        stop,
+                        p1=index_cursor,
+                        p2=close,
+                        p3=upper_addr,
+                        p4=len(upper),
+                    )
+                )
+
+            predicates = [p for p in predicates if p not in scan.expressions]
+
+        next_ir = InstructionIR(Opcode.Next, p1=loop_cursor)
+        # Where to go when a row doesn't match.
+        skip = next_ir if lookup is None else close
+
+        if scan is not None and not scan.covering:
+            row_id_addr = memory.next_addr()
+            body.append(InstructionIR(Opcode.IdxPKey, p1=index_cursor, p2=row_id_addr))
+            body.append(
+                InstructionIR(Opcode.Seek, p1=table_cursor, p2=skip, p3=row_id_addr)
+            )
+
+        for predicate in predicates:
+            body.extend(
+                self.compile_condition(predicate, table_name, load, skip, memory)
             )
 
+        body.extend(emit(load, skip, close))
+        next_ir.p2 = body[0]
+
+        instructions.extend(body)
+        if lookup is None:
+            instructions.append(next_ir)
+        instructions.append(close)
+        if scan is not None and not scan.covering:
+            instructions.append(InstructionIR(Opcode.Close, p1=table_cursor))
+
+        return instructions
+
+    def compile_insert(
+        self, statement: InsertStatement, memory: Memory
+    ) -> List[InstructionIR]:
+        """
+        The table and index cursors are opened once and every row,
+        from VALUES or the SELECT's scan, goes through them before they're closed.
+        """
+        table_name = str(statement.into.value)
+        # INSERT ... SELECT scans through cursors 0 and 1.
+        table_cursor = 0 if statement.select is None else 2
+        table_page_number = self.get_table_root_page_number(table_name)
+        table_page_number_addr = memory.next_addr()
+        instructions = []
+
+        instructions.append(
+            InstructionIR(
+                Opcode.Integer,
+                p1=table_page_number,
+                p2=table_page_number_addr,
+                p3=0,
+            )
+        )
+        split_policy = self.get_table_split_policy(table_name)
+        # TODO: get number of columns from schema stmt - replace 3.
+        instructions.append(
+            InstructionIR(
+                Opcode.OpenWrite,
+                p1=table_cursor,
+                p2=table_page_number_addr,
+                p3=3,
+                p4=split_policy,
+            )
+        )
+        instructions.extend(self.open_filter(table_name, table_cursor, memory))
+
+        # Keep each of the tables indexes up to date.
+        indexes = self.get_table_indexes(table_name)
+        for i, index in enumerate(indexes):
+            index_cursor = table_cursor + i + 1
+            index_page_number_addr = memory.next_addr()
             instructions.append(
                 InstructionIR(
-                    Opcode.String,
-                    p1=len(text),
-                    p2=text_addr,
-                    p4=text,
+                    Opcode.Integer,
+                    p1=index.root_page_number,
+                    p2=index_page_number_addr,
                 )
             )
-
-            record_addr = memory.next_addr()
+            stored = index.columns + index.include
             instructions.append(
+                InstructionIR(
+                    Opcode.OpenWrite,
+                    p1=index_cursor,
+                    p2=index_page_number_addr,
+                    p3=len(stored) + 1,
+                    p4=split_policy,
+                )
+            )
+            instructions.extend(self.open_filter(index.name, index_cursor, memory))
+
+        pk_index = self.get_primary_key_index(table_name)
+        column_count = len(self.get_table_column_names(table_name))
+
+        # Lay out the registers so that every column
+        # apart from the primary key is contiguous for MakeRecord.
+        addrs = {}
+        for i in range(column_count):
+            if i != pk_index or pk_index in (0, column_count - 1):
+                addrs[i] = memory.next_addr()
+
+        if pk_index not in addrs:
+            addrs[pk_index] = memory.next_addr()
+
+        pk_addr = addrs[pk_index]
+        record_addrs = [addrs[i] for i in range(column_count) if i != pk_index]
+        record_addr = memory.next_addr()
+        # With more than one row they're likely in row_id order.
+        flags = 0 if len(statement.values) == 1 else OPFLAG_APPEND
+
+        def insert_row() -> List[InstructionIR]:
+            """
+            Writes the row in addrs to the table and its indexes.
+            """
+            body = [
                 InstructionIR(
                     Opcode.MakeRecord,
-                    p1=schema_type_addr,
-                    p2=column_count,
+                    p1=record_addrs[0] if record_addrs else 0,
+                    p2=len(record_addrs),
                     p3=record_addr,
+                ),
+                # TODO: How is this figured? This means we need to load the btree cursor?
+                InstructionIR(
+                    Opcode.Insert,
+                    p1=table_cursor,
+                    p2=record_addr,
+                    p3=pk_addr,
+                    p4=table_name,
+                    p5=flags,
+                ),
+            ]
+
+            for i, index in enumerate(indexes):
+                body.extend(
+                    self.compile_index_entry(
+                        Opcode.IdxInsert,
+                        index,
+                        table_cursor + i + 1,
+                        addrs,
+                        pk_addr,
+                        memory,
+                    )
+                )
+
+            return body
+
+        for values in statement.values:
+            if len(values) != column_count:
+                raise ParsingException(
+                    f"{table_name} has {column_count} columns but {len(values)} values were supplied"
+                )
+
+            for i, token in enumerate(values):
+                # TODO: handle NULL.
+                instructions.append(self.load_literal(token, addrs[i]))
+
+            instructions.extend(insert_row())
+
+        if statement.select is not None:
+            instructions.extend(
+                self.compile_insert_select(
+                    statement.select, table_name, addrs, insert_row, memory
                 )
             )
 
-            primary_key = len(self.get_schema()) + 1
-            primary_key_addr = memory.next_addr()
-            # TODO: I'm not sure why we don't use seek end + Key opcodes to get the primary key?
+        instructions.append(InstructionIR(Opcode.Close, p1=table_cursor))
+        for i, _ in enumerate(indexes):
+            instructions.append(InstructionIR(Opcode.Close, p1=table_cursor + i + 1))
+
+        return instructions
+
+    def compile_insert_select(
+        self,
+        select: SelectStatement,
+        table_name: str,
+        addrs: Dict[int, int],
+        insert_row: Callable[[], List[InstructionIR]],
+        memory: Memory,
+    ) -> List[InstructionIR]:
+        """
+        Scans the SELECT's table loading each row straight
+        into the insert's registers then runs insert_row.
+        """
+        source_name = str(select._from.value)
+        if select.joins:
+            raise ParsingException("INSERT ... SELECT with a JOIN is not supported")
+
+        if source_name == table_name:
+            # The new rows would turn up in the scan.
+            raise ParsingException(
+                f"INSERT INTO {table_name} SELECT ... FROM {table_name} is not supported"
+            )
+
+        column_indexes = self.get_column_indexes(select)
+        if len(column_indexes) != len(addrs):
+            raise ParsingException(
+                f"{table_name} has {len(addrs)} columns but the SELECT returns {len(column_indexes)}"
+            )
+
+        column_names = self.get_table_column_names(source_name)
+        halt = InstructionIR(Opcode.Noop)
+        instructions, limit_addr, offset_addr = self.compile_limit(select, halt, memory)
+
+        def emit(
+            load: Load, skip: InstructionIR, done: InstructionIR
+        ) -> List[InstructionIR]:
+            body = []
+
+            if offset_addr is not None:
+                body.append(InstructionIR(Opcode.IfPos, p1=offset_addr, p2=skip, p3=1))
+
+            body.extend(load(c, addrs[i]) for i, c in enumerate(column_indexes))
+            body.extend(insert_row())
+
+            if limit_addr is not None:
+                body.append(InstructionIR(Opcode.DecrJumpZero, p1=limit_addr, p2=done))
+
+            return body
+
+        instructions.extend(
+            self.compile_scan(
+                source_name,
+                select.where,
+                [column_names[i] for i in column_indexes],
+                memory.next_addr(),
+                emit,
+                memory,
+            )
+        )
+        instructions.append(halt)
+
+        return instructions
+
+    def compile_index_entry(
+        self,
+        opcode: Opcode,
+        index: IndexSchema,
+        index_cursor: int,
+        addrs: Dict[int, int],
+        row_id_addr: int,
+        memory: Memory,
+    ) -> List[InstructionIR]:
+        """
+        Builds a row's index entry from the column registers in addrs
+        then adds (IdxInsert) or removes (IdxDelete) it.
+        """
+        instructions = []
+        stored = index.columns + index.include
+
+        key_addrs = [memory.next_addr() for _ in stored]
+        for column_name, key_addr in zip(stored, key_addrs):
+            column_index = self.get_column_index(index.table_name, column_name)
             instructions.append(
-                InstructionIR(Opcode.Integer, p1=primary_key, p2=primary_key_addr)
+                InstructionIR(Opcode.SCopy, p1=addrs[column_index], p2=key_addr)
             )
 
+        key_record_addr = memory.next_addr()
+        instructions.append(
+            InstructionIR(
+                Opcode.MakeRecord,
+                p1=key_addrs[0],
+                p2=len(key_addrs),
+                p3=key_record_addr,
+            )
+        )
+        instructions.append(
+            InstructionIR(
+                opcode,
+                p1=index_cursor,
+                p2=key_record_addr,
+                p3=row_id_addr,
+                p4=len(index.columns),
+            )
+        )
+
+        return instructions
+
+    def compile_update(
+        self, statement: UpdateStatement, memory: Memory
+    ) -> List[InstructionIR]:
+        """
+        Updates run in two passes so that rewriting rows can't upset the scan.
+        First the row_ids of the matching rows are collected in a RowSet,
+        then each row is looked up, changed and written back along with
+        any index entries which include a changed column.
+        """
+        table_name = str(statement.table.value)
+        table_page_number = self.get_table_root_page_number(table_name)
+        pk_index = self.get_primary_key_index(table_name)
+        column_names = self.get_table_column_names(table_name)
+        table_cursor = 0
+
+        assignments = {}
+        for assignment in statement.assignments:
+            column_index = self.get_column_index(
+                table_name, str(assignment.column.value)
+            )
+            if column_index == pk_index:
+                raise ParsingException(f"Updating the primary key is not supported")
+
+            assignments[column_index] = assignment.value
+
+        table_page_number_addr = memory.next_addr()
+        rowset_addr = memory.next_addr()
+        instructions = [InstructionIR(Opcode.Null, p2=rowset_addr)]
+
+        def emit(
+            load: Load, skip: InstructionIR, done: InstructionIR
+        ) -> List[InstructionIR]:
+            row_id_addr = memory.next_addr()
+            return [
+                load(pk_index, row_id_addr),
+                InstructionIR(Opcode.RowSetAdd, p1=rowset_addr, p2=row_id_addr),
+            ]
+
+        instructions.extend(
+            self.compile_scan(
+                table_name,
+                statement.where,
+                [column_names[pk_index]],
+                table_page_number_addr,
+                emit,
+                memory,
+            )
+        )
+
+        split_policy = self.get_table_split_policy(table_name)
+        instructions.append(
+            InstructionIR(
+                Opcode.Integer, p1=table_page_number, p2=table_page_number_addr
+            )
+        )
+        instructions.append(
+            InstructionIR(
+                Opcode.OpenWrite,
+                p1=table_cursor,
+                p2=table_page_number_addr,
+                p3=len(column_names),
+                p4=split_policy,
+            )
+        )
+        instructions.extend(self.open_filter(table_name, table_cursor, memory))
+
+        changed = {column_names[i] for i in assignments}
+        indexes = [
+            index
+            for index in self.get_table_indexes(table_name)
+            if changed.intersection(index.columns + index.include)
+        ]
+        for i, index in enumerate(indexes):
+            index_page_number_addr = memory.next_addr()
             instructions.append(
                 InstructionIR(
-                    Opcode.Insert, p1=schema_cursor, p2=record_addr, p3=primary_key_addr
-                ),
+                    Opcode.Integer,
+                    p1=index.root_page_number,
+                    p2=index_page_number_addr,
+                )
+            )
+            instructions.append(
+                InstructionIR(
+                    Opcode.OpenWrite,
+                    p1=table_cursor + i + 1,
+                    p2=index_page_number_addr,
+                    p3=len(index.columns) + len(index.include) + 1,
+                    p4=split_policy,
+                )
+            )
+            instructions.extend(
+                self.open_filter(index.name, table_cursor + i + 1, memory)
+            )
+
+        # Same layout as insert, the columns apart from
+        # the primary key are contiguous for MakeRecord.
+        row_id_addr = memory.next_addr()
+        addrs = {pk_index: row_id_addr}
+        for i in range(len(column_names)):
+            if i != pk_index:
+                addrs[i] = memory.next_addr()
+
+        record_addrs = [addrs[i] for i in range(len(column_names)) if i != pk_index]
+
+        close = InstructionIR(Opcode.Close, p1=table_cursor)
+        read = InstructionIR(
+            Opcode.RowSetRead, p1=rowset_addr, p2=close, p3=row_id_addr
+        )
+        instructions.append(read)
+        instructions.append(
+            InstructionIR(Opcode.Seek, p1=table_cursor, p2=read, p3=row_id_addr)
+        )
+
+        for i in range(len(column_names)):
+            if i != pk_index:
+                instructions.append(
+                    self.load_column(table_cursor, i, pk_index, addrs[i])
+                )
+
+        for i, index in enumerate(indexes):
+            instructions.extend(
+                self.compile_index_entry(
+                    Opcode.IdxDelete,
+                    index,
+                    table_cursor + i + 1,
+                    addrs,
+                    row_id_addr,
+                    memory,
+                )
+            )
+
+        for i, token in assignments.items():
+            instructions.append(self.load_literal(token, addrs[i]))
+
+        record_addr = memory.next_addr()
+        instructions.append(
+            InstructionIR(
+                Opcode.MakeRecord,
+                p1=record_addrs[0] if record_addrs else 0,
+                p2=len(record_addrs),
+                p3=record_addr,
+            )
+        )
+        instructions.append(
+            InstructionIR(
+                Opcode.Insert,
+                p1=table_cursor,
+                p2=record_addr,
+                p3=row_id_addr,
+                p5=OPFLAG_ISUPDATE,
+            )
+        )
+
+        for i, index in enumerate(indexes):
+            instructions.extend(
+                self.compile_index_entry(
+                    Opcode.IdxInsert,
+                    index,
+                    table_cursor + i + 1,
+                    addrs,
+                    row_id_addr,
+                    memory,
+                )
+            )
+
+        instructions.append(InstructionIR(Opcode.Goto, p2=read))
+        instructions.append(close)
+        for i, _ in enumerate(indexes):
+            instructions.append(InstructionIR(Opcode.Close, p1=table_cursor + i + 1))
+
+        instructions.append(InstructionIR(Opcode.Halt, p1=0, p2=0))
+
+        return instructions
+
+    def compile_schema_insert(
+        self,
+        create_opcode: Opcode,
+        schema_type: str,
+        item_name: str,
+        associated_table_name: str,
+        text: str,
+        memory: Memory,
+        offset: int = 0,
+    ) -> Tuple[List[InstructionIR], int]:
+        """
+        Creates a new b-tree and adds a row pointing to it in the schema table.
+        Returns the instructions and the register holding the new root page number.
+        offset is the number of schema rows added earlier in the same program.
+        """
+        instructions = []
+        schema_root_page_num = 0
+        schema_root_page_num_addr = memory.next_addr()
+        # Layout the registers
+        schema_type_addr = memory.next_addr()
+        item_name_addr = memory.next_addr()
+        associated_table_name_addr = memory.next_addr()
+        root_page_num_addr = memory.next_addr()
+        text_addr = memory.next_addr()
+
+        column_count = 5
+
+        schema_cursor = 0
+
+        instructions.append(
+            InstructionIR(
+                Opcode.Integer,
+                p1=schema_root_page_num,
+                p2=schema_root_page_num_addr,
+            )
+        )
+        instructions.append(
+            InstructionIR(
+                Opcode.OpenWrite,
+                p1=schema_cursor,
+                p2=schema_root_page_num_addr,
+                p3=column_count,
+            )
+        )
+        instructions.append(InstructionIR(create_opcode, p1=root_page_num_addr))
+        instructions.append(
+            InstructionIR(
+                Opcode.String,
+                p1=len(schema_type),
+                p2=schema_type_addr,
+                p4=schema_type,
+            )
+        )
+        instructions.append(
+            InstructionIR(
+                Opcode.String, p1=len(item_name), p2=item_name_addr, p4=item_name
+            )
+        )
+        instructions.append(
+            InstructionIR(
+                Opcode.String,
+                p1=len(associated_table_name),
+                p2=associated_table_name_addr,
+                p4=associated_table_name,
+            )
+        )
+
+        instructions.append(
+            InstructionIR(
+                Opcode.String,
+                p1=len(text),
+                p2=text_addr,
+                p4=text,
+            )
+        )
+
+        record_addr = memory.next_addr()
+        instructions.append(
+            InstructionIR(
+                Opcode.MakeRecord,
+                p1=schema_type_addr,
+                p2=column_count,
+                p3=record_addr,
+            )
+        )
+
+        primary_key = len(self.get_catalog()) + 1 + offset
+        primary_key_addr = memory.next_addr()
+        # TODO: I'm not sure why we don't use seek end + Key opcodes to get the primary key?
+        instructions.append(
+            InstructionIR(Opcode.Integer, p1=primary_key, p2=primary_key_addr)
+        )
+
+        instructions.append(
+            InstructionIR(
+                Opcode.Insert,
+                p1=schema_cursor,
+                p2=record_addr,
+                p3=primary_key_addr,
+                p4=SCHEMA_TABLE_NAME,
+            ),
+        )
+
+        instructions.append(
+            InstructionIR(Opcode.Close, p1=schema_cursor),
+        )
+
+        return instructions, root_page_num_addr
+
+    def compile_create(
+        self, statement: CreateStatement, sql_text: str, memory: Memory
+    ) -> List[InstructionIR]:
+        table_name = str(statement.table.value)
+        # Check the options are valid before the table is created.
+        self.split_policy(statement)
+        instructions, _ = self.compile_schema_insert(
+            Opcode.CreateTable, "table", table_name, table_name, sql_text, memory
+        )
+
+        if self.table_options(statement).get("bloom"):
+            bloom_instructions, _ = self.compile_schema_insert(
+                Opcode.CreateFilter, "bloom", table_name, table_name, "", memory, 1
             )
+            instructions.extend(bloom_instructions)
 
+        instructions.append(self.set_cookie())
+
+        return instructions
+
+    def set_cookie(self) -> InstructionIR:
+        """
+        Marks the schema as changed, programs compiled before this are stale.
+        """
+        return InstructionIR(Opcode.SetCookie, p1=self.pager.schema_cookie() + 1)
+
+    def compile_create_index(
+        self, statement: CreateIndexStatement, sql_text: str, memory: Memory
+    ) -> List[InstructionIR]:
+        """
+        Creates the index b-tree then backfills it from the table.
+        The entries are buffered and sorted so the tree can be built bottom up.
+        """
+        table_name = str(statement.table.value)
+        table_page_number = self.get_table_root_page_number(table_name)
+        pk_index = self.get_primary_key_index(table_name)
+        column_indexes = [
+            self.get_column_index(table_name, str(column.value))
+            for column in statement.columns + statement.include
+        ]
+
+        index_name = str(statement.name.value)
+        instructions, index_page_number_addr = self.compile_schema_insert(
+            Opcode.CreateIndex,
+            "index",
+            index_name,
+            table_name,
+            sql_text,
+            memory,
+        )
+
+        # Indexes on tables with a bloom filter get one too.
+        bloom_page_number_addr = None
+        if self.get_bloom_page_number(table_name) is not None:
+            bloom_instructions, bloom_page_number_addr = self.compile_schema_insert(
+                Opcode.CreateFilter, "bloom", index_name, table_name, "", memory, 1
+            )
+            instructions.extend(bloom_instructions)
+
+        table_cursor = 1
+        index_cursor = 2
+        table_page_number_addr = memory.next_addr()
+        instructions.append(
+            InstructionIR(
+                Opcode.Integer, p1=table_page_number, p2=table_page_number_addr
+            )
+        )
+        instructions.append(
+            InstructionIR(
+                Opcode.OpenRead,
+                p1=table_cursor,
+                p2=table_page_number_addr,
+                p3=len(column_indexes),
+            )
+        )
+        instructions.append(
+            InstructionIR(
+                Opcode.OpenWrite,
+                p1=index_cursor,
+                p2=index_page_number_addr,
+                p3=len(column_indexes) + 1,
+                p4=self.get_table_split_policy(table_name),
+            )
+        )
+        if bloom_page_number_addr is not None:
             instructions.append(
-                InstructionIR(Opcode.Close, p1=schema_cursor),
+                InstructionIR(
+                    Opcode.OpenFilter, p1=index_cursor, p2=bloom_page_number_addr
+                )
             )
 
-            program.irs = instructions
+        close = InstructionIR(Opcode.Close, p1=table_cursor)
+        instructions.append(InstructionIR(Opcode.Rewind, p1=table_cursor, p2=close))
 
-        program.compile()
+        body = []
+        key_addrs = [memory.next_addr() for _ in column_indexes]
+        for column_index, key_addr in zip(column_indexes, key_addrs):
+            body.append(
+                self.load_column(table_cursor, column_index, pk_index, key_addr)
+            )
 
-        return program
+        row_id_addr = memory.next_addr()
+        key_record_addr = memory.next_addr()
+        body.append(InstructionIR(Opcode.Key, p1=table_cursor, p2=row_id_addr))
+        body.append(
+            InstructionIR(
+                Opcode.MakeRecord,
+                p1=key_addrs[0],
+                p2=len(key_addrs),
+                p3=key_record_addr,
+            )
+        )
+        body.append(
+            InstructionIR(
+                Opcode.IdxInsert,
+                p1=index_cursor,
+                p2=key_record_addr,
+                p3=row_id_addr,
+                p4=len(statement.columns),
+                p5=OPFLAG_BULK_BUILD,
+            )
+        )
+
+        instructions.extend(body)
+        instructions.append(InstructionIR(Opcode.Next, p1=table_cursor, p2=body[0]))
+        instructions.append(close)
+        instructions.append(InstructionIR(Opcode.Close, p1=index_cursor))
+        instructions.append(self.set_cookie())
+
+        return instructions
+
+    def compile_analyze(
+        self, statement: AnalyzeStatement, memory: Memory
+    ) -> List[InstructionIR]:
+        """
+        Reads the stats of the table, or every table when there's no name,
+        and its indexes into the stats table. It's created the first time.
+        Each b-tree's row is keyed by its root page number so running
+        ANALYZE again replaces it.
+        """
+        catalog = self.get_catalog()
+        table_names = [
+            name
+            for name in catalog.tables
+            if name not in (SCHEMA_TABLE_NAME, STATS_TABLE_NAME)
+        ]
+
+        if statement.table is not None:
+            table_name = catalog.table(str(statement.table.value)).name
+            if table_name not in table_names:
+                raise ParsingException(f"Can't analyze {table_name}")
+
+            table_names = [table_name]
+
+        stats_cursor = 0
+        tree_cursor = 1
+        instructions = []
+
+        if STATS_TABLE_NAME in catalog.tables:
+            stats_table = catalog.table(STATS_TABLE_NAME)
+            if stats_table.sql_text != STATS_TABLE_SQL_TEXT:
+                raise ParsingException(
+                    f"Table: {STATS_TABLE_NAME} is reserved for ANALYZE"
+                )
+
+            stats_page_number_addr = memory.next_addr()
+            instructions.append(
+                InstructionIR(
+                    Opcode.Integer,
+                    p1=stats_table.root_page_number,
+                    p2=stats_page_number_addr,
+                )
+            )
+        else:
+            create, stats_page_number_addr = self.compile_schema_insert(
+                Opcode.CreateTable,
+                "table",
+                STATS_TABLE_NAME,
+                STATS_TABLE_NAME,
+                STATS_TABLE_SQL_TEXT,
+                memory,
+            )
+            instructions.extend(create)
+
+        instructions.append(
+            InstructionIR(Opcode.OpenWrite, p1=stats_cursor, p2=stats_page_number_addr)
+        )
+
+        # Layout the registers in the order of the stats table's columns.
+        page_number_addr = memory.next_addr()
+        name_addr = memory.next_addr()
+        table_name_addr = memory.next_addr()
+        stats_addr = memory.next_addr()
+        for _ in range(ANALYZE_COLUMNS - 1):
+            memory.next_addr()
+        record_addr = memory.next_addr()
+
+        for table_name in table_names:
+            table = catalog.table(table_name)
+            # Table records are [row_id, *columns] without the primary key.
+            trees = [
+                (
+                    table.name,
+                    table.root_page_number,
+                    [
+                        0 if i == table.pk_index else record_index(i, table.pk_index)
+                        for i in range(len(table.columns))
+                    ],
+                )
+            ]
+            trees += [
+                (
+                    index.name,
+                    index.root_page_number,
+                    # Index records are [row_id, *columns, *include].
+                    list(range(1, len(index.columns) + 1)),
+                )
+                for index in table.indexes
+            ]
+
+            for name, root_page_number, positions in trees:
+                instructions += [
+                    InstructionIR(
+                        Opcode.Integer, p1=root_page_number, p2=page_number_addr
+                    ),
+                    InstructionIR(Opcode.OpenRead, p1=tree_cursor, p2=page_number_addr),
+                    InstructionIR(
+                        Opcode.Analyze, p1=tree_cursor, p2=stats_addr, p4=positions
+                    ),
+                    InstructionIR(Opcode.Close, p1=tree_cursor),
+                    InstructionIR(Opcode.String, p1=len(name), p2=name_addr, p4=name),
+                    InstructionIR(
+                        Opcode.String,
+                        p1=len(table_name),
+                        p2=table_name_addr,
+                        p4=table_name,
+                    ),
+                    InstructionIR(
+                        Opcode.MakeRecord,
+                        p1=name_addr,
+                        p2=ANALYZE_COLUMNS + 2,
+                        p3=record_addr,
+                    ),
+                    InstructionIR(
+                        Opcode.Insert,
+                        p1=stats_cursor,
+                        p2=record_addr,
+                        p3=page_number_addr,
+                        p5=OPFLAG_ISUPDATE,
+                    ),
+                ]
+
+        instructions.append(InstructionIR(Opcode.Close, p1=stats_cursor))
+        instructions.append(self.set_cookie())
+
+        return instructions
+
+    def compile_explain(
+        self, statement: ExplainStatement, program: Program, memory: Memory
+    ) -> List[InstructionIR]:
+        """
+        Returns rows describing the explained statement's program,
+        it isn't run. EXPLAIN has a row for each instruction
+        [addr, opcode, p1, p2, p3, p4, p5] and EXPLAIN QUERY PLAN a row
+        for each step of the plan [id, detail].
+
+        EXPLAIN ANALYZE does run it, throwing away its rows, and adds
+        what each instruction cost to its row, see PROFILE_COLUMNS.
+        """
+        if statement.analyze:
+            return self.compile_profile(program, memory)
+
+        if statement.query_plan:
+            rows = [[i, detail] for i, detail in enumerate(program.plan)]
+        else:
+            rows = [
+                [
+                    addr,
+                    i.opcode.name,
+                    i.p1,
+                    i.p2,
+                    i.p3,
+                    describe_operand(i.p4),
+                    i.p5,
+                ]
+                for addr, i in enumerate(program.instructions)
+            ]
+
+        return self.compile_rows(rows, memory)
+
+    def compile_profile(self, program: Program, memory: Memory) -> List[InstructionIR]:
+        """
+        Runs the program with profiling then returns its annotated listing.
+        """
+        listing_addr = memory.next_addr()
+        row_addrs = [memory.next_addr() for _ in PROFILE_COLUMNS]
+        halt = InstructionIR(Opcode.Halt)
+        next_row = InstructionIR(
+            Opcode.AggNext,
+            p1=listing_addr,
+            p2=halt,
+            p3=row_addrs[0],
+            p4=len(row_addrs),
+        )
+
+        return [
+            InstructionIR(Opcode.Profile, p1=listing_addr, p4=program),
+            *self.compile_results(next_row, row_addrs, None, None, halt),
+            halt,
+        ]
+
+    @staticmethod
+    def compile_rows(rows: List[List[Any]], memory: Memory) -> List[InstructionIR]:
+        """
+        Returns rows which are known at compile time.
+        """
+        if not rows:
+            return []
+
+        addrs = [memory.next_addr() for _ in rows[0]]
+        instructions = []
+
+        for row in rows:
+            for value, addr in zip(row, addrs):
+                if value is None:
+                    instructions.append(InstructionIR(Opcode.Null, p2=addr))
+                elif isinstance(value, str):
+                    instructions.append(
+                        InstructionIR(Opcode.String, p1=len(value), p2=addr, p4=value)
+                    )
+                else:
+                    instructions.append(
+                        InstructionIR(Opcode.Integer, p1=value, p2=addr)
+                    )
+
+            instructions.append(
+                InstructionIR(Opcode.ResultRow, p1=addrs[0], p2=addrs[-1])
+            )
+
+        return instructions
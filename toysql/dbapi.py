@@ -0,0 +1,203 @@
+"""
+A DB-API 2.0 style interface over the compiler and VM. eg:
+
+    connection = connect("example.db")
+    cursor = connection.cursor()
+    cursor.execute("SELECT * FROM users WHERE id > ?", [10])
+
+    for row in cursor:
+        ...
+
+https://peps.python.org/pep-0249/
+"""
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+import itertools
+
+from toysql.compiler import Compiler, Program
+from toysql.exceptions import ClosedException
+from toysql.pager import Pager
+from toysql.vm import VM
+
+apilevel = "2.0"
+# Threads can share the module but not connections.
+threadsafety = 1
+# ? placeholders, :name ones work too when the parameters are a dict.
+paramstyle = "qmark"
+
+Parameters = Union[Sequence[Any], Dict[str, Any]]
+
+
+class Cursor:
+    """
+    Runs statements and fetches their rows.
+
+    Rows are pulled from the VM as they're fetched so only the next
+    one is held, a big SELECT doesn't have to fit in memory. execute
+    runs the program up to its first row, a statement without rows
+    (eg INSERT) has finished by the time execute returns.
+    """
+
+    # Rows fetchmany returns when it isn't given a size.
+    arraysize: int = 1
+    # Isn't known without running the statement to the end.
+    rowcount = -1
+
+    def __init__(self, connection: "Connection"):
+        self.connection = connection
+        self.closed = False
+        # A (name, type_code, ...) tuple for each column of the last
+        # statement's rows, None if it has no rows. Types aren't known.
+        self.description: Optional[List[Tuple[Optional[str], ...]]] = None
+        self.rows: Iterator[List[Any]] = iter(())
+        # The next row, read ahead by execute.
+        self.row: Optional[List[Any]] = None
+
+    def execute(self, sql_text: str, parameters: Parameters = ()) -> "Cursor":
+        self.check()
+        statement = self.connection.compiler.prepare_statement(sql_text)
+        self.describe(statement.program)
+        self.start(
+            self.connection.vm.execute(statement.program, statement.bind(parameters))
+        )
+
+        return self
+
+    def executemany(
+        self, sql_text: str, seq_of_parameters: Iterable[Parameters]
+    ) -> "Cursor":
+        """
+        Runs the statement once for each set of parameters,
+        it's compiled once and each run binds the next set.
+        """
+        self.check()
+        statement = self.connection.compiler.prepare_statement(sql_text)
+        self.describe(statement.program)
+
+        for parameters in seq_of_parameters:
+            self.start(
+                self.connection.vm.execute(
+                    statement.program, statement.bind(parameters)
+                )
+            )
+
+        return self
+
+    def fetchone(self) -> Optional[List[Any]]:
+        self.check()
+        row = self.row
+
+        if row is not None:
+            self.row = next(self.rows, None)
+
+        return row
+
+    def fetchmany(self, size: Optional[int] = None) -> List[List[Any]]:
+        self.check()
+        size = self.arraysize if size is None else size
+
+        return list(itertools.islice(self, size))
+
+    def fetchall(self) -> List[List[Any]]:
+        self.check()
+        return list(self)
+
+    def __iter__(self) -> "Cursor":
+        return self
+
+    def __next__(self) -> List[Any]:
+        row = self.fetchone()
+        if row is None:
+            raise StopIteration
+
+        return row
+
+    def close(self):
+        self.stop()
+        self.closed = True
+
+    def setinputsizes(self, sizes):
+        pass
+
+    def setoutputsize(self, size, column=None):
+        pass
+
+    def start(self, rows: Iterator[List[Any]]):
+        """
+        Throws away the rows of the last statement and
+        runs rows' program up to its first row.
+        """
+        self.stop()
+        self.rows = rows
+        self.row = next(rows, None)
+
+    def describe(self, program: Program):
+        self.description = [
+            (name, None, None, None, None, None, None) for name in program.columns
+        ] or None
+
+    def stop(self):
+        close = getattr(self.rows, "close", None)
+        if close is not None:
+            close()
+
+        self.rows = iter(())
+        self.row = None
+
+    def check(self):
+        if self.closed or self.connection.closed:
+            raise ClosedException("Cursor is closed")
+
+
+class Connection:
+    """
+    A database file with its compiler, which caches
+    compiled programs, and the VM to run them.
+    """
+
+    def __init__(self, database: str, engine: str = "interpreter"):
+        self.pager = Pager(database)
+        self.compiler = Compiler(self.pager)
+        self.vm = VM(self.pager, engine=engine)
+        self.closed = False
+
+    def cursor(self) -> Cursor:
+        self.check()
+        return Cursor(self)
+
+    def execute(self, sql_text: str, parameters: Parameters = ()) -> Cursor:
+        """
+        Shortcut for cursor().execute(...)
+        """
+        return self.cursor().execute(sql_text, parameters)
+
+    def executemany(
+        self, sql_text: str, seq_of_parameters: Iterable[Parameters]
+    ) -> Cursor:
+        return self.cursor().executemany(sql_text, seq_of_parameters)
+
+    def commit(self):
+        # There are no transactions, each write goes straight to the file.
+        self.check()
+
+    def close(self):
+        if not self.closed:
+            self.pager.close()
+            self.closed = True
+
+    def check(self):
+        if self.closed:
+            raise ClosedException("Connection is closed")
+
+
+def connect(database: str, engine: str = "interpreter") -> Connection:
+    return Connection(database, engine)
@@ -20,3 +20,19 @@ class LexingException(Exception):
 
 class ParsingException(Exception):
     pass
+
+
+class ColumnNotFoundException(NotFoundException):
+    pass
+
+
+class BindingException(Exception):
+    pass
+
+
+class SchemaChangedException(Exception):
+    pass
+
+
+class ClosedException(Exception):
+    pass
@@ -0,0 +1,145 @@
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import pickle
+import tempfile
+
+# Build rows a HashJoin keeps in memory before it spills partitions to disk.
+JOIN_BUFFER = 10_000
+# Build rows are split between this many partitions by hashing their key.
+PARTITIONS = 8
+# A partition that's still too big this many splits down is mostly one key,
+# splitting it again won't help so it's kept in memory.
+MAX_DEPTH = 4
+
+
+class HashJoin:
+    """
+    Matches rows by key with a dict built from one side of a join,
+    the build side, and probed with each row from the other side.
+
+    Build rows are spread over partitions by hashing their key, when there
+    are more than buffer_size in memory the biggest partition is written to
+    a temp file and every later build row for it goes there too.
+    A probe row whose key is in a spilled partition can't be matched yet so
+    it's written to that partition's probe file, deferred yields them once
+    the probe side is done by joining each spilled partition on its own
+    (which can spill again if it's still too big).
+
+    NULL keys never match.
+    """
+
+    def __init__(self, buffer_size: int = JOIN_BUFFER, depth: int = 0):
+        self.buffer_size = max(1, buffer_size)
+        # Salts the partition hash so a partition splits
+        # differently when it spills again.
+        self.depth = depth
+        # None once a partition has spilled.
+        self.tables: List[Optional[Dict[Any, List[List[Any]]]]] = [
+            {} for _ in range(PARTITIONS)
+        ]
+        self.sizes = [0] * PARTITIONS
+        self.build_files: List[Any] = [None] * PARTITIONS
+        self.probe_files: List[Any] = [None] * PARTITIONS
+        # Build rows in memory.
+        self.rows = 0
+        # Build rows written to partition files.
+        self.spilled = 0
+        # The build rows matching the last probe, see HashNext.
+        self.matches: Iterator[List[Any]] = iter(())
+        self.pending: Optional[Iterator[Tuple[Any, List[Any]]]] = None
+
+    def partition(self, key: Any) -> int:
+        return hash((self.depth, key)) % PARTITIONS
+
+    def build(self, key: Any, row: List[Any]):
+        if key is None:
+            return
+
+        partition = self.partition(key)
+        table = self.tables[partition]
+
+        if table is None:
+            pickle.dump((key, row), self.build_files[partition])
+            self.spilled += 1
+            return
+
+        table.setdefault(key, []).append(row)
+        self.sizes[partition] += 1
+        self.rows += 1
+
+        if self.rows > self.buffer_size and self.depth < MAX_DEPTH:
+            self.spill()
+
+    def spill(self):
+        partition = max(
+            (i for i, table in enumerate(self.tables) if table is not None),
+            key=lambda i: self.sizes[i],
+        )
+        table = self.tables[partition]
+        file = tempfile.TemporaryFile()
+
+        for key, rows in (table or {}).items():
+            for row in rows:
+                pickle.dump((key, row), file)
+
+        self.tables[partition] = None
+        self.build_files[partition] = file
+        self.probe_files[partition] = tempfile.TemporaryFile()
+        self.rows -= self.sizes[partition]
+        self.spilled += self.sizes[partition]
+
+    def probe(self, key: Any, row: List[Any]) -> bool:
+        """
+        Sets matches to the build rows with key, False if the
+        key's partition has spilled and row was deferred instead.
+        """
+        if key is None:
+            self.matches = iter(())
+            return True
+
+        partition = self.partition(key)
+        table = self.tables[partition]
+
+        if table is None:
+            pickle.dump((key, row), self.probe_files[partition])
+            return False
+
+        self.matches = iter(table.get(key, ()))
+        return True
+
+    @staticmethod
+    def read(file) -> Iterator[Tuple[Any, List[Any]]]:
+        file.seek(0)
+        try:
+            while True:
+                yield pickle.load(file)
+        except EOFError:
+            file.close()
+
+    def deferred(self) -> Iterator[Tuple[Any, List[Any]]]:
+        """
+        The deferred probe rows (key, row), matches is set for each.
+        """
+        for partition, table in enumerate(self.tables):
+            if table is not None:
+                continue
+
+            join = HashJoin(self.buffer_size, self.depth + 1)
+            for key, row in self.read(self.build_files[partition]):
+                join.build(key, row)
+
+            for key, row in self.read(self.probe_files[partition]):
+                if join.probe(key, row):
+                    self.matches = join.matches
+                    yield key, row
+
+            for key, row in join.deferred():
+                self.matches = join.matches
+                yield key, row
+
+            self.spilled += join.spilled
+
+    def next_deferred(self) -> Optional[Tuple[Any, List[Any]]]:
+        if self.pending is None:
+            self.pending = self.deferred()
+
+        return next(self.pending, None)
@@ -1,8 +1,8 @@
 from dataclasses import dataclass
 from enum import Enum, auto
-from io import StringIO
+import re
 from toysql.exceptions import LexingException
-from typing import List, Optional, Union
+from typing import Iterable, Iterator, List, Optional, TextIO, Union, cast
 
 
 class Identifier(Enum):
@@ -19,6 +19,8 @@ class Keyword(Enum):
     _as = "as"
     where = "where"
     _and = "and"
+    _or = "or"
+    _not = "not"
     create = "create"
     insert = "insert"
     table = "table"
@@ -30,6 +32,25 @@ class Keyword(Enum):
     null = "null"
     primary = "primary"
     key = "key"
+    index = "index"
+    on = "on"
+    include = "include"
+    limit = "limit"
+    offset = "offset"
+    _with = "with"
+    update = "update"
+    set = "set"
+    group = "group"
+    by = "by"
+    order = "order"
+    asc = "asc"
+    desc = "desc"
+    join = "join"
+    inner = "inner"
+    left = "left"
+    outer = "outer"
+    analyze = "analyze"
+    explain = "explain"
 
 
 class Symbol(Enum):
@@ -39,10 +60,13 @@ class Symbol(Enum):
     left_paren = "("
     right_paren = ")"
     equal = "="
+    not_equal = "!="
+    # Same as != but standard sql.
+    lt_gt = "<>"
     gt = ">"
     gteq = ">="
     lt = "<"
-    lteq = ">="
+    lteq = "<="
 
 
 class DataType(Enum):
@@ -70,7 +94,18 @@ class DataType(Enum):
         raise Exception(f"Unable to infer datatype of {v}")
 
 
-TokenType = Union[DataType, Symbol, Keyword, Identifier]
+class Parameter(Enum):
+    """
+    Placeholders for values bound when a prepared statement is executed.
+    """
+
+    # ?
+    positional = "?"
+    # :name
+    named = ":"
+
+
+TokenType = Union[DataType, Symbol, Keyword, Identifier, Parameter]
 
 
 class Kind(Enum):
@@ -87,88 +122,61 @@ class Location:
 
 
 class Cursor:
-    def __init__(self, text) -> None:
-        self.reader = StringIO(text)
+    """
+    Walks through the source keeping track of the line
+    and where it starts, so finding a location is O(1).
+    """
 
-    @property
-    def pointer(self):
-        return self.reader.tell()
+    def __init__(self, text) -> None:
+        self.text = text
+        self.pointer = 0
+        self.line = 0
+        # Index of the first character on the current line.
+        self.line_start = 0
 
     def __len__(self) -> int:
         """
         length of underlying str.
         """
-        return len(self.reader.getvalue())
+        return len(self.text)
 
     def peek(self, size=1) -> str:
         """
-        stringIO doesn't have peek
-        peek reads the current character
-        without advancing the cursor.
+        Reads the next size characters without advancing the cursor.
         """
-        pointer = self.reader.tell()
-        value = self.read(size)
-        self.reader.seek(pointer)
-
-        return value
+        return self.text[self.pointer : self.pointer + size]
 
     def read(self, size=None) -> str:
         """
-        Reads remaining text from current index without moving the cursor
-        """
-        return self.reader.read(size)
-
-    def is_complete(self) -> bool:
-        return self.reader.tell() == len(self)
-
-    def line_no(self) -> int:
-        """
-        Calculates the current line number
-        of the cursor.
+        Reads size characters (or the rest of the text) advancing the cursor.
         """
-        pointer = self.reader.tell()
-        count = 0
+        start = self.pointer
+        end = len(self.text) if size is None else min(start + size, len(self.text))
+        self.pointer = end
 
-        self.reader.seek(0)
-        buffer = self.reader.read(pointer)
-        count += buffer.count("\n")
+        newlines = self.text.count("\n", start, end)
+        if newlines:
+            self.line += newlines
+            self.line_start = self.text.rindex("\n", start, end) + 1
 
-        self.reader.seek(pointer)
-        return count
+        return self.text[start:end]
 
-    def column_no(self) -> int:
-        """
-        Calculates the character count since the last
-        line break.
-        """
-        pointer = self.reader.tell()
-        start = pointer
-
-        while True:
-            # Find the beginning of the
-            # line
-            self.reader.seek(start)
-            value = self.peek()
-            if start == 0:
-                break
-
-            if value == "\n":
-                # This counts as previous line
-                # so add one char.
-                start += 1
-                break
-
-            start -= 1
-
-        count = pointer - start
+    def is_complete(self) -> bool:
+        return self.pointer >= len(self.text)
 
-        self.reader.seek(pointer)
+    def location(self) -> Location:
+        """Returns (line_number, col) of the cursor."""
+        return Location(self.line, self.pointer - self.line_start)
 
-        return count
 
-    def location(self) -> Location:
-        """Returns (line_number, col) of `index` in `s`."""
-        return Location(self.line_no(), self.column_no())
+TOKEN_KINDS = {
+    Keyword: Kind.keyword,
+    Symbol: Kind.keyword,
+    Identifier: Kind.identifier,
+    DataType: Kind.datatype,
+    # Parameters can go anywhere a literal can.
+    Parameter: Kind.datatype,
+}
 
 
 @dataclass
@@ -181,15 +189,9 @@ class Token:
         self.type = type
         self.loc = loc
 
-        if isinstance(type, Keyword):
-            self.kind = Kind.keyword
-        elif isinstance(type, Symbol):
-            self.kind = Kind.keyword
-        elif isinstance(type, Identifier):
-            self.kind = Kind.identifier
-        elif isinstance(type, DataType):
-            self.kind = Kind.datatype
-        else:
+        try:
+            self.kind = TOKEN_KINDS[type.__class__]
+        except KeyError:
             raise Exception("Unknown token type -> kind mapping")
 
         if value is None:
@@ -198,227 +200,228 @@ class Token:
             self.value = value
 
 
-def is_alphabetical(c: str):
-    return (c >= "A" and c <= "Z") or (c >= "a" and c <= "z")
-
-
-def is_digit(c: str):
-    return c >= "0" and c <= "9"
-
-
-def is_period(c: str):
-    return c == "."
-
-
-def is_exp_marker(c: str):
-    return c == "e"
-
-
-def keyword_lexer(cursor: Cursor) -> Optional[Token]:
-    cursor_start = cursor.location()
-    match = None
-    options = [e.value for e in Keyword]
-    options.sort(key=len, reverse=True)
+def alternatives(options: List[str]) -> str:
+    """
+    Longest first so ">=" isn't matched as ">" then "=".
+    """
+    return "|".join(re.escape(o) for o in sorted(options, key=len, reverse=True))
 
-    for option in options:
-        l = len(option)
 
-        substr = cursor.peek(l)
-        lower_substr = substr.lower()
-        if lower_substr == option:
-            # matched.
+KEYWORDS = {keyword.value: keyword for keyword in Keyword}
+SYMBOLS = {symbol.value: symbol for symbol in Symbol}
 
-            # Now we need to make sure it's either
-            # a full word OR it's the end of the string.
-            # cursor.peek will return as much as it can
-            # even if you give a length greater than
-            # the underlying string. That's why we
-            # check l == len(with_next_char)
-            with_next_char = cursor.peek(l + 1)
+# A keyword has to be a whole word, so "selected" isn't "select" + "ed"
+# and "null_count" is an identifier.
+KEYWORD_PATTERN = f"(?i:{alternatives(list(KEYWORDS))})(?![A-Za-z0-9$_])"
+SYMBOL_PATTERN = alternatives(list(SYMBOLS))
+# TODO - this currently handles
+# floating points - we should
+# instead just do floats.
+NUMERIC_PATTERN = r"(?=[0-9.])[0-9]*(?:\.[0-9]*)?(?:e[0-9]*)?"
+TEXT_PATTERN = r"'[^']*'"
+PARAMETER_PATTERN = r"\?|:[A-Za-z_][A-Za-z0-9_]*"
+BARE_IDENTIFIER_PATTERN = r"[A-Za-z][A-Za-z0-9$_]*"
+BARE_IDENTIFIER = re.compile(BARE_IDENTIFIER_PATTERN)
+# A column qualified by its table eg: orders.id, lexed as one identifier.
+QUALIFIED_IDENTIFIER_PATTERN = rf"{BARE_IDENTIFIER_PATTERN}\.{BARE_IDENTIFIER_PATTERN}"
+IDENTIFIER_PATTERN = (
+    rf'{QUALIFIED_IDENTIFIER_PATTERN}|"[^"]*"|{BARE_IDENTIFIER_PATTERN}'
+)
+WHITESPACE_PATTERN = r"[ \n\r]+"
 
-            if l == len(with_next_char) or not is_alphabetical(with_next_char[-1]):
-                # now makesure it's a complete word
-                # but checking the next char is a space.
-                cursor.read(l)
-                match = lower_substr
+# How much of a stream lex_stream reads at a time.
+STREAM_CHUNK_SIZE = 64 * 1024
 
-    if match is None:
-        return None
 
-    return Token(type=Keyword(match), loc=cursor_start)
+def keyword_token(value: str, loc: Location) -> Token:
+    return Token(type=KEYWORDS[value.lower()], loc=loc)
 
 
-def numeric_lexer(cursor: Cursor):
-    # TODO - this currently handles
-    # floating points - we should
-    # instead just do floats.
-    cursor_start = cursor.location()
-    period_found = False
-    exp_marker_found = False
+def symbol_token(value: str, loc: Location) -> Token:
+    return Token(type=SYMBOLS[value], loc=loc)
 
-    c = cursor.peek()
-    value = ""
 
-    if not is_digit(c) and not is_period(c):
-        return None
+def parameter_token(value: str, loc: Location) -> Token:
+    if value == "?":
+        return Token(type=Parameter.positional, loc=loc)
 
-    while not cursor.is_complete():
-        c = cursor.peek()
+    return Token(type=Parameter.named, loc=loc, value=value)
 
-        if is_period(c):
-            if period_found:
-                # What cases would you have ".."?
-                return None
 
-            period_found = True
-            value += cursor.read(1)
-            continue
+def numeric_token(value: str, loc: Location) -> Token:
+    return Token(type=DataType.integer, loc=loc, value=value)
 
-        if is_exp_marker(c):
-            if exp_marker_found:
-                return None
 
-            # No periods allowed after expMarker
-            period_found = True
-            exp_marker_found = True
+def text_token(value: str, loc: Location) -> Token:
+    return Token(type=DataType.text, loc=loc, value=value[1:-1])
 
-            c_next = cursor.peek()
-            if c_next == "-" or c_next == "+":
-                value += cursor.read(1)
 
-            value += cursor.read(1)
-            continue
+def identifier_token(value: str, loc: Location) -> Token:
+    if value.startswith('"'):
+        # Delimited identifiers keep their case.
+        return Token(type=Identifier.long, loc=loc, value=value[1:-1])
 
-        if not is_digit(c):
-            break
+    return Token(type=Identifier.long, loc=loc, value=value.lower())
 
-        value += cursor.read(1)
 
-    # No characters accumulated
-    if len(value) == 0:
-        return None
+# In order of precedence, keywords get first pick.
+LEXERS = {
+    "keyword": (KEYWORD_PATTERN, keyword_token),
+    "symbol": (SYMBOL_PATTERN, symbol_token),
+    "parameter": (PARAMETER_PATTERN, parameter_token),
+    "numeric": (NUMERIC_PATTERN, numeric_token),
+    "text": (TEXT_PATTERN, text_token),
+    "identifier": (IDENTIFIER_PATTERN, identifier_token),
+}
 
-    return Token(type=DataType.integer, loc=cursor_start, value=value)
+# Every lexer in one pattern, the name of the group
+# which matched tells us which token to build.
+TOKEN_PATTERN = re.compile(
+    "|".join(
+        [f"(?P<whitespace>{WHITESPACE_PATTERN})"]
+        + [f"(?P<{name}>{pattern})" for name, (pattern, _) in LEXERS.items()]
+    )
+)
 
 
-def symbol_lexer(cursor: Cursor):
-    options = [e.value for e in Symbol]
-    cursor_start = cursor.location()
-    current = cursor.peek()
+def pattern_lexer(name: str):
+    """
+    Lexes a single kind of token at the cursor, or returns None.
+    """
+    pattern, build = LEXERS[name]
+    regex = re.compile(pattern)
 
-    try:
-        options.index(current)
-    except ValueError:
-        return None
+    def lexer(cursor: Cursor) -> Optional[Token]:
+        match = regex.match(cursor.text, cursor.pointer)
+        if match is None:
+            return None
 
-    cursor.read(1)
+        loc = cursor.location()
+        value = cursor.read(match.end() - match.start())
+        return build(value, loc)
 
-    return Token(
-        type=Symbol(current),
-        loc=cursor_start,
-    )
+    return lexer
 
 
-class DelimitedLexer:
-    def __init__(self, delimiter: str, type: TokenType, kind: Kind) -> None:
-        self.delimiter = delimiter
-        self.type = type
-        self.kind = kind
-
-    def lex(self, cursor: Cursor):
-        cursor_start = cursor.location()
-        if cursor.peek() != self.delimiter:
-            return None
+keyword_lexer = pattern_lexer("keyword")
+symbol_lexer = pattern_lexer("symbol")
+numeric_lexer = pattern_lexer("numeric")
+text_lexer = pattern_lexer("text")
+identifier_lexer = pattern_lexer("identifier")
+parameter_lexer = pattern_lexer("parameter")
 
-        # Now we have found the delimiter
-        # we want to continue until we find the
-        # end delimiter.
-        cursor.read(1)
 
-        value = ""
-        while not cursor.is_complete():
-            if cursor.peek() == self.delimiter:
-                # Move over the delimiter.
-                cursor.read(1)
+def tokenize(chunks: Iterable[str]) -> Iterator[Token]:
+    """
+    Single pass over the source, at each position TOKEN_PATTERN
+    picks the first lexer which matches. The line and column are
+    tracked as we go rather than recounted for each token.
 
-                return Token(type=self.type, loc=cursor_start, value=value)
+    The source arrives in chunks, only the text which hasn't been
+    lexed yet is kept so memory is bound by the largest token.
+    """
+    chunks = iter(chunks)
+    match_token = TOKEN_PATTERN.match
+    buffer = ""
+    pointer = 0
+    # Position of buffer[0] in the source.
+    offset = 0
+    line = 0
+    line_start = 0
+    eof = False
+
+    while True:
+        match = match_token(buffer, pointer)
+
+        # A token which runs to the end of the buffer might carry on
+        # in the next chunk, as might an identifier followed by a "."
+        # which ends the buffer, eg: "o." then "id" is one token.
+        if not eof and (
+            match is None
+            or match.end() == len(buffer)
+            or (
+                match.lastgroup == "identifier"
+                and match.end() == len(buffer) - 1
+                and buffer[-1] == "."
+            )
+        ):
+            chunk = next(chunks, None)
 
-            value += cursor.read(1)
+            if chunk is None:
+                eof = True
+            else:
+                buffer = buffer[pointer:] + chunk
+                offset += pointer
+                pointer = 0
 
-        return None
+            continue
 
+        if match is None:
+            if pointer == len(buffer):
+                return
 
-def text_lexer(cursor: Cursor):
-    lexer = DelimitedLexer("'", DataType.text, Kind.datatype)
-    return lexer.lex(cursor)
+            raise LexingException(
+                f"Lexing error at location {line}:{offset + pointer - line_start}"
+            )
 
+        # Every alternative in the pattern is a named group.
+        name = cast(str, match.lastgroup)
+        end = match.end()
 
-def identifier_lexer(cursor: Cursor):
-    # Look for double quote texts.
-    cursor_start = cursor.location()
-    token = DelimitedLexer('"', Identifier.long, Kind.identifier).lex(cursor)
+        if name != "whitespace":
+            _, build = LEXERS[name]
+            yield build(match.group(), Location(line, offset + pointer - line_start))
 
-    if token:
-        return token
+        newlines = buffer.count("\n", pointer, end)
+        if newlines:
+            line += newlines
+            line_start = offset + buffer.rindex("\n", pointer, end) + 1
 
-    c = cursor.peek()
+        pointer = end
 
-    if not is_alphabetical(c):
-        return None
 
-    value = cursor.read(1)
+def lex(source: str) -> List[Token]:
+    return list(tokenize([source.strip()]))
 
-    while not cursor.is_complete():
-        c = cursor.peek()
 
-        is_numeric = c >= "0" and c <= "9"
+def lex_stream(stream: TextIO, chunk_size=STREAM_CHUNK_SIZE) -> Iterator[Token]:
+    """
+    Lexes a file like object lazily, for scripts too big to read at once.
+    """
+    return tokenize(iter(lambda: stream.read(chunk_size), ""))
 
-        if is_alphabetical(c) or is_numeric or c == "$" or c == "_":
-            value += cursor.read(1)
-            continue
 
-        break
+def to_sql(tokens: List[Token]) -> str:
+    """
+    Writes tokens back out as sql text, the inverse of lex
+    apart from whitespace and the case of keywords.
+    """
+    sql = ""
 
-    if len(value) == 0:
-        return None
+    for token in tokens:
+        if token.type == DataType.text:
+            value = f"'{token.value}'"
+        elif token.kind == Kind.identifier and not is_bare_identifier(token.value):
+            value = f'"{token.value}"'
+        else:
+            value = token.value
 
-    return Token(type=Identifier.long, loc=cursor_start, value=value.lower())
+        if sql and not sql.endswith("(") and value not in (",", ")", ";"):
+            sql += " "
 
+        sql += value
 
-def lex(source: str) -> List[Token]:
-    source = source.strip()
-    discard_characters = [" ", "\n", "\r"]
-    tokens = []
-    cursor = Cursor(source)
-    # Explicitly describe type here
-    # So we ensure each of these is a lexer.
-    lexers = [
-        keyword_lexer,  # Note keyword should always have first pick.
-        symbol_lexer,
-        numeric_lexer,
-        text_lexer,
-        identifier_lexer,
-    ]
-
-    while not cursor.is_complete():
-        if cursor.peek() in discard_characters:
-            # move the cursor forward
-            # when discarding things.
-            cursor.read(1)
-            continue
+    return sql
 
-        for lexer in lexers:
-            token = lexer(cursor)
-            if token:
-                tokens.append(token)
-                break
-        else:
-            # Else in a for loop is executed when
-            # it no breaks are called.
-            # Therefore this means no tokens were found.
-            location = cursor.location()
-            raise LexingException(
-                f"Lexing error at location {location.line}:{location.col}"
-            )
 
-    return tokens
+def is_bare_identifier(value: str) -> bool:
+    """
+    Can the identifier be written without quotes and lexed back the same.
+    """
+    parts = value.split(".")
+    return len(parts) <= 2 and all(
+        BARE_IDENTIFIER.fullmatch(part) is not None
+        and part == part.lower()
+        and part not in KEYWORDS
+        for part in parts
+    )
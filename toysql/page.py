@@ -1,13 +1,47 @@
-from typing import Optional, List
+from typing import Optional, List, Any, Tuple
 from enum import Enum
 from toysql.record import Record, Integer
 import bisect
 import io
 
 
+# Page 0 keeps the schema cookie in its last bytes, outside of the b-tree.
+SCHEMA_COOKIE_SIZE = 4
+# Bytes for the page number in the page header, the same as child pointers.
+PAGE_NUMBER_SIZE = 4
+
+
 class PageType(Enum):
     leaf = 0
     interior = 1
+    index_leaf = 2
+    index_interior = 3
+    # Raw bits of a BloomFilter after the header, no cells.
+    bloom = 4
+
+
+def sort_key(value: Any):
+    """
+    Maps a value onto something python can compare
+    with any other value. Like sqlite NULL sorts first, then integers
+    and then text.
+    """
+    if value is None:
+        return (0, 0)
+
+    if isinstance(value, (int, float)):
+        return (1, value)
+
+    return (2, value)
+
+
+# Sorts after every value sort_key can produce. It's appended to a
+# key prefix to seek past every entry which shares that prefix.
+MAX_SORT_KEY = (3,)
+
+
+def index_key(values: List[Any]) -> tuple:
+    return tuple(sort_key(value) for value in values)
 
 
 class FixedInteger:
@@ -26,15 +60,31 @@ class Cell:
     """
 
     row_id = 0
+    # (position, length) of the cell in the page image it was read from.
+    slot: Optional[Tuple[int, int]] = None
 
-    def to_bytes(self):
+    @property
+    def key(self) -> Any:
+        """
+        The value cells are ordered by. For table b-trees that's the row_id.
+        """
+        return self.row_id
+
+    def to_bytes(self) -> bytes:
         return b""
 
+    def divider(self, left_child_page_number: int) -> "Cell":
+        """
+        Returns the interior cell which routes keys less than
+        this cell's key to left_child_page_number.
+        """
+        raise NotImplementedError()
+
     def __eq__(self, other: "Cell") -> bool:
-        return self.row_id == other.row_id
+        return self.key == other.key
 
     def __lt__(self, other: "Cell"):
-        return self.row_id < other.row_id
+        return self.key < other.key
 
     def __len__(self):
         return len(self.to_bytes())
@@ -61,6 +111,9 @@ class LeafPageCell(Cell):
     def __eq__(self, o: "LeafPageCell") -> bool:
         return self.record == o.record
 
+    def divider(self, left_child_page_number: int) -> "InteriorPageCell":
+        return InteriorPageCell(self.row_id, left_child_page_number)
+
     def to_bytes(self):
         """
         pass
@@ -108,6 +161,9 @@ class InteriorPageCell(Cell):
     def __eq__(self, o: "InteriorPageCell") -> bool:
         return self.row_id == o.row_id
 
+    def divider(self, left_child_page_number: int) -> "InteriorPageCell":
+        return InteriorPageCell(self.row_id, left_child_page_number)
+
     def to_bytes(self):
         buff = io.BytesIO()
         page_number = FixedInteger.to_bytes(4, self.left_child_page_number)
@@ -132,9 +188,102 @@ class InteriorPageCell(Cell):
         return InteriorPageCell(row_id, left_child_page_number)
 
 
+class IndexLeafPageCell(Cell):
+    """
+    Index B-Tree Leaf Cell (header 0x0a):
+
+    A varint which is the size of the payload.
+    A varint which is the number of key values.
+    The payload, a record of [row_id, *key_values, *included_values].
+
+    The row_id leads the payload so the table record format can be
+    reused as is. Cells are ordered by (*key_values, row_id) so that
+    duplicate values are still unique entries. Included values are
+    carried along so queries can be answered from the index alone.
+    """
+
+    def __init__(self, payload: Record, key_size: Optional[int] = None) -> None:
+        if isinstance(payload, Record):
+            self.record = payload
+        else:
+            self.record = Record(payload)
+
+        if key_size is None:
+            key_size = len(self.record.values) - 1
+
+        self.key_size = key_size
+
+    @property
+    def row_id(self):
+        return self.record.row_id
+
+    @property
+    def key(self) -> tuple:
+        values = [v for _, v in self.record.values]
+        return index_key(values[1 : self.key_size + 1] + values[:1])
+
+    def divider(self, left_child_page_number: int) -> "IndexInteriorPageCell":
+        # Interior cells only route so they don't need the included values.
+        record = Record(self.record.values[: self.key_size + 1])
+        return IndexInteriorPageCell(record, left_child_page_number)
+
+    def to_bytes(self):
+        record_bytes = self.record.to_bytes()
+        return (
+            Integer(len(record_bytes)).to_bytes()
+            + Integer(self.key_size).to_bytes()
+            + record_bytes
+        )
+
+    @staticmethod
+    def from_bytes(data) -> "IndexLeafPageCell":
+        record_size = Integer.from_bytes(data)
+        offset = record_size.content_length()
+        key_size = Integer.from_bytes(data[offset:])
+        offset += key_size.content_length()
+        record = Record.from_bytes(data[offset : offset + record_size.value])
+
+        return IndexLeafPageCell(record, key_size.value)
+
+
+class IndexInteriorPageCell(IndexLeafPageCell):
+    """
+    Index B-Tree Interior Cell (header 0x02):
+
+    A 4-byte big-endian page number which is the left child pointer.
+    A varint which is the size of the payload.
+    A varint which is the number of key values.
+    The payload, the key of the left most entry in the right subtree.
+    """
+
+    def __init__(
+        self,
+        payload: Record,
+        left_child_page_number,
+        key_size: Optional[int] = None,
+    ) -> None:
+        super().__init__(payload, key_size)
+        self.left_child_page_number = left_child_page_number
+
+    def to_bytes(self):
+        page_number = FixedInteger.to_bytes(4, self.left_child_page_number)
+        return page_number + super().to_bytes()
+
+    @staticmethod
+    def from_bytes(data) -> "IndexInteriorPageCell":
+        left_child_page_number = FixedInteger.from_bytes(data[:4])
+        cell = IndexLeafPageCell.from_bytes(data[4:])
+
+        return IndexInteriorPageCell(cell.record, left_child_page_number, cell.key_size)
+
+
 class Page:
     """
-    header is 8 bytes in size for leaf pages and 12 bytes for interior pages
+    header is 11 bytes in size for leaf pages and 15 bytes for interior pages
+
+    Format note: the page number at the start of the header used to be
+    1 byte (8 and 12 byte headers). Files in that layout are still read
+    and written, the Pager converts their pages, see Pager.read_bytes.
 
     Cells are expected to be sorted before hand useing cells.sort()
     """
@@ -198,7 +347,10 @@ class Page:
         return output
 
     def is_leaf(self):
-        return self.page_type == PageType.leaf
+        return self.page_type in (PageType.leaf, PageType.index_leaf)
+
+    def is_index(self):
+        return self.page_type in (PageType.index_leaf, PageType.index_interior)
 
     def add(self, *args, **kwargs):
         """
@@ -221,7 +373,7 @@ class Page:
         if there is we add it if not we raise PageFullException
         """
         # now check the key doesnt exist.
-        exists = self.find_cell(cell.row_id)
+        exists = self.find_cell(cell.key)
 
         if exists:
             self.remove_cell(exists)
@@ -232,24 +384,36 @@ class Page:
     def remove_cell(self, cell):
         self.cells.remove(cell)
 
-    def find_cell(self, row_id):
+    def find_cell(self, key):
         for cell in self.cells:
-            if cell.row_id == row_id:
+            if cell.key == key:
                 return cell
 
         return None
 
+    def is_interior(self):
+        return self.page_type in (PageType.interior, PageType.index_interior)
+
     def header_size(self):
-        if self.page_type == PageType.leaf:
-            return 8
+        if not self.is_interior():
+            return 11
+
+        return 15
 
-        return 12
+    def reserved_size(self):
+        """
+        Bytes at the end of the page which aren't used for cells.
+        """
+        if self.page_number == 0:
+            return SCHEMA_COOKIE_SIZE
+
+        return 0
 
     def __len__(self):
         header_size = self.header_size()
 
         [cell_offsets, cell_data] = self.cells_to_bytes()
-        return header_size + len(cell_offsets) + len(cell_data)
+        return header_size + len(cell_offsets) + len(cell_data) + self.reserved_size()
 
     def cells_to_bytes(self) -> List[bytes]:
         """
@@ -279,12 +443,12 @@ class Page:
         cell_content_offset = len(cell_data)
 
         # Seek negative offset of cell_content area.
-        buff.seek(-cell_content_offset, 2)
+        buff.seek(-(cell_content_offset + self.reserved_size()), 2)
         buff.write(cell_data)
 
         buff.seek(0)
         # Header
-        buff.write(FixedInteger.to_bytes(1, self.page_number))
+        buff.write(FixedInteger.to_bytes(PAGE_NUMBER_SIZE, self.page_number))
         # Header type.
         buff.write(FixedInteger.to_bytes(1, self.page_type.value))
         # Free block pointer. (Not implemented)
@@ -294,7 +458,7 @@ class Page:
         # Cell Content Offset
         buff.write(FixedInteger.to_bytes(2, cell_content_offset))
 
-        if self.page_type == PageType.interior:
+        if self.is_interior():
             buff.write(FixedInteger.to_bytes(4, self.right_child_page_number))
 
         # Right after the header we add the cell_offsets
@@ -311,13 +475,30 @@ class Page:
             return LeafPageCell.from_bytes(raw_bytes)
         if page_type == PageType.interior:
             return InteriorPageCell.from_bytes(raw_bytes)
+        if page_type == PageType.index_leaf:
+            return IndexLeafPageCell.from_bytes(raw_bytes)
+        if page_type == PageType.index_interior:
+            return IndexInteriorPageCell.from_bytes(raw_bytes)
 
         raise Exception(f"Unknown page type {page_type}")
 
+    @staticmethod
+    def header(data) -> Tuple[PageType, int]:
+        """
+        The page type and number of cells, without decoding the cells.
+        """
+        start = PAGE_NUMBER_SIZE
+        page_type = PageType(FixedInteger.from_bytes(data[start : start + 1]))
+        # Skip the free block pointer.
+        start += 3
+        number_of_cells = FixedInteger.from_bytes(data[start : start + 2])
+
+        return page_type, number_of_cells
+
     @staticmethod
     def from_bytes(data) -> "Page":
         buffer = io.BytesIO(data)
-        page_number = FixedInteger.from_bytes(buffer.read(1))
+        page_number = FixedInteger.from_bytes(buffer.read(PAGE_NUMBER_SIZE))
         page_type = PageType(FixedInteger.from_bytes(buffer.read(1)))
         # Free block pointer.
         _ = PageType(FixedInteger.from_bytes(buffer.read(2)))
@@ -329,7 +510,7 @@ class Page:
         # This is the right most child pointer. All the other pointers
         # are in an InteriorPageCell[key, pointer] but the right most
         # one is stored seperately.
-        if page_type == PageType.interior:
+        if page_type in (PageType.interior, PageType.index_interior):
             right_child_page_number = FixedInteger.from_bytes(buffer.read(4))
 
         cells = []
@@ -341,11 +522,14 @@ class Page:
             cell_offsets.append(FixedInteger.from_bytes(buffer.read(2)))
 
         # Now read cells
-        buffer.seek(-cell_content_offset, 2)
+        reserved_size = SCHEMA_COOKIE_SIZE if page_number == 0 else 0
+        buffer.seek(-(cell_content_offset + reserved_size), 2)
 
         for offset in cell_offsets:
+            position = buffer.tell()
             cell_content = buffer.read(offset)
             cell = Page.cell_from_bytes(page_type, cell_content)
+            cell.slot = (position, offset)
             cells.append(cell)
 
         return Page(
@@ -1,10 +1,20 @@
 from pathlib import Path
 import os
-from toysql.page import Page, PageType
+from toysql.page import (
+    Page,
+    PageType,
+    FixedInteger,
+    SCHEMA_COOKIE_SIZE,
+    PAGE_NUMBER_SIZE,
+)
 from toysql.exceptions import PageNotFoundException
 
 PageNumber = int
 
+# Files written before the page header's page number was widened to
+# PAGE_NUMBER_SIZE have a 1 byte page number, they're limited to 256 pages.
+LEGACY_PAGE_NUMBER_SIZE = 1
+
 
 class Pager:
     """
@@ -15,42 +25,171 @@ class Pager:
     def __init__(self, file_path: str, page_size=4096):
         file_name = Path(file_path)
         file_name.touch(exist_ok=True)
-        self.f = open(file_name, "rb+")
+        # Unbuffered so pages written by another pager
+        # on the same file are never read from a stale buffer.
+        self.f = open(file_name, "rb+", buffering=0)
         self.page_size = page_size
+        # Bumped on every write so readers can tell if a page they hold is stale.
+        self.changes = 0
 
         if self.is_corrupt():
             raise Exception(f"{file_path} is corrupted")
 
+        # Legacy files are read and written in their own layout, the
+        # rest of toysql only sees pages in the current one.
+        self.page_number_size = self.header_page_number_size()
+
     def is_corrupt(self) -> bool:
         """
         Checks if the current file is not exact page size * blocks.
         """
         return self.size() % self.page_size != 0
 
-    def new(self) -> PageNumber:
+    def header_page_number_size(self) -> int:
+        """
+        The size of the page number in the page headers of the file.
+
+        Page 0 tells the layouts apart. In the current one it starts with
+        a 4 byte 0, its page type and a 2 byte free block pointer which is
+        always 0. A legacy page 0 has its type in byte 1 and its number of
+        cells, never 0 once there's a table, in bytes 4-5.
+        """
+        if len(self) == 0:
+            return PAGE_NUMBER_SIZE
+
+        self.f.seek(0)
+        header = self.f.read(PAGE_NUMBER_SIZE + 3)
+        page_type = header[PAGE_NUMBER_SIZE]
+
+        if (
+            header[:PAGE_NUMBER_SIZE] == bytes(PAGE_NUMBER_SIZE)
+            and page_type in {t.value for t in PageType}
+            and header[PAGE_NUMBER_SIZE + 1 :] == bytes(2)
+        ):
+            return PAGE_NUMBER_SIZE
+
+        return LEGACY_PAGE_NUMBER_SIZE
+
+    def is_legacy(self) -> bool:
+        return self.page_number_size == LEGACY_PAGE_NUMBER_SIZE
+
+    def new(self, page_type=PageType.leaf) -> PageNumber:
         """
         Requests a new page
         """
         page_number = len(self)
-        page = Page(PageType.leaf, page_number, page_size=self.page_size)
+        page = Page(page_type, page_number, page_size=self.page_size)
         self.write(page)
 
         return page_number
 
     def read(self, page_number: PageNumber) -> Page:
+        return Page.from_bytes(self.read_bytes(page_number))
+
+    def read_bytes(self, page_number: PageNumber) -> bytes:
+        """
+        Returns the raw page image.
+
+        A legacy page gets a PAGE_NUMBER_SIZE page number in place of
+        its own so it's 3 bytes longer. Cells are read from the end
+        of the image so they're where Page.from_bytes expects them.
+        """
         if page_number is None or page_number >= len(self):
             raise PageNotFoundException(f"page_number: {page_number} not found")
 
         self.f.seek(page_number * self.page_size)
-        return Page.from_bytes(self.f.read(self.page_size))
+        data = self.f.read(self.page_size)
+
+        if self.is_legacy():
+            page_number_bytes = FixedInteger.to_bytes(PAGE_NUMBER_SIZE, page_number)
+            return page_number_bytes + data[LEGACY_PAGE_NUMBER_SIZE:]
+
+        return data
 
     def write(self, page: Page):
+        data = page.to_bytes()
+        reserved_size = page.reserved_size()
+
+        if self.is_legacy():
+            data = self.to_legacy(page, data)
+
+        if reserved_size and page.page_number < len(self):
+            # Leave the reserved bytes (the schema cookie) as they are.
+            data = data[:-reserved_size]
+
         self.f.seek(page.page_number * self.page_size)
-        self.f.write(page.to_bytes())
+        self.f.write(data)
         self.f.flush()
+        self.changes += 1
 
         return page
 
+    def to_legacy(self, page: Page, data: bytes) -> bytes:
+        """
+        The page image with a 1 byte page number, the 3 bytes saved
+        go between the cell offsets and the cells.
+        """
+        if page.page_number >= 1 << (8 * LEGACY_PAGE_NUMBER_SIZE):
+            raise Exception(
+                f"Page {page.page_number} can't be written, files with a "
+                f"{LEGACY_PAGE_NUMBER_SIZE} byte page number hold 256 pages"
+            )
+
+        end = page.header_size() + 2 * len(page.cells)
+        gap = bytes(PAGE_NUMBER_SIZE - LEGACY_PAGE_NUMBER_SIZE)
+
+        return (
+            FixedInteger.to_bytes(LEGACY_PAGE_NUMBER_SIZE, page.page_number)
+            + data[PAGE_NUMBER_SIZE:end]
+            + gap
+            + data[end:]
+        )
+
+    def write_bytes(self, page_number: PageNumber, offset: int, data: bytes):
+        """
+        Overwrites part of a page image, as read_bytes returns it,
+        without re-encoding the page.
+        """
+        if self.is_legacy():
+            assert offset >= PAGE_NUMBER_SIZE
+            offset -= PAGE_NUMBER_SIZE - LEGACY_PAGE_NUMBER_SIZE
+
+        self.write_raw(page_number, offset, data)
+
+    def write_raw(self, page_number: PageNumber, offset: int, data: bytes):
+        """
+        Overwrites part of a page in the file.
+        """
+        assert offset + len(data) <= self.page_size
+        self.f.seek(page_number * self.page_size + offset)
+        self.f.write(data)
+        self.f.flush()
+        self.changes += 1
+
+    def schema_cookie(self) -> int:
+        """
+        Counts changes to the schema, anything compiled
+        against an older schema is out of date.
+
+        It's read from page 0 every time as another pager
+        on the same file may have changed the schema.
+        """
+        if len(self) == 0:
+            return 0
+
+        self.f.seek(self.page_size - SCHEMA_COOKIE_SIZE)
+        return FixedInteger.from_bytes(self.f.read(SCHEMA_COOKIE_SIZE))
+
+    def set_schema_cookie(self, cookie: int):
+        self.write_raw(
+            0,
+            self.page_size - SCHEMA_COOKIE_SIZE,
+            FixedInteger.to_bytes(SCHEMA_COOKIE_SIZE, cookie),
+        )
+
+    def close(self):
+        self.f.close()
+
     def __len__(self) -> int:
         current = self.f.tell()
         size = self.size()
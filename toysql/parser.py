@@ -1,9 +1,88 @@
-from typing import Optional, List, Protocol
-from dataclasses import dataclass
-from toysql.lexer import Token, Kind, Keyword, Symbol, DataType
+from typing import Optional, List, Protocol, Union, Dict, Iterable, Iterator
+from dataclasses import dataclass, field
+import itertools
+from toysql.lexer import Token, Kind, Keyword, Symbol, DataType, to_sql
 from toysql.exceptions import ParsingException
 
-Expression = Token
+
+@dataclass
+class BinaryExpression:
+    """
+    An operator applied to two expressions eg: x = 1 or a AND b
+    """
+
+    op: Token
+    left: "Expression"
+    right: "Expression"
+
+
+@dataclass
+class UnaryExpression:
+    """
+    An operator applied to one expression eg: NOT x = 1
+    """
+
+    op: Token
+    operand: "Expression"
+
+
+@dataclass
+class FunctionExpression:
+    """
+    An aggregate function applied to a column eg: SUM(amount) or COUNT(*)
+    """
+
+    name: Token
+    argument: Token
+
+    def __str__(self) -> str:
+        return f"{self.name.value}({self.argument.value})"
+
+
+Expression = Union[Token, BinaryExpression, UnaryExpression]
+# A column (or aggregate) in the SELECT list.
+SelectItem = Union[Token, FunctionExpression]
+
+
+@dataclass
+class OrderingTerm:
+    """
+    A column (or aggregate) in an ORDER BY clause eg: name DESC
+    """
+
+    expression: Union[Token, FunctionExpression]
+    descending: bool = False
+
+    def __str__(self) -> str:
+        if isinstance(self.expression, FunctionExpression):
+            return str(self.expression)
+
+        return str(self.expression.value)
+
+
+@dataclass
+class Join:
+    """
+    A table joined to the one before it eg: LEFT JOIN customers ON ...
+    """
+
+    table: Token
+    on: "Expression"
+    # LEFT JOIN keeps rows without a match, with NULLs for the joined table.
+    left: bool = False
+
+
+AGGREGATE_FUNCTIONS = ["count", "sum", "min", "max", "avg"]
+
+COMPARISON_OPERATORS = [
+    Symbol.equal,
+    Symbol.not_equal,
+    Symbol.lt_gt,
+    Symbol.gt,
+    Symbol.gteq,
+    Symbol.lt,
+    Symbol.lteq,
+]
 
 
 def expect(token: Optional[Token], **kwargs):
@@ -48,9 +127,9 @@ class TokenCursor:
     def current(self):
         return self.tokens[self.pointer]
 
-    def peek(self):
+    def peek(self, offset=1):
         try:
-            return self.tokens[self.pointer + 1]
+            return self.tokens[self.pointer + offset]
         except IndexError:
             return None
 
@@ -67,6 +146,84 @@ class TokenCursor:
         return self.pointer >= len(self.tokens)
 
 
+def parse_operand(cursor: TokenCursor) -> Token:
+    """
+    An operand is either a literal or a column name.
+    """
+    for kind in [Kind.datatype, Kind.identifier]:
+        if match(cursor.peek(), kind=kind):
+            return cursor.move()
+
+    raise ParsingException("Expected expression")
+
+
+def parse_comparison(cursor: TokenCursor) -> BinaryExpression:
+    left = parse_operand(cursor)
+    op = cursor.peek()
+
+    if op is None or op.type not in COMPARISON_OPERATORS:
+        raise ParsingException("Expected comparison operator")
+
+    cursor.move()
+    right = parse_operand(cursor)
+
+    return BinaryExpression(op, left, right)
+
+
+def parse_primary(cursor: TokenCursor) -> Expression:
+    """
+    A comparison or a parenthesized expression.
+    """
+    if not match(cursor.peek(), type=Symbol.left_paren):
+        return parse_comparison(cursor)
+
+    cursor.move()
+    expression = parse_expression(cursor)
+
+    if not match(cursor.peek(), type=Symbol.right_paren):
+        raise ParsingException("Expected )")
+
+    cursor.move()
+    return expression
+
+
+def parse_not(cursor: TokenCursor) -> Expression:
+    if match(cursor.peek(), type=Keyword._not):
+        op = cursor.move()
+        return UnaryExpression(op, parse_not(cursor))
+
+    return parse_primary(cursor)
+
+
+def parse_and(cursor: TokenCursor) -> Expression:
+    expression = parse_not(cursor)
+
+    while match(cursor.peek(), type=Keyword._and):
+        op = cursor.move()
+        expression = BinaryExpression(op, expression, parse_not(cursor))
+
+    return expression
+
+
+def parse_expression(cursor: TokenCursor) -> Expression:
+    """
+    Parses a WHERE clause, from loosest to tightest binding:
+
+        $expression OR $expression
+        $expression AND $expression
+        NOT $expression
+        ( $expression )
+        $operand $operator $operand
+    """
+    expression = parse_and(cursor)
+
+    while match(cursor.peek(), type=Keyword._or):
+        op = cursor.move()
+        expression = BinaryExpression(op, expression, parse_and(cursor))
+
+    return expression
+
+
 class Statement(Protocol):
     @staticmethod
     def parse(cursor: TokenCursor) -> "Statement":
@@ -76,11 +233,59 @@ class Statement(Protocol):
 @dataclass
 class SelectStatement(Statement):
     _from: Token
-    items: List[Expression]
+    items: List[SelectItem]
+    where: Optional[Expression] = None
+    limit: Optional[Token] = None
+    offset: Optional[Token] = None
+    group_by: List[Token] = field(default_factory=list)
+    order_by: List[OrderingTerm] = field(default_factory=list)
+    joins: List[Join] = field(default_factory=list)
+
+    @property
+    def aggregates(self) -> List[FunctionExpression]:
+        return [i for i in self.items if isinstance(i, FunctionExpression)]
+
+    @staticmethod
+    def parse_function(cursor: TokenCursor, name: Token) -> FunctionExpression:
+        """
+        The rest of an aggregate call after its name: ( column ) or ( * )
+        """
+        if str(name.value) not in AGGREGATE_FUNCTIONS:
+            raise ParsingException(f"Unknown function {name.value}")
+
+        cursor.move()
+        argument = cursor.peek()
+
+        if argument is None or not (
+            match(argument, kind=Kind.identifier)
+            or (name.value == "count" and match(argument, type=Symbol.asterisk))
+        ):
+            raise ParsingException(f"Expected column in {name.value}()")
+
+        cursor.move()
+        if not match(cursor.peek(), type=Symbol.right_paren):
+            raise ParsingException("Expected )")
+
+        cursor.move()
+        return FunctionExpression(name, argument)
 
     @staticmethod
-    def parse_expressions(cursor: TokenCursor, delimiters: List[Token]) -> List[Token]:
-        expressions = []
+    def parse_count(cursor: TokenCursor) -> Token:
+        """
+        The value of LIMIT or OFFSET, an integer or a parameter.
+        """
+        token = cursor.peek()
+
+        if token is None or token.kind != Kind.datatype or token.type == DataType.text:
+            raise ParsingException("Expected integer")
+
+        return cursor.move()
+
+    @staticmethod
+    def parse_expressions(
+        cursor: TokenCursor, delimiters: List[Token]
+    ) -> List[SelectItem]:
+        expressions: List[SelectItem] = []
 
         while not cursor.is_complete():
             for delimiter in delimiters:
@@ -115,6 +320,12 @@ class SelectStatement(Statement):
                 except:
                     raise ParsingException("Expected expression")
 
+            if exp.kind == Kind.identifier and match(
+                cursor.peek(), type=Symbol.left_paren
+            ):
+                expressions.append(SelectStatement.parse_function(cursor, exp))
+                continue
+
             expressions.append(exp)
 
         return expressions
@@ -128,6 +339,11 @@ class SelectStatement(Statement):
         $expression [, ...]
         FROM
         $table-name
+        [[INNER | LEFT [OUTER]] JOIN $table-name ON $expression] ...
+        [WHERE $expression]
+        [GROUP BY $column-name [, ...]]
+        [ORDER BY $column-name [ASC|DESC] [, ...]]
+        [LIMIT $count [OFFSET $count]]
         """
         # Implement parse for select statement.
         expect(cursor.current(), type=Keyword.select)
@@ -156,6 +372,96 @@ class SelectStatement(Statement):
         except LookupError:
             raise ParsingException("Expected table name")
 
+        joins = []
+        while True:
+            left = False
+            if match(cursor.peek(), type=Keyword.left):
+                cursor.move()
+                left = True
+
+                if match(cursor.peek(), type=Keyword.outer):
+                    cursor.move()
+            elif match(cursor.peek(), type=Keyword.inner):
+                cursor.move()
+            elif not match(cursor.peek(), type=Keyword.join):
+                break
+
+            if not match(cursor.peek(), type=Keyword.join):
+                raise ParsingException("Expected JOIN")
+
+            cursor.move()
+            if not match(cursor.peek(), kind=Kind.identifier):
+                raise ParsingException("Expected table name")
+
+            table = cursor.move()
+            if not match(cursor.peek(), type=Keyword.on):
+                raise ParsingException("Expected ON")
+
+            cursor.move()
+            joins.append(Join(table, parse_expression(cursor), left))
+
+        where = None
+        if match(cursor.peek(), type=Keyword.where):
+            cursor.move()
+            where = parse_expression(cursor)
+
+        group_by = []
+        if match(cursor.peek(), type=Keyword.group):
+            cursor.move()
+            if not match(cursor.peek(), type=Keyword.by):
+                raise ParsingException("Expected BY")
+
+            cursor.move()
+            while True:
+                if not match(cursor.peek(), kind=Kind.identifier):
+                    raise ParsingException("Expected column name")
+
+                group_by.append(cursor.move())
+
+                if not match(cursor.peek(), type=Symbol.comma):
+                    break
+
+                cursor.move()
+
+        order_by = []
+        if match(cursor.peek(), type=Keyword.order):
+            cursor.move()
+            if not match(cursor.peek(), type=Keyword.by):
+                raise ParsingException("Expected BY")
+
+            cursor.move()
+            while True:
+                if not match(cursor.peek(), kind=Kind.identifier):
+                    raise ParsingException("Expected column name")
+
+                term: Union[Token, FunctionExpression] = cursor.move()
+                if match(cursor.peek(), type=Symbol.left_paren):
+                    term = SelectStatement.parse_function(cursor, term)
+
+                descending = False
+                if match(cursor.peek(), type=Keyword.asc):
+                    cursor.move()
+                elif match(cursor.peek(), type=Keyword.desc):
+                    cursor.move()
+                    descending = True
+
+                order_by.append(OrderingTerm(term, descending))
+
+                if not match(cursor.peek(), type=Symbol.comma):
+                    break
+
+                cursor.move()
+
+        limit = None
+        offset = None
+        if match(cursor.peek(), type=Keyword.limit):
+            cursor.move()
+            limit = SelectStatement.parse_count(cursor)
+
+            if match(cursor.peek(), type=Keyword.offset):
+                cursor.move()
+                offset = SelectStatement.parse_count(cursor)
+
         if match(cursor.peek(), type=Symbol.semicolon):
             try:
                 cursor.move()
@@ -168,14 +474,25 @@ class SelectStatement(Statement):
             except StopIteration:
                 pass
 
-        return SelectStatement(_from=from_identifier, items=select_items)
+        return SelectStatement(
+            _from=from_identifier,
+            items=select_items,
+            where=where,
+            limit=limit,
+            offset=offset,
+            group_by=group_by,
+            order_by=order_by,
+            joins=joins,
+        )
 
 
 @dataclass
 class InsertStatement(Statement):
-    values: List[Token]
+    # One list of tokens per VALUES row.
+    values: List[List[Token]]
     into: Token
     columns: List[Token]
+    select: Optional[SelectStatement] = None
 
     @staticmethod
     def parse_values(cursor: TokenCursor) -> List[Token]:
@@ -232,7 +549,11 @@ class InsertStatement(Statement):
         or
 
             INSERT INTO table_name
-            VALUES (value1, value2, value3, ...);
+            VALUES (value1, value2, value3, ...), (value1, ...), ...;
+
+        or
+
+            INSERT INTO table_name SELECT ...;
         """
         expect(cursor.current(), type=Keyword.insert)
 
@@ -249,17 +570,33 @@ class InsertStatement(Statement):
             raise ParsingException("Expected table name")
 
         columns = []
-        try:
-            expect(cursor.peek(), type=Keyword.values)
-            cursor.move()
-        except LookupError:
+        if not match(cursor.peek(), type=Keyword.values) and not match(
+            cursor.peek(), type=Keyword.select
+        ):
             # if next token is not VALUES it might be declaring columns
             try:
                 columns = InsertStatement.parse_values(cursor)
             except LookupError:
                 raise ParsingException("Expected values keyword")
 
-        values = InsertStatement.parse_values(cursor)
+        if match(cursor.peek(), type=Keyword.select):
+            cursor.move()
+            select = SelectStatement.parse(cursor)
+            return InsertStatement(
+                into=table_identifier, values=[], columns=columns, select=select
+            )
+
+        try:
+            expect(cursor.peek(), type=Keyword.values)
+            cursor.move()
+        except LookupError:
+            raise ParsingException("Expected values keyword")
+
+        values = [InsertStatement.parse_values(cursor)]
+
+        while match(cursor.peek(), type=Symbol.comma):
+            cursor.move()
+            values.append(InsertStatement.parse_values(cursor))
 
         if match(cursor.peek(), type=Symbol.semicolon):
             try:
@@ -271,6 +608,99 @@ class InsertStatement(Statement):
         return InsertStatement(into=table_identifier, values=values, columns=columns)
 
 
+@dataclass
+class Assignment:
+    """
+    column = value in an UPDATE's SET clause.
+    """
+
+    column: Token
+    value: Token
+
+
+@dataclass
+class UpdateStatement(Statement):
+    table: Token
+    assignments: List[Assignment]
+    where: Optional[Expression] = None
+
+    @staticmethod
+    def parse_assignments(cursor: TokenCursor) -> List[Assignment]:
+        """
+        Looks for a comma seperated list of column = value
+        """
+        assignments = []
+
+        while len(assignments) == 0 or match(cursor.peek(), type=Symbol.comma):
+            if len(assignments) > 0:
+                cursor.move()
+
+            try:
+                expect(cursor.peek(), kind=Kind.identifier)
+                column = cursor.move()
+            except LookupError:
+                raise ParsingException("Expected column name")
+
+            try:
+                expect(cursor.peek(), type=Symbol.equal)
+                cursor.move()
+            except LookupError:
+                raise ParsingException(f"Expected {Symbol.equal.value}")
+
+            value = cursor.peek()
+            if value is None or not (
+                value.kind == Kind.datatype or value.type == Keyword.null
+            ):
+                raise ParsingException("Expected value")
+
+            cursor.move()
+
+            assignments.append(Assignment(column, value))
+
+        return assignments
+
+    @staticmethod
+    def parse(cursor: TokenCursor) -> "UpdateStatement":
+        """
+        Parses an update statement in the format:
+
+            UPDATE table_name
+            SET column1 = value1, column2 = value2, ...
+            [WHERE $expression];
+        """
+        expect(cursor.current(), type=Keyword.update)
+
+        try:
+            expect(cursor.peek(), kind=Kind.identifier)
+            table_identifier = cursor.move()
+        except LookupError:
+            raise ParsingException("Expected table name")
+
+        try:
+            expect(cursor.peek(), type=Keyword.set)
+            cursor.move()
+        except LookupError:
+            raise ParsingException("Expected set keyword")
+
+        assignments = UpdateStatement.parse_assignments(cursor)
+
+        where = None
+        if match(cursor.peek(), type=Keyword.where):
+            cursor.move()
+            where = parse_expression(cursor)
+
+        if match(cursor.peek(), type=Symbol.semicolon):
+            try:
+                cursor.move()
+                cursor.move()
+            except StopIteration:
+                pass
+
+        return UpdateStatement(
+            table=table_identifier, assignments=assignments, where=where
+        )
+
+
 @dataclass
 class ColumnDefinition:
     name: Token
@@ -282,6 +712,8 @@ class ColumnDefinition:
 class CreateStatement(Statement):
     table: Token
     columns: List[ColumnDefinition]
+    # Storage options eg: WITH (fillfactor=90)
+    options: Dict[str, Token] = field(default_factory=dict)
 
     @staticmethod
     def parse_columns(cursor: TokenCursor) -> List[ColumnDefinition]:
@@ -343,6 +775,57 @@ class CreateStatement(Statement):
 
         return columns
 
+    @staticmethod
+    def parse_options(cursor: TokenCursor) -> Dict[str, Token]:
+        """
+        Parses the storage options in the format:
+            WITH (name1=value1, name2=value2, ...)
+        """
+        options = {}
+        if not match(cursor.peek(), type=Keyword._with):
+            return options
+
+        cursor.move()
+
+        try:
+            expect(cursor.peek(), type=Symbol.left_paren)
+            cursor.move()
+        except LookupError:
+            raise ParsingException(f"Expected {Symbol.left_paren.value}")
+
+        while not match(cursor.peek(), type=Symbol.right_paren):
+            if len(options) > 0:
+                try:
+                    expect(cursor.peek(), type=Symbol.comma)
+                    cursor.move()
+                except LookupError:
+                    raise ParsingException(f"Expected {Symbol.comma.value}")
+
+            try:
+                expect(cursor.peek(), kind=Kind.identifier)
+                name = cursor.move()
+            except LookupError:
+                raise ParsingException(f"Expected option name")
+
+            try:
+                expect(cursor.peek(), type=Symbol.equal)
+                cursor.move()
+            except LookupError:
+                raise ParsingException(f"Expected {Symbol.equal.value}")
+
+            value = cursor.peek()
+            if value is None or value.kind not in (Kind.datatype, Kind.identifier):
+                raise ParsingException(f"Expected option value")
+
+            options[str(name.value)] = cursor.move()
+
+        cursor.move()
+
+        if len(options) == 0:
+            raise ParsingException(f"Expected option name")
+
+        return options
+
     @staticmethod
     def parse(cursor: TokenCursor) -> "CreateStatement":
         """
@@ -352,7 +835,7 @@ class CreateStatement(Statement):
                 column2 datatype,
                 column3 datatype,
                ....
-            );
+            ) [WITH (fillfactor=90, split=append)];
         """
         expect(cursor.current(), type=Keyword.create)
 
@@ -369,6 +852,7 @@ class CreateStatement(Statement):
             raise ParsingException(f"Expected table name")
 
         columns = CreateStatement.parse_columns(cursor)
+        options = CreateStatement.parse_options(cursor)
 
         if match(cursor.peek(), type=Symbol.semicolon):
             try:
@@ -377,12 +861,206 @@ class CreateStatement(Statement):
             except StopIteration:
                 pass
 
-        return CreateStatement(table=table_identifier, columns=columns)
+        return CreateStatement(table=table_identifier, columns=columns, options=options)
+
+
+def parse_identifiers(cursor: TokenCursor) -> List[Token]:
+    """
+    Looks for a parenthesised comma seperated list of identifiers
+    eg: (column1, column2)
+    """
+    try:
+        expect(cursor.peek(), type=Symbol.left_paren)
+        cursor.move()
+    except LookupError:
+        raise ParsingException(f"Expected {Symbol.left_paren.value}")
+
+    identifiers = []
+    while not match(cursor.peek(), type=Symbol.right_paren):
+        if len(identifiers) > 0:
+            try:
+                expect(cursor.peek(), type=Symbol.comma)
+                cursor.move()
+            except LookupError:
+                raise ParsingException(f"Expected {Symbol.comma.value}")
+
+        try:
+            expect(cursor.peek(), kind=Kind.identifier)
+            identifiers.append(cursor.move())
+        except LookupError:
+            raise ParsingException(f"Expected column name")
+
+    cursor.move()
+
+    if len(identifiers) == 0:
+        raise ParsingException(f"Expected column name")
+
+    return identifiers
+
+
+@dataclass
+class CreateIndexStatement(Statement):
+    name: Token
+    table: Token
+    columns: List[Token]
+    include: List[Token]
+
+    @staticmethod
+    def parse(cursor: TokenCursor) -> "CreateIndexStatement":
+        """
+        Parses a create index statement in the format:
+            CREATE INDEX index_name ON table_name (column1, column2, ...)
+            [INCLUDE (column3, ...)];
+
+        Included columns are stored in the index but aren't part of the key.
+        """
+        expect(cursor.current(), type=Keyword.create)
+        # Not an index, let CreateStatement have a go.
+        expect(cursor.peek(), type=Keyword.index)
+        cursor.move()
+
+        try:
+            expect(cursor.peek(), kind=Kind.identifier)
+            name = cursor.move()
+        except LookupError:
+            raise ParsingException(f"Expected index name")
+
+        try:
+            expect(cursor.peek(), type=Keyword.on)
+            cursor.move()
+        except LookupError:
+            raise ParsingException(f"Expected on keyword")
+
+        try:
+            expect(cursor.peek(), kind=Kind.identifier)
+            table_identifier = cursor.move()
+        except LookupError:
+            raise ParsingException(f"Expected table name")
+
+        columns = parse_identifiers(cursor)
+
+        include = []
+        if match(cursor.peek(), type=Keyword.include):
+            cursor.move()
+            include = parse_identifiers(cursor)
+
+        if match(cursor.peek(), type=Symbol.semicolon):
+            try:
+                cursor.move()
+                cursor.move()
+            except StopIteration:
+                pass
+
+        return CreateIndexStatement(
+            name=name, table=table_identifier, columns=columns, include=include
+        )
+
+
+@dataclass
+class AnalyzeStatement(Statement):
+    table: Optional[Token] = None
+
+    @staticmethod
+    def parse(cursor: TokenCursor) -> "AnalyzeStatement":
+        """
+        Parses an analyze statement in the format:
+            ANALYZE [table_name];
+
+        Without a table name every table is analyzed.
+        """
+        expect(cursor.current(), type=Keyword.analyze)
+
+        table_identifier = None
+        if match(cursor.peek(), kind=Kind.identifier):
+            table_identifier = cursor.move()
+
+        if match(cursor.peek(), type=Symbol.semicolon):
+            cursor.move()
+
+        try:
+            cursor.move()
+        except StopIteration:
+            pass
+
+        return AnalyzeStatement(table=table_identifier)
+
+
+@dataclass
+class ExplainStatement(Statement):
+    statement: Statement
+    # EXPLAIN QUERY PLAN rather than the program's instructions.
+    query_plan: bool = False
+    # EXPLAIN ANALYZE, runs the statement and profiles each instruction.
+    analyze: bool = False
+    # The explained statement's tokens, for its sql text.
+    tokens: List[Token] = field(default_factory=list)
+
+    @staticmethod
+    def parse(cursor: TokenCursor) -> "ExplainStatement":
+        """
+        Parses an explain statement in the format:
+            EXPLAIN [QUERY PLAN | ANALYZE] statement;
+
+        QUERY and PLAN aren't keywords so they can still be used as names.
+        ANALYZE followed by a keyword is EXPLAIN ANALYZE otherwise
+        it's the ANALYZE statement being explained.
+        """
+        expect(cursor.current(), type=Keyword.explain)
+
+        query_plan = False
+        analyze = False
+        if match(cursor.peek(), type=Keyword.analyze) and match(
+            cursor.peek(2), kind=Kind.keyword
+        ):
+            cursor.move()
+            analyze = True
+        elif match(cursor.peek(), kind=Kind.identifier, value="query"):
+            cursor.move()
+
+            try:
+                expect(cursor.peek(), kind=Kind.identifier, value="plan")
+                cursor.move()
+            except LookupError:
+                raise ParsingException("Expected PLAN")
+
+            query_plan = True
+
+        try:
+            cursor.move()
+        except StopIteration:
+            raise ParsingException("Expected a statement to explain")
+
+        start = cursor.pointer
+        tokens = list(
+            itertools.takewhile(
+                lambda token: token.type != Symbol.semicolon, cursor.tokens[start:]
+            )
+        )
+
+        for parser in STATEMENTS:
+            try:
+                statement = parser.parse(cursor)
+                return ExplainStatement(statement, query_plan, analyze, tokens)
+            except LookupError:
+                continue
+
+        raise ParsingException("Expected a statement to explain")
+
+
+# Each statement's parser, tried in order.
+STATEMENTS: List[Statement] = [
+    SelectStatement,
+    CreateIndexStatement,
+    CreateStatement,
+    InsertStatement,
+    UpdateStatement,
+    AnalyzeStatement,
+]
 
 
 def parse(tokens: List[Token]):
     stmts = []
-    parsers: List[Statement] = [SelectStatement, CreateStatement, InsertStatement]
+    parsers: List[Statement] = [*STATEMENTS, ExplainStatement]
     cursor = TokenCursor(tokens)
 
     while not cursor.is_complete():
@@ -398,3 +1076,45 @@ def parse(tokens: List[Token]):
         if pointer == cursor.pointer:
             break
     return stmts
+
+
+def split_statements(tokens: Iterable[Token]) -> Iterator[List[Token]]:
+    """
+    Groups tokens into statements as each ; arrives, so only
+    one statement's tokens are held at a time.
+    """
+    statement = []
+
+    for token in tokens:
+        statement.append(token)
+
+        if token.type == Symbol.semicolon:
+            yield statement
+            statement = []
+
+    if statement:
+        yield statement
+
+
+def parse_statements(tokens: List[Token]) -> List[Statement]:
+    """
+    parse for one group from split_statements, raises rather than
+    returning nothing when the tokens aren't a statement so
+    a bad statement in a script isn't skipped.
+    """
+    statements = parse(tokens)
+
+    if not statements and any(token.type != Symbol.semicolon for token in tokens):
+        loc = tokens[0].loc
+        where = f" at location {loc.line}:{loc.col}" if loc is not None else ""
+        raise ParsingException(f"Invalid statement{where}: {to_sql(tokens)}")
+
+    return statements
+
+
+def parse_stream(tokens: Iterable[Token]) -> Iterator[Statement]:
+    """
+    Lazy version of parse for tokens from lex_stream.
+    """
+    for statement in split_statements(tokens):
+        yield from parse_statements(statement)
@@ -0,0 +1,127 @@
+from typing import Any, Iterator, List, Optional, Tuple
+import heapq
+import itertools
+import pickle
+import tempfile
+
+from toysql.page import sort_key
+
+# Rows a Sorter sorts in memory before writing them out as a sorted run.
+SORT_BUFFER = 10_000
+
+
+class Descending:
+    """
+    Wraps a sort key so it sorts the other way round.
+    """
+
+    __slots__ = ["key"]
+
+    def __init__(self, key: Any):
+        self.key = key
+
+    def __lt__(self, other: "Descending") -> bool:
+        return other.key < self.key
+
+    def __eq__(self, other: Any) -> bool:
+        return self.key == other.key
+
+
+class Sorter:
+    """
+    Sorts rows of [*keys, *values] by their keys and returns the values.
+    descending has a flag for each key.
+
+    Rows are sorted in memory until there are buffer_size of them,
+    then they're written to a temp file as a sorted run and the runs
+    are merged with heapq.merge at the end.
+
+    When only the first limit rows are wanted (ORDER BY ... LIMIT) and
+    they fit in the buffer it keeps a heap of the best limit rows
+    seen so far instead, the rest of the input is never sorted.
+
+    Rows with equal keys stay in the order they were inserted.
+    """
+
+    def __init__(
+        self,
+        descending: List[bool],
+        limit: Optional[int] = None,
+        buffer_size: int = SORT_BUFFER,
+    ):
+        self.descending = descending
+        self.key_count = len(descending)
+        self.buffer_size = max(1, buffer_size)
+        self.limit = limit if limit is not None and limit <= self.buffer_size else None
+        # Numbers the rows so ties keep their order.
+        self.sequence = itertools.count()
+        # (sequence, row) or for top-n a heap of (Descending(key), sequence, row)
+        self.rows: List[Any] = []
+        self.runs: List[Any] = []
+
+    def key(self, entry: Tuple[int, List[Any]]) -> tuple:
+        sequence, row = entry
+        return (
+            *(
+                Descending(sort_key(value)) if descending else sort_key(value)
+                for value, descending in zip(row, self.descending)
+            ),
+            sequence,
+        )
+
+    def insert(self, row: List[Any]):
+        entry = (next(self.sequence), row)
+
+        if self.limit is not None:
+            if self.limit == 0:
+                return
+
+            # A max heap of the best rows, the worst is on top
+            # and is replaced when a better one comes along.
+            item = (Descending(self.key(entry)), entry)
+            if len(self.rows) < self.limit:
+                heapq.heappush(self.rows, item)
+            elif self.rows[0][0] < item[0]:
+                heapq.heapreplace(self.rows, item)
+
+            return
+
+        self.rows.append(entry)
+        if len(self.rows) >= self.buffer_size:
+            self.spill()
+
+    def spill(self):
+        self.rows.sort(key=self.key)
+        run = tempfile.TemporaryFile()
+
+        for entry in self.rows:
+            pickle.dump(entry, run)
+
+        run.seek(0)
+        self.runs.append(run)
+        self.rows = []
+
+    @staticmethod
+    def read(run) -> Iterator[Tuple[int, List[Any]]]:
+        try:
+            while True:
+                yield pickle.load(run)
+        except EOFError:
+            run.close()
+
+    def sorted(self) -> Iterator[List[Any]]:
+        """
+        The values of each row in order.
+        """
+        if self.limit is not None:
+            entries: Iterator[Any] = iter(
+                sorted((entry for _, entry in self.rows), key=self.key)
+            )
+        else:
+            self.rows.sort(key=self.key)
+            entries = heapq.merge(
+                *[self.read(run) for run in self.runs], self.rows, key=self.key
+            )
+
+        for _, row in entries:
+            yield row[self.key_count :]
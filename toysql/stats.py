@@ -0,0 +1,206 @@
+from typing import Any, List, Tuple
+from collections import Counter
+from dataclasses import dataclass
+import bisect
+import json
+import math
+
+from toysql.lexer import Symbol
+from toysql.page import Page, PageType, sort_key
+from toysql.pager import Pager
+
+# Leaf pages ANALYZE decodes, spread evenly across the b-tree.
+SAMPLE_PAGES = 64
+# Values in a column's histogram, the bounds of buckets which
+# each hold about the same number of rows.
+BUCKETS = 10
+# Long text is cut down in histograms so a table's stats fit in a cell.
+HISTOGRAM_TEXT = 16
+# Child pages per interior page the costs assume, see seek_cost.
+FANOUT = 64
+# Guesses for how many rows a comparison keeps when
+# there are no stats or the value isn't known until it runs.
+EQUAL_SELECTIVITY = 0.1
+RANGE_SELECTIVITY = 1 / 3
+
+
+def seek_cost(page_count: float) -> float:
+    """
+    Pages read finding one key, a path from the root to a leaf.
+    """
+    return 1 + math.log(max(page_count, 1), FANOUT)
+
+
+@dataclass
+class ColumnStats:
+    """
+    What ANALYZE learnt about one column's values.
+
+    histogram is an equi-depth histogram: sorted values from the sample
+    with about as many rows between each pair.
+    """
+
+    distinct: int
+    nulls: int
+    histogram: List[Any]
+
+    def selectivity(self, op: Symbol, value: Any, row_count: int) -> float:
+        """
+        The fraction of rows where column <op> value.
+        """
+        if row_count == 0 or value is None:
+            # Nothing compares equal to NULL.
+            return 0.0
+
+        non_null = max(row_count - self.nulls, 0) / row_count
+        keys = [sort_key(v) for v in self.histogram]
+        key = sort_key(value)
+
+        if op in (Symbol.equal, Symbol.not_equal, Symbol.lt_gt):
+            equal = non_null / max(self.distinct, 1)
+            if keys and not keys[0] <= key <= keys[-1]:
+                equal = 0.0
+
+            return equal if op == Symbol.equal else non_null - equal
+
+        if not keys:
+            return non_null * RANGE_SELECTIVITY
+
+        below = bisect.bisect_left(keys, key) / len(keys)
+        at_or_below = bisect.bisect_right(keys, key) / len(keys)
+        fractions = {
+            Symbol.lt: below,
+            Symbol.lteq: at_or_below,
+            Symbol.gt: 1 - at_or_below,
+            Symbol.gteq: 1 - below,
+        }
+
+        return non_null * fractions[op]
+
+
+@dataclass
+class Stats:
+    """
+    A row of the stats table: the size of a table or index b-tree
+    and its column stats, in record position order.
+    """
+
+    name: str
+    table_name: str
+    row_count: int
+    page_count: int
+    columns: List[ColumnStats]
+
+    @staticmethod
+    def from_row(row: List[Any]) -> "Stats":
+        _, name, table_name, row_count, page_count, distinct, nulls, histograms = row
+        columns = [
+            ColumnStats(*column)
+            for column in zip(
+                json.loads(distinct), json.loads(nulls), json.loads(histograms)
+            )
+        ]
+
+        return Stats(name, table_name, row_count, page_count, columns)
+
+
+def estimate_distinct(values: List[Any], total: int) -> int:
+    """
+    Guesses the distinct values in a column of total values from a sample.
+
+    Values seen once in the sample hint at many more that weren't
+    sampled at all, this is the Haas & Stokes estimator postgres uses:
+    n * d / (n - f1 + f1 * n / N)
+    """
+    if not values:
+        return 0
+
+    counts = Counter(values)
+    d = len(counts)
+    n = len(values)
+
+    if n >= total:
+        return d
+
+    f1 = sum(1 for count in counts.values() if count == 1)
+    estimate = n * d / (n - f1 + f1 * n / total)
+
+    return min(total, max(d, round(estimate)))
+
+
+def histogram(values: List[Any]) -> List[Any]:
+    ordered = sorted(values, key=sort_key)
+    if not ordered:
+        return []
+
+    bounds = [
+        ordered[round(i * (len(ordered) - 1) / BUCKETS)] for i in range(BUCKETS + 1)
+    ]
+
+    return [v[:HISTOGRAM_TEXT] if isinstance(v, str) else v for v in bounds]
+
+
+def analyze(
+    pager: Pager,
+    root_page_number: int,
+    positions: List[int],
+    sample_pages: int = SAMPLE_PAGES,
+) -> List[Any]:
+    """
+    Reads the stats of the b-tree at root_page_number for its row in the
+    stats table: [row_count, page_count, distinct_values, null_values, histograms]
+    the last three are JSON lists with a value for each record position.
+
+    Interior pages are decoded to find the leaves but the row count comes
+    from each leaf's header. Only sample_pages of the leaves are decoded
+    so distinct values and histograms are estimates on big tables.
+    """
+    leaves: List[Tuple[int, int]] = []
+    page_count = 0
+    page_numbers = [root_page_number]
+
+    while page_numbers:
+        page_number = page_numbers.pop()
+        data = pager.read_bytes(page_number)
+        page_type, number_of_cells = Page.header(data)
+        page_count += 1
+
+        if page_type in (PageType.leaf, PageType.index_leaf):
+            leaves.append((page_number, number_of_cells))
+            continue
+
+        page = Page.from_bytes(data)
+        children = [cell.left_child_page_number for cell in page.cells]
+        # Reversed so the leaves are popped in key order.
+        page_numbers.extend(reversed(children + [page.right_child_page_number]))
+
+    row_count = sum(number_of_cells for _, number_of_cells in leaves)
+    step = max(1, len(leaves) / max(sample_pages, 1))
+    sampled = [leaves[int(i * step)] for i in range(min(len(leaves), sample_pages))]
+    records = []
+
+    for page_number, _ in sampled:
+        page = Page.from_bytes(pager.read_bytes(page_number))
+        records.extend(cell.record.values for cell in page.cells)
+
+    scale = row_count / len(records) if records else 0
+    distinct = []
+    nulls = []
+    histograms = []
+
+    for position in positions:
+        values = [record[position][1] for record in records]
+        non_null = [v for v in values if v is not None]
+        null_count = round((len(values) - len(non_null)) * scale)
+
+        distinct.append(estimate_distinct(non_null, row_count - null_count))
+        nulls.append(null_count)
+        histograms.append(histogram(non_null))
+
+    return [
+        row_count,
+        page_count,
+        json.dumps(distinct),
+        json.dumps(nulls),
+        json.dumps(histograms),
+    ]
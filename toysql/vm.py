@@ -1,141 +1,1753 @@
-from toysql.compiler import Program, Opcode
+from toysql.compiler import (
+    Program,
+    Instruction,
+    Opcode,
+    JUMP_IF_NULL,
+    OPFLAG_BULK_BUILD,
+    OPFLAG_ISUPDATE,
+    OPFLAG_APPEND,
+    OPFLAG_SEEKEQ,
+    OPFLAG_SKIP_NULLS,
+    ANALYZE_COLUMNS,
+    describe_operand,
+)
 from toysql.record import DataType, Record
-from toysql.btree import BTree
-from typing import cast
+from toysql.btree import BTree, CursorIO, SplitPolicy
+from toysql.aggregate import HashAggregate, MAX_GROUPS
+from toysql.sorter import Sorter, SORT_BUFFER
+from toysql.join import HashJoin, JOIN_BUFFER
+from toysql.stats import analyze
+from toysql.page import Page, PageType, sort_key, index_key
+from toysql.exceptions import (
+    DuplicateKeyException,
+    NotFoundException,
+    BindingException,
+    SchemaChangedException,
+)
+from typing import cast, Optional, Sequence, Any, Callable, Dict, List, Tuple, Union
+from dataclasses import dataclass, field
+from array import array
+import heapq
+import logging
+import operator
+import sys
+import time
+
+logger = logging.getLogger(__name__)
+
+COMPARISONS = {
+    Opcode.Eq: operator.eq,
+    Opcode.Ne: operator.ne,
+    Opcode.Lt: operator.lt,
+    Opcode.Le: operator.le,
+    Opcode.Gt: operator.gt,
+    Opcode.Ge: operator.ge,
+}
+
+INDEX_COMPARISONS = {
+    Opcode.IdxGt: operator.gt,
+    Opcode.IdxGe: operator.ge,
+    Opcode.IdxLt: operator.lt,
+    Opcode.IdxLe: operator.le,
+}
+
+
+@dataclass
+class Frame:
+    """
+    The state of one execution of a program.
+    """
+
+    registers: List[Any]
+    parameters: Sequence[Any]
+    btrees: Dict[int, BTree] = field(default_factory=dict)
+    # Index entries waiting for a bulk build, by cursor.
+    bulk: Dict[int, List[Any]] = field(default_factory=dict)
+    # The leaf page a batch scan is on, by cursor.
+    leaves: Dict[int, Page] = field(default_factory=dict)
+    # Set by ResultRow (or ResultBatch) for execute to yield.
+    row: Optional[List[Any]] = None
+
+
+# Takes the frame, the instruction and its address, returns the next address.
+Handler = Callable[[Frame, Instruction, int], int]
+
+
+def seek_row_id(tree: BTree, row_id: Any) -> bool:
+    """
+    Moves a table cursor to row_id, False if there's no such row.
+    """
+    if not isinstance(row_id, int):
+        # A bound value which can't be a row_id.
+        return False
+
+    try:
+        tree.seek(row_id)
+        return True
+    except NotFoundException:
+        return False
+
+
+def insert_unique(tree: BTree, record: Record, append: bool, table_name: Any):
+    """
+    Inserts a table row, raising if there's already one with its row_id.
+    """
+    try:
+        tree.insert(record, append=append, replace=False)
+    except DuplicateKeyException:
+        raise DuplicateKeyException(f"UNIQUE constraint failed: {table_name}.row_id")
+
+
+def seek_key(
+    tree: BTree, values: List[Any], gt: bool, eq: bool, skip_nulls: bool = False
+) -> bool:
+    """
+    Moves a cursor to the first entry >= (or > if gt) the key in values,
+    False if there isn't one. eq means only an equal key is wanted
+    so the bloom filter can rule it out without reading the tree.
+
+    Nothing is equal to, less or greater than NULL so a NULL bound matches
+    nothing. With skip_nulls the last value is the NULL to seek past
+    rather than a bound, see OPFLAG_SKIP_NULLS.
+    """
+    bounds = values[:-1] if skip_nulls else values
+    if tree.is_index and any(value is None for value in bounds):
+        return False
+
+    key = index_key(values) if tree.is_index else values[0]
+
+    if eq and not tree.might_contain(key):
+        # No entry with this key so no need to look.
+        return False
+
+    if not tree.is_index and not isinstance(key, int):
+        # Nothing is >= NULL and text sorts after every row_id.
+        return False
+
+    found = tree.seek_gt(key) if gt else tree.seek_ge(key)
+    return found is not None
+
+
+def entry_key(tree: BTree, size: int) -> tuple:
+    """
+    The first size values of the index entry at the cursor.
+    """
+    return index_key([v for _, v in tree.current().values[1 : size + 1]])
+
+
+Vector = Union[array, List[Any]]
+
+
+def column_vector(page: Page, index: int) -> Vector:
+    """
+    Value index of every record in a leaf page, integers are packed
+    into an array, a column with text or NULLs stays a list.
+    """
+    values = [cell.record.values[index][1] for cell in page.cells]
+
+    try:
+        return array("q", values)
+    except (TypeError, OverflowError):
+        return values
+
+
+def key_vector(page: Page) -> Vector:
+    return array("q", [cell.record.row_id for cell in page.cells])
+
+
+def select(
+    compare: Callable[[Any, Any], bool], left: Any, right: Any, selection: List[int]
+) -> List[int]:
+    """
+    The positions in selection where left <compare> right, each side is
+    a vector or a single value. NULL never matches anything.
+    """
+    if all(isinstance(side, array) or type(side) is int for side in (left, right)):
+        # No NULLs or text so no need for sort_key.
+        if not isinstance(right, array):
+            return [i for i in selection if compare(left[i], right)]
+
+        if not isinstance(left, array):
+            return [i for i in selection if compare(left, right[i])]
+
+        return [i for i in selection if compare(left[i], right[i])]
+
+    kept = []
+    for i in selection:
+        a = left[i] if isinstance(left, (array, list)) else left
+        b = right[i] if isinstance(right, (array, list)) else right
+
+        if a is not None and b is not None and compare(sort_key(a), sort_key(b)):
+            kept.append(i)
+
+    return kept
+
+
+def batch(vectors: List[Vector], selection: List[int]) -> List[List[Any]]:
+    """
+    The selected rows of a page, one list per row like ResultRow.
+    """
+    return [[vector[i] for vector in vectors] for i in selection]
+
+
+@dataclass
+class Profile:
+    """
+    What each instruction of a program cost, by address. eg:
+
+        profile = Profile(program)
+        rows = list(vm.execute(program, profile=profile))
+        print(profile.show())
+
+    Times are from time.perf_counter_ns() and include the profiling's
+    own overhead, so they're for comparing instructions with each other.
+    """
+
+    program: Program
+    # Times each instruction ran.
+    counts: List[int] = field(init=False)
+    # Nanoseconds spent in each instruction.
+    times: List[int] = field(init=False)
+    # Cursor page reads, hits and bytes decoded by each instruction, see CursorIO.
+    reads: List[int] = field(init=False)
+    hits: List[int] = field(init=False)
+    decoded: List[int] = field(init=False)
+    # The same by cursor, summed over each time it was opened.
+    cursors: Dict[int, CursorIO] = field(default_factory=dict)
+
+    def __post_init__(self):
+        size = len(self.program.instructions)
+        self.counts = [0] * size
+        self.times = [0] * size
+        self.reads = [0] * size
+        self.hits = [0] * size
+        self.decoded = [0] * size
+
+    def listing(self) -> List[List[Any]]:
+        """
+        A row for each instruction, the EXPLAIN columns then the counters
+        in the order of compiler.PROFILE_COLUMNS.
+        """
+        return [
+            [
+                addr,
+                i.opcode.name,
+                i.p1,
+                i.p2,
+                i.p3,
+                describe_operand(i.p4),
+                i.p5,
+                self.counts[addr],
+                self.times[addr],
+                self.reads[addr],
+                self.hits[addr],
+                self.decoded[addr],
+            ]
+            for addr, i in enumerate(self.program.instructions)
+        ]
+
+    def show(self) -> str:
+        """
+        The listing as text with each instruction's share of the time,
+        followed by the page reads of each cursor.
+        """
+        total = sum(self.times) or 1
+        lines = [
+            f"{'addr':>4} {'opcode':<14} {'p1':>5} {'p2':>5} {'p3':>5} {'p4':<16} "
+            f"{'p5':>3} {'count':>8} {'time_us':>10} {'time%':>6} "
+            f"{'reads':>6} {'hits':>8} {'decoded':>9}"
+        ]
+
+        for row, ns in zip(self.listing(), self.times):
+            addr, opcode, p1, p2, p3, p4, p5, count, _, reads, hits, decoded = [
+                "" if value is None else value for value in row
+            ]
+            lines.append(
+                f"{addr:>4} {opcode:<14} {p1:>5} {p2:>5} {p3:>5} {str(p4)[:16]:<16} "
+                f"{p5:>3} {count:>8} {ns / 1000:>10.1f} {100 * ns / total:>6.1f} "
+                f"{reads:>6} {hits:>8} {decoded:>9}"
+            )
+
+        for cursor, io in sorted(self.cursors.items()):
+            lines.append(
+                f"cursor {cursor}: {io.reads} reads, {io.hits} hits, "
+                f"{io.decoded} bytes decoded"
+            )
+
+        return "\n".join(lines)
+
+
+def profile_listing(vm: "VM", program: Program, parameters: Sequence[Any]):
+    """
+    Runs the program to the end with profiling, throwing away its rows,
+    and returns an iterator of its annotated listing for EXPLAIN ANALYZE.
+    """
+    profile = Profile(program)
+    for _ in vm.execute(program, parameters, profile):
+        pass
+
+    return iter(profile.listing())
+
+
+# Ways to run a program, see VM.execute.
+ENGINES = ["interpreter", "codegen"]
 
 
 class VM:
-    def __init__(self, pager):
+    def __init__(
+        self,
+        pager,
+        trace: bool = False,
+        engine: str = "interpreter",
+        max_groups: int = MAX_GROUPS,
+        sort_buffer: int = SORT_BUFFER,
+        join_buffer: int = JOIN_BUFFER,
+        count_steps: bool = False,
+    ):
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown engine: {engine}, expected one of {ENGINES}")
+
         self.pager = pager
+        # Log each instruction and the registers it
+        # leaves behind at DEBUG level, it's slow.
+        self.trace = trace
+        # interpreter dispatches one instruction at a time,
+        # codegen turns the program into a python function, see Codegen.
+        self.engine = engine
+        # Groups aggregated in memory before spilling to disk, see HashAggregate.
+        self.max_groups = max_groups
+        # Rows sorted in memory before writing a run to disk, see Sorter.
+        self.sort_buffer = sort_buffer
+        # Rows a hash join builds in memory before spilling to disk, see HashJoin.
+        self.join_buffer = join_buffer
+        # Instructions run by the last program. The interpreter always
+        # counts them, generated code only does if count_steps is set.
+        self.steps = 0
+        self.count_steps = count_steps
+
+        handlers: Dict[Opcode, Handler] = {
+            Opcode.Integer: self.integer,
+            Opcode.String: self.string,
+            Opcode.Null: self.null,
+            Opcode.SCopy: self.scopy,
+            Opcode.Variable: self.variable,
+            **{
+                opcode: self.comparison(compare)
+                for opcode, compare in COMPARISONS.items()
+            },
+            Opcode.Halt: self.halt,
+            Opcode.Noop: self.noop,
+            Opcode.Goto: self.goto,
+            Opcode.IfNot: self.if_not,
+            Opcode.IfPos: self.if_pos,
+            Opcode.DecrJumpZero: self.decr_jump_zero,
+            Opcode.OpenRead: self.open_read,
+            Opcode.OpenWrite: self.open_write,
+            Opcode.OpenFilter: self.open_filter,
+            Opcode.Close: self.close,
+            Opcode.Rewind: self.rewind,
+            Opcode.Next: self.next,
+            Opcode.Seek: self.seek,
+            Opcode.SeekGe: self.seek_ge,
+            Opcode.SeekGt: self.seek_ge,
+            **{
+                opcode: self.index_comparison(compare)
+                for opcode, compare in INDEX_COMPARISONS.items()
+            },
+            Opcode.Column: self.column,
+            Opcode.Key: self.key,
+            Opcode.IdxPKey: self.idx_pkey,
+            Opcode.MakeRecord: self.make_record,
+            Opcode.ResultRow: self.result_row,
+            Opcode.Insert: self.insert,
+            Opcode.IdxInsert: self.idx_insert,
+            Opcode.IdxDelete: self.idx_delete,
+            Opcode.RowSetAdd: self.rowset_add,
+            Opcode.RowSetRead: self.rowset_read,
+            Opcode.CreateTable: self.create_table,
+            Opcode.CreateIndex: self.create_index,
+            Opcode.CreateFilter: self.create_filter,
+            Opcode.SetCookie: self.set_cookie,
+            Opcode.Analyze: self.analyze,
+            Opcode.Profile: self.profile,
+            Opcode.RewindPage: self.rewind_page,
+            Opcode.NextPage: self.next_page,
+            Opcode.ColumnVector: self.column_vector,
+            Opcode.KeyVector: self.key_vector,
+            Opcode.SelectAll: self.select_all,
+            Opcode.Filter: self.filter,
+            Opcode.SelectionUnion: self.selection_union,
+            Opcode.ResultBatch: self.result_batch,
+            Opcode.AggStep: self.agg_step,
+            Opcode.AggFinal: self.agg_final,
+            Opcode.AggNext: self.agg_next,
+            Opcode.SorterOpen: self.sorter_open,
+            Opcode.SorterInsert: self.sorter_insert,
+            Opcode.SorterSort: self.sorter_sort,
+            Opcode.SorterNext: self.agg_next,
+            Opcode.HashOpen: self.hash_open,
+            Opcode.HashBuild: self.hash_build,
+            Opcode.HashProbe: self.hash_probe,
+            Opcode.HashNext: self.hash_next,
+            Opcode.HashDeferred: self.hash_deferred,
+            Opcode.Add: self.add,
+        }
+
+        # Indexed by the opcode's value so dispatch is a list lookup.
+        self.handlers: List[Handler] = [self.unsupported] * (
+            max(opcode.value for opcode in Opcode) + 1
+        )
+        for opcode, handler in handlers.items():
+            self.handlers[opcode.value] = handler
+
+    def execute(
+        self,
+        program: Program,
+        parameters: Sequence[Any] = (),
+        profile: Optional[Profile] = None,
+    ):
+        """
+        Runs the program yielding each row it returns. With a profile
+        it runs one instruction at a time and records what each cost.
+        """
+        if (
+            program.schema_cookie is not None
+            and program.schema_cookie != self.pager.schema_cookie()
+        ):
+            raise SchemaChangedException(
+                "Schema changed since the program was compiled"
+            )
+
+        if profile is not None:
+            yield from self.execute_profiled(program, parameters, profile)
+            return
+
+        if self.engine == "codegen" and not self.trace:
+            if self.count_steps:
+                if program.counting_function is None:
+                    program.counting_function = Codegen(program, True).function()
+
+                yield from program.counting_function(self, parameters)
+                return
+
+            if program.function is None:
+                program.function = Codegen(program).function()
+
+            yield from program.function(self, parameters)
+            return
+
+        if self.trace:
+            yield from self.execute_traced(program, parameters)
+            return
+
+        instructions = program.instructions
+        code = [self.handlers[instruction.opcode.value] for instruction in instructions]
+        frame = Frame([None] * program.register_count, parameters)
+        end = len(instructions)
+        steps = 0
+        pc = 0
+
+        while pc < end:
+            instruction = instructions[pc]
+            steps += 1
+            pc = code[pc](frame, instruction, pc)
+
+            if frame.row is not None:
+                row, frame.row = frame.row, None
+                self.steps = steps
+                yield row
+
+        self.steps = steps
+
+    def execute_traced(self, program: Program, parameters: Sequence[Any] = ()):
+        """
+        execute, logging each instruction and the registers after it.
+        Kept apart so the checks don't slow down every other program.
+        """
+        instructions = program.instructions
+        frame = Frame([None] * program.register_count, parameters)
+        steps = 0
+        pc = 0
+
+        while pc < len(instructions):
+            instruction = instructions[pc]
+            steps += 1
+            logger.debug("%4d %s", pc, instruction)
+            pc = self.handlers[instruction.opcode.value](frame, instruction, pc)
+            logger.debug("     registers %s", frame.registers)
+
+            if frame.row is not None:
+                row, frame.row = frame.row, None
+                self.steps = steps
+                yield row
+
+        self.steps = steps
+
+    def execute_profiled(
+        self, program: Program, parameters: Sequence[Any], profile: Profile
+    ):
+        """
+        execute, counting the runs, time and cursor page reads of each
+        instruction. The reads are the change in the counters of the
+        cursors open around the instruction.
+        """
+        instructions = program.instructions
+        frame = Frame([None] * program.register_count, parameters)
+        clock = time.perf_counter_ns
+        opened: List[Tuple[int, BTree]] = []
+        steps = 0
+        pc = 0
+
+        try:
+            while pc < len(instructions):
+                instruction = instructions[pc]
+                steps += 1
+                trees = list(frame.btrees.values())
+                before = [(t.io.reads, t.io.hits, t.io.decoded) for t in trees]
+
+                start = clock()
+                next_pc = self.handlers[instruction.opcode.value](
+                    frame, instruction, pc
+                )
+                profile.times[pc] += clock() - start
+                profile.counts[pc] += 1
+
+                for cursor, tree in frame.btrees.items():
+                    if all(tree is not t for t in trees):
+                        opened.append((cursor, tree))
+                        trees.append(tree)
+                        before.append((0, 0, 0))
+
+                for tree, (reads, hits, decoded) in zip(trees, before):
+                    profile.reads[pc] += tree.io.reads - reads
+                    profile.hits[pc] += tree.io.hits - hits
+                    profile.decoded[pc] += tree.io.decoded - decoded
+
+                pc = next_pc
+
+                if frame.row is not None:
+                    row, frame.row = frame.row, None
+                    self.steps = steps
+                    yield row
+        finally:
+            self.steps = steps
+
+            for cursor, tree in opened:
+                io = profile.cursors.setdefault(cursor, CursorIO())
+                io.reads += tree.io.reads
+                io.hits += tree.io.hits
+                io.decoded += tree.io.decoded
+
+    def unsupported(self, frame: Frame, instruction: Instruction, pc: int) -> int:
+        raise NotImplementedError(f"{instruction.opcode} is not supported")
+
+    # Register Manipulation Instructions
+
+    def integer(self, frame: Frame, instruction: Instruction, pc: int) -> int:
+        frame.registers[instruction.p2] = instruction.p1
+        return pc + 1
+
+    def string(self, frame: Frame, instruction: Instruction, pc: int) -> int:
+        frame.registers[instruction.p2] = instruction.p4
+        return pc + 1
+
+    def null(self, frame: Frame, instruction: Instruction, pc: int) -> int:
+        frame.registers[instruction.p2] = None
+        return pc + 1
+
+    def scopy(self, frame: Frame, instruction: Instruction, pc: int) -> int:
+        # shallow copy register value p1 -> p2.
+        frame.registers[instruction.p2] = frame.registers[instruction.p1]
+        return pc + 1
+
+    def variable(self, frame: Frame, instruction: Instruction, pc: int) -> int:
+        # Copy the value bound to parameter p1 into r[p2].
+        try:
+            frame.registers[instruction.p2] = frame.parameters[instruction.p1]
+        except IndexError:
+            raise BindingException(f"No value for parameter {instruction.p4}")
+        return pc + 1
+
+    # Control Flow Instructions
+
+    def comparison(self, compare: Callable[[Any, Any], bool]) -> Handler:
+        def handler(frame: Frame, instruction: Instruction, pc: int) -> int:
+            # Jump to p2 if r[p1] <op> r[p3]
+            # NULL compares false to everything unless JUMP_IF_NULL is set.
+            left = frame.registers[instruction.p1]
+            right = frame.registers[instruction.p3]
+
+            if left is None or right is None:
+                jump = bool(instruction.p5 & JUMP_IF_NULL)
+            else:
+                jump = compare(sort_key(left), sort_key(right))
+
+            return cast(int, instruction.p2) if jump else pc + 1
+
+        return handler
+
+    def halt(self, frame: Frame, instruction: Instruction, pc: int) -> int:
+        if instruction.p1 != 0:
+            # We have an error
+            raise Exception(instruction.p4)
+
+        # Past the end of any program.
+        return sys.maxsize
+
+    def noop(self, frame: Frame, instruction: Instruction, pc: int) -> int:
+        return pc + 1
+
+    def goto(self, frame: Frame, instruction: Instruction, pc: int) -> int:
+        return cast(int, instruction.p2)
+
+    def if_not(self, frame: Frame, instruction: Instruction, pc: int) -> int:
+        # Jump to p2 if r[p1] is 0
+        if not frame.registers[instruction.p1]:
+            return cast(int, instruction.p2)
+
+        return pc + 1
+
+    def if_pos(self, frame: Frame, instruction: Instruction, pc: int) -> int:
+        # If r[p1] > 0 take p3 from it and jump to p2
+        if frame.registers[instruction.p1] > 0:
+            frame.registers[instruction.p1] -= instruction.p3
+            return cast(int, instruction.p2)
+
+        return pc + 1
+
+    def decr_jump_zero(self, frame: Frame, instruction: Instruction, pc: int) -> int:
+        # Take 1 from r[p1], jump to p2 if it's now 0
+        frame.registers[instruction.p1] -= 1
+        if frame.registers[instruction.p1] == 0:
+            return cast(int, instruction.p2)
+
+        return pc + 1
+
+    # Database Opening and Closing Instructions
+
+    def open_read(self, frame: Frame, instruction: Instruction, pc: int) -> int:
+        # Open a cursor with root page r[p2] and assign its refname to val p1
+        root_page_number = frame.registers[instruction.p2]
+        frame.btrees[instruction.p1] = BTree(self.pager, root_page_number)
+        return pc + 1
+
+    def open_write(self, frame: Frame, instruction: Instruction, pc: int) -> int:
+        # Open btree with write cursor (Currently cursors don't have read/write flag)
+        # p4 is the tables split policy, None for the default.
+        root_page_number = frame.registers[instruction.p2]
+        frame.btrees[instruction.p1] = BTree(
+            self.pager, root_page_number, cast(Optional[SplitPolicy], instruction.p4)
+        )
+        return pc + 1
+
+    def open_filter(self, frame: Frame, instruction: Instruction, pc: int) -> int:
+        # Use the bloom filter in page r[p2] for cursor p1
+        frame.btrees[instruction.p1].bloom_page_number = frame.registers[instruction.p2]
+        return pc + 1
+
+    def close(self, frame: Frame, instruction: Instruction, pc: int) -> int:
+        tree = frame.btrees.pop(instruction.p1)
+
+        if instruction.p1 in frame.bulk:
+            tree.bulk_load(sorted(frame.bulk.pop(instruction.p1)))
+
+        return pc + 1
+
+    # Cursor Manipulation Instructions
+
+    def rewind(self, frame: Frame, instruction: Instruction, pc: int) -> int:
+        # If table or index is empty jump to p2
+        # else rewind the btree cursor to start.
+        tree = frame.btrees[instruction.p1]
+
+        if tree.is_empty():
+            return cast(int, instruction.p2)
+
+        tree.reset()
+        # Position on the first record so Next moves past it
+        # even when nothing reads it (e.g. rows skipped by OFFSET).
+        tree.current()
+        return pc + 1
+
+    def next(self, frame: Frame, instruction: Instruction, pc: int) -> int:
+        try:
+            next(frame.btrees[instruction.p1])
+            return cast(int, instruction.p2)
+        except StopIteration:
+            return pc + 1
+
+    def seek(self, frame: Frame, instruction: Instruction, pc: int) -> int:
+        # Move cursor p1 to the row_id in r[p3]
+        # if it doesn't exist jump to p2.
+        if seek_row_id(frame.btrees[instruction.p1], frame.registers[instruction.p3]):
+            return pc + 1
+
+        return cast(int, instruction.p2)
+
+    def seek_ge(self, frame: Frame, instruction: Instruction, pc: int) -> int:
+        # SeekGe and SeekGt
+        # Move cursor p1 to the first entry >= (or >) the key
+        # in registers p3 ... p3 + p4, if there isn't one jump to p2.
+        size = cast(Optional[int], instruction.p4) or 1
+        values = frame.registers[instruction.p3 : instruction.p3 + size]
+
+        if seek_key(
+            frame.btrees[instruction.p1],
+            values,
+            instruction.opcode == Opcode.SeekGt,
+            bool(instruction.p5 & OPFLAG_SEEKEQ),
+            bool(instruction.p5 & OPFLAG_SKIP_NULLS),
+        ):
+            return pc + 1
+
+        return cast(int, instruction.p2)
+
+    def index_comparison(self, compare: Callable[[Any, Any], bool]) -> Handler:
+        def handler(frame: Frame, instruction: Instruction, pc: int) -> int:
+            # Compare the first p4 values of the index entry at cursor p1
+            # with registers p3 ... p3 + p4, jump to p2 if entry <op> registers.
+            size = cast(int, instruction.p4)
+            key = index_key([frame.registers[instruction.p3 + i] for i in range(size)])
+
+            if compare(entry_key(frame.btrees[instruction.p1], size), key):
+                return cast(int, instruction.p2)
+
+            return pc + 1
+
+        return handler
+
+    # Cursor Access Instructions
+
+    def column(self, frame: Frame, instruction: Instruction, pc: int) -> int:
+        # Read column at index p2 and store in register p3
+        # p4 columns from there if it's set.
+        row = frame.btrees[instruction.p1].current()
+
+        for i in range(cast(Optional[int], instruction.p4) or 1):
+            frame.registers[instruction.p3 + i] = row.values[instruction.p2 + i][1]
+
+        return pc + 1
+
+    def key(self, frame: Frame, instruction: Instruction, pc: int) -> int:
+        # Store the row_id of the row at cursor p1 in register p2
+        row = frame.btrees[instruction.p1].current()
+        frame.registers[instruction.p2] = row.row_id
+        return pc + 1
+
+    def idx_pkey(self, frame: Frame, instruction: Instruction, pc: int) -> int:
+        # Store the row_id of the index entry at cursor p1 in r[p2]
+        entry = frame.btrees[instruction.p1].current()
+        frame.registers[instruction.p2] = entry.row_id
+        return pc + 1
+
+    # Database Record Instructions
+
+    def make_record(self, frame: Frame, instruction: Instruction, pc: int) -> int:
+        values = []
+
+        for i in range(instruction.p2):
+            v = frame.registers[instruction.p1 + i]
+            values.append([DataType.infer(v), v])
+
+        frame.registers[instruction.p3] = values
+        return pc + 1
+
+    def result_row(self, frame: Frame, instruction: Instruction, pc: int) -> int:
+        # Take all the stored values in registers p1 - p2 and yield them
+        # to the caller.
+        frame.row = frame.registers[instruction.p1 : instruction.p2 + 1]
+        return pc + 1
+
+    # Insert instructions
+
+    def insert(self, frame: Frame, instruction: Instruction, pc: int) -> int:
+        values = frame.registers[instruction.p2]
+        record = Record(
+            [
+                [DataType.integer, frame.registers[instruction.p3]],
+                *values,
+            ]
+        )
+
+        if instruction.p5 & OPFLAG_ISUPDATE:
+            frame.btrees[instruction.p1].update(record)
+        else:
+            insert_unique(
+                frame.btrees[instruction.p1],
+                record,
+                bool(instruction.p5 & OPFLAG_APPEND),
+                instruction.p4,
+            )
+
+        frame.registers[instruction.p2] = record
+        return pc + 1
+
+    def idx_insert(self, frame: Frame, instruction: Instruction, pc: int) -> int:
+        # Add the key in r[p2] with the row_id in r[p3] to index p1
+        # p4 is the number of key values, the rest are included values.
+        values = frame.registers[instruction.p2]
+        record = Record(
+            [
+                [DataType.integer, frame.registers[instruction.p3]],
+                *values,
+            ]
+        )
+
+        tree = frame.btrees[instruction.p1]
+        key_size = cast(Optional[int], instruction.p4)
+
+        if instruction.p5 & OPFLAG_BULK_BUILD:
+            cell = tree.new_cell(record, key_size)
+            frame.bulk.setdefault(instruction.p1, []).append(cell)
+        else:
+            tree.insert(record, key_size)
+
+        return pc + 1
+
+    def idx_delete(self, frame: Frame, instruction: Instruction, pc: int) -> int:
+        # Remove the entry for the key in r[p2] and the row_id in r[p3]
+        # from index p1. p4 is the number of key values.
+        values = frame.registers[instruction.p2]
+        record = Record(
+            [
+                [DataType.integer, frame.registers[instruction.p3]],
+                *values,
+            ]
+        )
+
+        tree = frame.btrees[instruction.p1]
+        cell = tree.new_cell(record, cast(Optional[int], instruction.p4))
+        tree.delete(cell.key)
+        return pc + 1
+
+    # RowSet Instructions
+
+    def rowset_add(self, frame: Frame, instruction: Instruction, pc: int) -> int:
+        # Add the integer in r[p2] to the RowSet in r[p1]
+        if frame.registers[instruction.p1] is None:
+            frame.registers[instruction.p1] = []
+
+        heapq.heappush(frame.registers[instruction.p1], frame.registers[instruction.p2])
+        return pc + 1
+
+    def rowset_read(self, frame: Frame, instruction: Instruction, pc: int) -> int:
+        # Take the smallest value out of the RowSet in r[p1]
+        # and store it in r[p3] or jump to p2 if it's empty.
+        rowset = frame.registers[instruction.p1]
+
+        if rowset:
+            frame.registers[instruction.p3] = heapq.heappop(rowset)
+            return pc + 1
+
+        return cast(int, instruction.p2)
+
+    # B-Tree Creation Instructions
+
+    def create_table(self, frame: Frame, instruction: Instruction, pc: int) -> int:
+        # TODO: Should be able to roll this back.
+        # RN: pager.new() will write to disk.
+        frame.registers[instruction.p1] = self.pager.new()
+        return pc + 1
+
+    def create_index(self, frame: Frame, instruction: Instruction, pc: int) -> int:
+        frame.registers[instruction.p1] = self.pager.new(PageType.index_leaf)
+        return pc + 1
 
-    def execute(self, program: Program):
-        btrees = {}
-        registers = {}
-        cursor = 0
-        print("\n".join([str(instruct) for instruct in (program.instructions)]))
-
-        while len(program.instructions) > cursor:
-            instruction = program.instructions[cursor]
-            if instruction.opcode == Opcode.CreateTable:
-                # TODO: Should be able to roll this back.
-                # RN: pager.new() will write to disk.
-                page_number = self.pager.new()
-                registers[instruction.p1] = page_number
-                cursor += 1
-
-            if instruction.opcode == Opcode.SCopy:
-                # shallow copy register value p1 -> p2.
-                registers[instruction.p2] = registers[instruction.p1]
-                cursor += 1
-
-            if instruction.opcode == Opcode.OpenWrite:
-                # Open btree with write cursor (Currently cursors don't have read/write flag)
-                # TODO: Also p4 is unimplemeneted.
-                root_page_number = registers[instruction.p2]
-                btrees[instruction.p1] = BTree(self.pager, root_page_number)
-                cursor += 1
-
-            if instruction.opcode == Opcode.OpenRead:
-                # Open a cursor with root page p2 and assign its refname to val p1
-                root_page_number = registers[instruction.p2]
-                btrees[instruction.p1] = BTree(self.pager, root_page_number)
-                cursor += 1
-
-            if instruction.opcode == Opcode.String:
-                registers[instruction.p2] = instruction.p4
-                cursor += 1
-
-            if instruction.opcode == Opcode.Integer:
-                registers[instruction.p2] = instruction.p1
-                cursor += 1
-
-            if instruction.opcode == Opcode.Noop:
-                cursor += 1
-
-            if instruction.opcode == Opcode.Rewind:
-                # If table or index is empty jump to p2
-                # else rewind the btree cursor to start.
-                tree = btrees[instruction.p1]
-
-                if tree.is_empty():
-                    cursor = cast(int, instruction.p2)
-                else:
-                    btrees[instruction.p1].reset()
-                    cursor += 1
-
-            if instruction.opcode == Opcode.Key:
-                # Read column at index p2 and store in register p3
-                row = btrees[instruction.p1].current()
-                registers[instruction.p2] = row.row_id
-                cursor += 1
-
-            if instruction.opcode == Opcode.Column:
-                # Read column at index p2 and store in register p3
-                row = btrees[instruction.p1].current()
-
-                v = row.values[instruction.p2][1]
-                registers[instruction.p3] = v
-                cursor += 1
-
-            if instruction.opcode == Opcode.MakeRecord:
-                values = []
-
-                for i in range(instruction.p2):
-                    c = []
-                    v = registers[instruction.p1 + i]
-                    t = DataType.infer(v)
-                    c.append(t)
-                    c.append(registers[instruction.p1 + i])
-                    values.append(c)
-
-                registers[instruction.p3] = values
-                cursor += 1
-
-            if instruction.opcode == Opcode.ResultRow:
-                # Take all the stored values in registers p1 - p2 and yield them
-                # to the caller.
-                values = []
-
-                for i in range(
-                    cast(int, instruction.p1), cast(int, instruction.p2) + 1
-                ):
-                    values.append(registers[i])
-
-                cursor += 1
-
-                yield values
-
-            if instruction.opcode == Opcode.Insert:
-                values = registers[instruction.p2]
-                key_with_values = [
-                    [DataType.integer, registers[instruction.p3]],
-                    *values,
-                ]
-
-                record = Record(key_with_values)
-
-                btrees[instruction.p1].insert(record)
-                registers[instruction.p2] = record
-                cursor += 1
-
-            if instruction.opcode == Opcode.Next:
-                tree = btrees[instruction.p1]
-
-                try:
-                    v = next(tree)
-                    cursor = cast(int, instruction.p2)
-                except StopIteration:
-                    cursor += 1
-
-            if instruction.opcode == Opcode.Close:
-                del btrees[instruction.p1]
-                cursor += 1
+    def create_filter(self, frame: Frame, instruction: Instruction, pc: int) -> int:
+        # Allocate an empty bloom filter page, store the page number in r[p1]
+        frame.registers[instruction.p1] = self.pager.new(PageType.bloom)
+        return pc + 1
+
+    # Schema Instructions
+
+    def set_cookie(self, frame: Frame, instruction: Instruction, pc: int) -> int:
+        self.pager.set_schema_cookie(instruction.p1)
+        return pc + 1
+
+    def analyze(self, frame: Frame, instruction: Instruction, pc: int) -> int:
+        # Read the stats of cursor p1's b-tree into the registers from p2,
+        # p4 is the record position of each column.
+        start = instruction.p2
+        frame.registers[start : start + ANALYZE_COLUMNS] = analyze(
+            self.pager,
+            frame.btrees[instruction.p1].root_page_number,
+            cast(List[int], instruction.p4),
+        )
+        return pc + 1
+
+    def profile(self, frame: Frame, instruction: Instruction, pc: int) -> int:
+        # Run the program in p4 with profiling and store an iterator
+        # of its annotated listing in r[p1] for AggNext.
+        frame.registers[instruction.p1] = profile_listing(
+            self, cast(Program, instruction.p4), frame.parameters
+        )
+        return pc + 1
+
+    # Batch Instructions
+
+    def rewind_page(self, frame: Frame, instruction: Instruction, pc: int) -> int:
+        # Move cursor p1 to the first leaf page, jump to p2 if there are no rows.
+        tree = frame.btrees[instruction.p1]
+        tree.reset()
+        page = tree.next_leaf()
+
+        if page is None:
+            return cast(int, instruction.p2)
+
+        frame.leaves[instruction.p1] = page
+        return pc + 1
+
+    def next_page(self, frame: Frame, instruction: Instruction, pc: int) -> int:
+        # Move cursor p1 to the next leaf page and jump to p2 if there is one.
+        page = frame.btrees[instruction.p1].next_leaf()
+
+        if page is None:
+            return pc + 1
+
+        frame.leaves[instruction.p1] = page
+        return cast(int, instruction.p2)
+
+    def column_vector(self, frame: Frame, instruction: Instruction, pc: int) -> int:
+        # Store value p2 of every record on cursor p1's page in r[p3]
+        page = frame.leaves[instruction.p1]
+        frame.registers[instruction.p3] = column_vector(page, instruction.p2)
+        return pc + 1
+
+    def key_vector(self, frame: Frame, instruction: Instruction, pc: int) -> int:
+        # Store the row_ids of the records on cursor p1's page in r[p2]
+        frame.registers[instruction.p2] = key_vector(frame.leaves[instruction.p1])
+        return pc + 1
+
+    def select_all(self, frame: Frame, instruction: Instruction, pc: int) -> int:
+        # Select every record on cursor p1's page into r[p2]
+        count = len(frame.leaves[instruction.p1].cells)
+        frame.registers[instruction.p2] = list(range(count))
+        return pc + 1
+
+    def filter(self, frame: Frame, instruction: Instruction, pc: int) -> int:
+        # Keep the rows in selection r[p3] where r[p1] <p4> r[p2]
+        registers = frame.registers
+        registers[instruction.p3] = select(
+            COMPARISONS[cast(Opcode, instruction.p4)],
+            registers[instruction.p1],
+            registers[instruction.p2],
+            registers[instruction.p3],
+        )
+        return pc + 1
+
+    def selection_union(self, frame: Frame, instruction: Instruction, pc: int) -> int:
+        # r[p3] = rows selected in either r[p1] or r[p2]
+        left = frame.registers[instruction.p1]
+        right = frame.registers[instruction.p2]
+        frame.registers[instruction.p3] = sorted(set(left).union(right))
+        return pc + 1
+
+    def result_batch(self, frame: Frame, instruction: Instruction, pc: int) -> int:
+        # Yield the rows selected in r[p3] from the vectors in registers p1 - p2.
+        selection = frame.registers[instruction.p3]
+
+        if selection:
+            vectors = frame.registers[instruction.p1 : instruction.p2 + 1]
+            frame.row = batch(vectors, selection)
+
+        return pc + 1
+
+    # Aggregate Instructions
+
+    def agg_step(self, frame: Frame, instruction: Instruction, pc: int) -> int:
+        # Add registers p2 ... to the HashAggregate in r[p1], the first p3
+        # are the group key and there's one more for each aggregate in p4.
+        aggregates = cast(list, instruction.p4)
+        if frame.registers[instruction.p1] is None:
+            frame.registers[instruction.p1] = HashAggregate(
+                aggregates, instruction.p3, self.max_groups
+            )
+
+        width = instruction.p3 + len(aggregates)
+        frame.registers[instruction.p1].step(
+            frame.registers[instruction.p2 : instruction.p2 + width]
+        )
+        return pc + 1
+
+    def agg_final(self, frame: Frame, instruction: Instruction, pc: int) -> int:
+        # Replace the HashAggregate in r[p1] with its finished rows.
+        aggregate = frame.registers[instruction.p1]
+        if aggregate is None:
+            # No rows were stepped.
+            aggregate = HashAggregate(
+                cast(list, instruction.p4), instruction.p3, self.max_groups
+            )
+
+        frame.registers[instruction.p1] = aggregate.rows()
+        return pc + 1
+
+    def agg_next(self, frame: Frame, instruction: Instruction, pc: int) -> int:
+        # AggNext and SorterNext
+        # Store the next finished row from r[p1] in the p4 registers
+        # from p3, jump to p2 if there are no more.
+        try:
+            row = next(frame.registers[instruction.p1])
+        except StopIteration:
+            return cast(int, instruction.p2)
+
+        size = cast(int, instruction.p4)
+        frame.registers[instruction.p3 : instruction.p3 + size] = row
+        return pc + 1
+
+    # Sorter Instructions
+
+    def sorter_open(self, frame: Frame, instruction: Instruction, pc: int) -> int:
+        # Store a Sorter in r[p1], p4 has a descending flag for each key
+        # and r[p3] is the number of rows wanted or NULL for all of them.
+        frame.registers[instruction.p1] = Sorter(
+            cast(list, instruction.p4),
+            frame.registers[instruction.p3],
+            self.sort_buffer,
+        )
+        return pc + 1
+
+    def sorter_insert(self, frame: Frame, instruction: Instruction, pc: int) -> int:
+        # Add the p3 registers from p2 to the Sorter in r[p1], keys first.
+        row = frame.registers[instruction.p2 : instruction.p2 + instruction.p3]
+        frame.registers[instruction.p1].insert(row)
+        return pc + 1
+
+    def sorter_sort(self, frame: Frame, instruction: Instruction, pc: int) -> int:
+        # Replace the Sorter in r[p1] with its sorted rows for SorterNext.
+        frame.registers[instruction.p1] = frame.registers[instruction.p1].sorted()
+        return pc + 1
+
+    # Hash Join Instructions
+
+    def hash_open(self, frame: Frame, instruction: Instruction, pc: int) -> int:
+        # Store an empty HashJoin in r[p1].
+        frame.registers[instruction.p1] = HashJoin(self.join_buffer)
+        return pc + 1
+
+    def hash_build(self, frame: Frame, instruction: Instruction, pc: int) -> int:
+        # Add the p3 registers after the key in r[p2] to the HashJoin in r[p1].
+        start = instruction.p2 + 1
+        frame.registers[instruction.p1].build(
+            frame.registers[instruction.p2],
+            frame.registers[start : start + instruction.p3],
+        )
+        return pc + 1
+
+    def hash_probe(self, frame: Frame, instruction: Instruction, pc: int) -> int:
+        # Look up the key in r[p3] in the HashJoin in r[p1] for HashNext,
+        # if it has to be deferred along with the p4 registers after the key
+        # jump to p2.
+        start = instruction.p3 + 1
+        size = cast(int, instruction.p4)
+        if frame.registers[instruction.p1].probe(
+            frame.registers[instruction.p3],
+            frame.registers[start : start + size],
+        ):
+            return pc + 1
+
+        return cast(int, instruction.p2)
+
+    def hash_next(self, frame: Frame, instruction: Instruction, pc: int) -> int:
+        # Store the next match of the HashJoin in r[p1] in the p4
+        # registers from p3, jump to p2 if there are no more.
+        try:
+            row = next(frame.registers[instruction.p1].matches)
+        except StopIteration:
+            return cast(int, instruction.p2)
+
+        size = cast(int, instruction.p4)
+        frame.registers[instruction.p3 : instruction.p3 + size] = row
+        return pc + 1
+
+    def hash_deferred(self, frame: Frame, instruction: Instruction, pc: int) -> int:
+        # Load the next deferred probe of the HashJoin in r[p1], the key into r[p3]
+        # and its row into the p4 registers after, jump to p2 if there are no more.
+        entry = frame.registers[instruction.p1].next_deferred()
+        if entry is None:
+            return cast(int, instruction.p2)
+
+        key, row = entry
+        frame.registers[instruction.p3] = key
+        start = instruction.p3 + 1
+        frame.registers[start : start + cast(int, instruction.p4)] = row
+        return pc + 1
+
+    # Arithmetic Instructions
+
+    def add(self, frame: Frame, instruction: Instruction, pc: int) -> int:
+        # r[p3] = r[p1] + r[p2], NULL if either is.
+        left = frame.registers[instruction.p1]
+        right = frame.registers[instruction.p2]
+        frame.registers[instruction.p3] = (
+            None if left is None or right is None else left + right
+        )
+        return pc + 1
+
+
+# Instructions which jump to p2.
+JUMPS = {
+    *COMPARISONS,
+    *INDEX_COMPARISONS,
+    Opcode.Goto,
+    Opcode.IfNot,
+    Opcode.IfPos,
+    Opcode.DecrJumpZero,
+    Opcode.Rewind,
+    Opcode.Next,
+    Opcode.Seek,
+    Opcode.SeekGe,
+    Opcode.SeekGt,
+    Opcode.RowSetRead,
+    Opcode.RewindPage,
+    Opcode.NextPage,
+    Opcode.AggNext,
+    Opcode.SorterNext,
+    Opcode.HashProbe,
+    Opcode.HashNext,
+    Opcode.HashDeferred,
+}
+
+OPERATORS = {
+    Opcode.Eq: "==",
+    Opcode.Ne: "!=",
+    Opcode.Lt: "<",
+    Opcode.Le: "<=",
+    Opcode.Gt: ">",
+    Opcode.Ge: ">=",
+    Opcode.IdxGt: ">",
+    Opcode.IdxGe: ">=",
+    Opcode.IdxLt: "<",
+    Opcode.IdxLe: "<=",
+}
+
+
+class Codegen:
+    """
+    Turns a program into the source of a python generator function
+    so it runs without dispatching each instruction. eg:
+
+        0 Integer 1 0
+        1 OpenRead 0 0
+        2 Rewind 0 5
+        3 Column 0 1 1
+        4 ResultRow 1 1
+        ...
+
+    becomes
+
+        def program(vm, parameters):
+            ...
+            while True:
+                if block == 0:
+                    r0 = 1
+                    c0 = BTree(vm.pager, r0)
+                    if c0.is_empty():
+                        block = 5
+                        continue
+                    ...
+
+    Registers are locals and each run of instructions between jumps
+    (a basic block) is straight line code, jumps pick the next block.
+    Anything that isn't an int, str or None is passed in as a constant.
+
+    With count_steps each jump, row and exit adds the instructions run
+    in its block to steps, for VM.steps. It's left out otherwise so the
+    dispatch between blocks is just the jump.
+    """
+
+    def __init__(self, program: Program, count_steps: bool = False):
+        self.program = program
+        self.count_steps = count_steps
+        self.constants: List[Any] = []
+        self.emitters: Dict[Opcode, Callable[[Instruction, int], List[str]]] = {
+            Opcode.Integer: self.integer,
+            Opcode.String: self.string,
+            Opcode.Null: self.null,
+            Opcode.SCopy: self.scopy,
+            Opcode.Variable: self.variable,
+            **{opcode: self.comparison for opcode in COMPARISONS},
+            Opcode.Halt: self.halt,
+            Opcode.Noop: self.noop,
+            Opcode.Goto: self.goto,
+            Opcode.IfNot: self.if_not,
+            Opcode.IfPos: self.if_pos,
+            Opcode.DecrJumpZero: self.decr_jump_zero,
+            Opcode.OpenRead: self.open_read,
+            Opcode.OpenWrite: self.open_write,
+            Opcode.OpenFilter: self.open_filter,
+            Opcode.Close: self.close,
+            Opcode.Rewind: self.rewind,
+            Opcode.Next: self.next,
+            Opcode.Seek: self.seek,
+            Opcode.SeekGe: self.seek_ge,
+            Opcode.SeekGt: self.seek_ge,
+            **{opcode: self.index_comparison for opcode in INDEX_COMPARISONS},
+            Opcode.Column: self.column,
+            Opcode.Key: self.key,
+            Opcode.IdxPKey: self.key,
+            Opcode.MakeRecord: self.make_record,
+            Opcode.ResultRow: self.result_row,
+            Opcode.Insert: self.insert,
+            Opcode.IdxInsert: self.idx_insert,
+            Opcode.IdxDelete: self.idx_delete,
+            Opcode.RowSetAdd: self.rowset_add,
+            Opcode.RowSetRead: self.rowset_read,
+            Opcode.CreateTable: self.create_table,
+            Opcode.CreateIndex: self.create_index,
+            Opcode.CreateFilter: self.create_filter,
+            Opcode.SetCookie: self.set_cookie,
+            Opcode.Analyze: self.analyze,
+            Opcode.Profile: self.profile,
+            Opcode.RewindPage: self.rewind_page,
+            Opcode.NextPage: self.next_page,
+            Opcode.ColumnVector: self.column_vector,
+            Opcode.KeyVector: self.key_vector,
+            Opcode.SelectAll: self.select_all,
+            Opcode.Filter: self.filter,
+            Opcode.SelectionUnion: self.selection_union,
+            Opcode.ResultBatch: self.result_batch,
+            Opcode.AggStep: self.agg_step,
+            Opcode.AggFinal: self.agg_final,
+            Opcode.AggNext: self.agg_next,
+            Opcode.SorterOpen: self.sorter_open,
+            Opcode.SorterInsert: self.sorter_insert,
+            Opcode.SorterSort: self.sorter_sort,
+            Opcode.SorterNext: self.agg_next,
+            Opcode.HashOpen: self.hash_open,
+            Opcode.HashBuild: self.hash_build,
+            Opcode.HashProbe: self.hash_probe,
+            Opcode.HashNext: self.hash_next,
+            Opcode.HashDeferred: self.hash_deferred,
+            Opcode.Add: self.add,
+        }
+        # Instructions run since the start of the current block.
+        self.count = 0
+
+    def blocks(self) -> List[int]:
+        """
+        The address each basic block starts at.
+        """
+        instructions = self.program.instructions
+        starts = {0}
+
+        for pc, instruction in enumerate(instructions):
+            if instruction.opcode in JUMPS:
+                starts.add(instruction.p2)
+                starts.add(pc + 1)
 
             if instruction.opcode == Opcode.Halt:
-                if instruction.p1 != 0:
-                    # We have an error
-                    raise Exception(instruction.p4)
-                break
+                starts.add(pc + 1)
+
+        return sorted(start for start in starts if start < len(instructions))
+
+    def source(self) -> str:
+        instructions = self.program.instructions
+        starts = self.blocks()
+        cursors = sorted(
+            {
+                i.p1
+                for i in instructions
+                if i.opcode in (Opcode.OpenRead, Opcode.OpenWrite)
+            }
+        )
+        lines = ["def program(vm, parameters):"]
+        body = ["pager = vm.pager", "bulk = {}", "block = 0"]
+        body += ["steps = 0"] if self.count_steps else []
+        body += [f"r{n} = None" for n in range(self.program.register_count)]
+        body += [f"c{n} = None" for n in cursors]
+        # Leaf pages for batch scans.
+        body += [f"p{n} = None" for n in cursors]
+        # An empty program, eg: EXPLAIN QUERY PLAN of an INSERT, has no blocks.
+        body += ["while True:"] if starts else []
+
+        for i, start in enumerate(starts):
+            end = starts[i + 1] if i + 1 < len(starts) else len(instructions)
+            block = [f"{'if' if i == 0 else 'elif'} block == {start}:"]
+            code = []
+            self.count = 0
+
+            for pc in range(start, end):
+                instruction = instructions[pc]
+                self.count += 1
+                emit = self.emitters.get(instruction.opcode, self.unsupported)
+                code += emit(instruction, pc)
+
+            # Nothing after a Halt or Goto is reached.
+            if instructions[end - 1].opcode in (Opcode.Halt, Opcode.Goto):
+                pass
+            elif end < len(instructions):
+                code += self.jump(end)
+            else:
+                code += self.exit()
+
+            block += indent(code)
+            body += indent(block)
+
+        # Every exit breaks out of the loop to here.
+        body += ["vm.steps = steps"] if self.count_steps else []
+        # Makes it a generator when there's no ResultRow.
+        body.append("yield from ()")
+        lines += indent(body)
+        return "\n".join(lines) + "\n"
+
+    def function(self) -> Callable:
+        namespace: Dict[str, Any] = {
+            "BTree": BTree,
+            "Record": Record,
+            "DataType": DataType,
+            "PageType": PageType,
+            "BindingException": BindingException,
+            "sort_key": sort_key,
+            "index_key": index_key,
+            "seek_row_id": seek_row_id,
+            "insert_unique": insert_unique,
+            "seek_key": seek_key,
+            "entry_key": entry_key,
+            "column_vector": column_vector,
+            "key_vector": key_vector,
+            "select": select,
+            "batch": batch,
+            "HashAggregate": HashAggregate,
+            "Sorter": Sorter,
+            "HashJoin": HashJoin,
+            "analyze": analyze,
+            "profile_listing": profile_listing,
+            "heapq": heapq,
+        }
+        source = self.source()
+        namespace["K"] = self.constants
+        exec(compile(source, "<program>", "exec"), namespace)
+        return namespace["program"]
+
+    def literal(self, value: Any) -> str:
+        if value is None or type(value) in (int, str, bool):
+            return repr(value)
+
+        self.constants.append(value)
+        return f"K[{len(self.constants) - 1}]"
+
+    def steps(self) -> List[str]:
+        """
+        Adds the instructions run so far in the block to steps.
+        """
+        return [f"steps += {self.count}"] if self.count_steps else []
+
+    def vm_steps(self) -> List[str]:
+        """
+        Sets VM.steps before the program yields a row.
+        """
+        return [f"vm.steps = steps + {self.count}"] if self.count_steps else []
+
+    def jump(self, target: int) -> List[str]:
+        return self.steps() + [f"block = {target}", "continue"]
+
+    def exit(self) -> List[str]:
+        return self.steps() + ["break"]
+
+    def unsupported(self, instruction: Instruction, pc: int) -> List[str]:
+        message = f"{instruction.opcode} is not supported"
+        return [f"raise NotImplementedError({message!r})"]
+
+    # Register Manipulation Instructions
+
+    def integer(self, instruction: Instruction, pc: int) -> List[str]:
+        return [f"r{instruction.p2} = {self.literal(instruction.p1)}"]
+
+    def string(self, instruction: Instruction, pc: int) -> List[str]:
+        return [f"r{instruction.p2} = {self.literal(instruction.p4)}"]
+
+    def null(self, instruction: Instruction, pc: int) -> List[str]:
+        return [f"r{instruction.p2} = None"]
+
+    def scopy(self, instruction: Instruction, pc: int) -> List[str]:
+        return [f"r{instruction.p2} = r{instruction.p1}"]
+
+    def variable(self, instruction: Instruction, pc: int) -> List[str]:
+        message = f"No value for parameter {instruction.p4}"
+        return [
+            f"if len(parameters) <= {instruction.p1}:",
+            f"    raise BindingException({message!r})",
+            f"r{instruction.p2} = parameters[{instruction.p1}]",
+        ]
+
+    # Control Flow Instructions
+
+    def comparison(self, instruction: Instruction, pc: int) -> List[str]:
+        left = f"r{instruction.p1}"
+        right = f"r{instruction.p3}"
+        compare = f"sort_key({left}) {OPERATORS[instruction.opcode]} sort_key({right})"
+
+        if instruction.p5 & JUMP_IF_NULL:
+            test = f"{left} is None or {right} is None or {compare}"
+        else:
+            test = f"{left} is not None and {right} is not None and {compare}"
+
+        return [f"if {test}:", *indent(self.jump(instruction.p2))]
+
+    def halt(self, instruction: Instruction, pc: int) -> List[str]:
+        if instruction.p1 != 0:
+            return [f"raise Exception({self.literal(instruction.p4)})"]
+
+        return self.exit()
+
+    def noop(self, instruction: Instruction, pc: int) -> List[str]:
+        return []
+
+    def goto(self, instruction: Instruction, pc: int) -> List[str]:
+        return self.jump(instruction.p2)
+
+    def if_not(self, instruction: Instruction, pc: int) -> List[str]:
+        return [f"if not r{instruction.p1}:", *indent(self.jump(instruction.p2))]
+
+    def if_pos(self, instruction: Instruction, pc: int) -> List[str]:
+        register = f"r{instruction.p1}"
+        return [
+            f"if {register} > 0:",
+            f"    {register} -= {instruction.p3}",
+            *indent(self.jump(instruction.p2)),
+        ]
+
+    def decr_jump_zero(self, instruction: Instruction, pc: int) -> List[str]:
+        register = f"r{instruction.p1}"
+        return [
+            f"{register} -= 1",
+            f"if {register} == 0:",
+            *indent(self.jump(instruction.p2)),
+        ]
+
+    # Database Opening and Closing Instructions
+
+    def open_read(self, instruction: Instruction, pc: int) -> List[str]:
+        return [f"c{instruction.p1} = BTree(pager, r{instruction.p2})"]
+
+    def open_write(self, instruction: Instruction, pc: int) -> List[str]:
+        policy = self.literal(instruction.p4)
+        return [f"c{instruction.p1} = BTree(pager, r{instruction.p2}, {policy})"]
+
+    def open_filter(self, instruction: Instruction, pc: int) -> List[str]:
+        return [f"c{instruction.p1}.bloom_page_number = r{instruction.p2}"]
+
+    def close(self, instruction: Instruction, pc: int) -> List[str]:
+        cursor = instruction.p1
+        return [
+            f"if {cursor} in bulk:",
+            f"    c{cursor}.bulk_load(sorted(bulk.pop({cursor})))",
+            f"c{cursor} = None",
+        ]
+
+    # Cursor Manipulation Instructions
+
+    def rewind(self, instruction: Instruction, pc: int) -> List[str]:
+        cursor = f"c{instruction.p1}"
+        return [
+            f"if {cursor}.is_empty():",
+            *indent(self.jump(instruction.p2)),
+            f"{cursor}.reset()",
+            f"{cursor}.current()",
+        ]
+
+    def next(self, instruction: Instruction, pc: int) -> List[str]:
+        return [
+            "try:",
+            f"    next(c{instruction.p1})",
+            "except StopIteration:",
+            "    pass",
+            "else:",
+            *indent(self.jump(instruction.p2)),
+        ]
+
+    def seek(self, instruction: Instruction, pc: int) -> List[str]:
+        return [
+            f"if not seek_row_id(c{instruction.p1}, r{instruction.p3}):",
+            *indent(self.jump(instruction.p2)),
+        ]
+
+    def seek_ge(self, instruction: Instruction, pc: int) -> List[str]:
+        values = registers(instruction.p3, cast(Optional[int], instruction.p4) or 1)
+        gt = instruction.opcode == Opcode.SeekGt
+        eq = bool(instruction.p5 & OPFLAG_SEEKEQ)
+        skip_nulls = bool(instruction.p5 & OPFLAG_SKIP_NULLS)
+        return [
+            f"if not seek_key(c{instruction.p1}, {values}, {gt}, {eq}, {skip_nulls}):",
+            *indent(self.jump(instruction.p2)),
+        ]
+
+    def index_comparison(self, instruction: Instruction, pc: int) -> List[str]:
+        size = cast(int, instruction.p4)
+        key = f"index_key({registers(instruction.p3, size)})"
+        operator = OPERATORS[instruction.opcode]
+        return [
+            f"if entry_key(c{instruction.p1}, {size}) {operator} {key}:",
+            *indent(self.jump(instruction.p2)),
+        ]
+
+    # Cursor Access Instructions
+
+    def column(self, instruction: Instruction, pc: int) -> List[str]:
+        lines = [f"values = c{instruction.p1}.current().values"]
+
+        for i in range(cast(Optional[int], instruction.p4) or 1):
+            lines.append(f"r{instruction.p3 + i} = values[{instruction.p2 + i}][1]")
+
+        return lines
+
+    def key(self, instruction: Instruction, pc: int) -> List[str]:
+        # Key and IdxPKey
+        return [f"r{instruction.p2} = c{instruction.p1}.current().row_id"]
+
+    # Database Record Instructions
+
+    def make_record(self, instruction: Instruction, pc: int) -> List[str]:
+        values = ", ".join(
+            f"[DataType.infer(r{instruction.p1 + i}), r{instruction.p1 + i}]"
+            for i in range(instruction.p2)
+        )
+        return [f"r{instruction.p3} = [{values}]"]
+
+    def result_row(self, instruction: Instruction, pc: int) -> List[str]:
+        row = registers(instruction.p1, instruction.p2 - instruction.p1 + 1)
+        return self.vm_steps() + [f"yield {row}"]
+
+    # Insert instructions
+
+    def record(self, instruction: Instruction) -> str:
+        return (
+            f"record = Record([[DataType.integer, r{instruction.p3}], "
+            f"*r{instruction.p2}])"
+        )
+
+    def insert(self, instruction: Instruction, pc: int) -> List[str]:
+        cursor = f"c{instruction.p1}"
+
+        if instruction.p5 & OPFLAG_ISUPDATE:
+            write = f"{cursor}.update(record)"
+        else:
+            append = bool(instruction.p5 & OPFLAG_APPEND)
+            table_name = self.literal(instruction.p4)
+            write = f"insert_unique({cursor}, record, {append}, {table_name})"
+
+        return [self.record(instruction), write, f"r{instruction.p2} = record"]
+
+    def idx_insert(self, instruction: Instruction, pc: int) -> List[str]:
+        cursor = f"c{instruction.p1}"
+        key_size = self.literal(instruction.p4)
+
+        if instruction.p5 & OPFLAG_BULK_BUILD:
+            cell = f"{cursor}.new_cell(record, {key_size})"
+            write = f"bulk.setdefault({instruction.p1}, []).append({cell})"
+        else:
+            write = f"{cursor}.insert(record, {key_size})"
+
+        return [self.record(instruction), write]
+
+    def idx_delete(self, instruction: Instruction, pc: int) -> List[str]:
+        cursor = f"c{instruction.p1}"
+        key_size = self.literal(instruction.p4)
+        return [
+            self.record(instruction),
+            f"{cursor}.delete({cursor}.new_cell(record, {key_size}).key)",
+        ]
+
+    # RowSet Instructions
+
+    def rowset_add(self, instruction: Instruction, pc: int) -> List[str]:
+        rowset = f"r{instruction.p1}"
+        return [
+            f"if {rowset} is None:",
+            f"    {rowset} = []",
+            f"heapq.heappush({rowset}, r{instruction.p2})",
+        ]
+
+    def rowset_read(self, instruction: Instruction, pc: int) -> List[str]:
+        rowset = f"r{instruction.p1}"
+        return [
+            f"if not {rowset}:",
+            *indent(self.jump(instruction.p2)),
+            f"r{instruction.p3} = heapq.heappop({rowset})",
+        ]
+
+    # B-Tree Creation Instructions
+
+    def create_table(self, instruction: Instruction, pc: int) -> List[str]:
+        return [f"r{instruction.p1} = pager.new()"]
+
+    def create_index(self, instruction: Instruction, pc: int) -> List[str]:
+        return [f"r{instruction.p1} = pager.new(PageType.index_leaf)"]
+
+    def create_filter(self, instruction: Instruction, pc: int) -> List[str]:
+        return [f"r{instruction.p1} = pager.new(PageType.bloom)"]
+
+    # Schema Instructions
+
+    def set_cookie(self, instruction: Instruction, pc: int) -> List[str]:
+        return [f"pager.set_schema_cookie({self.literal(instruction.p1)})"]
+
+    def analyze(self, instruction: Instruction, pc: int) -> List[str]:
+        targets = ", ".join(f"r{instruction.p2 + i}" for i in range(ANALYZE_COLUMNS))
+        positions = self.literal(instruction.p4)
+        return [
+            f"{targets} = analyze(pager, c{instruction.p1}.root_page_number, {positions})"
+        ]
+
+    def profile(self, instruction: Instruction, pc: int) -> List[str]:
+        program = self.literal(instruction.p4)
+        return [f"r{instruction.p1} = profile_listing(vm, {program}, parameters)"]
+
+    # Batch Instructions
+
+    def rewind_page(self, instruction: Instruction, pc: int) -> List[str]:
+        cursor = instruction.p1
+        return [
+            f"c{cursor}.reset()",
+            f"p{cursor} = c{cursor}.next_leaf()",
+            f"if p{cursor} is None:",
+            *indent(self.jump(instruction.p2)),
+        ]
+
+    def next_page(self, instruction: Instruction, pc: int) -> List[str]:
+        cursor = instruction.p1
+        return [
+            f"p{cursor} = c{cursor}.next_leaf()",
+            f"if p{cursor} is not None:",
+            *indent(self.jump(instruction.p2)),
+        ]
+
+    def column_vector(self, instruction: Instruction, pc: int) -> List[str]:
+        return [
+            f"r{instruction.p3} = column_vector(p{instruction.p1}, {instruction.p2})"
+        ]
+
+    def key_vector(self, instruction: Instruction, pc: int) -> List[str]:
+        return [f"r{instruction.p2} = key_vector(p{instruction.p1})"]
+
+    def select_all(self, instruction: Instruction, pc: int) -> List[str]:
+        return [f"r{instruction.p2} = list(range(len(p{instruction.p1}.cells)))"]
+
+    def filter(self, instruction: Instruction, pc: int) -> List[str]:
+        compare = self.literal(COMPARISONS[cast(Opcode, instruction.p4)])
+        selection = f"r{instruction.p3}"
+        return [
+            f"{selection} = select({compare}, r{instruction.p1}, "
+            f"r{instruction.p2}, {selection})"
+        ]
+
+    def selection_union(self, instruction: Instruction, pc: int) -> List[str]:
+        return [
+            f"r{instruction.p3} = sorted(set(r{instruction.p1}).union(r{instruction.p2}))"
+        ]
+
+    def result_batch(self, instruction: Instruction, pc: int) -> List[str]:
+        vectors = registers(instruction.p1, instruction.p2 - instruction.p1 + 1)
+        selection = f"r{instruction.p3}"
+        return (
+            [f"if {selection}:"]
+            + indent(self.vm_steps())
+            + [f"    yield batch({vectors}, {selection})"]
+        )
+
+    # Aggregate Instructions
+
+    def agg_step(self, instruction: Instruction, pc: int) -> List[str]:
+        aggregate = f"r{instruction.p1}"
+        aggregates = self.literal(instruction.p4)
+        width = instruction.p3 + len(cast(list, instruction.p4))
+        return [
+            f"if {aggregate} is None:",
+            f"    {aggregate} = HashAggregate({aggregates}, {instruction.p3}, "
+            "vm.max_groups)",
+            f"{aggregate}.step({registers(instruction.p2, width)})",
+        ]
+
+    def agg_final(self, instruction: Instruction, pc: int) -> List[str]:
+        aggregate = f"r{instruction.p1}"
+        aggregates = self.literal(instruction.p4)
+        return [
+            f"if {aggregate} is None:",
+            f"    {aggregate} = HashAggregate({aggregates}, {instruction.p3}, "
+            "vm.max_groups)",
+            f"{aggregate} = {aggregate}.rows()",
+        ]
+
+    def agg_next(self, instruction: Instruction, pc: int) -> List[str]:
+        # AggNext and SorterNext
+        size = cast(int, instruction.p4)
+        targets = "".join(f"r{instruction.p3 + i}, " for i in range(size))
+        return [
+            "try:",
+            f"    {targets}= next(r{instruction.p1})",
+            "except StopIteration:",
+            *indent(self.jump(instruction.p2)),
+        ]
+
+    # Sorter Instructions
+
+    def sorter_open(self, instruction: Instruction, pc: int) -> List[str]:
+        descending = self.literal(instruction.p4)
+        return [
+            f"r{instruction.p1} = Sorter({descending}, r{instruction.p3}, "
+            "vm.sort_buffer)"
+        ]
+
+    def sorter_insert(self, instruction: Instruction, pc: int) -> List[str]:
+        row = registers(instruction.p2, instruction.p3)
+        return [f"r{instruction.p1}.insert({row})"]
+
+    def sorter_sort(self, instruction: Instruction, pc: int) -> List[str]:
+        return [f"r{instruction.p1} = r{instruction.p1}.sorted()"]
+
+    # Hash Join Instructions
+
+    def hash_open(self, instruction: Instruction, pc: int) -> List[str]:
+        return [f"r{instruction.p1} = HashJoin(vm.join_buffer)"]
+
+    def hash_build(self, instruction: Instruction, pc: int) -> List[str]:
+        row = registers(instruction.p2 + 1, instruction.p3)
+        return [f"r{instruction.p1}.build(r{instruction.p2}, {row})"]
+
+    def hash_probe(self, instruction: Instruction, pc: int) -> List[str]:
+        row = registers(instruction.p3 + 1, cast(int, instruction.p4))
+        return [
+            f"if not r{instruction.p1}.probe(r{instruction.p3}, {row}):",
+            *indent(self.jump(instruction.p2)),
+        ]
+
+    def hash_next(self, instruction: Instruction, pc: int) -> List[str]:
+        size = cast(int, instruction.p4)
+        targets = "".join(f"r{instruction.p3 + i}, " for i in range(size))
+        return [
+            "try:",
+            f"    {targets}{'= ' if targets else ''}next(r{instruction.p1}.matches)",
+            "except StopIteration:",
+            *indent(self.jump(instruction.p2)),
+        ]
+
+    def hash_deferred(self, instruction: Instruction, pc: int) -> List[str]:
+        size = cast(int, instruction.p4)
+        targets = "".join(f"r{instruction.p3 + 1 + i}, " for i in range(size))
+        return [
+            f"entry = r{instruction.p1}.next_deferred()",
+            "if entry is None:",
+            *indent(self.jump(instruction.p2)),
+            f"r{instruction.p3}, ({targets}) = entry",
+        ]
+
+    # Arithmetic Instructions
+
+    def add(self, instruction: Instruction, pc: int) -> List[str]:
+        left = f"r{instruction.p1}"
+        right = f"r{instruction.p2}"
+        return [
+            f"r{instruction.p3} = None if {left} is None or {right} is None "
+            f"else {left} + {right}"
+        ]
+
+
+def registers(start: int, count: int) -> str:
+    """
+    Source for a list of count registers from start.
+    """
+    return "[" + ", ".join(f"r{start + i}" for i in range(count)) + "]"
+
 
-        print("---end_statement---")
-        return
+def indent(lines: List[str]) -> List[str]:
+    return ["    " + line for line in lines]